@@ -0,0 +1,278 @@
+import heapq
+import math
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class HNSWIndex:
+    def __init__(
+        self,
+        m: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 50,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes a Hierarchical Navigable Small World graph for approximate maximum inner product search. The
+        index only stores the graph: the vectors stay in the matrix owned by the caller, which is passed to every
+        call, so that rows are addressed by their position in that matrix.
+
+        Args:
+            m (int): The number of neighbours of a node on the upper layers, twice as many on the bottom layer.
+                Larger values raise recall and memory use.
+            ef_construction (int): The size of the candidate list while inserting. Larger values build a better
+                graph, more slowly.
+            ef_search (int): The default size of the candidate list while searching, the main knob of the
+                recall/latency trade-off.
+            seed (Optional[int]): The seed of the random generator drawing the layer of each node.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_mult = 1 / math.log(m)
+        self.links: List[List[List[int]]] = []
+        self.entry_point: Optional[int] = None
+        self.max_level = -1
+        self.n_nodes = 0
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        """
+        Counts the rows covered by the graph, i.e. up to the last inserted row, skipped rows included.
+
+        Returns:
+            int: The number of rows covered by the graph.
+        """
+        return len(self.links)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the links, the layer of every node and the entry point to a file, replaced atomically so that a crash
+        leaves the previous graph intact.
+
+        Args:
+            path (str): The file to write.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        levels = np.array([len(node) - 1 for node in self.links], dtype=np.int32)
+        counts = np.array(
+            [len(layer) for node in self.links for layer in node], dtype=np.int32
+        )
+        neighbours = np.array(
+            [n for node in self.links for layer in node for n in layer], dtype=np.int32
+        )
+        entry_point = -1 if self.entry_point is None else self.entry_point
+        header = np.array([self.m, entry_point, self.max_level, self.n_nodes])
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f, header=header, levels=levels, counts=counts, neighbours=neighbours
+            )
+        os.replace(path + ".tmp", path)
+
+    def load(self, path: str) -> bool:
+        """
+        Reads a graph written by `save`, unless it was built with a different number of neighbours per node.
+
+        Args:
+            path (str): The file to read.
+
+        Returns:
+            bool: Whether the graph was loaded.
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as f:
+            m, entry_point, max_level, n_nodes = f["header"].tolist()
+            if m != self.m:
+                return False
+            levels, counts, neighbours = f["levels"], f["counts"], f["neighbours"]
+        layers = np.split(neighbours, np.cumsum(counts)[:-1]) if len(counts) else []
+        offsets = np.concatenate([[0], np.cumsum(levels + 1)]).tolist()
+        self.links = [
+            [layer.tolist() for layer in layers[start:end]]
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        self.entry_point = None if entry_point < 0 else entry_point
+        self.max_level, self.n_nodes = max_level, n_nodes
+        return True
+
+    def _search_layer(
+        self,
+        data: np.ndarray,
+        query: np.ndarray,
+        entry_points: List[int],
+        ef: int,
+        level: int,
+        limit: int,
+        alive: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Runs a greedy best-first search on one layer of the graph. Masked rows are traversed, so that they keep
+        routing the search, but never enter the results, so the search goes on until it finds `ef` rows alive.
+
+        Args:
+            data (np.ndarray): The vector matrix.
+            query (np.ndarray): The query vector.
+            entry_points (List[int]): The nodes the search starts from.
+            ef (int): The size of the dynamic candidate list.
+            level (int): The layer to search.
+            limit (int): The number of rows of `data` that may be visited, so that concurrent inserts are ignored.
+            alive (Optional[np.ndarray]): The mask of the rows that may be returned. Defaults to every row.
+
+        Returns:
+            List[Tuple[float, int]]: Up to `ef` pairs of score and node, best first.
+        """
+        visited = set(entry_points)
+        scores = (data[entry_points] @ query).tolist()
+        candidates = [(-score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [
+            (score, node)
+            for score, node in zip(scores, entry_points)
+            if alive is None or alive[node]
+        ]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            negative_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -negative_score < results[0][0]:
+                break
+            links = self.links[node]
+            if level >= len(links):
+                continue
+            neighbours = [n for n in links[level] if n < limit and n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for score, neighbour in zip(
+                (data[neighbours] @ query).tolist(), neighbours
+            ):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbour))
+                    if alive is None or alive[neighbour]:
+                        heapq.heappush(results, (score, neighbour))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbours(
+        self, data: np.ndarray, candidates: List[Tuple[float, int]], m: int
+    ) -> List[int]:
+        """
+        Selects up to `m` neighbours among candidates with the HNSW heuristic: a candidate is kept only if it is
+        closer to the base node than to every neighbour kept so far, which keeps links spread in all directions.
+        Pruned candidates fill the remaining slots.
+
+        Args:
+            data (np.ndarray): The vector matrix.
+            candidates (List[Tuple[float, int]]): Pairs of score to the base node and candidate, best first.
+            m (int): The maximum number of neighbours.
+
+        Returns:
+            List[int]: The selected neighbours.
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        similarities = data[nodes] @ data[nodes].T
+        selected: List[int] = []
+        pruned: List[int] = []
+        for i, (score, _) in enumerate(candidates):
+            if len(selected) == m:
+                break
+            if not selected or score > similarities[i, selected].max():
+                selected.append(i)
+            else:
+                pruned.append(i)
+        selected += pruned[: m - len(selected)]
+        return [nodes[i] for i in selected]
+
+    def add(self, data: np.ndarray, rows: List[int]) -> None:
+        """
+        Inserts rows of the vector matrix in the graph, one at a time, so the index grows with the store. Rows between
+        the inserted ones, e.g. deleted rows left out of a rebuild, are skipped: they have no links and are never
+        returned.
+
+        Args:
+            data (np.ndarray): The vector matrix, holding at least every row up to the last inserted one.
+            rows (List[int]): The rows to insert, in increasing order. They must follow the rows already covered.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        for row in rows:
+            level = int(-math.log(1.0 - self._rng.random()) * self.level_mult)
+            self.links += [[] for _ in range(row - len(self.links))]
+            self.links.append([[] for _ in range(level + 1)])
+            self.n_nodes += 1
+            if self.entry_point is None:
+                self.entry_point, self.max_level = row, level
+                continue
+            query = data[row]
+            limit = row + 1
+            entry_points = [self.entry_point]
+            for layer in range(self.max_level, level, -1):
+                entry_points = [
+                    self._search_layer(data, query, entry_points, 1, layer, limit)[0][1]
+                ]
+            for layer in range(min(level, self.max_level), -1, -1):
+                candidates = self._search_layer(
+                    data, query, entry_points, self.ef_construction, layer, limit
+                )
+                max_links = 2 * self.m if layer == 0 else self.m
+                neighbours = self._select_neighbours(data, candidates, self.m)
+                self.links[row][layer] = neighbours
+                for neighbour in neighbours:
+                    links = self.links[neighbour][layer]
+                    links.append(row)
+                    if len(links) > max_links:
+                        scores = (data[links] @ data[neighbour]).tolist()
+                        ranked = sorted(zip(scores, links), reverse=True)
+                        self.links[neighbour][layer] = self._select_neighbours(
+                            data, ranked, max_links
+                        )
+                entry_points = [node for _, node in candidates]
+            if level > self.max_level:
+                self.entry_point, self.max_level = row, level
+
+    def search(
+        self,
+        data: np.ndarray,
+        query: np.ndarray,
+        k: int,
+        ef_search: Optional[int] = None,
+        alive: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Searches the rows with the highest inner product with a query.
+
+        Args:
+            data (np.ndarray): The vector matrix.
+            query (np.ndarray): The query vector.
+            k (int): The number of rows to return.
+            ef_search (Optional[int]): The size of the candidate list, at least `k`. Defaults to the index setting.
+            alive (Optional[np.ndarray]): The mask of the rows that may be returned. Masked rows still route the
+                search, which goes on past them until it finds `ef` rows alive.
+
+        Returns:
+            List[Tuple[float, int]]: Up to `k` pairs of score and row, best first.
+        """
+        if self.entry_point is None or k <= 0:
+            return []
+        limit = min(len(self.links), len(data))
+        ef = max(ef_search or self.ef_search, k)
+        entry_points = [self.entry_point]
+        for layer in range(self.max_level, 0, -1):
+            entry_points = [
+                self._search_layer(data, query, entry_points, 1, layer, limit)[0][1]
+            ]
+        results = self._search_layer(data, query, entry_points, ef, 0, limit, alive)
+        return results[:k]
@@ -0,0 +1,109 @@
+"""
+Compares approximate HNSW search with exact search on synthetic clustered embeddings, reporting recall@k against
+exact search and p50/p99 query latency for several `ef_search` values.
+
+Usage:
+    python -m benchmarks.ann_benchmark --n-vectors 50000 --dim 128 --k 6
+"""
+
+import argparse
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from ann_index import HNSWIndex
+
+
+def make_data(
+    n_vectors: int, n_queries: int, dim: int, seed: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draws normalized vectors around random cluster centres, which is closer to real embeddings than uniform noise.
+
+    Args:
+        n_vectors (int): The number of indexed vectors.
+        n_queries (int): The number of query vectors.
+        dim (int): The dimension of the vectors.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The indexed vectors and the query vectors.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(n_vectors // 100, 1), dim))
+    points = centres[rng.integers(len(centres), size=n_vectors + n_queries)]
+    points += 0.5 * rng.standard_normal(points.shape)
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    points = points.astype(np.float32)
+    return points[:n_vectors], points[n_vectors:]
+
+
+def percentiles(latencies: List[float]) -> Tuple[float, float]:
+    """
+    Computes the median and 99th percentile of latencies, in milliseconds.
+
+    Args:
+        latencies (List[float]): The latencies in seconds.
+
+    Returns:
+        Tuple[float, float]: The p50 and p99 latencies in milliseconds.
+    """
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99])
+    return float(p50), float(p99)
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints one row per search configuration.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-vectors", type=int, default=20000)
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data, queries = make_data(args.n_vectors, args.n_queries, args.dim, args.seed)
+
+    exact, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores = data @ query
+        top = np.argpartition(-scores, args.k - 1)[: args.k]
+        latencies.append(time.perf_counter() - start)
+        exact.append(set(top.tolist()))
+    print(f"{'search':>16} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+    print(
+        f"{'exact':>16} {1.0:>10.3f} {percentiles(latencies)[0]:>8.3f} "
+        f"{percentiles(latencies)[1]:>8.3f}"
+    )
+
+    index = HNSWIndex(m=args.m, ef_construction=args.ef_construction, seed=args.seed)
+    start = time.perf_counter()
+    index.add(data, list(range(len(data))))
+    print(f"# HNSW build: {time.perf_counter() - start:.1f}s for {len(data)} vectors")
+
+    for ef_search in args.ef_search:
+        hits, latencies = 0, []
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            found = index.search(data, query, args.k, ef_search=ef_search)
+            latencies.append(time.perf_counter() - start)
+            hits += len({row for _, row in found} & truth)
+        p50, p99 = percentiles(latencies)
+        recall = hits / (args.k * len(queries))
+        print(
+            f"{'hnsw ef=' + str(ef_search):>16} {recall:>10.3f} {p50:>8.3f} {p99:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Measures the insert throughput of the local vector store when chunks are written file by file in the batches they are
+read in, as the indexer did before the bulk writer, and through the bulk writer for several batch sizes. Embedding
+calls cost `--call-latency` seconds each plus `--text-latency` seconds per text, like a remote embeddings endpoint.
+
+Usage:
+    python -m benchmarks.bulk_write_benchmark --files 50 --chunks-per-file 20 --batch-sizes 64 256 1024
+"""
+
+import argparse
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from bulk_writer import BulkWriter
+from local_vectorstore import LocalVectorStore
+
+
+class LatencyEmbeddings(Embeddings):
+    def __init__(self, dim: int, call_latency: float, text_latency: float) -> None:
+        """
+        Initializes random embeddings whose calls take a fixed time plus a time per text.
+
+        Args:
+            dim (int): The dimension of the vectors.
+            call_latency (float): The number of seconds of every call.
+            text_latency (float): The number of seconds per embedded text.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.dim = dim
+        self.call_latency = call_latency
+        self.text_latency = text_latency
+        self.rng = np.random.default_rng(0)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.call_latency + self.text_latency * len(texts))
+        return self.rng.standard_normal((len(texts), self.dim)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the chunks written per second of each write path.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--chunks-per-file", type=int, default=20)
+    parser.add_argument("--read-batch-size", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--max-in-flight", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--call-latency", type=float, default=0.02)
+    parser.add_argument("--text-latency", type=float, default=0.0002)
+    args = parser.parse_args()
+
+    files = [
+        [
+            (f"{file}-{chunk}", Document(page_content=f"file {file} chunk {chunk}"))
+            for chunk in range(args.chunks_per_file)
+        ]
+        for file in range(args.files)
+    ]
+    n_chunks = args.files * args.chunks_per_file
+
+    def new_store() -> LocalVectorStore:
+        return LocalVectorStore(
+            embedding=LatencyEmbeddings(args.dim, args.call_latency, args.text_latency)
+        )
+
+    print(f"{'write path':>22} {'chunks':>7} {'seconds':>8} {'chunks/s':>9}")
+    vectorstore = new_store()
+    start = time.perf_counter()
+    for chunks in files:
+        for i in range(0, len(chunks), args.read_batch_size):
+            batch = chunks[i : i + args.read_batch_size]
+            vectorstore.add_documents(
+                [doc for _, doc in batch], ids=[chunk_id for chunk_id, _ in batch]
+            )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{'per file':>22} {len(vectorstore):>7} {elapsed:>8.2f} {n_chunks / elapsed:>9.0f}"
+    )
+
+    for batch_size in args.batch_sizes:
+        vectorstore = new_store()
+        writer = BulkWriter(
+            vectorstore, batch_size=batch_size, max_in_flight=args.max_in_flight
+        )
+        start = time.perf_counter()
+        for chunks in files:
+            writer.submit(
+                [chunk_id for chunk_id, _ in chunks], [doc for _, doc in chunks]
+            )
+        writer.close()
+        elapsed = time.perf_counter() - start
+        name = f"bulk, batch {batch_size}"
+        print(
+            f"{name:>22} {len(vectorstore):>7} {elapsed:>8.2f} {n_chunks / elapsed:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Measures the generation throughput of the local chat model backend against the number of concurrent users, with the
+requests generated one at a time (`--max-batch-size 1`, as without the scheduler) and with continuous batching. Each
+user thread sends its prompts one after the other and every request generates `--new-tokens` tokens. Uses a randomly
+initialized Llama model of the given size unless `--model` names a model to load.
+
+Usage:
+    python -m benchmarks.generation_benchmark --users 1 2 4 8 16 --max-batch-size 8
+    python -m benchmarks.generation_benchmark --model TinyLlama/TinyLlama-1.1B-Chat-v1.0 --quantization int8
+"""
+
+import argparse
+import random
+import threading
+import time
+from typing import List, Tuple
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from benchmarks.ann_benchmark import percentiles
+from generation_scheduler import GenerationScheduler
+from local_llm import load_model
+
+
+def run_users(
+    scheduler: GenerationScheduler,
+    n_users: int,
+    requests_per_user: int,
+    prompt_length: int,
+    new_tokens: int,
+    vocab_size: int,
+) -> Tuple[float, List[float]]:
+    """
+    Runs concurrent users, each sending its requests one after the other.
+
+    Args:
+        scheduler (GenerationScheduler): The scheduler generating the requests.
+        n_users (int): The number of concurrent users.
+        requests_per_user (int): The number of requests each user sends.
+        prompt_length (int): The maximum number of tokens of a prompt.
+        new_tokens (int): The number of tokens each request generates.
+        vocab_size (int): The size of the vocabulary prompts are drawn from.
+
+    Returns:
+        Tuple[float, List[float]]: The elapsed time and the latency of every request, in seconds.
+    """
+    latencies: List[float] = []
+
+    def user(seed: int) -> None:
+        rng = random.Random(seed)
+        for _ in range(requests_per_user):
+            prompt_ids = [
+                rng.randrange(vocab_size)
+                for _ in range(rng.randint(prompt_length // 2, prompt_length))
+            ]
+            start = time.perf_counter()
+            scheduler.submit(prompt_ids, max_new_tokens=new_tokens).result()
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=user, args=(seed,)) for seed in range(n_users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints one row per batch size and number of users.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests-per-user", type=int, default=2)
+    parser.add_argument("--prompt-length", type=int, default=128)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait", type=float, default=0.01)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--quantization", default="int8")
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    if args.model is not None:
+        quantization = None if args.quantization == "none" else args.quantization
+        model = load_model(args.model, quantization=quantization)
+        vocab_size = model.config.vocab_size
+    else:
+        torch.manual_seed(0)
+        config = LlamaConfig(
+            vocab_size=args.vocab_size,
+            hidden_size=args.hidden_size,
+            intermediate_size=4 * args.hidden_size,
+            num_hidden_layers=args.layers,
+            num_attention_heads=args.hidden_size // 64,
+            num_key_value_heads=args.hidden_size // 64,
+        )
+        model = LlamaForCausalLM(config).eval()
+        if args.quantization == "int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        vocab_size = args.vocab_size
+
+    print(
+        f"{'batch':>6} {'users':>6} {'tokens':>7} {'tokens/s':>9} {'p50 ms':>9} {'p99 ms':>9}"
+    )
+    for max_batch_size in sorted({1, args.max_batch_size}):
+        for n_users in args.users:
+            # No end of sequence token, so that every request generates the same number of tokens.
+            scheduler = GenerationScheduler(
+                model, None, max_batch_size=max_batch_size, max_wait=args.max_wait
+            )
+            elapsed, latencies = run_users(
+                scheduler,
+                n_users,
+                args.requests_per_user,
+                args.prompt_length,
+                args.new_tokens,
+                vocab_size,
+            )
+            scheduler.close()
+            tokens = scheduler.get_stats()["generated_tokens"]
+            p50, p99 = percentiles(latencies)
+            print(
+                f"{max_batch_size:>6} {n_users:>6} {tokens:>7} {tokens / elapsed:>9.1f} "
+                f"{p50:>9.0f} {p99:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
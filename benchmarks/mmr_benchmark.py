@@ -0,0 +1,106 @@
+"""
+Compares the vectorized maximal marginal relevance selection of `mmr` with LangChain's, which the "mmr" search type
+used before, on synthetic clustered embeddings. Reports the p50/p99 latency of both for several `fetch_k` values and
+checks that they select the same candidates.
+
+Usage:
+    python -m benchmarks.mmr_benchmark --fetch-k 20 100 500 1000 --k 6 --dim 768
+"""
+
+import argparse
+import time
+from typing import Callable, List
+
+import numpy as np
+from langchain_community.vectorstores.utils import (
+    maximal_marginal_relevance as langchain_mmr,
+)
+
+from benchmarks.ann_benchmark import make_data, percentiles
+from mmr import maximal_marginal_relevance
+
+
+def time_selection(
+    select: Callable[[np.ndarray, np.ndarray], List[int]],
+    queries: np.ndarray,
+    candidates: List[np.ndarray],
+) -> List[float]:
+    """
+    Times the selection of every query among its candidates.
+
+    Args:
+        select (Callable[[np.ndarray, np.ndarray], List[int]]): The selection function.
+        queries (np.ndarray): The query vectors.
+        candidates (List[np.ndarray]): The candidate vectors of each query.
+
+    Returns:
+        List[float]: The latency of every selection, in seconds.
+    """
+    latencies = []
+    for query, query_candidates in zip(queries, candidates):
+        start = time.perf_counter()
+        select(query, query_candidates)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints one row per `fetch_k`.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--fetch-k", type=int, nargs="+", default=[20, 100, 200, 500, 1000]
+    )
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--n-vectors", type=int, default=20000)
+    parser.add_argument("--n-queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data, queries = make_data(args.n_vectors, args.n_queries, args.dim, args.seed)
+
+    print(
+        f"{'fetch_k':>8} {'langchain p50':>14} {'p99':>8} {'vectorized p50':>15} {'p99':>8} "
+        f"{'speedup':>8} {'same':>5}"
+    )
+    for fetch_k in args.fetch_k:
+        # The candidates of a query are its `fetch_k` nearest vectors, as retrieved before the selection.
+        candidates = [data[np.argsort(-(data @ query))[:fetch_k]] for query in queries]
+        same = all(
+            maximal_marginal_relevance(
+                query, query_candidates, args.lambda_mult, args.k
+            )
+            == langchain_mmr(query, list(query_candidates), args.lambda_mult, args.k)
+            for query, query_candidates in zip(queries, candidates)
+        )
+        # LangChain takes the candidates as a list of vectors, as returned by the vector stores.
+        baseline = time_selection(
+            lambda query, query_candidates: langchain_mmr(
+                query, list(query_candidates), args.lambda_mult, args.k
+            ),
+            queries,
+            candidates,
+        )
+        vectorized = time_selection(
+            lambda query, query_candidates: maximal_marginal_relevance(
+                query, query_candidates, args.lambda_mult, args.k
+            ),
+            queries,
+            candidates,
+        )
+        baseline_p50, baseline_p99 = percentiles(baseline)
+        vectorized_p50, vectorized_p99 = percentiles(vectorized)
+        print(
+            f"{fetch_k:>8} {baseline_p50:>14.2f} {baseline_p99:>8.2f} {vectorized_p50:>15.2f} "
+            f"{vectorized_p99:>8.2f} {baseline_p50 / vectorized_p50:>7.1f}x {str(same):>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
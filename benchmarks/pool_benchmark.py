@@ -0,0 +1,172 @@
+"""
+Load-tests the vector store client pool under concurrent retrieval, reporting query latency, the time spent waiting
+for a free client and the number of clients in use, for several pool sizes. Uses a fake vector store answering after
+`--latency` seconds, of which `--failure-rate` of the calls drop their connection, unless `--weaviate-host` names a
+local Weaviate instance to query instead.
+
+Usage:
+    python -m benchmarks.pool_benchmark --users 16 --pool-sizes 1 4 8 16
+    python -m benchmarks.pool_benchmark --weaviate-host localhost --pool-sizes 2 8
+"""
+
+import argparse
+import random
+import threading
+import time
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+from weaviate.exceptions import WeaviateConnectionError
+
+from benchmarks.ann_benchmark import percentiles
+from database_utils import ClientPool, PooledVectorStore
+
+
+class FakeVectorStore:
+    def __init__(self, latency: float, failure_rate: float, seed: int) -> None:
+        """
+        Initializes a stand-in for a vector store holding one connection, which answers every search after a fixed
+        latency and drops its connection on a fraction of the calls.
+
+        Args:
+            latency (float): The number of seconds a search takes.
+            failure_rate (float): The fraction of searches failing with a connection error.
+            seed (int): The seed of the random generator deciding the failures.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self._embedding = None
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        time.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            raise WeaviateConnectionError("Connection dropped")
+        return [Document(page_content=query)] * k
+
+
+def make_pool(args: argparse.Namespace, size: int) -> ClientPool:
+    """
+    Builds a pool of fake vector stores, or of vector stores of the local Weaviate instance.
+
+    Args:
+        args (argparse.Namespace): The options of the benchmark.
+        size (int): The maximum number of clients of the pool.
+
+    Returns:
+        ClientPool: The pool.
+    """
+    if args.weaviate_host is not None:
+        import weaviate
+
+        from database_utils import MMRWeaviateVectorStore
+
+        return ClientPool(
+            lambda: MMRWeaviateVectorStore(
+                client=weaviate.connect_to_local(host=args.weaviate_host),
+                index_name="MyIndex",
+                text_key="text",
+            ),
+            size=size,
+            timeout=args.pool_timeout,
+            check=lambda store: store._client.is_ready(),
+            close=lambda store: store._client.close(),
+        )
+    seeds = iter(range(1_000_000))
+    return ClientPool(
+        lambda: FakeVectorStore(args.latency, args.failure_rate, next(seeds)),
+        size=size,
+        timeout=args.pool_timeout,
+        check=lambda store: True,
+        close=lambda store: None,
+    )
+
+
+def run_users(
+    vectorstore: PooledVectorStore, n_users: int, queries_per_user: int
+) -> Tuple[float, List[float], int, int]:
+    """
+    Runs concurrent users, each sending its queries one after the other, while sampling the clients in use.
+
+    Args:
+        vectorstore (PooledVectorStore): The pooled vector store.
+        n_users (int): The number of concurrent users.
+        queries_per_user (int): The number of queries each user sends.
+
+    Returns:
+        Tuple[float, List[float], int, int]: The elapsed time, the latency of every successful query in seconds,
+        the number of failed queries and the peak number of clients in use.
+    """
+    latencies: List[float] = []
+    failures = [0]
+    peak = [0]
+    done = threading.Event()
+
+    def user(seed: int) -> None:
+        for i in range(queries_per_user):
+            start = time.perf_counter()
+            try:
+                vectorstore.similarity_search(f"query {seed} {i}")
+            except (TimeoutError, WeaviateConnectionError):
+                failures[0] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    def monitor() -> None:
+        while not done.wait(0.001):
+            peak[0] = max(peak[0], int(vectorstore.pool.get_stats()["in_use"]))
+
+    threads = [threading.Thread(target=user, args=(seed,)) for seed in range(n_users)]
+    sampler = threading.Thread(target=monitor)
+    sampler.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return elapsed, latencies, failures[0], peak[0]
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints one row per pool size.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--queries-per-user", type=int, default=50)
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--pool-timeout", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--weaviate-host", default=None)
+    args = parser.parse_args()
+
+    print(
+        f"{'pool':>5} {'queries/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'wait ms':>8} "
+        f"{'max wait ms':>12} {'peak in use':>12} {'reconnects':>11} {'failed':>7}"
+    )
+    for size in args.pool_sizes:
+        with make_pool(args, size) as pool:
+            elapsed, latencies, failed, peak = run_users(
+                PooledVectorStore(pool), args.users, args.queries_per_user
+            )
+            stats = pool.get_stats()
+        p50, p99 = percentiles(latencies)
+        print(
+            f"{size:>5} {len(latencies) / elapsed:>10.1f} {p50:>8.1f} {p99:>8.1f} "
+            f"{stats['mean_wait_seconds'] * 1000:>8.2f} {stats['max_wait_seconds'] * 1000:>12.1f} "
+            f"{peak:>12} {stats['reconnects']:>11} {failed:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Measures the time to first token of the local chat model backend over the turns of chat sessions, with and without
+the prefix cache. Each prompt starts with the same `--prefix-length` tokens, standing for the instructions of the
+prompt template, followed by the growing history of its session and `--turn-length` new tokens for the retrieved
+context and the question. Only the states of the instructions and the history are cached. Uses a randomly initialized Llama model of the given size unless `--model` names a model to
+load.
+
+Usage:
+    python -m benchmarks.prefix_cache_benchmark --sessions 4 --turns 4
+    python -m benchmarks.prefix_cache_benchmark --model TinyLlama/TinyLlama-1.1B-Chat-v1.0 --quantization int8
+"""
+
+import argparse
+import random
+import time
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from benchmarks.ann_benchmark import percentiles
+from local_llm import load_model
+from prefix_cache import PrefixCache
+
+
+def time_to_first_token(
+    model: torch.nn.Module,
+    prefix_cache: Optional[PrefixCache],
+    prompts: List[Tuple[List[int], int]],
+) -> List[float]:
+    """
+    Encodes each prompt and samples its first token.
+
+    Args:
+        model (torch.nn.Module): The causal language model.
+        prefix_cache (Optional[PrefixCache]): The prefix cache, or None to encode every prompt from scratch.
+        prompts (List[Tuple[List[int], int]]): The token ids of the prompts, in the order they are sent, with the
+            number of tokens shared with the next prompts of their session.
+
+    Returns:
+        List[float]: The time to first token of every prompt, in seconds.
+    """
+    latencies = []
+    with torch.inference_mode():
+        for prompt_ids, cache_length in prompts:
+            start = time.perf_counter()
+            if prefix_cache is None:
+                logits = model(input_ids=torch.tensor([prompt_ids])).logits[0, -1]
+            else:
+                logits, _ = prefix_cache.prefill(model, prompt_ids, cache_length)
+            int(torch.argmax(logits))
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the time to first token with and without the prefix cache.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--prefix-length", type=int, default=256)
+    parser.add_argument("--turn-length", type=int, default=64)
+    parser.add_argument("--cache-mb", type=int, default=512)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--quantization", default="int8")
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    if args.model is not None:
+        quantization = None if args.quantization == "none" else args.quantization
+        model = load_model(args.model, quantization=quantization)
+        vocab_size = model.config.vocab_size
+    else:
+        torch.manual_seed(0)
+        config = LlamaConfig(
+            vocab_size=args.vocab_size,
+            hidden_size=args.hidden_size,
+            intermediate_size=4 * args.hidden_size,
+            num_hidden_layers=args.layers,
+            num_attention_heads=args.hidden_size // 64,
+            num_key_value_heads=args.hidden_size // 64,
+        )
+        model = LlamaForCausalLM(config).eval()
+        if args.quantization == "int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        vocab_size = args.vocab_size
+
+    rng = random.Random(0)
+    prefix = [rng.randrange(vocab_size) for _ in range(args.prefix_length)]
+    histories = [list(prefix) for _ in range(args.sessions)]
+    prompts = []
+    # Sessions take turns, as concurrent users would.
+    for _ in range(args.turns):
+        for history in histories:
+            turn = [rng.randrange(vocab_size) for _ in range(args.turn_length)]
+            prompts.append((history + turn, len(history)))
+            history.extend(turn)
+
+    prefix_cache = PrefixCache(max_bytes=args.cache_mb * 2**20)
+    print(f"{'prefix cache':>12} {'prompts':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, cache in (("off", None), ("on", prefix_cache)):
+        p50, p99 = percentiles(time_to_first_token(model, cache, prompts))
+        print(f"{name:>12} {len(prompts):>8} {p50:>9.0f} {p99:>9.0f}")
+    stats = prefix_cache.get_stats()
+    print(
+        f"hit rate {stats['hit_rate']:.2f}, reused tokens {stats['reused_tokens']}, "
+        f"computed tokens {stats['prefill_tokens']}, cached MB {stats['cached_bytes'] / 2**20:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
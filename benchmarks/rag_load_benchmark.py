@@ -0,0 +1,188 @@
+"""
+Load-tests the RAG chain against local fake backends that only add latency: an embeddings model standing in for the
+Hugging Face Inference API and a chat model standing in for the LLM endpoint. Reports the throughput and p50/p99
+latency of sequential `query` calls, then of concurrent `aquery` sessions multiplexed on one event loop.
+
+Usage:
+    python -m benchmarks.rag_load_benchmark --concurrency 1 8 32 128 --llm-latency 0.5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from benchmarks.ann_benchmark import percentiles
+from chat_model import ChatModel
+from local_vectorstore import LocalVectorStore
+from rag import RagChain
+from retriever import Retriever
+
+
+class LatencyEmbeddings(Embeddings):
+    """Embeds texts into deterministic pseudo-random vectors after a fixed delay, like a remote embeddings API."""
+
+    def __init__(self, latency: float, dim: int = 64) -> None:
+        self.latency = latency
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(self.dim).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+
+class LatencyChatModel(BaseChatModel):
+    """Answers with a fixed message after a fixed delay, like a remote LLM endpoint."""
+
+    latency: float = 0.5
+    answer: str = "This is a fake answer."
+
+    @property
+    def _llm_type(self) -> str:
+        return "latency-fake"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.answer))]
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.answer))]
+        )
+
+
+def make_sessions(
+    n_sessions: int, retriever: Retriever, chat_model: ChatModel
+) -> List[RagChain]:
+    """
+    Creates one RAG chain per session, sharing the retriever and the chat model as the app does.
+
+    Args:
+        n_sessions (int): The number of sessions.
+        retriever (Retriever): The shared retriever.
+        chat_model (ChatModel): The shared chat model.
+
+    Returns:
+        List[RagChain]: The chain of each session.
+    """
+    return [
+        RagChain(retriever.get_retriever(), chat_model, f"session-{i}")
+        for i in range(n_sessions)
+    ]
+
+
+async def run_sessions(
+    chains: List[RagChain], queries_per_session: int
+) -> Tuple[float, List[float]]:
+    """
+    Runs every session concurrently, each asking its questions one after the other.
+
+    Args:
+        chains (List[RagChain]): The chain of each session.
+        queries_per_session (int): The number of questions each session asks.
+
+    Returns:
+        Tuple[float, List[float]]: The elapsed time and the latency of every question, in seconds.
+    """
+    latencies: List[float] = []
+
+    async def session(chain: RagChain) -> None:
+        for i in range(queries_per_session):
+            start = time.perf_counter()
+            await chain.aquery(f"Question {i} of {chain.session_id}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(chain) for chain in chains))
+    return time.perf_counter() - start, latencies
+
+
+def main() -> None:
+    """
+    Runs the load test and prints one row per mode and concurrency level.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--queries-per-session", type=int, default=2)
+    parser.add_argument("--sequential-queries", type=int, default=8)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--n-docs", type=int, default=1000)
+    args = parser.parse_args()
+
+    embeddings = LatencyEmbeddings(args.embedding_latency)
+    store = LocalVectorStore(embedding=embeddings)
+    store.add_texts([f"Document {i} about topic {i % 37}." for i in range(args.n_docs)])
+    retriever = Retriever(store)
+    chat_model = ChatModel("latency-fake")
+    chat_model.chat_model = LatencyChatModel(latency=args.llm_latency)
+
+    print(
+        f"{'mode':>12} {'sessions':>8} {'queries':>8} {'q/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    (chain,) = make_sessions(1, retriever, chat_model)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(args.sequential_queries):
+        query_start = time.perf_counter()
+        chain.query(f"Question {i}")
+        latencies.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start
+    p50, p99 = percentiles(latencies)
+    print(
+        f"{'sync':>12} {1:>8} {len(latencies):>8} {len(latencies) / elapsed:>8.2f} "
+        f"{p50:>8.0f} {p99:>8.0f}"
+    )
+
+    for concurrency in args.concurrency:
+        chains = make_sessions(concurrency, retriever, chat_model)
+        elapsed, latencies = asyncio.run(run_sessions(chains, args.queries_per_session))
+        p50, p99 = percentiles(latencies)
+        print(
+            f"{'async':>12} {concurrency:>8} {len(latencies):>8} "
+            f"{len(latencies) / elapsed:>8.2f} {p50:>8.0f} {p99:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Measures the startup time of app sessions, i.e. of `RAGApp()` for a new browser tab, when the heavy components are
+built for every session, as before the resource registry, and when they are shared by the sessions of the process:
+the first session then pays the cold start and the following ones only build their RAG chain. By default the loading
+of the tokenizer, of the chat model endpoint client and of the vector store with its embeddings model is simulated by
+a fixed delay each, with `--real` the components configured by the environment are loaded instead.
+
+Usage:
+    python -m benchmarks.startup_benchmark --sessions 20 --load-latency 0.5
+    python -m benchmarks.startup_benchmark --sessions 5 --real
+"""
+
+import argparse
+import contextlib
+import time
+from types import SimpleNamespace
+from typing import Any, Iterator, List
+from unittest.mock import patch
+
+import main as app
+from benchmarks.ann_benchmark import percentiles
+from benchmarks.rag_load_benchmark import LatencyChatModel, LatencyEmbeddings
+from chat_model import ChatModel
+from local_vectorstore import LocalVectorStore
+from resources import ResourceRegistry
+
+
+class SessionState(dict):
+    """Stands in for `st.session_state` outside of a Streamlit run."""
+
+    def __getattr__(self, name: str) -> Any:
+        return self[name]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self[name] = value
+
+
+class WordTokenizer:
+    """Tokenizes texts into words, standing in for the tokenizer of the chat model."""
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[str]:
+        return text.split()
+
+    def decode(self, tokens: List[str]) -> str:
+        return " ".join(tokens)
+
+
+@contextlib.contextmanager
+def slow_backends(load_latency: float) -> Iterator[None]:
+    """
+    Replaces the loading of the tokenizer, the chat model and the vector store with fakes taking a fixed time to load.
+
+    Args:
+        load_latency (float): The number of seconds each load takes.
+
+    Returns:
+        Iterator[None]: A context within which the fakes are loaded.
+    """
+
+    def load_tokenizer(*args: Any, **kwargs: Any) -> WordTokenizer:
+        time.sleep(load_latency)
+        return WordTokenizer()
+
+    def set_chat_model(model: ChatModel) -> None:
+        time.sleep(load_latency)
+        model.chat_model = LatencyChatModel(latency=0.0)
+
+    def connect_database() -> SimpleNamespace:
+        time.sleep(load_latency)
+        return SimpleNamespace(get_db=LocalVectorStore)
+
+    def load_embeddings() -> SimpleNamespace:
+        return SimpleNamespace(get_embeddings_model=lambda: LatencyEmbeddings(0.0))
+
+    with patch(
+        "chat_model.AutoTokenizer.from_pretrained", load_tokenizer
+    ), patch.object(ChatModel, "set_chat_model", set_chat_model), patch(
+        "index.Database", connect_database
+    ), patch(
+        "index.Embeddings", load_embeddings
+    ):
+        yield
+
+
+def start_sessions(n_sessions: int, shared: bool) -> List[float]:
+    """
+    Starts app sessions one after the other, each with its own session state.
+
+    Args:
+        n_sessions (int): The number of sessions.
+        shared (bool): Whether the sessions share one resource registry, or each builds its own components.
+
+    Returns:
+        List[float]: The startup time of every session, in seconds.
+    """
+    resources = ResourceRegistry()
+    latencies = []
+    for _ in range(n_sessions):
+        if not shared:
+            resources = ResourceRegistry()
+        with patch.object(app, "st", SimpleNamespace(session_state=SessionState())):
+            start = time.perf_counter()
+            app.RAGApp(resources=resources)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints one row per mode.
+
+    Returns:
+        None: Returns object of NoneType
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--load-latency", type=float, default=0.5)
+    parser.add_argument("--real", action="store_true")
+    args = parser.parse_args()
+
+    backends = (
+        contextlib.nullcontext() if args.real else slow_backends(args.load_latency)
+    )
+    streamlit = app.st
+    print(f"{'mode':>12} {'sessions':>8} {'first ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        with backends:
+            for mode, shared in (("per-session", False), ("shared", True)):
+                latencies = start_sessions(args.sessions, shared)
+                # The first session is cold in both modes, the following ones are warm when sharing.
+                p50, p99 = percentiles(latencies[1:] or latencies)
+                print(
+                    f"{mode:>12} {args.sessions:>8} {1000 * latencies[0]:>9.0f} "
+                    f"{p50:>8.1f} {p99:>8.1f}"
+                )
+    finally:
+        app.st = streamlit
+
+
+if __name__ == "__main__":
+    main()
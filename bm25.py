@@ -0,0 +1,371 @@
+import json
+import math
+import os
+import re
+import shutil
+from array import array
+from collections import Counter
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Words, and compounds of words joined by '-', '.' or '/', so that part numbers such as "XJ-2000" or error codes such
+# as "0x80070005" are indexed whole.
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+PART_PATTERN = re.compile(r"[-./_]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase terms. Compound terms are indexed whole and also split into their parts, so that
+    "XJ-2000" matches both "xj-2000" and "2000".
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The terms of the text, in order.
+    """
+    terms: List[str] = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        parts = [part for part in PART_PATTERN.split(token) if part]
+        if len(parts) > 1:
+            terms += parts
+    return terms
+
+
+class BM25Index:
+    def __init__(
+        self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75
+    ) -> None:
+        """
+        Initializes an in-process BM25 inverted index over chunks. The postings of each term are two growable arrays
+        of unsigned ints, the rows of the chunks containing the term and the number of occurrences, which are scored
+        without copies through NumPy. Deleted chunks are masked out, and the index is rebuilt once they outnumber the
+        live ones.
+
+        Args:
+            path (Optional[str]): The directory persisting the index. If None, the index lives in memory only.
+            k1 (float): The BM25 term frequency saturation.
+            b (float): The BM25 length normalization.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array("I")
+        self.alive = bytearray()
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.rows: Dict[str, int] = {}
+        self.total_length = 0
+        self.version = 0
+        self._dirty = False
+        self._lock = Lock()
+        self._save_lock = Lock()
+        directory = self._current_directory()
+        if directory is not None:
+            self._load(directory)
+
+    def __len__(self) -> int:
+        """
+        Counts the chunks indexed, leaving out the deleted ones.
+
+        Returns:
+            int: The number of live chunks.
+        """
+        return len(self.rows)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        """
+        Tells whether a chunk is indexed.
+
+        Args:
+            chunk_id (str): The id of the chunk.
+
+        Returns:
+            bool: Whether the chunk is indexed and not deleted.
+        """
+        return chunk_id in self.rows
+
+    def _add(self, chunk_id: str, text: str, metadata: Dict) -> None:
+        """
+        Appends a chunk to the index.
+
+        Args:
+            chunk_id (str): The id of the chunk.
+            text (str): The text of the chunk.
+            metadata (Dict): The metadata of the chunk.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        row = len(self.ids)
+        terms = tokenize(text)
+        for term, count in Counter(terms).items():
+            if term not in self.postings:
+                self.postings[term] = (array("I"), array("I"))
+            rows, counts = self.postings[term]
+            rows.append(row)
+            counts.append(count)
+        self.lengths.append(len(terms))
+        self.alive.append(1)
+        self.ids.append(chunk_id)
+        self.texts.append(text)
+        self.metadatas.append(metadata)
+        self.rows[chunk_id] = row
+        self.total_length += len(terms)
+        self._dirty = True
+
+    def add(self, ids: Sequence[str], docs: Sequence[Document]) -> None:
+        """
+        Indexes chunks, skipping the ids already indexed.
+
+        Args:
+            ids (Sequence[str]): The ids of the chunks.
+            docs (Sequence[Document]): The chunks.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            for chunk_id, doc in zip(ids, docs):
+                if chunk_id not in self.rows:
+                    self._add(chunk_id, doc.page_content, doc.metadata)
+
+    def delete(self, ids: Sequence[str]) -> None:
+        """
+        Removes chunks from the index.
+
+        Args:
+            ids (Sequence[str]): The ids of the chunks.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            for chunk_id in ids:
+                row = self.rows.pop(chunk_id, None)
+                if row is not None:
+                    self.alive[row] = 0
+                    self.total_length -= self.lengths[row]
+                    self._dirty = True
+            if len(self.ids) > 2 * len(self.rows):
+                self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rebuilds the index from the live chunks, dropping the postings of deleted ones.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        live = [
+            (self.ids[row], self.texts[row], self.metadatas[row])
+            for row in range(len(self.ids))
+            if self.alive[row]
+        ]
+        self.postings = {}
+        self.lengths = array("I")
+        self.alive = bytearray()
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.rows = {}
+        self.total_length = 0
+        for chunk_id, text, metadata in live:
+            self._add(chunk_id, text, metadata)
+
+    def search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the chunks with the highest BM25 score for a query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of chunks to return.
+            filter (Optional[Dict[str, Any]]): The metadata values the chunks returned must have.
+
+        Returns:
+            List[Tuple[Document, float]]: The chunks matching at least one query term and their scores, best first.
+        """
+        with self._lock:
+            if not self.rows:
+                return []
+            n_docs = len(self.rows)
+            lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+            norms = self.k1 * (
+                1 - self.b + self.b * lengths / max(self.total_length / n_docs, 1.0)
+            )
+            alive = np.frombuffer(self.alive, dtype=bool)
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            for term, weight in Counter(tokenize(query)).items():
+                if term not in self.postings:
+                    continue
+                rows, counts = self.postings[term]
+                rows_view = np.frombuffer(rows, dtype=np.uint32)
+                counts_view = np.frombuffer(counts, dtype=np.uint32)
+                # Deleted chunks stay in the postings until the index is compacted, but not in the document frequency.
+                df = int(np.count_nonzero(alive[rows_view]))
+                if df == 0:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                scores[rows_view] += (
+                    weight
+                    * idf
+                    * counts_view
+                    * (self.k1 + 1)
+                    / (counts_view + norms[rows_view])
+                )
+            scores[~alive] = 0
+            if filter:
+                for row in np.flatnonzero(scores):
+                    metadata = self.metadatas[row]
+                    if any(metadata.get(key) != value for key, value in filter.items()):
+                        scores[row] = 0
+            top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [
+                (
+                    Document(
+                        page_content=self.texts[row], metadata=dict(self.metadatas[row])
+                    ),
+                    float(scores[row]),
+                )
+                for row in top
+                if scores[row] > 0
+            ]
+
+    def save(self) -> None:
+        """
+        Writes the index to its directory, if it has one and it changed since the last save: the postings of all terms
+        are concatenated into flat arrays with per-term offsets, so that loading them is a few bulk reads, and the
+        chunks go to a JSON lines file. The files are written to a new version directory, which then replaces the
+        previous one by atomically rewriting the `CURRENT` file naming it, so that a crash never mixes the files of
+        two versions. Deleted chunks are saved masked rather than compacted away.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                terms = list(self.postings)
+                offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([len(self.postings[term][0]) for term in terms])
+                rows = b"".join(self.postings[term][0].tobytes() for term in terms)
+                counts = b"".join(self.postings[term][1].tobytes() for term in terms)
+                arrays = {
+                    "offsets": offsets,
+                    "rows": np.frombuffer(rows, dtype=np.uint32),
+                    "counts": np.frombuffer(counts, dtype=np.uint32),
+                    "lengths": np.array(self.lengths, dtype=np.uint32),
+                    "alive": np.frombuffer(self.alive, dtype=bool).copy(),
+                }
+                docs = [
+                    {"id": chunk_id, "text": text, "metadata": metadata}
+                    for chunk_id, text, metadata in zip(
+                        self.ids, self.texts, self.metadatas
+                    )
+                ]
+            try:
+                self._write_version(self.path, self.version + 1, terms, docs, arrays)
+            except BaseException:
+                with self._lock:
+                    self._dirty = True
+                raise
+            self.version += 1
+
+    def _write_version(
+        self, path: str, version: int, terms: List[str], docs: List[Dict], arrays: Dict
+    ) -> None:
+        """
+        Writes a version of the index to its own directory, makes it the current one, and removes the other versions.
+
+        Args:
+            path (str): The index directory.
+            version (int): The number of the version.
+            terms (List[str]): The terms, in the order of the posting offsets.
+            docs (List[Dict]): The id, text and metadata of every row.
+            arrays (Dict): The posting, length and alive arrays.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        name = f"index-{version}"
+        directory = os.path.join(path, name)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "terms.json"), "w") as f:
+            json.dump(terms, f)
+        with open(os.path.join(directory, "docs.jsonl"), "w") as f:
+            f.writelines(json.dumps(doc) + "\n" for doc in docs)
+        with open(os.path.join(directory, "postings.npz"), "wb") as f:
+            np.savez(f, **arrays)
+        current = os.path.join(path, "CURRENT")
+        with open(current + ".tmp", "w") as f:
+            f.write(name)
+        os.replace(current + ".tmp", current)
+        for entry in os.listdir(path):
+            if entry.startswith("index-") and entry != name:
+                shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+    def _current_directory(self) -> Optional[str]:
+        """
+        Finds the directory holding the current version of the persisted index.
+
+        Returns:
+            Optional[str]: The directory named by the `CURRENT` file, or None if nothing was saved.
+        """
+        if self.path is None:
+            return None
+        current = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            name = f.read().strip()
+        self.version = int(name.rsplit("-", 1)[1])
+        return os.path.join(self.path, name)
+
+    def _load(self, directory: str) -> None:
+        """
+        Loads a persisted index, slicing the flat posting arrays back into per-term arrays.
+
+        Args:
+            directory (str): The directory holding the files of the index.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with open(os.path.join(directory, "terms.json")) as f:
+            terms = json.load(f)
+        with open(os.path.join(directory, "docs.jsonl")) as f:
+            docs = [json.loads(line) for line in f]
+        with np.load(os.path.join(directory, "postings.npz")) as data:
+            offsets, lengths = data["offsets"], data["lengths"]
+            rows, counts = data["rows"].tobytes(), data["counts"].tobytes()
+            alive = data["alive"]
+        for i, term in enumerate(terms):
+            start, end = 4 * int(offsets[i]), 4 * int(offsets[i + 1])
+            self.postings[term] = (array("I"), array("I"))
+            self.postings[term][0].frombytes(rows[start:end])
+            self.postings[term][1].frombytes(counts[start:end])
+        self.lengths.frombytes(lengths.astype(np.uint32).tobytes())
+        self.alive = bytearray(alive.astype(np.uint8).tobytes())
+        for row, doc in enumerate(docs):
+            self.ids.append(doc["id"])
+            self.texts.append(doc["text"])
+            self.metadatas.append(doc["metadata"])
+            if alive[row]:
+                self.rows[doc["id"]] = row
+        self.total_length = int(lengths[alive].sum())
@@ -0,0 +1,292 @@
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+class _PendingWrite:
+    """Completion of one submitted group of chunks, which may be split across several batches."""
+
+    def __init__(self, future: Future, remaining: int) -> None:
+        self.future = future
+        self.remaining = remaining
+
+
+class BulkWriter:
+    def __init__(
+        self,
+        vectorstore: VectorStore,
+        batch_size: int = 256,
+        max_in_flight: int = 2,
+    ) -> None:
+        """
+        Initializes a writer importing chunks into a vector store in batches of a fixed size, whatever the files they
+        come from. Chunks are buffered until a batch is full or the buffer is flushed, then embedded together and
+        written through the `add_vectors` bulk import of the vector store, or `add_documents` if it has none. At most
+        `max_in_flight` batches are embedded or written at the same time: submitting a chunk that fills a batch
+        blocks until one of them completes, which slows down the producers rather than letting the buffer grow.
+
+        Args:
+            vectorstore (VectorStore): The vector store to write to, whose embeddings model embeds the chunks.
+            batch_size (int): The number of chunks per import.
+            max_in_flight (int): The maximum number of batches embedded or written concurrently.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.vectorstore = vectorstore
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.chunks = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.embed_seconds = 0.0
+        self.insert_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.busy_seconds = 0.0
+        self._busy_since = 0.0
+        self._in_flight = 0
+        self._buffer: List[Tuple[str, Document, _PendingWrite]] = []
+        self._closed = False
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(
+            max_in_flight, thread_name_prefix="bulk-writer"
+        )
+
+    def submit(self, ids: List[str], docs: List[Document]) -> Future:
+        """
+        Buffers chunks for writing, and sends the batches they fill, blocking while `max_in_flight` batches are
+        already in flight.
+
+        Args:
+            ids (List[str]): The id of each chunk.
+            docs (List[Document]): The chunks.
+
+        Returns:
+            Future: Completes once every chunk is written, or fails with the error raised while writing these chunks,
+            in which case those still buffered are dropped.
+        """
+        future: Future = Future()
+        if not ids:
+            future.set_result(None)
+            return future
+        pending = _PendingWrite(future, len(ids))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The bulk writer is closed")
+            self._buffer += [
+                (chunk_id, doc, pending) for chunk_id, doc in zip(ids, docs)
+            ]
+            batches = self._take_batches(full_only=True)
+        for batch in batches:
+            self._dispatch(batch)
+        return future
+
+    def flush(self) -> None:
+        """
+        Sends the buffered chunks without waiting for a full batch, e.g. once a file has been read entirely.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            batches = self._take_batches(full_only=False)
+        for batch in batches:
+            self._dispatch(batch)
+
+    async def asubmit(self, ids: List[str], docs: List[Document]) -> asyncio.Future:
+        """
+        Buffers chunks for writing without blocking the event loop, see `submit`.
+
+        Args:
+            ids (List[str]): The id of each chunk.
+            docs (List[Document]): The chunks.
+
+        Returns:
+            asyncio.Future: Completes once every chunk is written.
+        """
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(None, self.submit, ids, docs)
+        return asyncio.wrap_future(future)
+
+    async def aflush(self) -> None:
+        """
+        Sends the buffered chunks without blocking the event loop, see `flush`.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def _take_batches(
+        self, full_only: bool
+    ) -> List[List[Tuple[str, Document, _PendingWrite]]]:
+        """
+        Removes the batches to send from the buffer. Must be called with the lock held.
+
+        Args:
+            full_only (bool): Whether to leave a last incomplete batch in the buffer.
+
+        Returns:
+            List[List[Tuple[str, Document, _PendingWrite]]]: The batches.
+        """
+        batches = []
+        while len(self._buffer) >= self.batch_size or (self._buffer and not full_only):
+            batches.append(self._buffer[: self.batch_size])
+            del self._buffer[: self.batch_size]
+        return batches
+
+    def _dispatch(self, batch: List[Tuple[str, Document, _PendingWrite]]) -> None:
+        """
+        Sends a batch to the writing threads once fewer than `max_in_flight` batches are in flight.
+
+        Args:
+            batch (List[Tuple[str, Document, _PendingWrite]]): The chunks of the batch.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        start = time.perf_counter()
+        self._slots.acquire()
+        now = time.perf_counter()
+        with self._lock:
+            self.blocked_seconds += now - start
+            if self._in_flight == 0:
+                self._busy_since = now
+            self._in_flight += 1
+        self._executor.submit(self._write, batch)
+
+    def _import(
+        self, batch: List[Tuple[str, Document, _PendingWrite]]
+    ) -> Optional[Exception]:
+        """
+        Embeds and writes chunks, and counts them in the statistics.
+
+        Args:
+            batch (List[Tuple[str, Document, _PendingWrite]]): The chunks to write.
+
+        Returns:
+            Optional[Exception]: The error raised by the embeddings model or the vector store, if any.
+        """
+        # A chunk submitted twice, e.g. by two files sharing it, is written once.
+        unique: Dict[str, Document] = {chunk_id: doc for chunk_id, doc, _ in batch}
+        ids, docs = list(unique), list(unique.values())
+        error: Optional[Exception] = None
+        embed_seconds = insert_seconds = 0.0
+        try:
+            start = time.perf_counter()
+            if hasattr(self.vectorstore, "add_vectors"):
+                texts = [doc.page_content for doc in docs]
+                vectors = self.vectorstore.embeddings.embed_documents(texts)  # type: ignore[union-attr]
+                embed_seconds = time.perf_counter() - start
+                self.vectorstore.add_vectors(
+                    vectors, texts, metadatas=[doc.metadata for doc in docs], ids=ids
+                )
+            else:
+                self.vectorstore.add_documents(docs, ids=ids)
+            insert_seconds = time.perf_counter() - start - embed_seconds
+        except Exception as e:
+            error = e
+        with self._lock:
+            self.batches += 1
+            self.embed_seconds += embed_seconds
+            self.insert_seconds += insert_seconds
+            if error is None:
+                self.chunks += len(ids)
+            else:
+                self.failed_batches += 1
+        return error
+
+    def _write(self, batch: List[Tuple[str, Document, _PendingWrite]]) -> None:
+        """
+        Writes a batch, then completes the writes it belongs to. A batch mixing the chunks of several writes that
+        fails is written again one write at a time, so that only the writes whose own chunks fail fail. The chunks
+        of a failed write that are still buffered are dropped rather than written later.
+
+        Args:
+            batch (List[Tuple[str, Document, _PendingWrite]]): The chunks of the batch.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        try:
+            batch = [entry for entry in batch if not entry[2].future.done()]
+            error = self._import(batch) if batch else None
+            groups: Dict[int, List[Tuple[str, Document, _PendingWrite]]] = {}
+            if error is not None:
+                for entry in batch:
+                    groups.setdefault(id(entry[2]), []).append(entry)
+            if len(groups) > 1:
+                results = [(group, self._import(group)) for group in groups.values()]
+            else:
+                results = [(batch, error)]
+        finally:
+            self._slots.release()
+        completed = []
+        with self._lock:
+            now = time.perf_counter()
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.busy_seconds += now - self._busy_since
+            failed = set()
+            for group, error in results:
+                for _, _, pending in group:
+                    pending.remaining -= 1
+                    if error is not None:
+                        failed.add(pending)
+                    if error is not None or pending.remaining == 0:
+                        completed.append((pending.future, error))
+            if failed:
+                self._buffer = [
+                    entry for entry in self._buffer if entry[2] not in failed
+                ]
+        for future, error in completed:
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+    def close(self) -> None:
+        """
+        Writes the buffered chunks and waits for every batch in flight.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.flush()
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports the insert throughput of the writer.
+
+        Returns:
+            Dict[str, float]: The number of chunks written, of batches and of failed batches, of batches in flight
+            and of buffered chunks, the seconds spent embedding, inserting and blocked by backpressure, and the
+            number of chunks written per second while batches were in flight.
+        """
+        with self._lock:
+            busy_seconds = self.busy_seconds
+            if self._in_flight:
+                busy_seconds += time.perf_counter() - self._busy_since
+            return {
+                "chunks": self.chunks,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "in_flight": self._in_flight,
+                "buffered": len(self._buffer),
+                "embed_seconds": self.embed_seconds,
+                "insert_seconds": self.insert_seconds,
+                "blocked_seconds": self.blocked_seconds,
+                "chunks_per_second": (
+                    self.chunks / busy_seconds if busy_seconds else 0.0
+                ),
+            }
@@ -0,0 +1,462 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, MutableMapping, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and an assistant in a few sentences. Keep the facts, names "
+    "and questions that later messages may refer to.\n\n{transcript}\n\nSummary:"
+)
+
+
+def count_words(text: str) -> int:
+    """
+    Approximates the number of tokens of a text by its number of words.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The number of whitespace separated words of the text.
+    """
+    return len(text.split())
+
+
+def summarize_with(chat_model: BaseChatModel) -> Callable[[List[BaseMessage]], str]:
+    """
+    Builds a summarizer asking a chat model to condense messages into a short summary.
+
+    Args:
+        chat_model (BaseChatModel): The chat model writing the summaries.
+
+    Returns:
+        Callable[[List[BaseMessage]], str]: The function summarizing a list of messages.
+    """
+
+    def summarize(messages: List[BaseMessage]) -> str:
+        transcript = "\n".join(
+            f"{message.type}: {message.content}" for message in messages
+        )
+        prompt = SUMMARY_PROMPT.format(transcript=transcript)
+        return str(chat_model.invoke([HumanMessage(content=prompt)]).content)
+
+    return summarize
+
+
+class BoundedHistory(BaseChatMessageHistory):
+    def __init__(
+        self,
+        max_messages: int = 40,
+        max_tokens: Optional[int] = None,
+        count_tokens: Callable[[str], int] = count_words,
+        summarizer: Optional[Callable[[List[BaseMessage]], str]] = None,
+    ) -> None:
+        """
+        Initializes an in-memory chat history capped in messages and tokens. When a cap is exceeded, the oldest
+        messages are dropped, or folded with the previous summary into a single summary message if a summarizer is
+        given.
+
+        Args:
+            max_messages (int): The maximum number of messages kept, the summary included.
+            max_tokens (Optional[int]): The maximum number of tokens kept, the summary included. If None, only the
+                number of messages is capped.
+            count_tokens (Callable[[str], int]): The function counting the tokens of a message. Defaults to a word
+                count.
+            summarizer (Optional[Callable[[List[BaseMessage]], str]]): The function condensing the evicted messages
+                into a summary. If None, evicted messages are dropped.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.summarizer = summarizer
+        self.messages: List[BaseMessage] = []
+        self.tokens: List[int] = []
+
+    def add_message(self, message: BaseMessage) -> None:
+        """
+        Adds a message to the history, then enforces the caps.
+
+        Args:
+            message (BaseMessage): The message to add.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Adds messages to the history, then enforces the caps once, so that a turn is summarized at most once.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages to add.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        for message in messages:
+            self.messages.append(message)
+            self.tokens.append(self.count_tokens(str(message.content)))
+        self._enforce_caps()
+
+    def _over_caps(self, n_messages: int, n_tokens: int) -> bool:
+        """
+        Checks whether a history of the given size exceeds the caps.
+
+        Args:
+            n_messages (int): The number of messages.
+            n_tokens (int): The number of tokens.
+
+        Returns:
+            bool: True if either cap is exceeded.
+        """
+        return n_messages > self.max_messages or (
+            self.max_tokens is not None and n_tokens > self.max_tokens
+        )
+
+    def _enforce_caps(self) -> None:
+        """
+        Evicts the oldest messages until the history fits its caps, always keeping the latest message, and replaces
+        them with a summary if a summarizer is set.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        total = sum(self.tokens)
+        if not self._over_caps(len(self.messages), total):
+            return
+        # With a summarizer, one slot is left for the summary message.
+        reserve = 1 if self.summarizer is not None else 0
+        evicted = 0
+        while evicted < len(self.messages) - 1 and self._over_caps(
+            len(self.messages) - evicted + reserve, total
+        ):
+            total -= self.tokens[evicted]
+            evicted += 1
+        old, self.messages = self.messages[:evicted], self.messages[evicted:]
+        self.tokens = self.tokens[evicted:]
+        if self.summarizer is None or not old:
+            return
+        try:
+            summary = self.summarizer(old)
+        except Exception:
+            # The conversation goes on without the evicted messages rather than failing on the summary.
+            return
+        self.messages.insert(0, SystemMessage(content=summary))
+        self.tokens.insert(0, self.count_tokens(summary))
+
+    def clear(self) -> None:
+        """
+        Clears all messages stored in the history.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.messages = []
+        self.tokens = []
+
+
+class HistoryStore(MutableMapping[str, BaseChatMessageHistory]):
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl: Optional[float] = 24 * 3600.0,
+        history_factory: Callable[[], BaseChatMessageHistory] = BoundedHistory,
+    ) -> None:
+        """
+        Initializes a mapping of session ids to chat histories that evicts the least recently used sessions beyond
+        `max_sessions` and the sessions idle for longer than `ttl`.
+
+        Args:
+            max_sessions (int): The maximum number of sessions kept.
+            ttl (Optional[float]): The number of seconds a session is kept after its last access. If None, sessions
+                are only evicted by the session cap.
+            history_factory (Callable[[], BaseChatMessageHistory]): The function creating the history of a new
+                session.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.history_factory = history_factory
+        self.sessions: OrderedDict[str, BaseChatMessageHistory] = OrderedDict()
+        self.last_access: Dict[str, float] = {}
+        self.evicted_sessions = 0
+        self._lock = Lock()
+
+    def new_history(self, session_id: str) -> BaseChatMessageHistory:
+        """
+        Creates the history of a new session.
+
+        Args:
+            session_id (str): The id of the session. In-memory histories do not need it.
+
+        Returns:
+            BaseChatMessageHistory: An empty chat history.
+        """
+        return self.history_factory()
+
+    def _evict_expired(self, now: float) -> None:
+        """
+        Drops the sessions idle for longer than the TTL. Sessions are ordered by last access, so only the oldest ones
+        are visited.
+
+        Args:
+            now (float): The current time.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        if self.ttl is None:
+            return
+        while self.sessions:
+            session_id = next(iter(self.sessions))
+            if now - self.last_access[session_id] <= self.ttl:
+                break
+            self._evict(session_id)
+
+    def _evict(self, session_id: str) -> None:
+        """
+        Drops a session.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        del self.sessions[session_id]
+        del self.last_access[session_id]
+        self.evicted_sessions += 1
+
+    def __getitem__(self, session_id: str) -> BaseChatMessageHistory:
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            history = self.sessions[session_id]
+            self.sessions.move_to_end(session_id)
+            self.last_access[session_id] = now
+            return history
+
+    def __setitem__(self, session_id: str, history: BaseChatMessageHistory) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            self.sessions[session_id] = history
+            self.sessions.move_to_end(session_id)
+            self.last_access[session_id] = now
+            while len(self.sessions) > self.max_sessions:
+                self._evict(next(iter(self.sessions)))
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            del self.sessions[session_id]
+            del self.last_access[session_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.sessions))
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Reports the memory used by the store, to size its caps.
+
+        Returns:
+            Dict[str, int]: The number of sessions, of messages and of bytes of message content held, and the number
+            of sessions evicted so far.
+        """
+        with self._lock:
+            histories = list(self.sessions.values())
+        messages = [message for history in histories for message in history.messages]
+        return {
+            "sessions": len(histories),
+            "messages": len(messages),
+            "content_bytes": sum(
+                len(str(message.content).encode("utf-8")) for message in messages
+            ),
+            "evicted_sessions": self.evicted_sessions,
+        }
+
+
+class SQLiteHistory(BaseChatMessageHistory):
+    def __init__(
+        self,
+        connection: sqlite3.Connection,
+        session_id: str,
+        max_messages: Optional[int] = 40,
+        lock: Optional[Lock] = None,
+    ) -> None:
+        """
+        Initializes the chat history of a session stored in an append-only SQLite log. Appending a message is a
+        single insert and loading the history reads only its last `max_messages` rows through the session index, so
+        neither grows with the length of the log.
+
+        Args:
+            connection (sqlite3.Connection): The connection to the log, as opened by `SQLiteHistoryStore.connect`.
+            session_id (str): The id of the session.
+            max_messages (Optional[int]): The number of most recent messages loaded. If None, the whole session is
+                loaded.
+            lock (Optional[Lock]): The lock serializing the use of a connection shared between threads.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.connection = connection
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self._lock = lock or Lock()
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        """
+        Loads the most recent messages of the session, oldest first.
+
+        Returns:
+            List[BaseMessage]: The last `max_messages` messages of the session.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (
+                    self.session_id,
+                    -1 if self.max_messages is None else self.max_messages,
+                ),
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in reversed(rows)])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Appends messages to the log in a single transaction.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages to add.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        rows = [
+            (self.session_id, json.dumps(message_to_dict(message)))
+            for message in messages
+        ]
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO messages (session_id, message) VALUES (?, ?)", rows
+            )
+
+    def clear(self) -> None:
+        """
+        Deletes all messages of the session from the log.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (self.session_id,)
+            )
+
+
+class SQLiteHistoryStore(HistoryStore):
+    def __init__(
+        self,
+        path: str,
+        max_messages: Optional[int] = 40,
+        max_sessions: int = 1000,
+        ttl: Optional[float] = 24 * 3600.0,
+    ) -> None:
+        """
+        Initializes a store keeping the chat histories in a SQLite database in WAL mode, so that they survive
+        restarts and are shared by every worker process opening the same file. Only lightweight handles are held in
+        memory, and evicting them drops no messages.
+
+        Args:
+            path (str): The path of the database file, created if missing.
+            max_messages (Optional[int]): The number of most recent messages loaded per session.
+            max_sessions (int): The maximum number of session handles kept.
+            ttl (Optional[float]): The number of seconds a session handle is kept after its last access.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        super().__init__(max_sessions=max_sessions, ttl=ttl)
+        self.path = path
+        self.max_messages = max_messages
+        self.connection = self.connect(path)
+        self._connection_lock = Lock()
+
+    @staticmethod
+    def connect(path: str) -> sqlite3.Connection:
+        """
+        Opens the database in WAL mode, so that readers do not block the writer, and creates the message log and its
+        session index if missing.
+
+        Args:
+            path (str): The path of the database file.
+
+        Returns:
+            sqlite3.Connection: The connection, usable from any thread.
+        """
+        connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Committed appends survive a process crash, only a power loss may lose the last ones.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, message TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)"
+            )
+        return connection
+
+    def new_history(self, session_id: str) -> BaseChatMessageHistory:
+        """
+        Opens the history of a session, with the messages already stored for it if any.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            BaseChatMessageHistory: The chat history of the session.
+        """
+        return SQLiteHistory(
+            self.connection, session_id, self.max_messages, self._connection_lock
+        )
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Reports the size of the log. Messages are on disk, so the counts cover every stored session.
+
+        Returns:
+            Dict[str, int]: The number of session handles held, the number of stored messages and their size in
+            bytes of serialized JSON, and the number of handles evicted so far.
+        """
+        with self._connection_lock:
+            n_messages, n_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(message AS BLOB))), 0) FROM messages"
+            ).fetchone()
+        return {
+            "sessions": len(self),
+            "messages": n_messages,
+            "content_bytes": n_bytes,
+            "evicted_sessions": self.evicted_sessions,
+        }
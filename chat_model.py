@@ -1,26 +1,79 @@
 import os
+from typing import List, Optional
 
 from langchain_community.chat_models import ChatHuggingFace
 from langchain_community.llms.huggingface_endpoint import HuggingFaceEndpoint
 from langchain_core.language_models import LLM, BaseChatModel, BaseLLM
-from transformers import AutoTokenizer
+from langchain_core.messages import BaseMessage
+from transformers import AutoTokenizer, PreTrainedModel
+
+from generation_scheduler import GenerationScheduler
+from local_llm import LocalChatModel, load_model
+from prefix_cache import PrefixCache
+from prompts import DEFAULT_PROMPT, prefix_boundary
+
+# Text of the RAG prompt after which the prompts of a session differ from one question to the next: the instructions
+# and the chat history come before it, the retrieved context and the question after.
+PREFIX_BOUNDARY = prefix_boundary(DEFAULT_PROMPT)
 
 
 class ChatModel:
-    def __init__(self, model_name: str) -> None:
+    def __init__(
+        self,
+        model_name: str,
+        backend: Optional[str] = None,
+        quantization: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        max_wait: Optional[float] = None,
+        prefix_cache_mb: Optional[int] = None,
+    ) -> None:
         """
         Initializes the ChatModel with a given model name.
 
         Args:
             model_name (str):The model name to use for setting up the tokenizer and the llm.
+            backend (Optional[str]): Either 'api' for the Hugging Face Inference endpoint or 'local' for in-process
+                generation. Defaults to the `CHAT_MODEL_BACKEND` environment variable, then to 'api'.
+            quantization (Optional[str]): The weight quantization of the local backend, 'int8', 'int4' or 'none',
+                which all run on the CPU, see `local_llm.load_model`. Defaults to the `CHAT_MODEL_QUANTIZATION`
+                environment variable, then to 'int8'.
+            num_threads (Optional[int]): The number of CPU threads of the local backend. Defaults to the
+                `CHAT_MODEL_NUM_THREADS` environment variable, then to the torch default.
+            max_batch_size (Optional[int]): The maximum number of sequences the local backend generates together.
+                Defaults to the `CHAT_MODEL_MAX_BATCH_SIZE` environment variable, then to 8.
+            max_wait (Optional[float]): The number of seconds the local backend waits for concurrent requests to
+                start a batch. Defaults to the `CHAT_MODEL_MAX_WAIT` environment variable, then to 0.01.
+            prefix_cache_mb (Optional[int]): The megabytes of attention key/value states of previous prompts the local
+                backend keeps to reuse for prompts starting the same way, 0 to disable. Defaults to the
+                `CHAT_MODEL_PREFIX_CACHE_MB` environment variable, then to 512.
 
         Returns:
             None: Returns NoneType
         """
-        self.chat_model = None
+        self.chat_model: Optional[BaseChatModel] = None
         self.model_name = model_name
         self.tokenizer = None
         self.llm = None
+        self.local_model: Optional[PreTrainedModel] = None
+        self.backend = backend or os.getenv("CHAT_MODEL_BACKEND", "api")
+        self.quantization = quantization or os.getenv("CHAT_MODEL_QUANTIZATION", "int8")
+        if num_threads is None and os.getenv("CHAT_MODEL_NUM_THREADS"):
+            num_threads = int(os.environ["CHAT_MODEL_NUM_THREADS"])
+        self.num_threads = num_threads
+        self.max_batch_size = max_batch_size or int(
+            os.getenv("CHAT_MODEL_MAX_BATCH_SIZE", "8")
+        )
+        self.max_wait = (
+            max_wait
+            if max_wait is not None
+            else float(os.getenv("CHAT_MODEL_MAX_WAIT", "0.01"))
+        )
+        self.prefix_cache_mb = (
+            prefix_cache_mb
+            if prefix_cache_mb is not None
+            else int(os.getenv("CHAT_MODEL_PREFIX_CACHE_MB", "512"))
+        )
 
     def set_tokenizer(self) -> None:
         """
@@ -76,15 +129,68 @@ class ChatModel:
             self.set_llm()
         return self.llm
 
+    def set_local_model(self) -> None:
+        """
+        Loads the model in-process for the local backend, with its weights quantized as configured.
+
+        Returns:
+            None: Returns object of NoneType
+
+        """
+        self.local_model = load_model(
+            self.model_name,
+            quantization=None if self.quantization == "none" else self.quantization,
+            num_threads=self.num_threads,
+        )
+
+    def get_local_model(self) -> PreTrainedModel:
+        """
+        Retrieves or lazily loads the in-process model of the local backend.
+
+        Returns:
+            PreTrainedModel: The causal language model generating the responses.
+
+        """
+        if self.local_model is None:
+            self.set_local_model()
+        return self.local_model
+
     def set_chat_model(self) -> None:
         """
-        Sets up the actual chat model integrating the LLM for generating chat responses.
+        Sets up the actual chat model integrating the LLM for generating chat responses, either through the
+        endpoint or in-process with the model and the tokenizer of `get_tokenizer`. In-process generation goes
+        through a scheduler batching the requests of concurrent sessions, which reuses the key/value states of the
+        prompt template and of each session's chat history across requests.
 
         Returns:
             None: Returns object as NoneType
 
         """
-        self.chat_model = ChatHuggingFace(llm=self.get_llm(), verbose=True)
+        if self.backend == "local":
+            model, tokenizer = self.get_local_model(), self.get_tokenizer()
+            self.chat_model = LocalChatModel(
+                model=model,
+                tokenizer=tokenizer,
+                prefix_boundary=PREFIX_BOUNDARY,
+                scheduler=GenerationScheduler(
+                    model,
+                    tokenizer.eos_token_id,
+                    max_batch_size=self.max_batch_size,
+                    max_wait=self.max_wait,
+                    prefix_cache=(
+                        PrefixCache(max_bytes=self.prefix_cache_mb * 2**20)
+                        if self.prefix_cache_mb > 0
+                        else None
+                    ),
+                ),
+                max_new_tokens=1000,
+                do_sample=True,
+                temperature=1.0,
+            )
+        elif self.backend == "api":
+            self.chat_model = ChatHuggingFace(llm=self.get_llm(), verbose=True)
+        else:
+            raise ValueError(f"Unknown chat model backend: {self.backend}")
 
     def get_chat_model(self) -> BaseChatModel:
         """
@@ -97,3 +203,16 @@ class ChatModel:
         if self.chat_model is None:
             self.set_chat_model()
         return self.chat_model
+
+    async def ainvoke(self, messages: List[BaseMessage]) -> BaseMessage:
+        """
+        Asynchronously generates a chat response, awaiting the LLM endpoint without blocking the event loop.
+
+        Args:
+            messages (List[BaseMessage]): The conversation to respond to.
+
+        Returns:
+            BaseMessage: The response of the chat model.
+
+        """
+        return await self.get_chat_model().ainvoke(messages)
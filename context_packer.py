@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from transformers import PreTrainedTokenizerBase
+
+
+class ContextPacker:
+    def __init__(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        max_tokens: int = 3000,
+        history_share: float = 0.3,
+        min_chunk_tokens: int = 32,
+        cache_size: int = 4096,
+    ) -> None:
+        """
+        Initializes a packer fitting the retrieved context and the chat history of a prompt into a token budget,
+        counted exactly with the tokenizer of the chat model.
+
+        Args:
+            tokenizer (PreTrainedTokenizerBase): The tokenizer of the chat model.
+            max_tokens (int): The number of tokens the question, context and history may use together.
+            history_share (float): The share of the budget left after the question reserved for the history. The
+                part of either share that is not needed goes to the other one.
+            min_chunk_tokens (int): The smallest part of a chunk worth keeping when the chunk has to be trimmed.
+            cache_size (int): The number of tokenized texts kept, so that chunks and messages seen again are not
+                tokenized again.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.min_chunk_tokens = min_chunk_tokens
+        self.cache_size = cache_size
+        self._tokens: OrderedDict[str, List[int]] = OrderedDict()
+        self._lock = Lock()
+        self._separator_tokens = len(self.tokenize("\n\n"))
+
+    def tokenize(self, text: str) -> List[int]:
+        """
+        Tokenizes a text, reusing the tokens of texts tokenized recently.
+
+        Args:
+            text (str): The text to tokenize.
+
+        Returns:
+            List[int]: The token ids of the text, without special tokens.
+        """
+        with self._lock:
+            if text in self._tokens:
+                self._tokens.move_to_end(text)
+                return self._tokens[text]
+        tokens = self.tokenizer.encode(text, add_special_tokens=False)
+        with self._lock:
+            self._tokens[text] = tokens
+            while len(self._tokens) > self.cache_size:
+                self._tokens.popitem(last=False)
+        return tokens
+
+    @staticmethod
+    def rank_docs(docs: Sequence[Document]) -> List[Document]:
+        """
+        Orders the retrieved documents from the most to the least relevant, by their `relevance_score` metadata when
+        they have one and by retrieval order otherwise.
+
+        Args:
+            docs (Sequence[Document]): The retrieved documents.
+
+        Returns:
+            List[Document]: The documents, most relevant first.
+        """
+        if all("relevance_score" in doc.metadata for doc in docs):
+            return sorted(docs, key=lambda doc: -doc.metadata["relevance_score"])
+        return list(docs)
+
+    def pack_docs(self, docs: Sequence[Document], budget: int) -> Tuple[str, int]:
+        """
+        Packs the most relevant documents into a token budget. The first document that does not fit is trimmed to
+        the remaining budget, and the less relevant ones are dropped.
+
+        Args:
+            docs (Sequence[Document]): The retrieved documents.
+            budget (int): The number of tokens the context may use.
+
+        Returns:
+            Tuple[str, int]: The context and the number of tokens it uses.
+        """
+        parts: List[str] = []
+        used = 0
+        for doc in self.rank_docs(docs):
+            separator = self._separator_tokens if parts else 0
+            tokens = self.tokenize(doc.page_content)
+            if used + separator + len(tokens) <= budget:
+                parts.append(doc.page_content)
+                used += separator + len(tokens)
+                continue
+            remaining = budget - used - separator
+            if remaining >= self.min_chunk_tokens:
+                parts.append(self.tokenizer.decode(tokens[:remaining]))
+                used += separator + remaining
+            break
+        return "\n\n".join(parts), used
+
+    def pack_history(
+        self, messages: Sequence[BaseMessage], budget: int
+    ) -> Tuple[str, int]:
+        """
+        Packs the most recent messages of the chat history into a token budget, dropping the oldest ones.
+
+        Args:
+            messages (Sequence[BaseMessage]): The chat history, oldest first.
+            budget (int): The number of tokens the history may use.
+
+        Returns:
+            Tuple[str, int]: The history, one message per line, and the number of tokens it uses.
+        """
+        lines: List[str] = []
+        used = 0
+        for message in reversed(messages):
+            line = f"{message.type}: {message.content}"
+            tokens = len(self.tokenize(line)) + (1 if lines else 0)
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(reversed(lines)), used
+
+    def pack(
+        self, question: str, docs: Sequence[Document], messages: Sequence[BaseMessage]
+    ) -> Tuple[str, str]:
+        """
+        Splits the budget left after the question between the context and the history, and packs both.
+
+        Args:
+            question (str): The question.
+            docs (Sequence[Document]): The retrieved documents.
+            messages (Sequence[BaseMessage]): The chat history, oldest first.
+
+        Returns:
+            Tuple[str, str]: The packed context and history.
+        """
+        available = max(self.max_tokens - len(self.tokenize(question)), 0)
+        history_budget = int(available * self.history_share)
+        _, history_needed = self.pack_history(messages, history_budget)
+        context, context_used = self.pack_docs(docs, available - history_needed)
+        history, _ = self.pack_history(messages, available - context_used)
+        return context, history
@@ -1,10 +1,757 @@
 import os
-from threading import Lock
-from typing import Any, Dict, List, Optional
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+    overload,
+)
 
+import numpy as np
 import weaviate
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.vectorstores import VectorStore
 from langchain_weaviate import WeaviateVectorStore
+from weaviate.classes.query import Filter
+from weaviate.config import AdditionalConfig, Timeout
+from weaviate.exceptions import WeaviateConnectionError
+
+from local_vectorstore import LocalVectorStore
+from mmr import maximal_marginal_relevance
+
+
+class MMRWeaviateVectorStore(WeaviateVectorStore):
+    @overload
+    def _perform_search(
+        self,
+        query: Optional[str],
+        k: int,
+        return_score: Literal[False] = False,
+        tenant: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[Document]: ...
+
+    @overload
+    def _perform_search(
+        self,
+        query: Optional[str],
+        k: int,
+        return_score: Literal[True],
+        tenant: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]: ...
+
+    def _perform_search(
+        self,
+        query: Optional[str],
+        k: int,
+        return_score: bool = False,
+        tenant: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Union[List[Document], List[Tuple[Document, float]]]:
+        """
+        Runs a search, translating a `filter` of metadata values, as accepted by the other vector stores of the
+        index, into the Weaviate `filters` argument, which expects a `Filter` object.
+
+        Args:
+            query (Optional[str]): The query text, None to search by `vector` only.
+            k (int): The number of documents to return.
+            return_score (bool): Whether to return the score of every document along with it.
+            tenant (Optional[str]): The tenant of the collection to search.
+            **kwargs (Any): Search options passed to Weaviate, and the `filter` mapping metadata keys to the values
+                the documents returned must have.
+
+        Returns:
+            Union[List[Document], List[Tuple[Document, float]]]: The documents, with their scores if `return_score`
+            is set.
+        """
+        filter = kwargs.pop("filter", None)
+        if filter:
+            kwargs["filters"] = Filter.all_of(
+                [Filter.by_property(key).equal(value) for key, value in filter.items()]
+            )
+        if return_score:
+            return super()._perform_search(
+                query, k, return_score=True, tenant=tenant, **kwargs
+            )
+        return super()._perform_search(
+            query, k, return_score=False, tenant=tenant, **kwargs
+        )
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Returns documents selected by maximal marginal relevance among the `fetch_k` most similar to a query vector,
+        fetched from Weaviate with their vectors, using the vectorized selection of `mmr.maximal_marginal_relevance`.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            fetch_k (int): The number of candidate documents.
+            lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+            **kwargs (Any): Search options passed to Weaviate.
+
+        Returns:
+            List[Document]: The selected documents.
+        """
+        results = self._perform_search(
+            query=None, k=fetch_k, include_vector=True, vector=embedding, **kwargs
+        )
+        if not results:
+            return []
+        vectors = np.array(
+            [result.metadata.pop("vector") for result in results], dtype=np.float32
+        )
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32), vectors, lambda_mult, k
+        )
+        return [results[i] for i in selected]
+
+    def add_vectors(
+        self,
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Adds precomputed vectors with their texts and metadata in one batch import request. An existing id is
+        replaced.
+
+        Args:
+            vectors (List[List[float]]): The vectors to add.
+            texts (List[str]): The text of each vector.
+            metadatas (Optional[List[Dict[str, Any]]]): The metadata of each vector.
+            ids (Optional[List[str]]): The id of each vector. Random ids are generated if not given.
+
+        Returns:
+            List[str]: The ids of the added vectors.
+        """
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        with self._collection.batch.fixed_size(
+            batch_size=len(texts), concurrent_requests=1
+        ) as batch:
+            for vector, text, metadata, doc_id in zip(vectors, texts, metadatas, ids):
+                batch.add_object(
+                    properties={self._text_key: text, **metadata},
+                    uuid=doc_id,
+                    vector=[float(value) for value in vector],
+                )
+        failed = self._collection.batch.failed_objects
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} of {len(texts)} objects failed to import: {failed[0].message}"
+            )
+        return ids
+
+
+# Errors after which a client is considered broken: it is closed rather than returned to its pool, and the call is
+# retried on a new connection.
+CONNECTION_ERRORS: Tuple[Type[BaseException], ...] = (
+    WeaviateConnectionError,
+    ConnectionError,
+)
+
+
+class ClientPool:
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        size: int = 4,
+        timeout: float = 30.0,
+        check_interval: float = 30.0,
+        check: Optional[Callable[[Any], bool]] = None,
+        close: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        """
+        Initializes a pool of vector store clients shared by concurrent callers, connected on demand up to `size`.
+        A client idle for longer than `check_interval` is health-checked before being handed out and replaced if it
+        fails, and a client whose call raised one of `CONNECTION_ERRORS` is closed instead of being returned, so that
+        one dropped connection does not break every session.
+
+        Args:
+            connect (Callable[[], Any]): Opens a new client.
+            size (int): The maximum number of clients, idle or in use.
+            timeout (float): The number of seconds a caller waits for a free client before failing.
+            check_interval (float): The number of seconds a client may stay idle without being health-checked.
+            check (Optional[Callable[[Any], bool]]): Tells whether a client is usable. Defaults to its `is_ready`
+                method.
+            close (Optional[Callable[[Any], None]]): Closes a client. Defaults to its `close` method.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.check = check if check is not None else lambda client: client.is_ready()
+        self.close_client = (
+            close if close is not None else lambda client: client.close()
+        )
+        self.idle: List[Tuple[Any, float]] = []
+        self.in_use = 0
+        self.created = 0
+        self.reconnects = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._closed = False
+        self._condition = Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """
+        Takes an idle client, health-checking it if it has been idle for long, or connects a new one if the pool is
+        not full, waiting for a client to be released otherwise.
+
+        Args:
+            timeout (Optional[float]): The number of seconds to wait for a free client. Defaults to the timeout of
+                the pool.
+
+        Returns:
+            Any: The client, to be handed back with `release`.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The client pool is closed")
+                if self.idle or self.in_use + len(self.idle) < self.size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise TimeoutError(
+                        f"No vector store client was free within {timeout} seconds"
+                    )
+                self._condition.wait(remaining)
+            client, released = self.idle.pop() if self.idle else (None, 0.0)
+            self.in_use += 1
+            waited = time.monotonic() - start
+            self.acquired += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        try:
+            if (
+                client is not None
+                and time.monotonic() - released > self.check_interval
+                and not self._healthy(client)
+            ):
+                self._discard(client)
+                client = None
+                with self._condition:
+                    self.reconnects += 1
+            if client is None:
+                client = self.connect()
+                with self._condition:
+                    self.created += 1
+        except BaseException:
+            with self._condition:
+                self.in_use -= 1
+                self._condition.notify()
+            raise
+        return client
+
+    def release(self, client: Any, broken: bool = False) -> None:
+        """
+        Hands a client back to the pool, or closes it if it is broken or the pool is closed.
+
+        Args:
+            client (Any): The client taken with `acquire`.
+            broken (bool): Whether the connection of the client failed.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._condition:
+            self.in_use -= 1
+            keep = not broken and not self._closed
+            if keep:
+                self.idle.append((client, time.monotonic()))
+            self._condition.notify()
+        if not keep:
+            self._discard(client)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Lends a client for the duration of a `with` block, releasing it when the block exits.
+
+        Args:
+            timeout (Optional[float]): The number of seconds to wait for a free client. Defaults to the timeout of
+                the pool.
+
+        Returns:
+            Iterator[Any]: The client.
+        """
+        client = self.acquire(timeout)
+        broken = False
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(client, broken)
+
+    def call(
+        self, function: Callable[[Any], Any], retries: int = 1, **kwargs: Any
+    ) -> Any:
+        """
+        Runs a function with a pooled client, retrying it on a new connection if the connection fails.
+
+        Args:
+            function (Callable[[Any], Any]): The function, taking the client.
+            retries (int): The number of retries after a connection error.
+            **kwargs (Any): The options of `connection`.
+
+        Returns:
+            Any: The result of the function.
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.connection(**kwargs) as client:
+                    return function(client)
+            except CONNECTION_ERRORS:
+                if attempt == retries:
+                    raise
+                with self._condition:
+                    self.reconnects += 1
+
+    def _healthy(self, client: Any) -> bool:
+        """
+        Health-checks a client, a check that raises counting as failed.
+
+        Args:
+            client (Any): The client to check.
+
+        Returns:
+            bool: Whether the client is usable.
+        """
+        try:
+            return bool(self.check(client))
+        except Exception:
+            return False
+
+    def _discard(self, client: Any) -> None:
+        """
+        Closes a client that leaves the pool, ignoring the errors of a connection that is already broken.
+
+        Args:
+            client (Any): The client to close.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        try:
+            self.close_client(client)
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """
+        Closes the idle clients and makes the pool close the others once released. Waiting and later callers fail.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._condition:
+            self._closed = True
+            idle, self.idle = self.idle, []
+            self._condition.notify_all()
+        for client, _ in idle:
+            self._discard(client)
+
+    def __enter__(self) -> "ClientPool":
+        """
+        Enters a `with` block closing the pool when it exits.
+
+        Returns:
+            ClientPool: The pool itself.
+        """
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """
+        Closes the pool at the end of a `with` block.
+
+        Args:
+            *exc_info (Any): The exception raised in the block, if any.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.close()
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports the usage of the pool, to size it under concurrent load.
+
+        Returns:
+            Dict[str, float]: The number of clients in use, idle and created, of reconnections, of acquisitions and
+            of acquisitions that timed out, and the mean and maximum time waited for a client in seconds.
+        """
+        with self._condition:
+            return {
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "created": self.created,
+                "reconnects": self.reconnects,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "mean_wait_seconds": (
+                    self.wait_seconds / self.acquired if self.acquired else 0.0
+                ),
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+def sigmoid_relevance_score(score: float) -> float:
+    """
+    Maps a Weaviate score to a relevance score between 0 and 1 with a logistic function, as the Weaviate vector
+    stores do by default.
+
+    Args:
+        score (float): The score returned by Weaviate.
+
+    Returns:
+        float: The relevance score.
+    """
+    return float(1 - 1 / (1 + np.exp(np.clip(score, -709, 709))))
+
+
+class PooledVectorStore(VectorStore):
+    def __init__(
+        self,
+        pool: ClientPool,
+        embedding: Optional[Embeddings] = None,
+        relevance_score_fn: Callable[[float], float] = sigmoid_relevance_score,
+    ) -> None:
+        """
+        Initializes a vector store running each operation on a vector store taken from a pool, so that concurrent
+        sessions use separate connections and a failed connection is replaced transparently.
+
+        Args:
+            pool (ClientPool): The pool, whose clients are vector stores, each with its own connection.
+            embedding (Optional[Embeddings]): The embeddings model, passed on to the pooled vector stores.
+            relevance_score_fn (Callable[[float], float]): Maps the scores of the pooled vector stores to relevance
+                scores between 0 and 1.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.pool = pool
+        self._embedding = embedding
+        self.relevance_score_fn = relevance_score_fn
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        """
+        Exposes the embeddings model passed on to the pooled vector stores.
+
+        Returns:
+            Optional[Embeddings]: The embeddings model, if any.
+        """
+        return self._embedding
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """
+        Runs a method of a pooled vector store, with the embeddings model of this one.
+
+        Args:
+            method (str): The name of the method.
+            *args (Any): The positional arguments of the method.
+            **kwargs (Any): The keyword arguments of the method.
+
+        Returns:
+            Any: The result of the method.
+        """
+
+        def run(store: VectorStore) -> Any:
+            store._embedding = self._embedding  # type: ignore[attr-defined]
+            return getattr(store, method)(*args, **kwargs)
+
+        return self.pool.call(run)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Embeds and adds texts on a pooled connection.
+
+        Args:
+            texts (Iterable[str]): The texts to add.
+            metadatas (Optional[List[dict]]): The metadata of each text.
+            **kwargs (Any): The options of the pooled vector stores, such as `ids`.
+
+        Returns:
+            List[str]: The ids of the added texts.
+        """
+        # Materialized, so that a retry gets the texts again.
+        return self._call("add_texts", list(texts), metadatas, **kwargs)
+
+    def add_vectors(
+        self,
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Bulk imports texts with their precomputed vectors on a pooled connection.
+
+        Args:
+            vectors (List[List[float]]): The vectors of the texts.
+            texts (List[str]): The texts.
+            metadatas (Optional[List[Dict[str, Any]]]): The metadata of each text.
+            ids (Optional[List[str]]): The ids of the texts. Defaults to random UUIDs.
+
+        Returns:
+            List[str]: The ids of the imported texts.
+        """
+        return self._call("add_vectors", vectors, texts, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        Deletes documents by id on a pooled connection.
+
+        Args:
+            ids (Optional[List[str]]): The ids of the documents to delete.
+            **kwargs (Any): The options of the pooled vector stores.
+
+        Returns:
+            Optional[bool]: Whether the deletion succeeded, None if the pooled vector stores do not tell.
+        """
+        return self._call("delete", ids, **kwargs)
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """
+        Searches the documents most similar to a query on a pooled connection.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options, such as `filter`.
+
+        Returns:
+            List[Document]: The most similar documents, best first.
+        """
+        return self._call("similarity_search", query, k=k, **kwargs)
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Searches the documents most similar to a query, with their scores, on a pooled connection.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options, such as `filter`.
+
+        Returns:
+            List[Tuple[Document, float]]: The most similar documents with their scores, best first.
+        """
+        return self._call("similarity_search_with_score", query, k=k, **kwargs)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """
+        Searches the documents most similar to a query vector on a pooled connection.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options, such as `filter`.
+
+        Returns:
+            List[Document]: The most similar documents, best first.
+        """
+        return self._call("similarity_search_by_vector", embedding, k=k, **kwargs)
+
+    def similarity_search_by_vector_batch(
+        self,
+        embeddings: Sequence[List[float]],
+        ks: Sequence[int],
+        filters: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+        **kwargs: Any,
+    ) -> List[List[Document]]:
+        """
+        Searches several query vectors concurrently, each on its own pooled connection, up to the size of the pool.
+
+        Args:
+            embeddings (Sequence[List[float]]): The query vectors.
+            ks (Sequence[int]): The number of documents to return for each query.
+            filters (Optional[Sequence[Optional[Dict[str, Any]]]]): The metadata values the documents returned for
+                each query must have, if any.
+            **kwargs (Any): Search options passed to every search.
+
+        Returns:
+            List[List[Document]]: The documents of each query, in query order.
+        """
+        if filters is None:
+            filters = [None] * len(embeddings)
+
+        def search(
+            embedding: List[float], k: int, filter: Optional[Dict[str, Any]]
+        ) -> List[Document]:
+            if filter:
+                return self.similarity_search_by_vector(
+                    embedding, k=k, filter=filter, **kwargs
+                )
+            return self.similarity_search_by_vector(embedding, k=k, **kwargs)
+
+        if len(embeddings) <= 1:
+            return [search(*query) for query in zip(embeddings, ks, filters)]
+        with ThreadPoolExecutor(min(self.pool.size, len(embeddings))) as executor:
+            return list(executor.map(search, embeddings, ks, filters))
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Selects documents by maximal marginal relevance among the `fetch_k` most similar to a query, on a pooled
+        connection.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            fetch_k (int): The number of candidate documents.
+            lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+            **kwargs (Any): Search options, such as `filter`.
+
+        Returns:
+            List[Document]: The selected documents, in selection order.
+        """
+        return self._call(
+            "max_marginal_relevance_search",
+            query,
+            k=k,
+            fetch_k=fetch_k,
+            lambda_mult=lambda_mult,
+            **kwargs,
+        )
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Selects documents by maximal marginal relevance among the `fetch_k` most similar to a query vector, on a
+        pooled connection.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            fetch_k (int): The number of candidate documents.
+            lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+            **kwargs (Any): Search options, such as `filter`.
+
+        Returns:
+            List[Document]: The selected documents, in selection order.
+        """
+        return self._call(
+            "max_marginal_relevance_search_by_vector",
+            embedding,
+            k=k,
+            fetch_k=fetch_k,
+            lambda_mult=lambda_mult,
+            **kwargs,
+        )
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        """
+        Selects the function mapping the scores of `similarity_search_with_score` to relevance scores.
+
+        Returns:
+            Callable[[float], float]: The relevance score function of this vector store.
+        """
+        return self.relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        pool_size: int = 4,
+        pool_timeout: float = 30.0,
+        index_name: str = "MyIndex",
+        text_key: str = "text",
+        **kwargs: Any,
+    ) -> "PooledVectorStore":
+        """
+        Connects a pool of clients of the Weaviate cluster configured by the environment, see `Database.connect`,
+        and adds texts to one of its indexes.
+
+        Args:
+            texts (List[str]): The texts to add.
+            embedding (Embeddings): The embeddings model.
+            metadatas (Optional[List[dict]]): The metadata of each text.
+            pool_size (int): The maximum number of clients.
+            pool_timeout (float): The number of seconds a call waits for a free client.
+            index_name (str): The name of the Weaviate index.
+            text_key (str): The property holding the texts in the index.
+            **kwargs (Any): The options of `add_texts`, such as `ids`.
+
+        Returns:
+            PooledVectorStore: The vector store of the index, on the new pool.
+        """
+        pool = Database.connect_pool(
+            size=pool_size,
+            timeout=pool_timeout,
+            index_name=index_name,
+            text_key=text_key,
+        )
+        vectorstore = cls(pool, embedding=embedding)
+        try:
+            vectorstore.add_texts(texts, metadatas, **kwargs)
+        except BaseException:
+            pool.close()
+            raise
+        return vectorstore
 
 
 class DatabaseSingletonMeta(type):
@@ -33,34 +780,132 @@ class DatabaseSingletonMeta(type):
 
 
 class Database(metaclass=DatabaseSingletonMeta):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+    ) -> None:
         """
-        Initializes the Database object by connecting to a Weaviate cluster and authentication using
-        environmental variables.
+        Initializes the Database object with a pool of clients of a Weaviate cluster, connected on demand and
+        authenticated using environmental variables, unless the in-process local backend is selected.
+
+        Args:
+            backend (Optional[str]): Either 'weaviate' or 'local'. Defaults to the `VECTOR_STORE_BACKEND`
+                environment variable, then to 'weaviate'.
+            pool_size (Optional[int]): The maximum number of Weaviate clients. Defaults to the
+                `VECTOR_STORE_POOL_SIZE` environment variable, then to 4.
+            pool_timeout (Optional[float]): The number of seconds a call waits for a free client. Defaults to the
+                `VECTOR_STORE_POOL_TIMEOUT` environment variable, then to 30.
 
         Returns:
             None: Returns object of NoneType
 
         """
-        self.db = None
-        self.client = weaviate.connect_to_wcs(
+        self.db: Optional[VectorStore] = None
+        self.pool: Optional[ClientPool] = None
+        self.backend = backend or os.getenv("VECTOR_STORE_BACKEND", "weaviate")
+        if self.backend != "local":
+            self.pool = self.connect_pool(
+                size=pool_size or int(os.getenv("VECTOR_STORE_POOL_SIZE", "4")),
+                timeout=(
+                    pool_timeout
+                    if pool_timeout is not None
+                    else float(os.getenv("VECTOR_STORE_POOL_TIMEOUT", "30"))
+                ),
+            )
+
+    @staticmethod
+    def connect() -> weaviate.WeaviateClient:
+        """
+        Connects a client to the Weaviate cluster, with the query and insert timeouts of the
+        `VECTOR_STORE_QUERY_TIMEOUT` and `VECTOR_STORE_INSERT_TIMEOUT` environment variables, in seconds, defaulting
+        to 30 and 90.
+
+        Returns:
+            weaviate.WeaviateClient: The connected client.
+
+        """
+        return weaviate.connect_to_wcs(
             cluster_url=os.getenv("WCS_DEMO_URL"),  # Replace with your WCS URL
             auth_credentials=weaviate.auth.AuthApiKey(
                 os.getenv("WCS_DEMO_RO_KEY")
             ),  # Replace with your WCS key
+            additional_config=AdditionalConfig(
+                timeout=Timeout(
+                    query=int(os.getenv("VECTOR_STORE_QUERY_TIMEOUT", "30")),
+                    insert=int(os.getenv("VECTOR_STORE_INSERT_TIMEOUT", "90")),
+                )
+            ),
+        )
+
+    @staticmethod
+    def connect_store(
+        index_name: str = "MyIndex", text_key: str = "text"
+    ) -> MMRWeaviateVectorStore:
+        """
+        Connects a new client and wraps it into the vector store of the index, as the pooled clients.
+
+        Args:
+            index_name (str): The name of the Weaviate index.
+            text_key (str): The property holding the texts in the index.
+
+        Returns:
+            MMRWeaviateVectorStore: The vector store, with its own connection.
+
+        """
+        client = Database.connect()
+        try:
+            return MMRWeaviateVectorStore(
+                client=client, index_name=index_name, text_key=text_key
+            )
+        except BaseException:
+            client.close()
+            raise
+
+    @staticmethod
+    def connect_pool(
+        size: int, timeout: float, index_name: str = "MyIndex", text_key: str = "text"
+    ) -> ClientPool:
+        """
+        Creates a pool of vector stores of a Weaviate index, each connecting its own client on demand.
+
+        Args:
+            size (int): The maximum number of clients.
+            timeout (float): The number of seconds a call waits for a free client.
+            index_name (str): The name of the Weaviate index.
+            text_key (str): The property holding the texts in the index.
+
+        Returns:
+            ClientPool: The pool of vector stores.
+
+        """
+        return ClientPool(
+            lambda: Database.connect_store(index_name, text_key),
+            size=size,
+            timeout=timeout,
+            check=lambda store: store._client.is_ready(),
+            close=lambda store: store._client.close(),
         )
 
     def set_db(self) -> None:
         """
-        Initializes and sets the database variable, setting up the Weaviate vector storage integration.
+        Initializes and sets the database variable, setting up the Weaviate vector storage integration on the client
+        pool or the local vector store persisted in the `LOCAL_VECTOR_STORE_DIR` directory, searched exactly or
+        through an HNSW index depending on `LOCAL_VECTOR_STORE_INDEX`.
 
         Returns:
             None: Returns object of NoneType
 
         """
-        self.db = WeaviateVectorStore(
-            client=self.client, index_name="MyIndex", text_key="text"
-        )
+        if self.pool is None:
+            self.db = LocalVectorStore(
+                path=os.getenv("LOCAL_VECTOR_STORE_DIR", "vectorstore"),
+                metric=os.getenv("LOCAL_VECTOR_STORE_METRIC", "cosine"),
+                index=os.getenv("LOCAL_VECTOR_STORE_INDEX", "flat"),
+            )
+        else:
+            self.db = PooledVectorStore(self.pool)
 
     def get_db(self) -> VectorStore:
         """
@@ -74,12 +919,48 @@ class Database(metaclass=DatabaseSingletonMeta):
             self.set_db()
         return self.db
 
+    def close(self) -> None:
+        """
+        Closes the client pool and forgets the singleton instance, so that the next `Database()` connects again.
+
+        Returns:
+            None: Returns object of NoneType
+
+        """
+        if self.pool is not None:
+            self.pool.close()
+        with DatabaseSingletonMeta._lock:
+            if DatabaseSingletonMeta._instances.get(type(self)) is self:
+                del DatabaseSingletonMeta._instances[type(self)]
+
+    def __enter__(self) -> "Database":
+        """
+        Enters a `with` block closing the database when it exits.
+
+        Returns:
+            Database: The database itself.
+        """
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """
+        Closes the database at the end of a `with` block.
+
+        Args:
+            *exc_info (Any): The exception raised in the block, if any.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.close()
+
     def __del__(self) -> None:
         """
-        Safely closes the client connection when the Database object is deleted.
+        Safely closes the client connections when the Database object is deleted.
 
         Returns:
             None: Returns of object of NoneType
 
         """
-        self.client.close()
+        if self.pool is not None:
+            self.pool.close()
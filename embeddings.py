@@ -1,40 +1,831 @@
+import asyncio
+import hashlib
+import json
 import os
-from typing import Union
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional, Union
 
 import langchain_core
+import numpy as np
+import requests
+import torch
 from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
 from langchain_core.pydantic_v1 import BaseModel
+from sentence_transformers import SentenceTransformer
+from torch.ao.quantization import quantize_dynamic
+
+
+def embed_queries(
+    embeddings: langchain_core.embeddings.Embeddings, texts: List[str]
+) -> List[List[float]]:
+    """
+    Embeds several queries at once with the models of this module, which batch them, and one by one with other
+    models, which may embed queries differently from documents.
+
+    Args:
+        embeddings (langchain_core.embeddings.Embeddings): The embeddings model.
+        texts (List[str]): The queries to embed.
+
+    Returns:
+        List[List[float]]: One embedding per query, in input order.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class EmbeddingCache:
+    def __init__(
+        self, model_name: str, cache_dir: Optional[str] = None, max_items: int = 10000
+    ) -> None:
+        """
+        Initializes a content-addressed store of embedding vectors. Recently used vectors are kept in a bounded
+        in-memory LRU, and when a cache directory is given every vector is also appended to a float32 matrix on disk
+        that is read back through a memory map.
+
+        Args:
+            model_name (str): The name of the embeddings model, part of every cache key and of the name of its
+                on-disk directory.
+            cache_dir (Optional[str]): The directory holding the on-disk cache. If None, only the LRU is used.
+            max_items (int): The maximum number of vectors kept in the in-memory LRU.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.model_name = model_name
+        self.max_items = max_items
+        self.lru: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.rows: Dict[str, int] = {}
+        self.dim: Optional[int] = None
+        self.matrix: Optional[np.memmap] = None
+        self.path: Optional[str] = None
+        self._lock = Lock()
+        if cache_dir is not None:
+            self.path = os.path.join(
+                cache_dir, model_name.replace("/", "__").replace(":", "--")
+            )
+            os.makedirs(self.path, exist_ok=True)
+            self._load(self.path)
+
+    def key(self, text: str, kind: str = "document") -> str:
+        """
+        Computes the cache key of a text, made of the model name, the kind of embedding and a hash of the text.
+
+        Args:
+            text (str): The text to compute the key for.
+            kind (str): Either 'document' or 'query', as some models embed the two differently.
+
+        Returns:
+            str: The hexadecimal cache key.
+        """
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{kind}:{digest}"
+
+    def _load(self, path: str) -> None:
+        """
+        Reads the key index and maps the vector matrix of the on-disk cache, if one exists already. Rows that were
+        written without their key, e.g. after a crash, and an incomplete last key are cut off the files, so that the
+        next vectors are appended at the row of their key. Files left without the metadata are removed.
+
+        Args:
+            path (str): The directory of the on-disk cache.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        meta_file = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_file):
+            # The metadata is written after the first vectors, which a crash may have left without it.
+            for name in ("vectors.f32", "keys.txt"):
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+            return
+        with open(meta_file) as f:
+            dim: int = json.load(f)["dim"]
+        self.dim = dim
+        vectors_file = os.path.join(path, "vectors.f32")
+        keys_file = os.path.join(path, "keys.txt")
+        with open(keys_file, "rb") as f:
+            lines = [line for line in f if line.endswith(b"\n")]
+        row_size = 4 * dim
+        n_rows = min(len(lines), os.path.getsize(vectors_file) // row_size)
+        os.truncate(vectors_file, n_rows * row_size)
+        os.truncate(keys_file, sum(len(line) for line in lines[:n_rows]))
+        self.rows = {
+            line.decode("utf-8").rstrip("\n"): row
+            for row, line in enumerate(lines[:n_rows])
+        }
+        self._map()
+
+    def _map(self) -> None:
+        """
+        Memory-maps the rows of the on-disk vector matrix that are covered by the key index.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.rows and self.path is not None and self.dim is not None:
+            self.matrix = np.memmap(
+                os.path.join(self.path, "vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self.rows), self.dim),
+            )
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Looks up a vector, first in the in-memory LRU and then on disk.
+
+        Args:
+            key (str): The cache key of the vector.
+
+        Returns:
+            Optional[np.ndarray]: The cached vector, or None if the key is not cached.
+        """
+        with self._lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key]
+            row = self.rows.get(key)
+            if row is None:
+                return None
+            if self.matrix is None or row >= len(self.matrix):
+                self._map()
+            if self.matrix is None:
+                return None
+            vector = np.array(self.matrix[row])
+            self._remember(key, vector)
+            return vector
+
+    def put(self, keys: List[str], vectors: List[List[float]]) -> None:
+        """
+        Stores vectors in the in-memory LRU and appends the ones not on disk yet to the on-disk cache.
+
+        Args:
+            keys (List[str]): The cache keys of the vectors.
+            vectors (List[List[float]]): The vectors to store.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if not keys:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for key, vector in zip(keys, matrix):
+                self._remember(key, vector)
+            if self.path is None:
+                return
+            new = [i for i, key in enumerate(keys) if key not in self.rows]
+            new = list({keys[i]: i for i in new}.values())
+            if not new:
+                return
+            # Vectors go first so that the key index never points past the end of the matrix, and the metadata last
+            # so that it never describes files that do not exist.
+            with open(os.path.join(self.path, "vectors.f32"), "ab") as f:
+                f.write(matrix[new].tobytes())
+            with open(os.path.join(self.path, "keys.txt"), "a") as f:
+                f.write("".join(f"{keys[i]}\n" for i in new))
+            for i in new:
+                self.rows[keys[i]] = len(self.rows)
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                with open(os.path.join(self.path, "meta.json"), "w") as f:
+                    json.dump({"model_name": self.model_name, "dim": self.dim}, f)
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        """
+        Puts a vector in the in-memory LRU, evicting the least recently used vectors beyond `max_items`.
+
+        Args:
+            key (str): The cache key of the vector.
+            vector (np.ndarray): The vector to keep in memory.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.lru[key] = vector
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_items:
+            self.lru.popitem(last=False)
+
+    def __len__(self) -> int:
+        """
+        Counts the distinct vectors held by the cache.
+
+        Returns:
+            int: The number of vectors on disk, or in memory for a memory-only cache.
+        """
+        return len(self.rows) if self.path is not None else len(self.lru)
+
+
+class CachedEmbeddings(langchain_core.embeddings.Embeddings):
+    def __init__(
+        self,
+        embeddings: langchain_core.embeddings.Embeddings,
+        model_name: str,
+        cache_dir: Optional[str] = None,
+        max_items: int = 10000,
+    ) -> None:
+        """
+        Wraps an embeddings model so that only texts missing from the cache are sent to it.
+
+        Args:
+            embeddings (langchain_core.embeddings.Embeddings): The embeddings model computing the cache misses.
+            model_name (str): The name of the wrapped embeddings model, part of every cache key, along with anything
+                else changing its vectors, such as its backend or quantization.
+            cache_dir (Optional[str]): The directory holding the on-disk cache. If None, only memory is used.
+            max_items (int): The maximum number of vectors kept in memory.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.embeddings = embeddings
+        self.cache = EmbeddingCache(
+            model_name, cache_dir=cache_dir, max_items=max_items
+        )
+        self.hits = 0
+        self.misses = 0
+        self.backend_calls = 0
+        self.backend_seconds = 0.0
+        self._stats_lock = Lock()
+
+    def _count(
+        self,
+        hits: int,
+        misses: int,
+        backend_calls: int = 0,
+        backend_seconds: float = 0.0,
+    ) -> None:
+        """
+        Updates the cache counters, which concurrent sessions share.
+
+        Args:
+            hits (int): The number of texts served from the cache.
+            misses (int): The number of texts missing from the cache.
+            backend_calls (int): The number of calls made to the wrapped model.
+            backend_seconds (float): The seconds spent in the wrapped model.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.backend_calls += backend_calls
+            self.backend_seconds += backend_seconds
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of documents, serving cached vectors and sending the remaining texts to the wrapped model in a
+        single call.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        keys = [self.cache.key(text) for text in texts]
+        vectors: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector.tolist()
+        self._count(len(texts) - len(missing), len(missing))
+        if missing:
+            start = time.perf_counter()
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            self._count(0, 0, 1, time.perf_counter() - start)
+            self.cache.put(list(missing.keys()), computed)
+            vectors.update(zip(missing.keys(), computed))
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a query, calling the wrapped model only if the query is not cached.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        key = self.cache.key(text, kind="query")
+        vector = self.cache.get(key)
+        if vector is not None:
+            self._count(1, 0)
+            return vector.tolist()
+        start = time.perf_counter()
+        computed = self.embeddings.embed_query(text)
+        self._count(0, 1, 1, time.perf_counter() - start)
+        self.cache.put([key], [computed])
+        return computed
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds several queries, sending the ones that are not cached to the wrapped model in a single call.
+
+        Args:
+            texts (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: One embedding per query, in input order.
+        """
+        keys = [self.cache.key(text, kind="query") for text in texts]
+        vectors: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector.tolist()
+        self._count(len(texts) - len(missing), len(missing))
+        if missing:
+            start = time.perf_counter()
+            computed = embed_queries(self.embeddings, list(missing.values()))
+            self._count(0, 0, 1, time.perf_counter() - start)
+            self.cache.put(list(missing.keys()), computed)
+            vectors.update(zip(missing.keys(), computed))
+        return [vectors[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Asynchronously embeds a query, awaiting the wrapped model only if the query is not cached.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        key = self.cache.key(text, kind="query")
+        vector = self.cache.get(key)
+        if vector is not None:
+            self._count(1, 0)
+            return vector.tolist()
+        start = time.perf_counter()
+        computed = await self.embeddings.aembed_query(text)
+        self._count(0, 1, 1, time.perf_counter() - start)
+        self.cache.put([key], [computed])
+        return computed
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports the cache counters, to measure how much backend traffic and latency the cache saves.
+
+        Returns:
+            Dict[str, float]: The hits, misses, hit rate, number of backend calls, seconds spent in the backend and
+            number of cached vectors.
+        """
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+            backend_calls, backend_seconds = self.backend_calls, self.backend_seconds
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "backend_calls": backend_calls,
+            "backend_seconds": backend_seconds,
+            "cached_vectors": len(self.cache),
+        }
+
+
+class InferenceAPIEmbeddings(HuggingFaceInferenceAPIEmbeddings):
+    """Hugging Face Inference API embeddings raising HTTP errors, rather than returning their body, with a timeout."""
+
+    timeout: float = 60.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of documents in one request.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        response = requests.post(
+            self._api_url,
+            headers=self._headers,
+            json={
+                "inputs": texts,
+                "options": {"wait_for_model": True, "use_cache": True},
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Tells whether a failed embeddings request may succeed if sent again: timeouts, connection errors, rate limiting
+    and server errors. Other errors, e.g. a rejected API key or a malformed request, fail the same way every time.
+
+    Args:
+        error (BaseException): The error raised by the request.
+
+    Returns:
+        bool: True if the request should be retried.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status in (408, 429) or status >= 500
+    return isinstance(
+        error,
+        (TimeoutError, ConnectionError, requests.Timeout, requests.ConnectionError),
+    )
+
+
+class BatchedEmbeddings(langchain_core.embeddings.Embeddings):
+    def __init__(
+        self,
+        embeddings: langchain_core.embeddings.Embeddings,
+        max_batch_size: int = 32,
+        max_batch_chars: int = 16000,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+    ) -> None:
+        """
+        Wraps an embeddings model so that large inputs are sent to it as size-bounded batches, several of them
+        concurrently, with batches failing with a transient error retried with exponential backoff. Other errors
+        are raised at once.
+
+        Args:
+            embeddings (langchain_core.embeddings.Embeddings): The embeddings model computing each batch.
+            max_batch_size (int): The maximum number of texts in a batch.
+            max_batch_chars (int): The maximum total number of characters in a batch. A single text longer than this
+                still gets a batch of its own.
+            max_concurrency (int): The maximum number of batches in flight at the same time.
+            max_retries (int): The number of times a batch failing with a transient error is retried before it is
+                split in halves, or the error is raised for a single text.
+            backoff (float): The delay in seconds before the first retry, doubled on every further retry.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retries = 0
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Splits the positions of the texts into consecutive batches bounded by count and total characters.
+
+        Args:
+            texts (List[str]): The texts to split into batches.
+
+        Returns:
+            List[List[int]]: The positions of the texts in each batch.
+        """
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        chars = 0
+        for i, text in enumerate(texts):
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or chars + len(text) > self.max_batch_chars
+            ):
+                batches.append(batch)
+                batch, chars = [], 0
+            batch.append(i)
+            chars += len(text)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds one batch, retrying it with exponential backoff and splitting it in halves if it keeps failing with a
+        transient error, as overly large requests are a common cause of timeouts. Other errors are raised at once.
+
+        Args:
+            texts (List[str]): The texts of the batch.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectors = await self.embeddings.aembed_documents(texts)
+                if not isinstance(vectors, list) or len(vectors) != len(texts):
+                    raise ValueError(
+                        f"Unexpected embeddings response: {vectors!r:.200}"
+                    )
+                return vectors
+            except Exception as e:
+                if not is_transient(e) or (
+                    attempt == self.max_retries and len(texts) == 1
+                ):
+                    raise
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(self.backoff * 2**attempt)
+        middle = len(texts) // 2
+        return await self._aembed_batch(texts[:middle]) + await self._aembed_batch(
+            texts[middle:]
+        )
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of documents as concurrent batches.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(batch: List[int]) -> List[List[float]]:
+            async with semaphore:
+                return await self._aembed_batch([texts[i] for i in batch])
+
+        batches = self.make_batches(texts)
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+        vectors: List[List[float]] = [[] for _ in texts]
+        for batch, batch_vectors in zip(batches, results):
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of documents as concurrent batches from synchronous code. When called from a thread that
+        already runs an event loop, the batches are dispatched from a helper thread.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed_documents(texts))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.aembed_documents(texts)).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a query with the same retry policy as the document batches.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return self.embeddings.embed_query(text)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff * 2**attempt)
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds several queries as concurrent batches. The Inference API embeds queries and documents alike.
+
+        Args:
+            texts (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: One embedding per query, in input order.
+        """
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Asynchronously embeds a query with the same retry policy as the document batches.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return await self.embeddings.aembed_query(text)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff * 2**attempt)
+        return await self.embeddings.aembed_query(text)
+
+
+class LocalEmbeddings(langchain_core.embeddings.Embeddings):
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-mpnet-base-v2",
+        batch_size: int = 32,
+        num_threads: Optional[int] = None,
+        quantize: bool = False,
+    ) -> None:
+        """
+        Initializes an embeddings model that runs a sentence-transformers model in-process on CPU, so that no network
+        round trip is needed.
+
+        Args:
+            model_name (str): The name or local path of the sentence-transformers model.
+            batch_size (int): The number of texts encoded per forward pass.
+            num_threads (Optional[int]): The number of threads used by torch. If None, the torch default is kept.
+            quantize (bool): If True, the linear layers of the model are quantized to int8 dynamically, which trades
+                a little accuracy for faster CPU inference.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.quantize = quantize
+        self.model = None
+        self._lock = Lock()
+
+    def set_model(self) -> None:
+        """
+        Loads the model on CPU, quantizing it if configured.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        model = SentenceTransformer(self.model_name, device="cpu")
+        model.eval()
+        if self.quantize:
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def get_model(self) -> SentenceTransformer:
+        """
+        Retrieves or lazily loads the model.
+
+        Returns:
+            SentenceTransformer: The model used for encoding texts.
+        """
+        if self.model is None:
+            self.set_model()
+        return self.model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of documents. Texts are sorted by length before being split into batches, by
+        `SentenceTransformer.encode`, so that each batch is padded to similar lengths, and the embeddings are
+        returned in input order.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One normalized embedding per text, in input order.
+        """
+        if not texts:
+            return []
+        model = self.get_model()
+        with self._lock, torch.inference_mode():
+            if self.num_threads is not None:
+                torch.set_num_threads(self.num_threads)
+            vectors = model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a query.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The normalized embedding of the query.
+        """
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds several queries in batched forward passes.
+
+        Args:
+            texts (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: One normalized embedding per query, in input order.
+        """
+        return self.embed_documents(texts)
 
 
 class Embeddings:
     def __init__(
-        self, embedding_model_name: str = "sentence-transformers/all-mpnet-base-v2"
+        self,
+        embedding_model_name: str = "sentence-transformers/all-mpnet-base-v2",
+        cache_dir: Optional[str] = None,
+        max_cache_items: int = 10000,
+        max_batch_size: int = 32,
+        max_concurrency: int = 4,
+        backend: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        quantize: Optional[bool] = None,
     ) -> None:
         """
         Initializes the Embeddings class by specifying the model to be used for generating embeddings.
 
         Args:
             embedding_model_name (str): The name of the model hosted on Hugging Face's model hub used for embeddings.
+            cache_dir (Optional[str]): The directory of the on-disk embedding cache. Defaults to the
+                `EMBEDDINGS_CACHE_DIR` environment variable; if neither is set, embeddings are not cached.
+            max_cache_items (int): The maximum number of vectors the cache keeps in memory.
+            max_batch_size (int): The maximum number of texts sent to the model in one request.
+            max_concurrency (int): The maximum number of requests in flight at the same time.
+            backend (Optional[str]): Either 'api' for the Hugging Face Inference API or 'local' for in-process CPU
+                inference. Defaults to the `EMBEDDINGS_BACKEND` environment variable, then to 'api'.
+            num_threads (Optional[int]): The number of CPU threads of the local backend. Defaults to the
+                `EMBEDDINGS_NUM_THREADS` environment variable, then to the torch default.
+            quantize (Optional[bool]): Whether the local backend quantizes the model to int8. Defaults to the
+                `EMBEDDINGS_QUANTIZE` environment variable, then to False.
 
         Returns:
             None: Returns object of NoneType
         """
-        self.embeddings = None
+        self.embeddings: Optional[langchain_core.embeddings.Embeddings] = None
         self.embedding_model_name = embedding_model_name
+        self.cache_dir = cache_dir or os.getenv("EMBEDDINGS_CACHE_DIR")
+        self.max_cache_items = max_cache_items
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.backend = backend or os.getenv("EMBEDDINGS_BACKEND", "api")
+        if num_threads is None and os.getenv("EMBEDDINGS_NUM_THREADS"):
+            num_threads = int(os.environ["EMBEDDINGS_NUM_THREADS"])
+        self.num_threads = num_threads
+        if quantize is None:
+            quantize = os.getenv("EMBEDDINGS_QUANTIZE", "").lower() in ("1", "true")
+        self.quantize = quantize
 
     def set_embeddings_model(self) -> None:
         """
-        Configures and sets the embeddings object using the specified transformer model from Hugging Face API.
-        It uses an API key stored in the environment to authenticate on Hugging Face Hub.
+        Configures and sets the embeddings object using the specified transformer model, either from Hugging Face
+        API or in-process. The API uses an API key stored in the environment to authenticate on Hugging Face Hub, and
+        requests are dispatched in concurrent batches. If a cache directory is configured only cache misses are sent
+        to the model.
 
         Returns:
             None: Returns object of NoneType
 
         """
-        self.embeddings = HuggingFaceInferenceAPIEmbeddings(
-            model_name=self.embedding_model_name,
-            api_key=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
-        )
+        if self.backend == "local":
+            self.embeddings = LocalEmbeddings(
+                model_name=self.embedding_model_name,
+                batch_size=self.max_batch_size,
+                num_threads=self.num_threads,
+                quantize=self.quantize,
+            )
+        elif self.backend == "api":
+            self.embeddings = InferenceAPIEmbeddings(
+                model_name=self.embedding_model_name,
+                api_key=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
+            )
+            self.embeddings = BatchedEmbeddings(
+                self.embeddings,
+                max_batch_size=self.max_batch_size,
+                max_concurrency=self.max_concurrency,
+            )
+        else:
+            raise ValueError(f"Unknown embeddings backend: {self.backend}")
+        if self.cache_dir:
+            # The backend and the precision of the weights change the vectors, so they are part of the cache keys.
+            precision = "int8" if self.backend == "local" and self.quantize else "fp32"
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                model_name=f"{self.embedding_model_name}:{self.backend}:{precision}",
+                cache_dir=self.cache_dir,
+                max_items=self.max_cache_items,
+            )
 
     def get_embeddings_model(
         self,
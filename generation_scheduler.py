@@ -0,0 +1,512 @@
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+from model_utils import model_device
+from prefix_cache import KVCache, PrefixCache
+
+
+class GenerationStream:
+    def __init__(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int,
+        do_sample: bool,
+        temperature: float,
+        cache_length: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes the handle of one generation request, through which its caller receives the generated tokens as
+        a stream, or all at once as from a future.
+
+        Args:
+            prompt_ids (List[int]): The token ids of the prompt.
+            max_new_tokens (int): The maximum number of tokens generated.
+            do_sample (bool): Whether tokens are sampled, rather than picked greedily.
+            temperature (float): The sampling temperature.
+            cache_length (Optional[int]): The number of prompt tokens whose states the prefix cache keeps. Defaults
+                to the whole prompt.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.prompt_ids = prompt_ids
+        self.cache_length = cache_length
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.tokens: List[int] = []
+        self.cancelled = False
+        self._queue: queue.Queue = queue.Queue()
+        self._done = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def put(self, token: int) -> None:
+        """
+        Delivers a generated token.
+
+        Args:
+            token (int): The id of the token.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.tokens.append(token)
+        self._queue.put(token)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """
+        Marks the request as complete, or failed.
+
+        Args:
+            error (Optional[BaseException]): The error the generation failed with, if any.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self._error = error
+        self._done.set()
+        self._queue.put(None)
+
+    def cancel(self) -> None:
+        """
+        Asks the scheduler to stop generating for this request, e.g. once its caller has met a stop sequence. The
+        sequence leaves the batch at the next token boundary.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.cancelled = True
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        Yields the tokens of the request as the scheduler generates them, raising the error of the scheduler if the
+        generation failed.
+
+        Returns:
+            Iterator[int]: The ids of the generated tokens.
+        """
+        while True:
+            token = self._queue.get()
+            if token is None:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield token
+
+    def result(self, timeout: Optional[float] = None) -> List[int]:
+        """
+        Waits for the request to complete.
+
+        Args:
+            timeout (Optional[float]): The number of seconds to wait. If None, waits until completion.
+
+        Returns:
+            List[int]: The ids of all the generated tokens.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("Generation did not complete in time")
+        if self._error is not None:
+            raise self._error
+        return self.tokens
+
+
+class GenerationScheduler:
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        eos_token_id: Optional[int],
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        prefix_cache: Optional[PrefixCache] = None,
+    ) -> None:
+        """
+        Initializes a scheduler running the generation requests of concurrent callers through a causal language model
+        in shared batches, with continuous batching: waiting requests join the running batch at the next token
+        boundary, rather than once the whole batch has finished, and finished sequences leave it right away.
+
+        Sequences are left-padded to a common length, and the key/value cache of the batch is extended or cut along
+        with them. Joining prompts are encoded together in one forward pass, or one at a time from the cached states
+        of their longest known prefix if there is a prefix cache, then each step generates one token for every
+        sequence of the batch. Padding columns that no sequence uses any more are dropped.
+
+        Args:
+            model (torch.nn.Module): The causal language model, taking `past_key_values` in the legacy tuple format.
+            eos_token_id (Optional[int]): The id of the end of sequence token, which ends a sequence and is not
+                delivered.
+            max_batch_size (int): The maximum number of sequences generated together.
+            max_wait (float): The number of seconds an idle scheduler waits for more requests to fill its first
+                batch. Requests arriving while a batch runs join it without waiting.
+            prefix_cache (Optional[PrefixCache]): The cache of the key/value states of previous prompts. If None,
+                every prompt is encoded from scratch.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.model = model
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.prefix_cache = prefix_cache
+        self.device = model_device(model)
+        self.generated_tokens = 0
+        self.steps = 0
+        self._requests: queue.Queue = queue.Queue()
+        self._active: List[GenerationStream] = []
+        self._next_tokens: Optional[torch.Tensor] = None
+        self._mask: Optional[torch.Tensor] = None
+        self._cache: Optional[KVCache] = None
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int = 1000,
+        do_sample: bool = True,
+        temperature: float = 1.0,
+        cache_length: Optional[int] = None,
+    ) -> GenerationStream:
+        """
+        Queues a generation request, starting the scheduler thread on first use.
+
+        Args:
+            prompt_ids (List[int]): The token ids of the prompt.
+            max_new_tokens (int): The maximum number of tokens generated.
+            do_sample (bool): Whether tokens are sampled, rather than picked greedily.
+            temperature (float): The sampling temperature.
+            cache_length (Optional[int]): The number of prompt tokens whose states the prefix cache keeps, i.e. the
+                part of the prompt shared with later requests. Defaults to the whole prompt.
+
+        Returns:
+            GenerationStream: The handle receiving the generated tokens.
+        """
+        stream = GenerationStream(
+            prompt_ids, max_new_tokens, do_sample, temperature, cache_length
+        )
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The scheduler is closed")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self._requests.put(stream)
+        return stream
+
+    def close(self) -> None:
+        """
+        Stops the scheduler thread once the running batch has finished. Queued requests that have not joined it fail.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            self._closed = True
+            worker = self._worker
+        self._requests.put(None)
+        if worker is not None:
+            worker.join()
+
+    def _take_requests(self) -> List[GenerationStream]:
+        """
+        Takes the queued requests fitting in the batch. An idle scheduler blocks for the first request and then waits
+        up to `max_wait` for more, while a busy one only takes the requests already queued.
+
+        Returns:
+            List[GenerationStream]: The requests joining the batch.
+        """
+        capacity = self.max_batch_size - len(self._active)
+        taken: List[GenerationStream] = []
+        deadline = None
+        while len(taken) < capacity:
+            try:
+                if self._active:
+                    stream = self._requests.get_nowait()
+                elif not taken:
+                    stream = self._requests.get()
+                    deadline = time.monotonic() + self.max_wait
+                else:
+                    stream = self._requests.get(
+                        timeout=max(deadline - time.monotonic(), 0)  # type: ignore[operator]
+                    )
+            except queue.Empty:
+                break
+            if stream is None:
+                self._closed = True
+                break
+            if stream.cancelled:
+                # Cancelled while queued: it completes empty, so that its caller stops waiting.
+                stream.finish()
+            else:
+                taken.append(stream)
+        return taken
+
+    def _run(self) -> None:
+        """
+        Runs the scheduling loop: admits requests at token boundaries and generates one token per sequence per step.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        while True:
+            joining = [] if self._closed else self._take_requests()
+            if not joining and not self._active:
+                if self._closed:
+                    break
+                continue
+            try:
+                with torch.inference_mode():
+                    if joining:
+                        self._prefill(joining)
+                    if self._active:
+                        self._step()
+            except Exception as error:
+                for stream in self._active + joining:
+                    if not stream._done.is_set():
+                        stream.finish(error)
+                self._active, self._cache = [], None
+                self._next_tokens = self._mask = None
+        while True:
+            try:
+                stream = self._requests.get_nowait()
+            except queue.Empty:
+                return
+            if stream is not None:
+                stream.finish(RuntimeError("The scheduler is closed"))
+
+    def _forward(
+        self, input_ids: torch.Tensor, mask: torch.Tensor, cache: Optional[KVCache]
+    ) -> Tuple[torch.Tensor, KVCache]:
+        """
+        Runs the model on left-padded inputs, with positions counted from the first real token of each sequence.
+
+        Args:
+            input_ids (torch.Tensor): The new token ids, of shape (batch, new positions).
+            mask (torch.Tensor): The attention mask of the cached and new positions, 0 on padding.
+            cache (Optional[KVCache]): The key/value cache of the previous positions.
+
+        Returns:
+            Tuple[torch.Tensor, KVCache]: The logits of the last position of each sequence, and the extended cache.
+        """
+        positions = (mask.cumsum(dim=1) - 1).clamp(min=0)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=positions[:, -input_ids.shape[1] :],
+            past_key_values=cache,
+            use_cache=True,
+        )
+        return outputs.logits[:, -1], tuple(outputs.past_key_values)
+
+    def _prefill(self, joining: List[GenerationStream]) -> None:
+        """
+        Encodes the prompts of the joining requests and merges them into the batch, padding either their cache or the
+        cache of the batch on the left so that all sequences have the same length. Without a prefix cache the prompts
+        are encoded together in one forward pass; with one, each prompt only runs the tokens after its longest cached
+        prefix.
+
+        Args:
+            joining (List[GenerationStream]): The requests joining the batch.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.prefix_cache is None:
+            length = max(len(stream.prompt_ids) for stream in joining)
+            input_ids = torch.zeros(
+                (len(joining), length), dtype=torch.long, device=self.device
+            )
+            mask = torch.zeros_like(input_ids)
+            for row, stream in enumerate(joining):
+                input_ids[row, length - len(stream.prompt_ids) :] = torch.tensor(
+                    stream.prompt_ids, device=self.device
+                )
+                mask[row, length - len(stream.prompt_ids) :] = 1
+            logits, cache = self._forward(input_ids, mask, None)
+        else:
+            encoded = [
+                self.prefix_cache.prefill(
+                    self.model, stream.prompt_ids, stream.cache_length
+                )
+                for stream in joining
+            ]
+            logits = torch.stack([prompt_logits for prompt_logits, _ in encoded])
+            mask = torch.ones(
+                (1, len(joining[0].prompt_ids)), dtype=torch.long, device=self.device
+            )
+            cache = encoded[0][1]
+            for stream, (_, prompt_cache) in zip(joining[1:], encoded[1:]):
+                mask, cache = self._concat(
+                    mask,
+                    cache,
+                    torch.ones(
+                        (1, len(stream.prompt_ids)),
+                        dtype=torch.long,
+                        device=self.device,
+                    ),
+                    prompt_cache,
+                )
+        if self._cache is None:
+            self._active, self._mask, self._cache = joining, mask, cache
+            self._next_tokens = torch.zeros(
+                len(joining), dtype=torch.long, device=self.device
+            )
+        else:
+            self._mask, self._cache = self._concat(
+                self._mask, self._cache, mask, cache  # type: ignore[arg-type]
+            )
+            self._active = self._active + joining
+            self._next_tokens = torch.cat(
+                [self._next_tokens, self._next_tokens.new_zeros(len(joining))]  # type: ignore[list-item, union-attr]
+            )
+        offset = len(self._active) - len(joining)
+        self._deliver(logits, range(offset, len(self._active)))
+
+    @classmethod
+    def _concat(
+        cls,
+        mask: torch.Tensor,
+        cache: KVCache,
+        new_mask: torch.Tensor,
+        new_cache: KVCache,
+    ) -> Tuple[torch.Tensor, KVCache]:
+        """
+        Stacks two batches of sequences, left-padding the shorter one.
+
+        Args:
+            mask (torch.Tensor): The attention mask of the first batch.
+            cache (KVCache): The key/value cache of the first batch.
+            new_mask (torch.Tensor): The attention mask of the second batch.
+            new_cache (KVCache): The key/value cache of the second batch.
+
+        Returns:
+            Tuple[torch.Tensor, KVCache]: The attention mask and key/value cache of both batches.
+        """
+        width = max(mask.shape[1], new_mask.shape[1])
+        return torch.cat([cls._pad(mask, width), cls._pad(new_mask, width)]), tuple(
+            (
+                torch.cat([cls._pad(keys, width), cls._pad(new_keys, width)]),
+                torch.cat([cls._pad(values, width), cls._pad(new_values, width)]),
+            )
+            for (keys, values), (new_keys, new_values) in zip(cache, new_cache)
+        )
+
+    @staticmethod
+    def _pad(tensor: torch.Tensor, width: int) -> torch.Tensor:
+        """
+        Left-pads a mask, or a cache tensor along its positions, with zeros.
+
+        Args:
+            tensor (torch.Tensor): The mask of shape (batch, positions) or cache tensor of shape
+                (batch, heads, positions, head size).
+            width (int): The number of positions after padding.
+
+        Returns:
+            torch.Tensor: The padded tensor.
+        """
+        dim = 1 if tensor.dim() == 2 else 2
+        missing = width - tensor.shape[dim]
+        if missing == 0:
+            return tensor
+        shape = list(tensor.shape)
+        shape[dim] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+    def _step(self) -> None:
+        """
+        Generates the next token of every sequence of the batch.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        mask = torch.cat(
+            [self._mask, self._mask.new_ones((len(self._active), 1))], dim=1  # type: ignore[list-item, union-attr]
+        )
+        logits, self._cache = self._forward(
+            self._next_tokens[:, None], mask, self._cache  # type: ignore[index]
+        )
+        self._mask = mask
+        self.steps += 1
+        self._deliver(logits, range(len(self._active)))
+
+    def _deliver(self, logits: torch.Tensor, rows: range) -> None:
+        """
+        Samples the next token of the given sequences, delivers it, and removes the sequences that have finished or
+        were cancelled from the batch.
+
+        Args:
+            logits (torch.Tensor): The logits of the last position of the sequences in `rows`.
+            rows (range): The rows of the batch the logits belong to.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        finished = set()
+        for row_logits, row in zip(logits, rows):
+            stream = self._active[row]
+            token = self._sample(row_logits, stream)
+            if token == self.eos_token_id:
+                finished.add(row)
+                continue
+            stream.put(token)
+            self.generated_tokens += 1
+            self._next_tokens[row] = token  # type: ignore[index]
+            if len(stream.tokens) >= stream.max_new_tokens:
+                finished.add(row)
+        finished.update(
+            row for row, stream in enumerate(self._active) if stream.cancelled
+        )
+        if not finished:
+            return
+        for row in finished:
+            self._active[row].finish()
+        keep = [row for row in range(len(self._active)) if row not in finished]
+        if not keep:
+            self._active, self._cache = [], None
+            self._next_tokens = self._mask = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        self._active = [self._active[row] for row in keep]
+        self._next_tokens = self._next_tokens[index]  # type: ignore[index]
+        mask = self._mask[index]  # type: ignore[index]
+        # Positions padded in every remaining sequence are dropped.
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        self._mask = mask[:, start:]
+        self._cache = tuple(
+            (keys[index, :, start:], values[index, :, start:])
+            for keys, values in self._cache  # type: ignore[union-attr]
+        )
+
+    @staticmethod
+    def _sample(logits: torch.Tensor, stream: GenerationStream) -> int:
+        """
+        Picks the next token of a sequence with the sampling settings of its request.
+
+        Args:
+            logits (torch.Tensor): The logits over the vocabulary.
+            stream (GenerationStream): The request.
+
+        Returns:
+            int: The id of the next token.
+        """
+        if not stream.do_sample or stream.temperature <= 0:
+            return int(torch.argmax(logits))
+        probabilities = torch.softmax(logits.float() / stream.temperature, dim=-1)
+        return int(torch.multinomial(probabilities, 1))
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Reports the counters of the scheduler.
+
+        Returns:
+            Dict[str, int]: The number of generated tokens, of batched steps, and of sequences in the running batch.
+        """
+        return {
+            "generated_tokens": self.generated_tokens,
+            "steps": self.steps,
+            "active": len(self._active),
+        }
@@ -1,29 +1,170 @@
 import asyncio
-from typing import List
+import os
+import threading
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-from langchain_community.document_loaders import PyPDFLoader
+import pypdf
+from langchain_community.document_loaders import Blob, PyPDFLoader
 from langchain_core.documents import Document
 from langchain_core.vectorstores import VectorStore
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from bm25 import BM25Index
+from bulk_writer import BulkWriter
 from database_utils import Database
 from embeddings import Embeddings
+from manifest import IndexManifest
+
+T = TypeVar("T")
+
+
+class FileProgress(NamedTuple):
+    """Progress of one file through the batch ingestion pipeline."""
+
+    file_name: str
+    status: str
+    chunks: int = 0
+    error: Optional[BaseException] = None
 
 
 class Indexer:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        batch_size: int = 64,
+        manifest: Optional[IndexManifest] = None,
+        lexical_index: Optional[BM25Index] = None,
+        writer: Optional[BulkWriter] = None,
+    ) -> None:
         """
         Initializes an Indexer object that tracks the vector store and a list of processed files.
 
+        Args:
+            batch_size (int): The number of chunks read from a file at once while streaming it to the writer.
+            manifest (Optional[IndexManifest]): The manifest of indexed files and chunks. Defaults to a manifest
+                persisted in the `INDEX_MANIFEST_PATH` file, or kept in memory if the variable is not set.
+            lexical_index (Optional[BM25Index]): A BM25 index maintained alongside the vector store for hybrid
+                search, or None to index vectors only.
+            writer (Optional[BulkWriter]): The writer importing chunks into the vector store. Defaults to a writer
+                of the vector store sending batches of `INDEX_WRITE_BATCH_SIZE` chunks (default 256), with at most
+                `INDEX_MAX_IN_FLIGHT_WRITES` batches in flight (default 2).
+
         Returns:
             None: Returns object of NoneType
 
         """
         self.vectorstore = None
-        self.files: List[str] = []
+        self.writer = writer
+        self.manifest = manifest or IndexManifest(os.getenv("INDEX_MANIFEST_PATH"))
+        self.files: List[str] = list(self.manifest.files)
+        self.batch_size = batch_size
+        self.lexical_index = lexical_index
+        self._pending_chunks: Counter = Counter()
+        self.generation = 0
+        self._listeners: List[Callable[[], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    def _run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """
+        Runs a coroutine to completion on the event loop of the indexer, started in a background thread on first use,
+        rather than on a new event loop per call.
+
+        Args:
+            coroutine (Coroutine[Any, Any, T]): The coroutine to run.
+
+        Returns:
+            T: The result of the coroutine.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Registers a callback run whenever the content of the vector store changes, e.g. to invalidate caches of
+        answers or retrieval results.
+
+        Args:
+            listener (Callable[[], None]): The callback to run.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self._listeners.append(listener)
+
+    def _notify_change(self) -> None:
+        """
+        Bumps the generation of the index and runs the listeners.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.generation += 1
+        for listener in self._listeners:
+            listener()
 
     @staticmethod
-    def load_and_split_data(file: str) -> List[Document]:
+    def iter_chunks(file: str) -> Iterator[Document]:
+        """
+        Lazily loads a PDF file page by page and splits each page into chunks as soon as it is read, so that only one
+        page is held in memory at a time.
+
+        Args:
+            file (str): The path to the PDF file to be processed.
+
+        Returns:
+            Iterator[Document]: The chunks of text of the file, in reading order.
+
+        """
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000, chunk_overlap=200
+        )
+        loader = PyPDFLoader(file)
+        # PyPDFLoader.lazy_load parses every page before yielding, so the parser is used directly.
+        for page in loader.parser.lazy_parse(Blob.from_path(loader.file_path)):
+            yield from text_splitter.split_documents([page])
+
+    @classmethod
+    def iter_batches(cls, file: str, batch_size: int) -> Iterator[List[Document]]:
+        """
+        Groups the chunks of a PDF file into fixed-size batches while the file is being read.
+
+        Args:
+            file (str): The path to the PDF file to be processed.
+            batch_size (int): The number of chunks per batch. The last batch may be smaller.
+
+        Returns:
+            Iterator[List[Document]]: The batches of chunks, in reading order.
+
+        """
+        chunks = cls.iter_chunks(file)
+        while batch := list(islice(chunks, batch_size)):
+            yield batch
+
+    @classmethod
+    def load_and_split_data(cls, file: str) -> List[Document]:
         """
          Loads a PDF file, splits it into pages, and further splits each page into chunks using defined settings.
 
@@ -34,17 +175,85 @@ class Indexer:
             List[Document]: A list of Document objects that represent chunks of text from the file.
 
         """
-        loader = PyPDFLoader(file)
-        pages = loader.load_and_split()
+        return list(cls.iter_chunks(file))
+
+    @staticmethod
+    def count_pages(file: str) -> int:
+        """
+        Counts the pages of a PDF file, without extracting their text.
+
+        Args:
+            file (str): The path to the PDF file.
+
+        Returns:
+            int: The number of pages.
+        """
+        return len(pypdf.PdfReader(file).pages)
+
+    @staticmethod
+    def load_pages(file: str, start: int, stop: int) -> List[Document]:
+        """
+        Loads a range of pages of a PDF file and splits each page into chunks, as `iter_chunks` does for the whole
+        file, so that a file can be parsed a few pages at a time in another process.
+
+        Args:
+            file (str): The path to the PDF file.
+            start (int): The number of the first page.
+            stop (int): The number of the page after the last one, which may be past the end of the file.
+
+        Returns:
+            List[Document]: The chunks of text of the pages, in reading order.
+        """
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000, chunk_overlap=200
         )
-        splits = text_splitter.split_documents(pages)
-        return splits
+        reader = pypdf.PdfReader(file)
+        chunks: List[Document] = []
+        for number in range(start, min(stop, len(reader.pages))):
+            page = Document(
+                page_content=reader.pages[number].extract_text(),
+                metadata={"source": file, "page": number},
+            )
+            chunks += text_splitter.split_documents([page])
+        return chunks
+
+    def is_indexed(self, file_name: str, file_hash: str) -> bool:
+        """
+        Checks whether a file has already been indexed with the same content.
+
+        Args:
+            file_name (str): The name of the file.
+            file_hash (str): The SHA-256 of the file content.
+
+        Returns:
+            bool: True if the file is indexed and unchanged, in the lexical index too if there is one. As the lexical
+            index is saved after a batch of files, a file recorded in the manifest before a crash may be missing from
+            it, in which case it is indexed again: its chunks are already stored, so only the lexical index is updated.
+        """
+        if not self.manifest.is_current(file_name, file_hash):
+            return False
+        if self.lexical_index is None:
+            return True
+        chunk_ids = self.manifest.files[file_name]["chunks"]
+        return all(chunk_id in self.lexical_index for chunk_id in chunk_ids)
+
+    def save_lexical_index(self) -> None:
+        """
+        Saves the lexical index, if there is one, once a file or a batch of files has been indexed.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.lexical_index is not None:
+            self.lexical_index.save()
 
     def add_doc(self, file_name: str, file: str) -> None:
         """
-        Processes a document file, splits it, and adds it to the vector store if not already added.
+        Processes a document file, splits it, and adds it to the vector store if not already added with the same
+        content. Chunks are streamed to the bulk writer in batches of `batch_size` while the file is read, and the
+        writer blocks the reading while its batches are in flight, so peak memory depends on the batch sizes rather
+        than on the size of the file. Only chunks that are not stored yet are embedded, and the chunks of a previous
+        version of the file that are no longer used are deleted.
 
         Args:
             file_name (str): The name of the file to be processed.
@@ -53,11 +262,267 @@ class Indexer:
         Returns:
             None:
         """
+        file_hash = self.manifest.hash_file(file)
+        if not self.is_indexed(file_name, file_hash):
+            vectorstore = self.get_vectorstore()
+            try:
+                self._run(
+                    self._aindex_batches(
+                        vectorstore,
+                        file_name,
+                        file_hash,
+                        self.iter_batches(file, self.batch_size),
+                    )
+                )
+            finally:
+                self.save_lexical_index()
+
+    async def _aindex_batches(
+        self,
+        vectorstore: VectorStore,
+        file_name: str,
+        file_hash: str,
+        batches: Union[Iterable[List[Document]], AsyncIterable[List[Document]]],
+    ) -> int:
+        """
+        Submits the new chunks of a file to the bulk writer batch by batch, with content-addressed ids, and once they
+        are all written deletes the stale chunks of its previous version and records it in the manifest. The lexical
+        index, if any, is kept in sync. The listeners run as soon as chunks are written or deleted, and once the file
+        is recorded.
+
+        Args:
+            vectorstore (VectorStore): The vector store stale chunks are deleted from.
+            file_name (str): The name of the file.
+            file_hash (str): The SHA-256 of the file content.
+            batches (Union[Iterable[List[Document]], AsyncIterable[List[Document]]]): The batches of chunks of the
+                file.
+
+        Returns:
+            int: The number of chunks written to the vector store.
+        """
+        writer = self.get_writer()
+        chunk_ids: List[str] = []
+        seen: Set[str] = set()
+        stale: List[str] = []
+        writes: List[asyncio.Future] = []
+        written = 0
+
+        def on_written(write: asyncio.Future) -> None:
+            # Results cached while the file is indexed are dropped as soon as its chunks are written or deleted, not
+            # only once the whole file is done.
+            if not write.cancelled() and write.exception() is None:
+                self._notify_change()
+
+        try:
+            async for batch in self._aiter_batches(batches):
+                # Once a write of the file fails, the rest of it is not sent: it would never enter the manifest.
+                running = []
+                for write in writes:
+                    if write.done():
+                        write.result()
+                    else:
+                        running.append(write)
+                writes = running
+                ids = [self.manifest.chunk_id(doc.page_content) for doc in batch]
+                # Chunks claimed by files being indexed are not deleted as stale by a concurrent re-index.
+                claimed = [i for i in dict.fromkeys(ids) if i not in seen]
+                self._pending_chunks.update(claimed)
+                seen.update(claimed)
+                chunk_ids += claimed
+                new = {
+                    chunk_id: doc
+                    for chunk_id, doc in zip(ids, batch)
+                    if chunk_id in claimed and not self.manifest.is_stored(chunk_id)
+                }
+                if new:
+                    write = await writer.asubmit(list(new.keys()), list(new.values()))
+                    write.add_done_callback(on_written)
+                    writes.append(write)
+                    written += len(new)
+                if self.lexical_index is not None:
+                    # Chunks already in the vector store are indexed too, the lexical index skips the ids it knows.
+                    self.lexical_index.add(ids, batch)
+            if writes:
+                # The last chunks of the file are sent with the chunks of other files buffered so far.
+                await writer.aflush()
+                await asyncio.gather(*writes)
+            stale = [
+                chunk_id
+                for chunk_id in self.manifest.stale_chunks(file_name, chunk_ids)
+                if not self._pending_chunks[chunk_id]
+            ]
+            if stale:
+                await vectorstore.adelete(stale)
+                if self.lexical_index is not None:
+                    self.lexical_index.delete(stale)
+                self._notify_change()
+            self.manifest.update(file_name, file_hash, chunk_ids)
+        finally:
+            self._pending_chunks.subtract(chunk_ids)
+            self._pending_chunks = +self._pending_chunks
+            if written or stale:
+                self._notify_change()
         if file_name not in self.files:
             self.files.append(file_name)
-            vectorstore = self.get_vectorstore()
-            chunks = self.load_and_split_data(file)
-            asyncio.run(vectorstore.aadd_documents(chunks))
+        return written
+
+    @staticmethod
+    async def _aiter_batches(
+        batches: Union[Iterable[List[Document]], AsyncIterable[List[Document]]]
+    ) -> AsyncIterator[List[Document]]:
+        """
+        Iterates over batches of chunks produced either synchronously or asynchronously.
+
+        Args:
+            batches (Union[Iterable[List[Document]], AsyncIterable[List[Document]]]): The batches of chunks.
+
+        Returns:
+            AsyncIterator[List[Document]]: The batches, in order.
+        """
+        if isinstance(batches, AsyncIterable):
+            async for batch in batches:
+                yield batch
+        else:
+            for batch in batches:
+                yield batch
+
+    async def aadd_docs(
+        self,
+        files: List[Tuple[str, str]],
+        on_progress: Optional[Callable[[FileProgress], None]] = None,
+        executor: Optional[Executor] = None,
+        max_workers: Optional[int] = None,
+        max_concurrent_writes: int = 2,
+        pages_per_task: int = 16,
+    ) -> Dict[str, Optional[BaseException]]:
+        """
+        Indexes several files through a bounded producer/consumer pipeline: files are parsed and split in a process
+        pool, as this is CPU-bound, `pages_per_task` pages at a time, and their chunks are streamed to the bulk
+        writer as the pages are parsed, which batches the chunks of different files together. Each file being written
+        has at most the chunks of one range of pages in memory while the next one is parsed, so memory does not grow
+        with the size of the files. A file that fails is reported and skipped without stopping the others.
+
+        Args:
+            files (List[Tuple[str, str]]): Pairs of file name and path of the files to index. Files already indexed
+                with the same content are reported as unchanged.
+            on_progress (Optional[Callable[[FileProgress], None]]): Called whenever a file is parsed, indexed, found
+                unchanged or fails.
+            executor (Optional[Executor]): The executor parsing the files. Defaults to a new process pool.
+            max_workers (Optional[int]): The number of processes of the default process pool.
+            max_concurrent_writes (int): The number of files parsed and submitted to the bulk writer at the same time.
+            pages_per_task (int): The number of pages parsed by a task of the executor.
+
+        Returns:
+            Dict[str, Optional[BaseException]]: The error of each processed file, None for the files indexed.
+        """
+        vectorstore = self.get_vectorstore()
+        loop = asyncio.get_running_loop()
+        results: Dict[str, Optional[BaseException]] = {}
+        queue: asyncio.Queue = asyncio.Queue()
+        pending = dict(files)
+
+        def report(progress: FileProgress) -> None:
+            if progress.error is not None or progress.status in (
+                "indexed",
+                "unchanged",
+            ):
+                results[progress.file_name] = progress.error
+            if on_progress is not None:
+                on_progress(progress)
+
+        async def open_file(name: str, path: str) -> None:
+            try:
+                file_hash = await loop.run_in_executor(
+                    None, self.manifest.hash_file, path
+                )
+                if self.is_indexed(name, file_hash):
+                    report(FileProgress(name, "unchanged"))
+                    return
+                n_pages = await loop.run_in_executor(pool, self.count_pages, path)
+            except Exception as e:
+                report(FileProgress(name, "failed", error=e))
+                return
+            await queue.put((name, file_hash, path, n_pages))
+
+        async def parse(
+            name: str, path: str, n_pages: int, counts: Counter
+        ) -> AsyncGenerator[List[Document], None]:
+            # The next range of pages is parsed while the chunks of the current one are written.
+            future: Optional[asyncio.Future[List[Document]]] = None
+            try:
+                for start in range(0, n_pages, pages_per_task):
+                    current = future or loop.run_in_executor(
+                        pool, self.load_pages, path, start, start + pages_per_task
+                    )
+                    future = None
+                    chunks = await current
+                    if start + pages_per_task < n_pages:
+                        future = loop.run_in_executor(
+                            pool,
+                            self.load_pages,
+                            path,
+                            start + pages_per_task,
+                            start + 2 * pages_per_task,
+                        )
+                    counts[name] += len(chunks)
+                    for i in range(0, len(chunks), self.batch_size):
+                        yield chunks[i : i + self.batch_size]
+            finally:
+                if future is not None:
+                    future.cancel()
+            report(FileProgress(name, "parsed", counts[name]))
+
+        async def write() -> None:
+            counts: Counter = Counter()
+            while (item := await queue.get()) is not None:
+                name, file_hash, path, n_pages = item
+                batches = parse(name, path, n_pages, counts)
+                try:
+                    await self._aindex_batches(vectorstore, name, file_hash, batches)
+                    report(FileProgress(name, "indexed", counts[name]))
+                except Exception as e:
+                    report(FileProgress(name, "failed", counts[name], e))
+                finally:
+                    # A file failing before its last pages are parsed drops the range parsed ahead.
+                    await batches.aclose()
+
+        pool = executor or ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            writers = [
+                asyncio.create_task(write()) for _ in range(max_concurrent_writes)
+            ]
+            await asyncio.gather(
+                *(open_file(name, path) for name, path in pending.items())
+            )
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+        finally:
+            if executor is None:
+                pool.shutdown()
+            # The lexical index is saved once for all the files, rather than rewritten after each of them.
+            await loop.run_in_executor(None, self.save_lexical_index)
+        return results
+
+    def add_docs(
+        self,
+        files: List[Tuple[str, str]],
+        on_progress: Optional[Callable[[FileProgress], None]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Optional[BaseException]]:
+        """
+        Indexes several files in parallel, see `aadd_docs`.
+
+        Args:
+            files (List[Tuple[str, str]]): Pairs of file name and path of the files to index.
+            on_progress (Optional[Callable[[FileProgress], None]]): Called whenever a file is parsed, indexed or
+                fails.
+            **kwargs (Any): The pipeline settings accepted by `aadd_docs`.
+
+        Returns:
+            Dict[str, Optional[BaseException]]: The error of each processed file, None for the files indexed.
+        """
+        return self._run(self.aadd_docs(files, on_progress=on_progress, **kwargs))
 
     def set_vectorstore(self) -> None:
         """
@@ -71,6 +536,35 @@ class Indexer:
         if self.vectorstore is not None:
             self.vectorstore._embedding = Embeddings().get_embeddings_model()
 
+    def set_writer(self) -> None:
+        """
+        Sets up the bulk writer of the vector store, with the batch size and number of batches in flight of the
+        `INDEX_WRITE_BATCH_SIZE` and `INDEX_MAX_IN_FLIGHT_WRITES` environment variables.
+
+        Returns:
+            None: Returns object of NoneType
+
+        """
+        self.writer = BulkWriter(
+            self.get_vectorstore(),
+            batch_size=int(os.getenv("INDEX_WRITE_BATCH_SIZE", "256")),
+            max_in_flight=int(os.getenv("INDEX_MAX_IN_FLIGHT_WRITES", "2")),
+        )
+
+    def get_writer(self) -> BulkWriter:
+        """
+        Retrieves the bulk writer, setting it up if it hasn't been set already.
+
+        Returns:
+            BulkWriter: The writer importing chunks into the vector store.
+
+        """
+        if self.writer is None:
+            self.set_writer()
+        if self.writer is None:
+            raise RuntimeError("The bulk writer could not be set up")
+        return self.writer
+
     def get_vectorstore(self) -> VectorStore:
         """
         Retrieves the vector store, setting it up if it hasn't been set already.
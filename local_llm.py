@@ -0,0 +1,464 @@
+from typing import Any, Iterator, List, Optional
+
+import torch
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from torch.ao.quantization import quantize_dynamic
+from transformers import AutoModelForCausalLM, PreTrainedModel, PreTrainedTokenizerBase
+
+from generation_scheduler import GenerationScheduler
+from model_utils import get_quantization_config, model_device
+from prefix_cache import PrefixCache
+
+# Roles of the chat templates of Hugging Face tokenizers, by LangChain message type.
+ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+class Int4Linear(torch.nn.Module):
+    """
+    Linear layer with 4-bit weights, quantized asymmetrically per group of `group_size` input features and multiplied
+    with the packed int4 matrix multiplication of torch, which runs on the CPU. Activations are cast to bfloat16.
+    """
+
+    def __init__(self, linear: torch.nn.Linear, group_size: int = 32) -> None:
+        """
+        Quantizes the weights of a linear layer.
+
+        Args:
+            linear (torch.nn.Linear): The layer to quantize, whose number of input features must be a multiple of
+                `group_size` and of 32, and number of output features a multiple of 16, see `Int4Linear.supports`.
+            group_size (int): The number of input features sharing a scale and a zero point.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        super().__init__()
+        self.in_features, self.out_features = linear.in_features, linear.out_features
+        self.group_size = group_size
+        weight = linear.weight.detach().float()
+        groups = weight.reshape(self.out_features, -1, group_size)
+        low = groups.amin(dim=-1, keepdim=True)
+        scales = (groups.amax(dim=-1, keepdim=True) - low).clamp(min=1e-6) / 15
+        quantized = ((groups - low) / scales).round().clamp(0, 15).to(torch.int32)
+        # The kernel computes (q - 8) * scale + zero, so the zero point is the value of q = 8.
+        zeros = low + 8 * scales
+        inner_k_tiles = next(
+            tiles for tiles in (8, 4, 2) if self.in_features % (16 * tiles) == 0
+        )
+        self.register_buffer(
+            "weight",
+            torch.ops.aten._convert_weight_to_int4pack(
+                quantized.reshape(self.out_features, self.in_features), inner_k_tiles
+            ),
+        )
+        self.register_buffer(
+            "scales_and_zeros",
+            torch.cat([scales, zeros], dim=-1)
+            .transpose(0, 1)
+            .contiguous()
+            .to(torch.bfloat16),
+        )
+        self.bias = (
+            None if linear.bias is None else torch.nn.Parameter(linear.bias.detach())
+        )
+
+    @staticmethod
+    def supports(linear: torch.nn.Linear, group_size: int = 32) -> bool:
+        """
+        Tells whether the shape of a linear layer fits the packed int4 kernel.
+
+        Args:
+            linear (torch.nn.Linear): The layer.
+            group_size (int): The number of input features sharing a scale and a zero point.
+
+        Returns:
+            bool: Whether the layer can be quantized to int4.
+        """
+        return (
+            linear.in_features % group_size == 0
+            and linear.in_features % 32 == 0
+            and linear.out_features % 16 == 0
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Applies the layer.
+
+        Args:
+            x (torch.Tensor): The inputs, whose last dimension is the input features.
+
+        Returns:
+            torch.Tensor: The outputs, in the dtype of the inputs.
+        """
+        outputs = torch.ops.aten._weight_int4pack_mm(
+            x.reshape(-1, self.in_features).to(torch.bfloat16),
+            self.weight,
+            self.group_size,
+            self.scales_and_zeros,
+        ).to(x.dtype)
+        if self.bias is not None:
+            outputs = outputs + self.bias
+        return outputs.reshape(*x.shape[:-1], self.out_features)
+
+
+def quantize_int4(model: torch.nn.Module, group_size: int = 32) -> torch.nn.Module:
+    """
+    Replaces the linear layers of a model whose shape fits the packed int4 kernel by `Int4Linear` layers, in place.
+
+    Args:
+        model (torch.nn.Module): The model to quantize.
+        group_size (int): The number of input features sharing a scale and a zero point.
+
+    Returns:
+        torch.nn.Module: The quantized model.
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, torch.nn.Linear) and Int4Linear.supports(
+                child, group_size
+            ):
+                setattr(module, name, Int4Linear(child, group_size))
+    return model
+
+
+def load_model(
+    model_name: str,
+    quantization: Optional[str] = "int8",
+    num_threads: Optional[int] = None,
+) -> PreTrainedModel:
+    """
+    Loads a causal language model for in-process generation, with its weights quantized if configured.
+
+    Args:
+        model_name (str): The name or local path of the model.
+        quantization (Optional[str]): 'int8' to quantize the linear layers to int8 dynamically, 'int4' to quantize
+            their weights to 4 bits, or None to keep full precision weights. Both run on the CPU; with a CUDA device,
+            int4 weights are loaded with the BitsAndBytes config of `model_utils.get_quantization_config` instead,
+            which requires the bitsandbytes package.
+        num_threads (Optional[int]): The number of threads used by torch. If None, the torch default is kept.
+
+    Returns:
+        PreTrainedModel: The model, in evaluation mode.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if quantization == "int4" and torch.cuda.is_available():
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            quantization_config=get_quantization_config(),
+            device_map="auto",
+        )
+    elif quantization in ("int8", "int4", None):
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name, torch_dtype=torch.float32
+        )
+        if quantization == "int8":
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif quantization == "int4":
+            model = quantize_int4(model)
+    else:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    model.eval()
+    return model
+
+
+def held_back(text: str, stop: List[str]) -> int:
+    """
+    Measures the end of a text that may be the start of a stop sequence, which is held back until the next tokens
+    tell whether it is.
+
+    Args:
+        text (str): The text generated so far.
+        stop (List[str]): The stop sequences.
+
+    Returns:
+        int: The number of characters to hold back.
+    """
+    return max(
+        (
+            size
+            for s in stop
+            for size in range(min(len(s) - 1, len(text)), 0, -1)
+            if text.endswith(s[:size])
+        ),
+        default=0,
+    )
+
+
+class LocalChatModel(BaseChatModel):
+    """
+    Chat model generating in-process with a Hugging Face causal language model. The prompt is encoded in one forward
+    pass, and each following step only runs the last generated token against the cached keys and values of the
+    previous ones, so that tokens are streamed as soon as they are sampled. With a prefix cache, the prompt only runs
+    the tokens after its longest prefix encoded by a previous call, and only the states of the prompt before
+    `prefix_boundary` are cached, as the text after it changes with every question. With a scheduler, the generation
+    of concurrent calls is batched by the scheduler instead, which holds its own prefix cache.
+    """
+
+    model: Any
+    tokenizer: Any
+    scheduler: Optional[GenerationScheduler] = None
+    prefix_cache: Optional[PrefixCache] = None
+    prefix_boundary: Optional[str] = None
+    max_new_tokens: int = 1000
+    do_sample: bool = True
+    temperature: float = 1.0
+
+    @property
+    def _llm_type(self) -> str:
+        """
+        Names the type of the chat model, for LangChain callbacks and serialization.
+
+        Returns:
+            str: The type of the chat model.
+        """
+        return "local-causal-lm"
+
+    def render(self, messages: List[BaseMessage]) -> str:
+        """
+        Renders a conversation with the chat template of the tokenizer, or as one "role: content" line per message
+        if the tokenizer has none.
+
+        Args:
+            messages (List[BaseMessage]): The conversation to respond to.
+
+        Returns:
+            str: The text of the prompt, ending with the start of the assistant turn.
+        """
+        tokenizer: PreTrainedTokenizerBase = self.tokenizer
+        if tokenizer.chat_template is not None:
+            return tokenizer.apply_chat_template(
+                [
+                    {
+                        "role": ROLES.get(message.type, message.type),
+                        "content": message.content,
+                    }
+                    for message in messages
+                ],
+                add_generation_prompt=True,
+                tokenize=False,
+            )
+        prompt = "".join(
+            f"{ROLES.get(message.type, message.type)}: {message.content}\n"
+            for message in messages
+        )
+        return prompt + "assistant:"
+
+    def tokenize(self, text: str) -> List[int]:
+        """
+        Encodes a rendered prompt, or the beginning of one. A chat template adds the special tokens itself.
+
+        Args:
+            text (str): The text to encode.
+
+        Returns:
+            List[int]: The token ids of the text.
+        """
+        tokenizer: PreTrainedTokenizerBase = self.tokenizer
+        return tokenizer.encode(
+            text, add_special_tokens=tokenizer.chat_template is None
+        )
+
+    def encode(self, messages: List[BaseMessage]) -> List[int]:
+        """
+        Encodes a conversation, see `render`.
+
+        Args:
+            messages (List[BaseMessage]): The conversation to respond to.
+
+        Returns:
+            List[int]: The token ids of the prompt, ending with the start of the assistant turn.
+        """
+        return self.tokenize(self.render(messages))
+
+    def shared_length(self, messages: List[BaseMessage], prompt_ids: List[int]) -> int:
+        """
+        Counts the tokens of a prompt before the first `prefix_boundary`, i.e. the part later prompts of the session
+        start with, whose states are worth caching.
+
+        Args:
+            messages (List[BaseMessage]): The conversation to respond to.
+            prompt_ids (List[int]): The token ids of the prompt.
+
+        Returns:
+            int: The number of tokens shared with later prompts, the whole prompt if there is no boundary.
+        """
+        if self.prefix_boundary is None:
+            return len(prompt_ids)
+        text = self.render(messages)
+        end = text.find(self.prefix_boundary)
+        if end < 0:
+            return len(prompt_ids)
+        # The last token of the prefix may merge with the text after it, so only the common tokens count.
+        prefix_ids = self.tokenize(text[:end])
+        length = 0
+        for prefix_id, prompt_id in zip(prefix_ids, prompt_ids):
+            if prefix_id != prompt_id:
+                break
+            length += 1
+        return length
+
+    def sample(self, logits: torch.Tensor) -> int:
+        """
+        Picks the next token from the logits of the last position.
+
+        Args:
+            logits (torch.Tensor): The logits over the vocabulary.
+
+        Returns:
+            int: The id of the next token.
+        """
+        if not self.do_sample or self.temperature <= 0:
+            return int(torch.argmax(logits))
+        probabilities = torch.softmax(logits.float() / self.temperature, dim=-1)
+        return int(torch.multinomial(probabilities, 1))
+
+    def generate_tokens(
+        self, prompt_ids: List[int], cache_length: Optional[int] = None
+    ) -> Iterator[int]:
+        """
+        Generates tokens one at a time, reusing the key/value cache of the model between steps, or through the
+        scheduler if any. The request of the scheduler is cancelled if the caller stops early.
+
+        Args:
+            prompt_ids (List[int]): The token ids of the prompt.
+            cache_length (Optional[int]): The number of prompt tokens whose states the prefix cache keeps. Defaults
+                to the whole prompt.
+
+        Returns:
+            Iterator[int]: The ids of the generated tokens, up to the end of sequence token, which is not included.
+        """
+        if self.scheduler is not None:
+            stream = self.scheduler.submit(
+                prompt_ids,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=self.do_sample,
+                temperature=self.temperature,
+                cache_length=cache_length,
+            )
+            try:
+                yield from stream
+            finally:
+                stream.cancel()
+            return
+        device = model_device(self.model)
+        input_ids = torch.tensor([prompt_ids], device=device)
+        past_key_values = None
+        with torch.inference_mode():
+            for _ in range(self.max_new_tokens):
+                if past_key_values is None and self.prefix_cache is not None:
+                    logits, past_key_values = self.prefix_cache.prefill(
+                        self.model, prompt_ids, cache_length
+                    )
+                else:
+                    outputs = self.model(
+                        input_ids=input_ids,
+                        past_key_values=past_key_values,
+                        use_cache=True,
+                    )
+                    logits = outputs.logits[0, -1]
+                    past_key_values = outputs.past_key_values
+                token = self.sample(logits)
+                if token == self.tokenizer.eos_token_id:
+                    return
+                yield token
+                input_ids = torch.tensor([[token]], device=device)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        """
+        Streams the response to a conversation as text chunks, as soon as the tokens are generated. Each step only
+        decodes the tokens since the last complete text, after the token before them, whose text is cut off again,
+        as it may change how the first of them decodes, e.g. with or without a leading space.
+
+        Args:
+            messages (List[BaseMessage]): The conversation to respond to.
+            stop (Optional[List[str]]): The sequences ending the response, which are not included.
+            run_manager (Optional[CallbackManagerForLLMRun]): The callbacks of the run.
+            **kwargs (Any): Ignored.
+
+        Returns:
+            Iterator[ChatGenerationChunk]: The chunks of the response.
+        """
+        stop = [s for s in stop or [] if s]
+        generated: List[int] = []
+        text = ""
+        emitted = 0
+        prefix_offset = read_offset = 0
+        prompt_ids = self.encode(messages)
+        cache_length = self.shared_length(messages, prompt_ids)
+        for token in self.generate_tokens(prompt_ids, cache_length):
+            generated.append(token)
+            prefix_text = self.tokenizer.decode(
+                generated[prefix_offset:read_offset], skip_special_tokens=True
+            )
+            new_text = self.tokenizer.decode(
+                generated[prefix_offset:], skip_special_tokens=True
+            )
+            # A character split across tokens is only added once complete.
+            if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+                continue
+            text += new_text[len(prefix_text) :]
+            prefix_offset, read_offset = read_offset, len(generated)
+            # The text emitted does not end with the start of a stop sequence, so none starts before it.
+            stops = [i for i in (text.find(s, emitted) for s in stop) if i >= 0]
+            end = min(stops) if stops else len(text) - held_back(text, stop)
+            if end > emitted:
+                yield self._chunk(text[emitted:end], run_manager)
+                emitted = end
+            if stops:
+                return
+        if len(text) > emitted:
+            yield self._chunk(text[emitted:], run_manager)
+
+    @staticmethod
+    def _chunk(
+        delta: str, run_manager: Optional[CallbackManagerForLLMRun]
+    ) -> ChatGenerationChunk:
+        """
+        Wraps newly generated text into a chunk, reporting it to the callbacks.
+
+        Args:
+            delta (str): The new text.
+            run_manager (Optional[CallbackManagerForLLMRun]): The callbacks of the run.
+
+        Returns:
+            ChatGenerationChunk: The chunk of the streamed message.
+        """
+        if run_manager is not None:
+            run_manager.on_llm_new_token(delta)
+        return ChatGenerationChunk(message=AIMessageChunk(content=delta))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """
+        Generates the response to a conversation, as the concatenation of the chunks of `_stream`.
+
+        Args:
+            messages (List[BaseMessage]): The conversation to respond to.
+            stop (Optional[List[str]]): The sequences ending the response, which are not included.
+            run_manager (Optional[CallbackManagerForLLMRun]): The callbacks of the run.
+            **kwargs (Any): Ignored.
+
+        Returns:
+            ChatResult: The response message.
+        """
+        content = "".join(
+            str(chunk.message.content)
+            for chunk in self._stream(messages, stop, run_manager, **kwargs)
+        )
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))]
+        )
@@ -0,0 +1,848 @@
+import json
+import os
+import uuid
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ann_index import HNSWIndex
+from mmr import maximal_marginal_relevance
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(
+        self,
+        embedding: Optional[Embeddings] = None,
+        path: Optional[str] = None,
+        metric: str = "cosine",
+        index: str = "flat",
+        m: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 50,
+        rebuild_threshold: float = 0.3,
+    ) -> None:
+        """
+        Initializes an in-process vector store. Vectors are kept in one contiguous NumPy matrix, with the text and
+        metadata of each row kept in lists next to it, and searched with a single matrix-vector product. If a path is
+        given, every write is appended to files in that directory, which are memory-mapped back on restart so that
+        nothing has to be embedded again.
+
+        Args:
+            embedding (Optional[Embeddings]): The embeddings model used for texts and queries.
+            path (Optional[str]): The directory persisting the store. If None, the store lives in memory only.
+            metric (str): Either 'cosine' or 'dot', the similarity used for search. Vectors are normalized on insert
+                for 'cosine'. The metric of an existing store on disk takes precedence.
+            index (str): Either 'flat' for exact search or 'hnsw' for approximate search with an HNSW graph, which
+                is updated on every insert. The graph of a persisted store is saved next to its vectors every time
+                it grew by a tenth, so that a restart only inserts the rows added since.
+            m (int): The number of neighbours per node of the HNSW graph.
+            ef_construction (int): The candidate list size used while inserting in the HNSW graph.
+            ef_search (int): The default candidate list size of HNSW searches.
+            rebuild_threshold (float): The fraction of deleted nodes of the HNSW graph beyond which it is rebuilt
+                from the rows alive, in the background.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if metric not in ("cosine", "dot"):
+            raise ValueError(f"Unknown metric: {metric}")
+        if index not in ("flat", "hnsw"):
+            raise ValueError(f"Unknown index: {index}")
+        self._embedding = embedding
+        self.path = path
+        self.metric = metric
+        self.dim: Optional[int] = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.rows: Dict[str, int] = {}
+        self.rebuild_threshold = rebuild_threshold
+        self._hnsw_params = {
+            "m": m,
+            "ef_construction": ef_construction,
+            "ef_search": ef_search,
+        }
+        self.hnsw = HNSWIndex(**self._hnsw_params) if index == "hnsw" else None
+        self._graph_saved = 0
+        self._lock = Lock()
+        self._rebuild_lock = Lock()
+        self._rebuild_thread: Optional[Thread] = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        """
+        Exposes the embeddings model of the store.
+
+        Returns:
+            Optional[Embeddings]: The embeddings model used for texts and queries.
+        """
+        return self._embedding
+
+    def _file(self, name: str) -> str:
+        """
+        Builds the path of one of the files persisting the store.
+
+        Args:
+            name (str): The name of the file.
+
+        Returns:
+            str: The path of the file inside the store directory.
+        """
+        return os.path.join(self.path, name)  # type: ignore[arg-type]
+
+    def _load(self) -> None:
+        """
+        Loads a persisted store: the vector matrix is memory-mapped and copied into a growable buffer, the documents
+        are read from their line-per-row log and deleted rows are masked out. The tail of a write interrupted by a
+        crash, i.e. vectors without their document or an incomplete document line, is cut off both files so that the
+        next write appends its vectors and documents at the same row.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if not os.path.exists(self._file("meta.json")):
+            return
+        with open(self._file("meta.json")) as f:
+            meta = json.load(f)
+        dim: int = meta["dim"]
+        self.dim, self.metric = dim, meta["metric"]
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        with open(self._file("docs.jsonl"), "rb") as f:
+            lines = [line for line in f if line.endswith(b"\n")]
+        row_size = 4 * dim
+        n_rows = min(len(lines), os.path.getsize(self._file("vectors.f32")) // row_size)
+        docs = [json.loads(line) for line in lines[:n_rows]]
+        os.truncate(self._file("vectors.f32"), n_rows * row_size)
+        os.truncate(self._file("docs.jsonl"), sum(len(line) for line in lines[:n_rows]))
+        self._reserve(n_rows)
+        if n_rows:
+            self.vectors[:n_rows] = np.memmap(
+                self._file("vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(n_rows, dim),
+            )
+        for row, doc in enumerate(docs):
+            self.ids.append(doc["id"])
+            self.texts.append(doc["text"])
+            self.metadatas.append(doc["metadata"])
+            self.rows[doc["id"]] = row
+        self.alive[:n_rows] = True
+        self.size = n_rows
+        if os.path.exists(self._file("deleted.txt")):
+            with open(self._file("deleted.txt")) as f:
+                for line in f:
+                    self._drop(int(line))
+        if self.hnsw is not None:
+            self._load_graph()
+
+    def _load_graph(self) -> None:
+        """
+        Loads the saved HNSW graph, or starts a new one if there is none or it covers rows lost in a crash, inserts
+        the rows alive added since it was saved and saves it again if it changed.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        hnsw = HNSWIndex(**self._hnsw_params)
+        if hnsw.load(self._file("hnsw.npz")) and len(hnsw) <= self.size:
+            self._graph_saved = len(hnsw)
+        else:
+            hnsw = HNSWIndex(**self._hnsw_params)
+        start = len(hnsw)
+        hnsw.add(
+            self.vectors,
+            (start + np.flatnonzero(self.alive[start : self.size])).tolist(),
+        )
+        self.hnsw = hnsw
+        if self._graph_is_stale():
+            self.rebuild_graph()
+        elif len(hnsw) > self._graph_saved:
+            self._save_graph()
+
+    def _save_graph(self) -> None:
+        """
+        Saves the HNSW graph next to the vectors, if the store is persisted.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.path is not None and self.hnsw is not None:
+            self.hnsw.save(self._file("hnsw.npz"))
+            self._graph_saved = len(self.hnsw)
+
+    def _graph_is_stale(self) -> bool:
+        """
+        Tells whether more than `rebuild_threshold` of the nodes of the HNSW graph are deleted rows, which still route
+        searches but slow them down and are never returned.
+
+        Returns:
+            bool: Whether the graph should be rebuilt.
+        """
+        if self.hnsw is None:
+            return False
+        n_deleted = self.hnsw.n_nodes - len(self.rows)
+        return n_deleted > self.rebuild_threshold * self.hnsw.n_nodes
+
+    def _rebuild_graph_in_background(self) -> bool:
+        """
+        Starts rebuilding the HNSW graph in a background thread if it is stale and no rebuild is running. Must be
+        called with the lock held.
+
+        Returns:
+            bool: Whether a rebuild was started.
+        """
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return False
+        if not self._graph_is_stale():
+            return False
+        self._rebuild_thread = Thread(target=self.rebuild_graph, daemon=True)
+        self._rebuild_thread.start()
+        return True
+
+    def rebuild_graph(self) -> None:
+        """
+        Rebuilds the HNSW graph from the rows alive. The new graph is built outside the lock from the rows alive when
+        the rebuild starts, while searches and writes keep using the current graph, deleted rows being skipped as
+        tombstones; the rows added meanwhile are inserted under the lock, before the new graph replaces the current
+        one and is saved.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.hnsw is None:
+            return
+        with self._rebuild_lock:
+            # Rows below `size` are never written again, and a grown matrix is a copy, so the snapshot stays valid.
+            with self._lock:
+                vectors, size = self.vectors, self.size
+                rows = np.flatnonzero(self.alive[:size]).tolist()
+            hnsw = HNSWIndex(**self._hnsw_params)
+            hnsw.add(vectors, rows)
+            with self._lock:
+                hnsw.add(
+                    self.vectors,
+                    (size + np.flatnonzero(self.alive[size : self.size])).tolist(),
+                )
+                self.hnsw = hnsw
+                self._save_graph()
+
+    def wait_for_graph_rebuild(self) -> None:
+        """
+        Waits for the background rebuild of the HNSW graph to finish, if one is running.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join()
+
+    def _reserve(self, n_rows: int) -> None:
+        """
+        Grows the vector matrix geometrically so that it can hold `n_rows` rows, keeping appends amortized O(1).
+
+        Args:
+            n_rows (int): The number of rows the matrix must be able to hold.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if n_rows <= len(self.vectors):
+            return
+        capacity = max(n_rows, 2 * len(self.vectors), 1024)
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[: self.size] = self.vectors[: self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self.size] = self.alive[: self.size]
+        self.vectors, self.alive = vectors, alive
+
+    def _drop(self, row: int) -> None:
+        """
+        Marks a row as deleted.
+
+        Args:
+            row (int): The row to delete.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.alive[row] = False
+        if self.rows.get(self.ids[row]) == row:
+            del self.rows[self.ids[row]]
+
+    def add_vectors(
+        self,
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Adds precomputed vectors with their texts and metadata. An existing id is replaced, and an id given several
+        times is added with its last vector.
+
+        Args:
+            vectors (List[List[float]]): The vectors to add.
+            texts (List[str]): The text of each vector.
+            metadatas (Optional[List[Dict[str, Any]]]): The metadata of each vector.
+            ids (Optional[List[str]]): The id of each vector. Random ids are generated if not given.
+
+        Returns:
+            List[str]: The ids of the added vectors.
+        """
+        if not texts:
+            return []
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        # An id given several times is added once, with its last vector.
+        last = {doc_id: i for i, doc_id in enumerate(ids)}
+        if len(last) < len(ids):
+            keep = sorted(last.values())
+            matrix = matrix[keep]
+            texts = [texts[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            added = [ids[i] for i in keep]
+        else:
+            added = ids
+        with self._lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+                if self.path is not None:
+                    with open(self._file("meta.json"), "w") as f:
+                        json.dump({"dim": self.dim, "metric": self.metric}, f)
+            replaced = [self.rows[i] for i in added if i in self.rows]
+            for row in replaced:
+                self._drop(row)
+            start = self.size
+            self._reserve(start + len(texts))
+            self.vectors[start : start + len(texts)] = matrix
+            self.alive[start : start + len(texts)] = True
+            for offset, (doc_id, text, metadata) in enumerate(
+                zip(added, texts, metadatas)
+            ):
+                self.ids.append(doc_id)
+                self.texts.append(text)
+                self.metadatas.append(metadata)
+                self.rows[doc_id] = start + offset
+            self.size += len(texts)
+            if self.hnsw is not None:
+                self.hnsw.add(self.vectors, list(range(start, self.size)))
+            if self.path is not None:
+                self._append(matrix, added, texts, metadatas, replaced)
+            if self.hnsw is not None and not self._rebuild_graph_in_background():
+                if len(self.hnsw) - self._graph_saved >= max(
+                    1024, len(self.hnsw) // 10
+                ):
+                    self._save_graph()
+        return ids
+
+    def _append(
+        self,
+        matrix: np.ndarray,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        deleted: List[int],
+    ) -> None:
+        """
+        Appends added rows and deleted row numbers to the files persisting the store. Vectors are written first so
+        that a crash never leaves documents without their vector.
+
+        Args:
+            matrix (np.ndarray): The added vectors.
+            ids (List[str]): The ids of the added rows.
+            texts (List[str]): The texts of the added rows.
+            metadatas (List[Dict[str, Any]]): The metadata of the added rows.
+            deleted (List[int]): The rows deleted by this write.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with open(self._file("vectors.f32"), "ab") as f:
+            f.write(matrix.tobytes())
+        with open(self._file("docs.jsonl"), "a") as f:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                f.write(
+                    json.dumps({"id": doc_id, "text": text, "metadata": metadata})
+                    + "\n"
+                )
+        if deleted:
+            with open(self._file("deleted.txt"), "a") as f:
+                f.write("".join(f"{row}\n" for row in deleted))
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Embeds texts and adds them to the store.
+
+        Args:
+            texts (Iterable[str]): The texts to add.
+            metadatas (Optional[List[dict]]): The metadata of each text.
+            ids (Optional[List[str]]): The id of each text. Random ids are generated if not given.
+            **kwargs (Any): Ignored, accepted for compatibility with other vector stores.
+
+        Returns:
+            List[str]: The ids of the added texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding.embed_documents(texts)  # type: ignore[union-attr]
+        return self.add_vectors(vectors, texts, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        Deletes vectors by id.
+
+        Args:
+            ids (Optional[List[str]]): The ids of the vectors to delete.
+            **kwargs (Any): Ignored, accepted for compatibility with other vector stores.
+
+        Returns:
+            Optional[bool]: True if any vector was deleted, False otherwise.
+        """
+        with self._lock:
+            rows = [self.rows[i] for i in ids or [] if i in self.rows]
+            for row in rows:
+                self._drop(row)
+            if rows and self.path is not None:
+                with open(self._file("deleted.txt"), "a") as f:
+                    f.write("".join(f"{row}\n" for row in rows))
+            self._rebuild_graph_in_background()
+        return bool(rows)
+
+    def _query(self, embedding: List[float]) -> np.ndarray:
+        """
+        Converts a query vector to the representation of the stored vectors.
+
+        Args:
+            embedding (List[float]): The query vector.
+
+        Returns:
+            np.ndarray: The float32 query vector, normalized for the cosine metric.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        if self.metric == "cosine":
+            query = query / (np.linalg.norm(query) or 1.0)
+        return query
+
+    def _filter_mask(
+        self, filter: Optional[Dict[str, Any]], size: int
+    ) -> Optional[np.ndarray]:
+        """
+        Builds the mask of the rows whose metadata match a filter.
+
+        Args:
+            filter (Optional[Dict[str, Any]]): The metadata values the rows must have.
+            size (int): The number of rows to consider.
+
+        Returns:
+            Optional[np.ndarray]: The boolean mask of matching rows, or None if there is no filter.
+        """
+        if not filter:
+            return None
+        return np.fromiter(
+            (
+                all(metadata.get(key) == value for key, value in filter.items())
+                for metadata in self.metadatas[:size]
+            ),
+            dtype=bool,
+            count=size,
+        )
+
+    def _search(
+        self,
+        embedding: List[float],
+        k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Selects the rows with the highest similarity to a query vector. Without an ANN index, or with a filter,
+        every row is scored in one matrix-vector product; otherwise the HNSW graph is searched.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of rows to select.
+            filter (Optional[Dict[str, Any]]): The metadata values the selected rows must have.
+            ef_search (Optional[int]): The candidate list size of the HNSW search. Defaults to the index setting.
+
+        Returns:
+            List[Tuple[float, int]]: Pairs of similarity and row, best first.
+        """
+        query = self._query(embedding)
+        if self.hnsw is not None and not filter:
+            return self.hnsw.search(
+                self.vectors, query, k, ef_search=ef_search, alive=self.alive
+            )
+        size = self.size
+        scores = self.vectors[:size] @ query
+        mask = self.alive[:size]
+        filter_mask = self._filter_mask(filter, size)
+        if filter_mask is not None:
+            mask = mask & filter_mask
+        scores[~mask] = -np.inf
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return list(zip(scores[top].tolist(), top.tolist()))
+
+    def _document(self, row: int) -> Document:
+        """
+        Builds the document stored in a row.
+
+        Args:
+            row (int): The row of the document.
+
+        Returns:
+            Document: The stored document.
+        """
+        return Document(
+            page_content=self.texts[row], metadata=dict(self.metadatas[row])
+        )
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the documents most similar to a query vector, with their similarity.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            filter (Optional[Dict[str, Any]]): The metadata values the returned documents must have.
+            ef_search (Optional[int]): The candidate list size of the HNSW search, trading latency for recall.
+            **kwargs (Any): Ignored, accepted for compatibility with other vector stores.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and their similarity, most similar first.
+        """
+        return [
+            (self._document(row), score)
+            for score, row in self._search(embedding, k, filter, ef_search)
+        ]
+
+    def similarity_search_by_vector_batch(
+        self,
+        embeddings: List[List[float]],
+        ks: List[int],
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+        ef_search: Optional[int] = None,
+        block_size: int = 256,
+        **kwargs: Any,
+    ) -> List[List[Document]]:
+        """
+        Returns the documents most similar to each of several query vectors. Without an ANN index, queries are
+        scored in blocks of `block_size` with one matrix product per block, which bounds the size of the score
+        matrix; with an HNSW index, each query searches the graph.
+
+        Args:
+            embeddings (List[List[float]]): The query vectors.
+            ks (List[int]): The number of documents to return for each query.
+            filters (Optional[List[Optional[Dict[str, Any]]]]): The metadata values the documents returned for each
+                query must have. Defaults to no filter.
+            ef_search (Optional[int]): The candidate list size of the HNSW searches.
+            block_size (int): The number of queries scored together.
+            **kwargs (Any): Ignored, accepted for compatibility with other vector stores.
+
+        Returns:
+            List[List[Document]]: The documents of each query, most similar first, in query order.
+        """
+        if filters is None:
+            filters = [None] * len(embeddings)
+        if self.hnsw is not None:
+            return [
+                [
+                    self._document(row)
+                    for _, row in self._search(embedding, k, filter, ef_search)
+                ]
+                for embedding, k, filter in zip(embeddings, ks, filters)
+            ]
+        size = self.size
+        if not size:
+            return [[] for _ in embeddings]
+        alive = self.alive[:size]
+        # Queries sharing a filter share its mask, and its number of matching rows.
+        masks: Dict[str, Tuple[np.ndarray, int]] = {"": (alive, int(alive.sum()))}
+        results: List[List[Document]] = []
+        for start in range(0, len(embeddings), block_size):
+            queries = np.stack(
+                [
+                    self._query(embedding)
+                    for embedding in embeddings[start : start + block_size]
+                ]
+            )
+            scores = queries @ self.vectors[:size].T
+            for i, row_scores in enumerate(scores):
+                filter = filters[start + i]
+                key = json.dumps(filter, sort_keys=True, default=str) if filter else ""
+                if key not in masks:
+                    mask = alive & self._filter_mask(filter, size)
+                    masks[key] = (mask, int(mask.sum()))
+                mask, n_matching = masks[key]
+                row_scores[~mask] = -np.inf
+                k = min(ks[start + i], n_matching)
+                if k <= 0:
+                    results.append([])
+                    continue
+                top = np.argpartition(-row_scores, k - 1)[:k]
+                top = top[np.argsort(-row_scores[top])]
+                results.append([self._document(row) for row in top.tolist()])
+        return results
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """
+        Returns the documents most similar to a query vector.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Document]: The documents, most similar first.
+        """
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the documents most similar to a query, with their similarity.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and their similarity, most similar first.
+        """
+        embedding = self._embedding.embed_query(query)  # type: ignore[union-attr]
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Asynchronously returns the documents most similar to a query, with their similarity. Only the query embedding
+        is awaited: the search itself runs in memory.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and their similarity, most similar first.
+        """
+        embedding = await self._embedding.aembed_query(query)  # type: ignore[union-attr]
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """
+        Asynchronously returns the documents most similar to a query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Document]: The documents, most similar first.
+        """
+        return [
+            doc
+            for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """
+        Returns the documents most similar to a query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Document]: The documents, most similar first.
+        """
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        """
+        Selects the function mapping similarities to relevance scores between 0 and 1: cosine similarities are
+        shifted from [-1, 1], and unbounded dot products squashed with a logistic function.
+
+        Returns:
+            Callable[[float], float]: The function mapping a similarity to a relevance score.
+        """
+        if self.metric == "dot":
+            return lambda score: float(1 / (1 + np.exp(-np.clip(score, -709, 709))))
+        return lambda score: (1.0 + score) / 2.0
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Returns documents selected by maximal marginal relevance among the `fetch_k` most similar to a query vector,
+        with the vectorized selection of `mmr.maximal_marginal_relevance`.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            fetch_k (int): The number of candidate documents.
+            lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+            filter (Optional[Dict[str, Any]]): The metadata values the returned documents must have.
+            ef_search (Optional[int]): The candidate list size of the HNSW search, trading latency for recall.
+            **kwargs (Any): Ignored, accepted for compatibility with other vector stores.
+
+        Returns:
+            List[Document]: The selected documents.
+        """
+        candidates = [
+            row for _, row in self._search(embedding, fetch_k, filter, ef_search)
+        ]
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32),
+            self.vectors[candidates],
+            lambda_mult=lambda_mult,
+            k=k,
+        )
+        return [self._document(candidates[i]) for i in selected]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Returns documents selected by maximal marginal relevance among the `fetch_k` most similar to a query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            fetch_k (int): The number of candidate documents.
+            lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Document]: The selected documents.
+        """
+        embedding = self._embedding.embed_query(query)  # type: ignore[union-attr]
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k, lambda_mult, **kwargs
+        )
+
+    async def amax_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Asynchronously returns documents selected by maximal marginal relevance among the `fetch_k` most similar to a
+        query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            fetch_k (int): The number of candidate documents.
+            lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+            **kwargs (Any): Search options such as `filter`.
+
+        Returns:
+            List[Document]: The selected documents.
+        """
+        embedding = await self._embedding.aembed_query(query)  # type: ignore[union-attr]
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k, lambda_mult, **kwargs
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """
+        Creates a store from texts.
+
+        Args:
+            texts (List[str]): The texts to add.
+            embedding (Embeddings): The embeddings model used for texts and queries.
+            metadatas (Optional[List[dict]]): The metadata of each text.
+            **kwargs (Any): The `path` and `metric` of the store, and the `ids` of the texts.
+
+        Returns:
+            LocalVectorStore: The store holding the texts.
+        """
+        ids = kwargs.pop("ids", None)
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def __len__(self) -> int:
+        """
+        Counts the vectors in the store.
+
+        Returns:
+            int: The number of vectors that have not been deleted.
+        """
+        return len(self.rows)
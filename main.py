@@ -1,21 +1,43 @@
+import hashlib
+import hmac
 import os
 import uuid
+from functools import partial
 from tempfile import NamedTemporaryFile
+from typing import Any, Dict, Iterator, List, Optional
 
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
-
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from bm25 import BM25Index
+from chat_history import (
+    BoundedHistory,
+    HistoryStore,
+    SQLiteHistoryStore,
+    count_words,
+    summarize_with,
+)
 from chat_model import ChatModel
-from index import Indexer
-from rag import RagChain
-from retriever import Retriever
+from context_packer import ContextPacker
+from index import FileProgress, Indexer
+from rag import RagChain, SemanticCache
+from reranker import Reranker
+from resources import ResourceRegistry, registry
+from retriever import RetrievalCache, Retriever
 
 
 class RAGApp:
-    def __init__(self) -> None:
+    def __init__(self, resources: Optional[ResourceRegistry] = None) -> None:
         """
-        Initializes the RAG-exp application, setting up all the necessary components and session states
+        Initializes the RAG-exp application, setting up all the necessary components and session states. The
+        components are shared by every session of the process, and only the RAG chain, bound to the chat history of
+        the session, is created per session.
+
+        Args:
+            resources (Optional[ResourceRegistry]): The registry of the shared components. Defaults to the registry of
+                the process.
 
         Returns:
             None:
@@ -25,70 +47,235 @@ class RAGApp:
         # Initialize components
 
         self.state = st.session_state
-        self.session_id = str(id(self.state))
+        # `st.session_state` is the same proxy object in every session, so the session id is generated once and kept
+        # in the state of the session, on the server only.
+        if "session_id" not in self.state:
+            self.state["session_id"] = self.new_session_id()
+        self.session_id = self.state["session_id"]
+        self.resources = registry if resources is None else resources
         self.model = self.get_model()
         self.indexer = self.get_indexer()
         self.vectorstore = self.get_vectorstore()
         self.retriever = self.get_retriever()
         self.rag_chain = self.get_rag_chain()
-        self.rag_chain.set_rag_chain()
         self.state.user_message = None
 
+    @staticmethod
+    def new_session_id() -> str:
+        """
+        Generates the id of a new session, under which its chat history is kept. It is a random token never exposed
+        to the browser, unless `HISTORY_USER_SECRET` is set and the user is signed in: the id is then an HMAC of
+        their email under the secret, so that their history is resumed in any of their sessions, e.g. after a
+        restart, and cannot be guessed by anyone else.
+
+        Returns:
+            str: The hexadecimal id of the session.
+
+        """
+        secret = os.getenv("HISTORY_USER_SECRET")
+        email = st.experimental_user.get("email") if secret else None
+        if secret and email:
+            return hmac.new(secret.encode(), email.encode(), hashlib.sha256).hexdigest()
+        return uuid.uuid4().hex
+
     def get_model(self) -> ChatModel:
         """
-        Fetches the chat model from session state or initiates one if it does not exist.
+        Fetches the shared chat model or initiates one if it does not exist.
 
         Returns:
             ChatModel:  An instance of the ChatModel used for generating responses.
 
         """
-        if "model" not in self.state.keys():
-            self.model = ChatModel(model_name="mistralai/Mistral-7B-Instruct-v0.2")
-            self.state["model"] = self.model
-        return self.state["model"]
+        return self.resources.get(
+            "model", partial(ChatModel, model_name="mistralai/Mistral-7B-Instruct-v0.2")
+        )
 
     def get_indexer(self) -> Indexer:
         """
-        Retrieves the document indexer from session state or creates one.
+        Retrieves the shared document indexer or creates one. If `HYBRID_SEARCH` is true, the indexer
+        also maintains a BM25 index, persisted in the `LEXICAL_INDEX_PATH` directory if set.
 
         Returns:
             Indexer: An instance of the Indexer used for managing document indexing.
 
         """
-        if "indexer" not in self.state.keys():
-            self.indexer = Indexer()
-            self.state["indexer"] = self.indexer
-        return self.state["indexer"]
+
+        def create() -> Indexer:
+            lexical_index = None
+            if os.getenv("HYBRID_SEARCH", "false").lower() == "true":
+                lexical_index = BM25Index(os.getenv("LEXICAL_INDEX_PATH"))
+            return Indexer(lexical_index=lexical_index)
+
+        return self.resources.get("indexer", create)
 
     def get_vectorstore(self) -> VectorStore:
         """
-        Obtains the vector store from session state, initializing it via the indexer if necessary.
+        Obtains the shared vector store, initializing it via the indexer if necessary.
 
         Returns:
             VectorStore: The vector store handling the embeddings and vector operations.
 
         """
-        if "vectorstore" not in self.state.keys():
-            self.vectorstore = self.get_indexer().get_vectorstore()
-            self.state["vectorstore"] = self.vectorstore
-        return self.state["vectorstore"]
+        return self.resources.get(
+            "vectorstore", lambda: self.get_indexer().get_vectorstore()
+        )
+
+    def get_retriever(self) -> BaseRetriever:
+        """
+        Acquires the shared retriever component, setting it up with the vector store if not already present. If
+        `HYBRID_SEARCH` is true, vector and BM25 results are fused. With a reranker, `RERANK_CANDIDATES` documents
+        are retrieved for it to choose from. If `RETRIEVAL_CACHE_MAX_ITEMS` is set, results are cached until the
+        indexer changes the index.
+
+        Returns:
+            BaseRetriever: The component used for retrieving relevant documents based on queries.
+
+        """
+
+        def create() -> BaseRetriever:
+            kwargs: Dict[str, Any] = {}
+            if self.get_reranker() is not None:
+                kwargs["search_kwargs"] = {
+                    "k": int(os.getenv("RERANK_CANDIDATES", "24"))
+                }
+            indexer = self.get_indexer()
+            if indexer.lexical_index is not None:
+                kwargs.update(search_type="hybrid", lexical_index=indexer.lexical_index)
+            max_items = os.getenv("RETRIEVAL_CACHE_MAX_ITEMS")
+            if max_items:
+                kwargs["cache"] = RetrievalCache(
+                    max_items=int(max_items),
+                    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+                    generation=lambda: indexer.generation,
+                )
+            return Retriever(self.get_vectorstore(), **kwargs).get_retriever()
+
+        return self.resources.get("retriever", create)
+
+    def get_reranker(self) -> Optional[Reranker]:
+        """
+        Fetches the shared reranker or creates one if `RERANKER_MODEL` is set. It keeps the
+        `RERANK_TOP_K` best documents and stops scoring after `RERANK_TIME_BUDGET` seconds.
+
+        Returns:
+            Optional[Reranker]: The cross-encoder reranking the retrieved documents, or None if disabled.
+
+        """
+
+        def create() -> Optional[Reranker]:
+            model_name = os.getenv("RERANKER_MODEL")
+            if not model_name:
+                return None
+            return Reranker(
+                model_name,
+                top_k=int(os.getenv("RERANK_TOP_K", "6")),
+                time_budget=float(os.getenv("RERANK_TIME_BUDGET", "0.3")),
+            )
+
+        return self.resources.get("reranker", create)
+
+    def get_semantic_cache(self) -> Optional[SemanticCache]:
+        """
+        Fetches the shared semantic answer cache or creates one if `SEMANTIC_CACHE_THRESHOLD` is set. The
+        cache is invalidated whenever the indexer changes the vector store.
+
+        Returns:
+            Optional[SemanticCache]: The cache answering questions similar to past ones, or None if disabled.
+
+        """
+
+        def create() -> Optional[SemanticCache]:
+            threshold = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+            if not threshold:
+                return None
+            embeddings = self.get_vectorstore().embeddings
+            if embeddings is None:
+                raise ValueError(
+                    "The semantic cache requires a vector store with embeddings"
+                )
+            semantic_cache = SemanticCache(
+                embeddings,
+                threshold=float(threshold),
+                ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+                max_items=int(os.getenv("SEMANTIC_CACHE_MAX_ITEMS", "1000")),
+            )
+            self.get_indexer().add_listener(semantic_cache.invalidate)
+            return semantic_cache
 
-    def get_retriever(self) -> VectorStoreRetriever:
+        return self.resources.get("semantic_cache", create)
+
+    def get_context_packer(self) -> Optional[ContextPacker]:
         """
-        Acquires the retriever component, setting it up with the vector store if not already present.
+        Fetches the shared context packer or creates one with the tokenizer of the chat model. The token
+        budget of the prompt is read from `PROMPT_TOKEN_BUDGET`, 0 disabling the packing.
 
         Returns:
-            VectorStoreRetriever: The component used for retrieving relevant documents based on queries.
+            Optional[ContextPacker]: The packer fitting the context and the history into the budget, or None if
+            disabled.
 
         """
-        if "retriever" not in self.state.keys():
-            self.retriever = Retriever(self.get_vectorstore()).get_retriever()
-            self.state["retriever"] = self.retriever
-        return self.state["retriever"]
+
+        def create() -> Optional[ContextPacker]:
+            budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+            if budget <= 0:
+                return None
+            return ContextPacker(
+                self.get_model().get_tokenizer(),
+                max_tokens=budget,
+                history_share=float(os.getenv("PROMPT_HISTORY_SHARE", "0.3")),
+            )
+
+        return self.resources.get("context_packer", create)
+
+    def get_history_store(self) -> HistoryStore:
+        """
+        Fetches the shared chat history store, keeping the history of each session, or creates one. Histories are capped to
+        `HISTORY_MAX_MESSAGES` messages and `HISTORY_MAX_TOKENS` tokens, counted with the tokenizer of the context
+        packer if any, and older turns are summarized by the chat model if `HISTORY_SUMMARIZE` is true. If
+        `HISTORY_DB_PATH` is set, histories are instead persisted to that SQLite database, shared by every worker, and
+        the last `HISTORY_MAX_MESSAGES` messages of a session are loaded.
+
+        Returns:
+            HistoryStore: The store of the chat history of each session.
+
+        """
+
+        def create() -> HistoryStore:
+            if os.getenv("HISTORY_DB_PATH"):
+                return SQLiteHistoryStore(
+                    os.environ["HISTORY_DB_PATH"],
+                    max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", "40")),
+                    max_sessions=int(os.getenv("HISTORY_MAX_SESSIONS", "1000")),
+                    ttl=float(os.getenv("HISTORY_SESSION_TTL", "86400")),
+                )
+            max_tokens = os.getenv("HISTORY_MAX_TOKENS")
+            context_packer = self.get_context_packer()
+            summarizer = None
+            if os.getenv("HISTORY_SUMMARIZE", "false").lower() == "true":
+                summarizer = summarize_with(self.get_model().get_chat_model())
+            return HistoryStore(
+                max_sessions=int(os.getenv("HISTORY_MAX_SESSIONS", "1000")),
+                ttl=float(os.getenv("HISTORY_SESSION_TTL", "86400")),
+                history_factory=partial(
+                    BoundedHistory,
+                    max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", "40")),
+                    max_tokens=int(max_tokens) if max_tokens else None,
+                    count_tokens=(
+                        count_words
+                        if context_packer is None
+                        else lambda text: len(context_packer.tokenize(text))
+                    ),
+                    summarizer=summarizer,
+                ),
+            )
+
+        return self.resources.get("history_store", create)
 
     def get_rag_chain(self) -> RagChain:
         """
-        Fetches or configures the RagChain combining retrieval and generation capabilities.
+        Fetches or configures the RagChain combining retrieval and generation capabilities. The chain is bound to the
+        chat history of the session, so it is kept in session state and built once per session from the shared
+        components.
 
         Returns:
             RagChain: The component responsible for generating responses using retrieved documents.
@@ -99,25 +286,53 @@ class RAGApp:
                 chat_model=self.get_model(),
                 retriever=self.get_retriever(),
                 session_id=self.session_id,
+                semantic_cache=self.get_semantic_cache(),
+                context_packer=self.get_context_packer(),
+                history_store=self.get_history_store(),
+                reranker=self.get_reranker(),
             )
+            self.rag_chain.set_rag_chain()
             self.state["rag_chain"] = self.rag_chain
         return self.state["rag_chain"]
 
     def upload_and_index_files(self) -> None:
-        """Handles the uploading and indexing of files.
+        """Handles the uploading and indexing of files. New or modified files are indexed together in parallel, with a
+        progress bar advancing as each file is indexed or fails.
 
         Returns:
             None:
         """
         uploaded_files = st.file_uploader("Choose a file", accept_multiple_files=True)
         if uploaded_files:
+            files = []
             for uploaded_file in uploaded_files:
-                if uploaded_file.name not in self.indexer.files:
+                file_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+                if not self.indexer.is_indexed(uploaded_file.name, file_hash):
                     suffix = uploaded_file.name.split(".")[-1]
                     with NamedTemporaryFile(suffix=f".{suffix}", delete=False) as f:
                         f.write(uploaded_file.getbuffer())
-                        self.indexer.add_doc(uploaded_file.name, f.name)
-                    os.remove(f.name)
+                    files.append((uploaded_file.name, f.name))
+            if not files:
+                return
+            progress_bar = st.progress(0.0, text="Indexing files...")
+            done: List[str] = []
+
+            def on_progress(progress: FileProgress) -> None:
+                if progress.status != "parsed":
+                    done.append(progress.file_name)
+                    progress_bar.progress(
+                        len(done) / len(files),
+                        text=f"{progress.file_name}: {progress.status}",
+                    )
+
+            try:
+                errors = self.indexer.add_docs(files, on_progress=on_progress)
+            finally:
+                for _, path in files:
+                    os.remove(path)
+            for file_name, error in errors.items():
+                if error is not None:
+                    st.error(f"Could not index {file_name}: {error}")
 
     def generate_response(self, input_text: str) -> str:
         """Generates a response for the given input text using the RAG chain.
@@ -131,6 +346,17 @@ class RAGApp:
         response = self.rag_chain.query(input_text)
         return response
 
+    def stream_response(self, input_text: str) -> Iterator[str]:
+        """Streams the response for the given input text using the RAG chain, token by token.
+
+        Args:
+            input_text (str): The user input text to respond to.
+
+        Returns:
+            Iterator[str]: The chunks of the generated response, as they are generated.
+        """
+        return self.rag_chain.stream(input_text)
+
     def chat_interface(self) -> None:
         """
         Creates and manages the chat interface for the application.
@@ -154,9 +380,7 @@ class RAGApp:
             with st.chat_message("human"):
                 st.write(self.state.user_message)
             with st.chat_message("ai"):
-                with st.spinner("Thinking..."):
-                    response = self.generate_response(self.state.user_message)
-                    st.write(response)
+                st.write_stream(self.stream_response(self.state.user_message))
             self.state.user_message = None
 
     def run(self) -> None:
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import uuid
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, TypedDict
+
+
+class ManifestEntry(TypedDict):
+    """The content hash of an indexed file and the ids of its distinct chunks."""
+
+    hash: str
+    chunks: List[str]
+
+
+class IndexManifest:
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Initializes a manifest of what has been indexed: the content hash of every file and the ids of its chunks.
+        Chunk ids are derived from the chunk text, so identical chunks share one id and are stored once, however many
+        files contain them.
+
+        Args:
+            path (Optional[str]): The JSON file persisting the manifest. If None, the manifest lives in memory only.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.path = path
+        self.files: Dict[str, ManifestEntry] = {}
+        self.chunk_refs: Counter = Counter()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)["files"]
+            for entry in self.files.values():
+                self.chunk_refs.update(entry["chunks"])
+
+    @staticmethod
+    def hash_file(file: str) -> str:
+        """
+        Computes the content hash of a file, reading it in blocks.
+
+        Args:
+            file (str): The path to the file.
+
+        Returns:
+            str: The hexadecimal SHA-256 of the file content.
+        """
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def chunk_id(text: str) -> str:
+        """
+        Computes the content-addressed id of a chunk, formatted as a UUID since vector stores such as Weaviate
+        require UUID ids.
+
+        Args:
+            text (str): The text of the chunk.
+
+        Returns:
+            str: The id of the chunk.
+        """
+        return str(uuid.UUID(hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]))
+
+    def is_current(self, file_name: str, file_hash: str) -> bool:
+        """
+        Checks whether a file has already been indexed with the same content.
+
+        Args:
+            file_name (str): The name of the file.
+            file_hash (str): The content hash of the file.
+
+        Returns:
+            bool: True if the file is indexed and unchanged.
+        """
+        entry = self.files.get(file_name)
+        return entry is not None and entry["hash"] == file_hash
+
+    def is_stored(self, chunk_id: str) -> bool:
+        """
+        Checks whether a chunk is already in the vector store, through any file.
+
+        Args:
+            chunk_id (str): The id of the chunk.
+
+        Returns:
+            bool: True if some indexed file references the chunk.
+        """
+        return self.chunk_refs[chunk_id] > 0
+
+    def stale_chunks(self, file_name: str, chunk_ids: Iterable[str]) -> List[str]:
+        """
+        Lists the chunks that re-indexing a file makes obsolete: the ones of its previous version that neither its
+        new version nor any other file references.
+
+        Args:
+            file_name (str): The name of the file.
+            chunk_ids (Iterable[str]): The ids of the chunks of the new version of the file.
+
+        Returns:
+            List[str]: The ids of the chunks to delete from the vector store.
+        """
+        entry = self.files.get(file_name)
+        if entry is None:
+            return []
+        new_ids = set(chunk_ids)
+        return [
+            chunk_id
+            for chunk_id in dict.fromkeys(entry["chunks"])
+            if chunk_id not in new_ids and self.chunk_refs[chunk_id] <= 1
+        ]
+
+    def update(self, file_name: str, file_hash: str, chunk_ids: List[str]) -> None:
+        """
+        Records the new version of a file and persists the manifest.
+
+        Args:
+            file_name (str): The name of the file.
+            file_hash (str): The content hash of the file.
+            chunk_ids (List[str]): The ids of the distinct chunks of the file.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        entry = self.files.get(file_name)
+        if entry is not None:
+            self.chunk_refs.subtract(entry["chunks"])
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        self.files[file_name] = {"hash": file_hash, "chunks": chunk_ids}
+        self.chunk_refs.update(chunk_ids)
+        self.chunk_refs = +self.chunk_refs
+        self.save()
+
+    def save(self) -> None:
+        """
+        Writes the manifest to its file, atomically so that a crash never leaves a truncated manifest.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        if self.path is None:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(temp_path, self.path)
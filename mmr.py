@@ -0,0 +1,45 @@
+from typing import List
+
+import numpy as np
+
+
+def maximal_marginal_relevance(
+    query_embedding: np.ndarray,
+    embeddings: np.ndarray,
+    lambda_mult: float = 0.5,
+    k: int = 4,
+) -> List[int]:
+    """
+    Selects candidates by maximal marginal relevance, as LangChain's `maximal_marginal_relevance` does, with cosine
+    similarities and the same picks. The similarity of every candidate to the closest selected one is kept in a
+    vector and updated with one matrix-vector product per pick, so that only the rows of the candidate similarity
+    matrix that are needed, one per selected candidate, are computed.
+
+    Args:
+        query_embedding (np.ndarray): The query vector.
+        embeddings (np.ndarray): The candidate vectors, one per row.
+        lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+        k (int): The number of candidates to select.
+
+    Returns:
+        List[int]: The positions of the selected candidates, in selection order.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    k = min(k, len(vectors))
+    if k <= 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)[:, None]
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    query = query / (np.linalg.norm(query) or 1.0)
+    similarity = vectors @ query
+    relevance = lambda_mult * similarity
+    selected = [int(np.argmax(similarity))]
+    max_similarity = vectors @ vectors[selected[0]]
+    while len(selected) < k:
+        scores = relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, vectors @ vectors[best], out=max_similarity)
+    return selected
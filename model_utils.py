@@ -32,3 +32,17 @@ def get_quantization_config(
         bnb_4bit_compute_dtype=bnb_4bit_compute_dtype,
     )
     return bnb_config
+
+
+def model_device(model: torch.nn.Module) -> torch.device:
+    """
+    Finds the device the inputs of a model must be created on, e.g. the GPU a quantized model was dispatched to.
+
+    Args:
+        model (torch.nn.Module): The model, whose `device` attribute is set by Hugging Face models.
+
+    Returns:
+        torch.device: The device of the model, or the CPU if it does not tell.
+    """
+    device = getattr(model, "device", None)
+    return device if isinstance(device, torch.device) else torch.device("cpu")
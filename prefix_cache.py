@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from model_utils import model_device
+
+# Key/value cache in the legacy format of Hugging Face models: one (keys, values) pair per layer, each of shape
+# (batch, heads, positions, head size).
+KVCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+class PrefixCache:
+    def __init__(self, max_bytes: int = 512 * 2**20, min_tokens: int = 16) -> None:
+        """
+        Initializes a cache of the attention key/value states of prompts, so that a prompt sharing its beginning with
+        a previous one, such as the fixed instructions of the prompt template followed by the chat history of the
+        same session, only runs its new tokens through the model. Since attention is causal, the states of the first
+        positions of a cached prompt are those of any prompt with the same first tokens, so a new prompt reuses the
+        longest common prefix of the cached prompts.
+
+        Args:
+            max_bytes (int): The memory the cached states may take, the least recently used prompts being evicted
+                first.
+            min_tokens (int): The minimum length of a common prefix worth reusing.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.entries: OrderedDict[int, Tuple[np.ndarray, KVCache, int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefill_tokens = 0
+        self._next_key = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _size(cache: KVCache) -> int:
+        """
+        Measures the memory held by key/value states.
+
+        Args:
+            cache (KVCache): The keys and values of every layer.
+
+        Returns:
+            int: The number of bytes of the key and value tensors.
+        """
+        return sum(keys.nbytes + values.nbytes for keys, values in cache)
+
+    def lookup(self, token_ids: List[int]) -> Tuple[int, Optional[KVCache]]:
+        """
+        Finds the longest cached prefix of a prompt, leaving at least its last token to run, whose logits give the
+        first generated token.
+
+        Args:
+            token_ids (List[int]): The token ids of the prompt.
+
+        Returns:
+            Tuple[int, Optional[KVCache]]: The length of the reused prefix and its key/value states, or 0 and None.
+        """
+        tokens = np.asarray(token_ids[:-1], dtype=np.int64)
+        with self._lock:
+            best_key, best_length = None, 0
+            for key, (cached, _, _) in self.entries.items():
+                size = min(len(cached), len(tokens))
+                different = np.flatnonzero(cached[:size] != tokens[:size])
+                length = int(different[0]) if len(different) else size
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is None or best_length < self.min_tokens:
+                self.misses += 1
+                return 0, None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            self.reused_tokens += best_length
+            cache = self.entries[best_key][1]
+        return best_length, tuple(
+            (keys[:, :, :best_length], values[:, :, :best_length])
+            for keys, values in cache
+        )
+
+    def put(self, token_ids: List[int], cache: KVCache) -> None:
+        """
+        Caches the key/value states of a prompt, dropping the cached prompts it extends, and evicts the least recently
+        used prompts beyond `max_bytes`.
+
+        Args:
+            token_ids (List[int]): The token ids of the prompt.
+            cache (KVCache): The key/value states of its positions, for a batch of one.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        size = self._size(cache)
+        if len(token_ids) < self.min_tokens or size > self.max_bytes:
+            return
+        tokens = np.asarray(token_ids, dtype=np.int64)
+        with self._lock:
+            for key, (cached, _, cached_size) in list(self.entries.items()):
+                if len(cached) <= len(tokens) and np.array_equal(
+                    cached, tokens[: len(cached)]
+                ):
+                    del self.entries[key]
+                    self.bytes -= cached_size
+            self.entries[self._next_key] = (tokens, cache, size)
+            self._next_key += 1
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def prefill(
+        self,
+        model: torch.nn.Module,
+        token_ids: List[int],
+        cache_length: Optional[int] = None,
+    ) -> Tuple[torch.Tensor, KVCache]:
+        """
+        Runs a prompt through the model, starting from the states of its longest cached prefix, and caches the states
+        of its first `cache_length` tokens. Caching only the part of the prompt that later prompts share, e.g. the
+        instructions and chat history but not the retrieved context and question, keeps the cache from filling up
+        with states no prompt will reuse: with 32 layers of 8 key/value heads of 128 float32 values, as in a 7B
+        model, each token takes 256 KiB.
+
+        Args:
+            model (torch.nn.Module): The causal language model.
+            token_ids (List[int]): The token ids of the prompt.
+            cache_length (Optional[int]): The number of tokens whose states are cached. Defaults to the whole prompt.
+
+        Returns:
+            Tuple[torch.Tensor, KVCache]: The logits of the last position, and the key/value states of the prompt.
+        """
+        length, past_key_values = self.lookup(token_ids)
+        outputs = model(
+            input_ids=torch.tensor([token_ids[length:]], device=model_device(model)),
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        cache = tuple(tuple(layer) for layer in outputs.past_key_values)
+        if cache_length is None or cache_length >= len(token_ids):
+            self.put(token_ids, cache)  # type: ignore[arg-type]
+        elif cache_length >= self.min_tokens:
+            # The states are copied, so that the cache does not hold on to those of the whole prompt.
+            self.put(
+                token_ids[:cache_length],
+                tuple(
+                    (
+                        keys[:, :, :cache_length].clone(),
+                        values[:, :, :cache_length].clone(),
+                    )
+                    for keys, values in cache
+                ),
+            )
+        with self._lock:
+            self.prefill_tokens += len(token_ids) - length
+        return outputs.logits[0, -1], cache  # type: ignore[return-value]
+
+    def invalidate(self) -> None:
+        """
+        Drops every cached prompt.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports the cache counters, to measure how much prefill the cache saves.
+
+        Returns:
+            Dict[str, float]: The hits, misses, hit rate, number of reused and of computed prompt tokens, number of
+            cached prompts and their size in bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "reused_tokens": self.reused_tokens,
+            "prefill_tokens": self.prefill_tokens,
+            "cached_prompts": len(self.entries),
+            "cached_bytes": self.bytes,
+        }
@@ -0,0 +1,42 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+# Default chat prompt setup for conversation interactions. The chat history comes before the retrieved context, so
+# that the prompts of a session start with the same instructions and history and their key/value states can be
+# reused by a local model from one question to the next, up to `prefix_boundary(DEFAULT_PROMPT)`.
+DEFAULT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "human",
+            "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to "
+            "answer the question. If you don't know the answer, just say that you don't know. Cite the sources or "
+            "context through which you are answering the question. You are free to answer the questions of user that "
+            "pertains to chatbot-domain like greetings, salutation etc., for these questions or answers don't use "
+            "the context or provide the sources use your own ability as assistant. Keep your answer concise and stick "
+            "to the question and if required to the sources and again if required to the chat history."
+            "Chat History: {history} \n Context: {context} \n Question: {question}"
+            "\n Answer:",
+        ),
+    ]
+)
+
+
+def prefix_boundary(prompt: ChatPromptTemplate, variable: str = "context") -> str:
+    """
+    Finds the text of a prompt template after which the prompts of a session differ from one question to the next,
+    i.e. the literal text between the placeholder of `variable` and the placeholder before it. Raises a ValueError if
+    no message of the template has the placeholder.
+
+    Args:
+        prompt (ChatPromptTemplate): The chat prompt template.
+        variable (str): The first variable of the template changing with every question.
+
+    Returns:
+        str: The text just before the placeholder of the variable.
+    """
+    placeholder = "{" + variable + "}"
+    for message in prompt.messages:
+        template = getattr(getattr(message, "prompt", None), "template", None)
+        if isinstance(template, str) and placeholder in template:
+            before = template.split(placeholder, 1)[0]
+            return before[before.rfind("}") + 1 :]
+    raise ValueError(f"The prompt template has no {placeholder} placeholder")
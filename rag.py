@@ -1,80 +1,263 @@
-from operator import itemgetter
-from typing import Dict, List
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
 
+import numpy as np
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.documents import Document
-from langchain_core.messages import BaseMessage
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_core.runnables import ConfigurableFieldSpec, RunnablePassthrough
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import (
+    ConfigurableFieldSpec,
+    Runnable,
+    RunnableConfig,
+    RunnableLambda,
+    RunnablePassthrough,
+)
 from langchain_core.runnables.base import RunnableBindingBase
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.vectorstores import VectorStoreRetriever
 
+from chat_history import HistoryStore
 from chat_model import ChatModel
+from context_packer import ContextPacker
+from prompts import DEFAULT_PROMPT
+from reranker import Reranker
 
-# Default chat prompt setup for conversation interactions.
-DEFAULT_PROMPT = ChatPromptTemplate.from_messages(
-    [
-        (
-            "human",
-            "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to "
-            "answer the question. If you don't know the answer, just say that you don't know. Cite the sources or "
-            "context through which you are answering the question. You are free to answer the questions of user that "
-            "pertains to chatbot-domain like greetings, salutation etc., for these questions or answers don't use "
-            "the context or provide the sources use your own ability as assistant. Keep your answer concise and stick "
-            "to the question and if required to the sources and again if required to the chat history."
-            "Context: {context} \n Chat History: {history} \n Question: {question}"
-            "\n Answer:",
-        ),
-    ]
-)
 
+class SemanticCache:
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_items: int = 1000,
+    ) -> None:
+        """
+        Initializes a cache of answers keyed on the meaning of the question: a question is answered from the cache
+        when a past question is close enough in embedding space, the same context was retrieved for both and they
+        were asked after the same chat history, since the cache is shared by every session. The embeddings of the
+        past questions are rows of a matrix of `max_items` rows, and a question is only compared, in one
+        matrix-vector product, with the past questions of the same fingerprint.
+
+        Args:
+            embeddings (Embeddings): The embeddings model used to embed the questions.
+            threshold (float): The minimum cosine similarity between two questions for one to reuse the answer of
+                the other.
+            ttl (float): The number of seconds an answer stays valid.
+            max_items (int): The maximum number of answers kept, the least recently used ones being evicted first.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self.vectors: Optional[np.ndarray] = None
+        # The fingerprint, answer and time of the answer in each used row, least recently used first.
+        self.entries: OrderedDict[int, Tuple[str, str, float]] = OrderedDict()
+        # The time of the answer in each used row, oldest first, to expire them in order.
+        self.times: OrderedDict[int, float] = OrderedDict()
+        self.rows: Dict[str, List[int]] = {}
+        self.free: List[int] = []
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def fingerprint(docs: List[Document], history: Sequence[BaseMessage] = ()) -> str:
+        """
+        Computes the fingerprint of a retrieved context and of the chat history preceding the question, so that an
+        answer is only reused for the same context in the same conversation, e.g. a follow-up question referring to
+        earlier turns is not answered with the answer written for another conversation.
+
+        Args:
+            docs (List[Document]): The retrieved documents.
+            history (Sequence[BaseMessage]): The chat history the answer is conditioned on.
+
+        Returns:
+            str: The hexadecimal SHA-256 of the documents, in retrieval order, and of the history.
+        """
+        digest = hashlib.sha256()
+        for doc in docs:
+            digest.update(doc.page_content.encode("utf-8"))
+            digest.update(b"\0")
+        digest.update(b"\1")
+        for message in history:
+            digest.update(f"{message.type}:{message.content}".encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        """
+        Scales a vector to unit length, so that inner products are cosine similarities.
+
+        Args:
+            vector (List[float]): The vector to normalize.
+
+        Returns:
+            np.ndarray: The normalized vector.
+        """
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def embed_query(self, question: str) -> np.ndarray:
+        """
+        Embeds a question.
+
+        Args:
+            question (str): The question to embed.
+
+        Returns:
+            np.ndarray: The normalized embedding of the question.
+        """
+        return self._normalize(self.embeddings.embed_query(question))
+
+    async def aembed_query(self, question: str) -> np.ndarray:
+        """
+        Asynchronously embeds a question.
 
-class InMemoryHistory(BaseChatMessageHistory, BaseModel):
-    """In memory implementation of chat message history."""
+        Args:
+            question (str): The question to embed.
 
-    messages: List[BaseMessage] = Field(default_factory=list)
+        Returns:
+            np.ndarray: The normalized embedding of the question.
+        """
+        return self._normalize(await self.embeddings.aembed_query(question))
+
+    def lookup(self, vector: np.ndarray, fingerprint: str) -> Optional[str]:
+        """
+        Looks up the answer of the most similar past question above the threshold that had the same context.
+
+        Args:
+            vector (np.ndarray): The normalized embedding of the question.
+            fingerprint (str): The fingerprint of the context retrieved for the question.
 
-    def add_message(self, message: BaseMessage) -> None:
-        """Add a self-created message to the store
+        Returns:
+            Optional[str]: The cached answer, or None on a miss.
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self.times and now - next(iter(self.times.values())) > self.ttl:
+                self._remove(next(iter(self.times)))
+            rows = self.rows.get(fingerprint)
+            if rows and self.vectors is not None:
+                similarities = self.vectors[rows] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.entries.move_to_end(rows[best])
+                    self.hits += 1
+                    return self.entries[rows[best]][1]
+            self.misses += 1
+            return None
+
+    def _remove(self, row: int) -> None:
+        """
+        Drops the answer in a row, which is reused by the next answer stored. Must be called with the lock held.
 
         Args:
-            message (BaseMessage):
+            row (int): The row of the answer.
 
         Returns:
             None: Returns NoneType object
         """
-        self.messages.append(message)
+        fingerprint = self.entries.pop(row)[0]
+        del self.times[row]
+        self.rows[fingerprint].remove(row)
+        if not self.rows[fingerprint]:
+            del self.rows[fingerprint]
+        self.free.append(row)
+
+    def put(self, vector: np.ndarray, fingerprint: str, answer: str) -> None:
+        """
+        Stores the answer to a question, evicting the least recently used answer if the cache holds `max_items`.
 
-    def clear(self) -> None:
+        Args:
+            vector (np.ndarray): The normalized embedding of the question.
+            fingerprint (str): The fingerprint of the context retrieved for the question.
+            answer (str): The answer to the question.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        with self._lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_items, len(vector)), dtype=np.float32)
+                self.free = list(range(self.max_items - 1, -1, -1))
+            if not self.free:
+                self._remove(next(iter(self.entries)))
+            row = self.free.pop()
+            now = time.monotonic()
+            self.vectors[row] = vector
+            self.entries[row] = (fingerprint, answer, now)
+            self.times[row] = now
+            self.rows.setdefault(fingerprint, []).append(row)
+
+    def invalidate(self) -> None:
         """
-        Clears all messages stored in the history.
+        Drops every cached answer, e.g. when documents are added to the vector store.
 
         Returns:
             None: Returns NoneType object
+        """
+        with self._lock:
+            self.vectors = None
+            self.entries.clear()
+            self.times.clear()
+            self.rows.clear()
+            self.free = []
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports the cache counters, to measure how many generations the cache saves.
 
+        Returns:
+            Dict[str, float]: The hits, misses, hit rate and number of cached answers.
         """
-        self.messages = []
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cached_answers": len(self.entries),
+        }
 
 
 class RagChain:
     def __init__(
         self,
-        retriever: VectorStoreRetriever,
+        retriever: BaseRetriever,
         chat_model: ChatModel,
         session_id: str,
         prompt: ChatPromptTemplate = DEFAULT_PROMPT,
+        semantic_cache: Optional[SemanticCache] = None,
+        context_packer: Optional[ContextPacker] = None,
+        history_store: Optional[HistoryStore] = None,
+        reranker: Optional[Reranker] = None,
     ) -> None:
         """
         Initializes the RagChain with necessary components.
 
         Args:
-            retriever (VectorStoreRetriever): The component for retrieving relevant documents based on input queries.
+            retriever (BaseRetriever): The component for retrieving relevant documents based on input queries.
             chat_model (ChatModel): The chat model used for processing and generating chat responses.
             session_id (str): The chat session id which will be used to track memory.
             prompt (ChatPromptTemplate): The prompt template to use for generating chat prompts.
+            semantic_cache (Optional[SemanticCache]): The cache answering questions similar to past ones without
+                generating. If None, every question is answered by the chat model.
+            context_packer (Optional[ContextPacker]): The packer fitting the retrieved context and the chat history
+                into a token budget. If None, every retrieved document and the whole history go into the prompt.
+            history_store (Optional[HistoryStore]): The store of the chat history of each session. Defaults to a
+                store with the default session and message caps.
+            reranker (Optional[Reranker]): The cross-encoder reordering the retrieved documents and keeping the most
+                relevant ones. If None, the documents are used in retrieval order.
 
         Returns:
             None: Returns NoneType object
@@ -83,8 +266,11 @@ class RagChain:
         self.retriever = retriever
         self.chat_model = chat_model
         self.prompt = prompt
-        self.store: Dict[str, BaseChatMessageHistory] = {}
+        self.store = history_store if history_store is not None else HistoryStore()
         self.session_id = session_id
+        self.semantic_cache = semantic_cache
+        self.context_packer = context_packer
+        self.reranker = reranker
 
     def get_session_history(self, session_id: str) -> BaseChatMessageHistory:
         """
@@ -97,9 +283,12 @@ class RagChain:
             BaseChatMessageHistory: The chat history associated with the session ID.
 
         """
-        if session_id not in self.store:
-            self.store[session_id] = InMemoryHistory()
-        return self.store[session_id]
+        try:
+            return self.store[session_id]
+        except KeyError:
+            history = self.store.new_history(session_id)
+            self.store[session_id] = history
+            return history
 
     @staticmethod
     def format_docs(docs: List[Document]) -> str:
@@ -115,6 +304,60 @@ class RagChain:
         """
         return "\n\n".join(doc.page_content for doc in docs)
 
+    def retrieve(self, inputs: Dict[str, Any]) -> List[Document]:
+        """
+        Retrieves the documents relevant to a question and reranks them, unless they were already retrieved.
+
+        Args:
+            inputs (Dict[str, Any]): The chain inputs: the `question`, and the already retrieved `docs` if any.
+
+        Returns:
+            List[Document]: The documents relevant to the question.
+
+        """
+        if "docs" in inputs:
+            return inputs["docs"]
+        docs = self.retriever.invoke(inputs["question"])
+        if self.reranker is not None:
+            docs = self.reranker.rerank(inputs["question"], docs)
+        return docs
+
+    async def aretrieve(self, inputs: Dict[str, Any]) -> List[Document]:
+        """
+        Asynchronously retrieves the documents relevant to a question and reranks them, unless they were already
+        retrieved.
+
+        Args:
+            inputs (Dict[str, Any]): The chain inputs: the `question`, and the already retrieved `docs` if any.
+
+        Returns:
+            List[Document]: The documents relevant to the question.
+
+        """
+        if "docs" in inputs:
+            return inputs["docs"]
+        docs = await self.retriever.ainvoke(inputs["question"])
+        if self.reranker is not None:
+            docs = await self.reranker.arerank(inputs["question"], docs)
+        return docs
+
+    def pack_inputs(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Packs the retrieved documents and the chat history of the chain inputs into the token budget of the context
+        packer.
+
+        Args:
+            inputs (Dict[str, Any]): The chain inputs: the `question`, the retrieved `docs` and the `history`.
+
+        Returns:
+            Dict[str, Any]: The inputs with the packed `context` and `history`.
+
+        """
+        context, history = self.context_packer.pack(  # type: ignore[union-attr]
+            inputs["question"], inputs["docs"], inputs["history"]
+        )
+        return {**inputs, "context": context, "history": history}
+
     def set_rag_chain(self) -> None:
         """
         Sets up the full retrieval-augmentation-generation chain for handling chat queries.
@@ -122,8 +365,12 @@ class RagChain:
         Returns:
             None: Returns object of NoneType
         """
-        context = itemgetter("question") | self.retriever | self.format_docs
-        first_step = RunnablePassthrough.assign(context=context)
+        docs = RunnableLambda(self.retrieve, afunc=self.aretrieve)
+        first_step: Runnable
+        if self.context_packer is None:
+            first_step = RunnablePassthrough.assign(context=docs | self.format_docs)
+        else:
+            first_step = RunnablePassthrough.assign(docs=docs) | self.pack_inputs
         rag_chain = (
             first_step
             | self.prompt
@@ -161,9 +408,117 @@ class RagChain:
             self.set_rag_chain()
         return self.rag_chain
 
+    def add_cached_answer(self, text: str, answer: str) -> None:
+        """
+        Records a question answered from the semantic cache in the session history, as the chain would have.
+
+        Args:
+            text (str): The question.
+            answer (str): The cached answer.
+
+        Returns:
+            None: Returns NoneType object
+        """
+        self.get_session_history(self.session_id).add_messages(
+            [HumanMessage(content=text), AIMessage(content=answer)]
+        )
+
+    def fingerprint(self, cache: SemanticCache, docs: List[Document]) -> str:
+        """
+        Computes the semantic cache fingerprint of a question of the session, from its retrieved documents and the
+        chat history of the session.
+
+        Args:
+            cache (SemanticCache): The semantic cache.
+            docs (List[Document]): The documents retrieved for the question.
+
+        Returns:
+            str: The fingerprint of the context and the history.
+        """
+        return cache.fingerprint(
+            docs, self.get_session_history(self.session_id).messages
+        )
+
     def query(self, text: str) -> str:
         """
-        Processes an input text query through the RAG chain and returns a response.
+        Processes an input text query through the RAG chain and returns a response. With a semantic cache, the
+        documents are retrieved first and the answer to a similar past question with the same context is reused.
+
+        Args:
+            text (str): The input query text to process.
+
+        Returns:
+            str: The generated response based on the input text and retrieved context.
+
+        """
+        config: RunnableConfig = {"configurable": {"session_id": self.session_id}}
+        if self.semantic_cache is None:
+            return self.get_rag_chain().invoke({"question": text}, config=config)
+        docs = self.retrieve({"question": text})
+        vector = self.semantic_cache.embed_query(text)
+        fingerprint = self.fingerprint(self.semantic_cache, docs)
+        answer = self.semantic_cache.lookup(vector, fingerprint)
+        if answer is not None:
+            self.add_cached_answer(text, answer)
+            return answer
+        answer = self.get_rag_chain().invoke(
+            {"question": text, "docs": docs}, config=config
+        )
+        self.semantic_cache.put(vector, fingerprint, answer)
+        return answer
+
+    def stream(self, text: str) -> Iterator[str]:
+        """
+        Processes an input text query through the RAG chain and yields the response as the chat model generates it.
+        The full response is added to the session history once generation ends. A cached answer is yielded at once.
+
+        Args:
+            text (str): The input query text to process.
+
+        Returns:
+            Iterator[str]: The chunks of the generated response, in order.
+
+        """
+        config: RunnableConfig = {"configurable": {"session_id": self.session_id}}
+        if self.semantic_cache is None:
+            return self.get_rag_chain().stream({"question": text}, config=config)
+        return self._stream_cached(text, config, self.semantic_cache)
+
+    def _stream_cached(
+        self, text: str, config: RunnableConfig, cache: SemanticCache
+    ) -> Iterator[str]:
+        """
+        Streams the response to a question through the semantic cache, see `stream`.
+
+        Args:
+            text (str): The input query text to process.
+            config (RunnableConfig): The configuration of the chain run.
+            cache (SemanticCache): The semantic cache.
+
+        Returns:
+            Iterator[str]: The chunks of the generated response, in order.
+
+        """
+        docs = self.retrieve({"question": text})
+        vector = cache.embed_query(text)
+        fingerprint = self.fingerprint(cache, docs)
+        answer = cache.lookup(vector, fingerprint)
+        if answer is not None:
+            self.add_cached_answer(text, answer)
+            yield answer
+            return
+        chunks = []
+        for chunk in self.get_rag_chain().stream(
+            {"question": text, "docs": docs}, config=config
+        ):
+            chunks.append(chunk)
+            yield chunk
+        cache.put(vector, fingerprint, "".join(chunks))
+
+    async def aquery(self, text: str) -> str:
+        """
+        Asynchronously processes an input text query through the RAG chain, so that one event loop can serve many
+        sessions while they wait on the vector store and the chat model. The semantic cache is used as in `query`.
 
         Args:
             text (str): The input query text to process.
@@ -172,6 +527,67 @@ class RagChain:
             str: The generated response based on the input text and retrieved context.
 
         """
-        return self.get_rag_chain().invoke(
-            {"question": text}, config={"configurable": {"session_id": self.session_id}}
+        config: RunnableConfig = {"configurable": {"session_id": self.session_id}}
+        if self.semantic_cache is None:
+            return await self.get_rag_chain().ainvoke({"question": text}, config=config)
+        docs = await self.aretrieve({"question": text})
+        vector = await self.semantic_cache.aembed_query(text)
+        fingerprint = self.fingerprint(self.semantic_cache, docs)
+        answer = self.semantic_cache.lookup(vector, fingerprint)
+        if answer is not None:
+            self.add_cached_answer(text, answer)
+            return answer
+        answer = await self.get_rag_chain().ainvoke(
+            {"question": text, "docs": docs}, config=config
         )
+        self.semantic_cache.put(vector, fingerprint, answer)
+        return answer
+
+    def astream(self, text: str) -> AsyncIterator[str]:
+        """
+        Asynchronously processes an input text query through the RAG chain and yields the response as the chat model
+        generates it. The full response is added to the session history once generation ends. A cached answer is
+        yielded at once.
+
+        Args:
+            text (str): The input query text to process.
+
+        Returns:
+            AsyncIterator[str]: The chunks of the generated response, in order.
+
+        """
+        config: RunnableConfig = {"configurable": {"session_id": self.session_id}}
+        if self.semantic_cache is None:
+            return self.get_rag_chain().astream({"question": text}, config=config)
+        return self._astream_cached(text, config, self.semantic_cache)
+
+    async def _astream_cached(
+        self, text: str, config: RunnableConfig, cache: SemanticCache
+    ) -> AsyncIterator[str]:
+        """
+        Asynchronously streams the response to a question through the semantic cache, see `astream`.
+
+        Args:
+            text (str): The input query text to process.
+            config (RunnableConfig): The configuration of the chain run.
+            cache (SemanticCache): The semantic cache.
+
+        Returns:
+            AsyncIterator[str]: The chunks of the generated response, in order.
+
+        """
+        docs = await self.aretrieve({"question": text})
+        vector = await cache.aembed_query(text)
+        fingerprint = self.fingerprint(cache, docs)
+        answer = cache.lookup(vector, fingerprint)
+        if answer is not None:
+            self.add_cached_answer(text, answer)
+            yield answer
+            return
+        chunks = []
+        async for chunk in self.get_rag_chain().astream(
+            {"question": text, "docs": docs}, config=config
+        ):
+            chunks.append(chunk)
+            yield chunk
+        cache.put(vector, fingerprint, "".join(chunks))
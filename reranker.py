@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from sentence_transformers import CrossEncoder
+
+
+class Reranker:
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        top_k: int = 6,
+        batch_size: int = 16,
+        time_budget: Optional[float] = 0.3,
+        cache_size: int = 10000,
+    ) -> None:
+        """
+        Initializes a reranker scoring (query, chunk) pairs with a local cross-encoder on CPU, to reorder a candidate
+        pool retrieved by embedding similarity. Candidates are scored in batches, in retrieval order, until the time
+        budget runs out, and the scores of pairs seen recently are reused.
+
+        Args:
+            model_name (str): The Hugging Face name of the cross-encoder.
+            top_k (int): The number of documents returned.
+            batch_size (int): The number of pairs scored per forward pass.
+            time_budget (Optional[float]): The number of seconds reranking may take. Once the next batch would not
+                fit, the remaining candidates keep their retrieval order after the scored ones. The first batch is
+                always scored. If None, every candidate is scored.
+            cache_size (int): The number of pair scores kept.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.model_name = model_name
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.cache_size = cache_size
+        self.model: Optional[CrossEncoder] = None
+        self._scores: OrderedDict[bytes, float] = OrderedDict()
+        self._lock = Lock()
+
+    def set_model(self) -> None:
+        """
+        Loads the cross-encoder on CPU.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.model = CrossEncoder(self.model_name, device="cpu")
+
+    def get_model(self) -> CrossEncoder:
+        """
+        Retrieves or lazily loads the cross-encoder.
+
+        Returns:
+            CrossEncoder: The cross-encoder scoring the pairs.
+        """
+        if self.model is None:
+            self.set_model()
+        return self.model
+
+    @staticmethod
+    def _key(query: str, text: str) -> bytes:
+        """
+        Computes the cache key of a pair, a digest rather than the texts so that cached chunks take little memory.
+
+        Args:
+            query (str): The query.
+            text (str): The text of the chunk.
+
+        Returns:
+            bytes: The key of the pair.
+        """
+        return hashlib.sha256(f"{query}\0{text}".encode("utf-8")).digest()
+
+    def score(self, query: str, docs: Sequence[Document]) -> List[Optional[float]]:
+        """
+        Scores the relevance of each document to the query, reusing cached scores and scoring the others in batches
+        within the time budget.
+
+        Args:
+            query (str): The query.
+            docs (Sequence[Document]): The candidate documents, in retrieval order.
+
+        Returns:
+            List[Optional[float]]: The score of each document, None for those left unscored by the time budget.
+        """
+        start = time.perf_counter()
+        keys = [self._key(query, doc.page_content) for doc in docs]
+        scores: Dict[bytes, float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+        batch_seconds = 0.0
+        for offset in range(0, len(missing), self.batch_size):
+            now = time.perf_counter()
+            if (
+                offset
+                and self.time_budget is not None
+                and now + batch_seconds > start + self.time_budget
+            ):
+                break
+            batch = missing[offset : offset + self.batch_size]
+            predictions = self.get_model().predict(
+                [(query, docs[i].page_content) for i in batch],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            batch_seconds = time.perf_counter() - now
+            with self._lock:
+                for i, prediction in zip(batch, predictions):
+                    scores[keys[i]] = self._scores[keys[i]] = float(prediction)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return [scores.get(key) for key in keys]
+
+    def rerank(self, query: str, docs: Sequence[Document]) -> List[Document]:
+        """
+        Reorders candidate documents by cross-encoder score and keeps the `top_k` best. Scored documents come first,
+        with their score in the `relevance_score` metadata, followed by the unscored ones in retrieval order.
+
+        Args:
+            query (str): The query.
+            docs (Sequence[Document]): The candidate documents, in retrieval order.
+
+        Returns:
+            List[Document]: The `top_k` most relevant documents, best first.
+        """
+        scores = self.score(query, docs)
+        scored = sorted(
+            (i for i, score in enumerate(scores) if score is not None),
+            key=lambda i: -scores[i],  # type: ignore[operator]
+        )
+        unscored = [i for i, score in enumerate(scores) if score is None]
+        reranked: List[Document] = []
+        for i in (scored + unscored)[: self.top_k]:
+            metadata = dict(docs[i].metadata)
+            if scores[i] is not None:
+                metadata["relevance_score"] = scores[i]
+            reranked.append(
+                Document(page_content=docs[i].page_content, metadata=metadata)
+            )
+        return reranked
+
+    async def arerank(self, query: str, docs: Sequence[Document]) -> List[Document]:
+        """
+        Reranks documents in a worker thread, so that the CPU-bound inference does not block the event loop.
+
+        Args:
+            query (str): The query.
+            docs (Sequence[Document]): The candidate documents, in retrieval order.
+
+        Returns:
+            List[Document]: The `top_k` most relevant documents, best first.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.rerank, query, docs)
@@ -0,0 +1,82 @@
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class ResourceRegistry:
+    def __init__(self) -> None:
+        """
+        Initializes a registry of the components shared by every session of the process, such as the chat model,
+        its tokenizer, the embeddings model and the vector store, so that they are built once rather than for each
+        browser tab. Each component is built by the first session needing it, while the others needing it wait for
+        it instead of building their own.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.resources: Dict[str, Any] = {}
+        self.build_seconds: Dict[str, float] = {}
+        self.reused = 0
+        self._locks: Dict[str, Lock] = {}
+        self._lock = Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.resources
+
+    def get(self, name: str, factory: Callable[[], T]) -> T:
+        """
+        Retrieves a shared component, building it on first use.
+
+        Args:
+            name (str): The name of the component.
+            factory (Callable[[], T]): Builds the component. It may get other components from the registry, but not
+                the one it builds.
+
+        Returns:
+            T: The shared component.
+        """
+        if name in self.resources:
+            self.reused += 1
+            return self.resources[name]
+        with self._lock:
+            lock = self._locks.setdefault(name, Lock())
+        with lock:
+            if name in self.resources:
+                self.reused += 1
+            else:
+                start = time.perf_counter()
+                self.resources[name] = factory()
+                self.build_seconds[name] = time.perf_counter() - start
+        return self.resources[name]
+
+    def clear(self) -> None:
+        """
+        Drops every component, so that the next sessions build new ones, e.g. after a configuration change.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            self.resources.clear()
+            self.build_seconds.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports how many components were built and reused, and how long building them took.
+
+        Returns:
+            Dict[str, float]: The number of components, of lookups served by an existing component, and the total
+            build time in seconds.
+        """
+        return {
+            "resources": len(self.resources),
+            "reused": self.reused,
+            "build_seconds": sum(self.build_seconds.values()),
+        }
+
+
+# The registry of the process. Streamlit reruns the script of the app for each interaction but keeps imported modules,
+# so this registry outlives reruns and is shared by every session.
+registry = ResourceRegistry()
@@ -1,7 +1,313 @@
-from typing import Any, Dict, List, Optional
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from langchain_core.documents import Document
-from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from bm25 import BM25Index
+from embeddings import embed_queries
+from manifest import IndexManifest
+
+
+class CachedResult(NamedTuple):
+    """Retrieval result kept by the cache: the chunk ids and scores, and the index generation it was computed at."""
+
+    hits: Tuple[Tuple[str, Optional[float]], ...]
+    generation: int
+    created: float
+
+
+class RetrievalCache:
+    def __init__(
+        self,
+        max_items: int = 1000,
+        ttl: Optional[float] = 300.0,
+        generation: Callable[[], int] = lambda: 0,
+    ) -> None:
+        """
+        Initializes a cache of retrieval results keyed by the normalized query and the search settings. Results are
+        kept as chunk ids and scores, and each chunk is stored once however many results contain it. Every result is
+        tagged with the index generation current when its retrieval started, and is not served once the generation
+        has moved on, so that results never predate the content of the index.
+
+        Args:
+            max_items (int): The maximum number of results kept, the least recently used ones being evicted first.
+            ttl (Optional[float]): The number of seconds a result is served, which bounds staleness against changes
+                the generation does not track, such as other processes writing to the vector store. If None, results
+                are kept until evicted or outdated.
+            generation (Callable[[], int]): Returns the current generation of the index, e.g. that of the Indexer.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        self.max_items = max_items
+        self.ttl = ttl
+        self.generation = generation
+        self.results: OrderedDict[str, CachedResult] = OrderedDict()
+        self.docs: Dict[str, Tuple[Document, int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def key(query: str, search_type: str, search_kwargs: Dict[str, Any]) -> str:
+        """
+        Builds the cache key of a retrieval, ignoring case and whitespace differences in the query.
+
+        Args:
+            query (str): The search query.
+            search_type (str): The type of search.
+            search_kwargs (Dict[str, Any]): The search settings.
+
+        Returns:
+            str: The cache key.
+        """
+        normalized = " ".join(query.casefold().split())
+        return json.dumps(
+            [normalized, search_type, search_kwargs], sort_keys=True, default=str
+        )
+
+    def _drop(self, key: str) -> None:
+        """
+        Drops a result, and the chunks no other result refers to.
+
+        Args:
+            key (str): The cache key of the result.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        for chunk_id, _ in self.results.pop(key).hits:
+            doc, refs = self.docs[chunk_id]
+            if refs == 1:
+                del self.docs[chunk_id]
+            else:
+                self.docs[chunk_id] = (doc, refs - 1)
+
+    def get(self, key: str) -> Optional[List[Document]]:
+        """
+        Looks up a retrieval result.
+
+        Args:
+            key (str): The cache key of the retrieval.
+
+        Returns:
+            Optional[List[Document]]: The documents, with their score in the `relevance_score` metadata if they had
+            one, or None on a miss.
+        """
+        with self._lock:
+            result = self.results.get(key)
+            if result is not None and (
+                result.generation != self.generation()
+                or (
+                    self.ttl is not None
+                    and time.monotonic() - result.created > self.ttl
+                )
+            ):
+                self._drop(key)
+                result = None
+            if result is None:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            docs = []
+            for chunk_id, score in result.hits:
+                doc = self.docs[chunk_id][0]
+                metadata = dict(doc.metadata)
+                if score is not None:
+                    metadata["relevance_score"] = score
+                docs.append(Document(page_content=doc.page_content, metadata=metadata))
+            return docs
+
+    def put(self, key: str, docs: List[Document], generation: int) -> None:
+        """
+        Stores a retrieval result, evicting the least recently used results beyond `max_items`.
+
+        Args:
+            key (str): The cache key of the retrieval.
+            docs (List[Document]): The retrieved documents.
+            generation (int): The index generation read before the retrieval started.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        hits = []
+        with self._lock:
+            if key in self.results:
+                self._drop(key)
+            for doc in docs:
+                metadata = dict(doc.metadata)
+                score = metadata.pop("relevance_score", None)
+                chunk_id = IndexManifest.chunk_id(doc.page_content)
+                stored, refs = self.docs.get(chunk_id, (None, 0))
+                if stored is None:
+                    stored = Document(page_content=doc.page_content, metadata=metadata)
+                self.docs[chunk_id] = (stored, refs + 1)
+                hits.append((chunk_id, score))
+            self.results[key] = CachedResult(tuple(hits), generation, time.monotonic())
+            while len(self.results) > self.max_items:
+                self._drop(next(iter(self.results)))
+
+    def invalidate(self) -> None:
+        """
+        Drops every cached result.
+
+        Returns:
+            None: Returns object of NoneType
+        """
+        with self._lock:
+            self.results.clear()
+            self.docs.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Reports the cache counters, to measure how many retrievals the cache saves.
+
+        Returns:
+            Dict[str, float]: The hits, misses, hit rate, number of cached results and of distinct cached chunks.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cached_results": len(self.results),
+            "cached_docs": len(self.docs),
+        }
+
+
+class CachedRetriever(BaseRetriever):
+    """Serves retrievals from a `RetrievalCache`, and retrieves and caches the misses with the wrapped retriever."""
+
+    retriever: BaseRetriever
+    cache: RetrievalCache
+    search_type: str
+    search_kwargs: Dict[str, Any]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = self.cache.key(query, self.search_type, self.search_kwargs)
+        docs = self.cache.get(key)
+        if docs is None:
+            # The generation is read first, so that a result overlapping a change of the index is never served.
+            generation = self.cache.generation()
+            docs = self.retriever.invoke(
+                query, config={"callbacks": run_manager.get_child()}
+            )
+            self.cache.put(key, docs, generation)
+        return docs
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = self.cache.key(query, self.search_type, self.search_kwargs)
+        docs = self.cache.get(key)
+        if docs is None:
+            generation = self.cache.generation()
+            docs = await self.retriever.ainvoke(
+                query, config={"callbacks": run_manager.get_child()}
+            )
+            self.cache.put(key, docs, generation)
+        return docs
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves documents with both a vector retriever and a BM25 index, and fuses the two rankings with weighted
+    reciprocal rank fusion, so that exact matches on rare terms such as part numbers rank high even when their
+    embedding is not close to the query. A `filter` of metadata values applies to the BM25 hits, the vector
+    retriever being given the same filter in its own search settings.
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_index: BM25Index
+    filter: Optional[Dict[str, Any]] = None
+    k: int = 6
+    fetch_k: int = 20
+    rrf_k: int = 60
+    lexical_weight: float = 1.0
+
+    def fuse(
+        self, vector_docs: Sequence[Document], lexical_docs: Sequence[Document]
+    ) -> List[Document]:
+        """
+        Fuses two rankings, scoring each document by the sum over the rankings of `weight / (rrf_k + rank)`.
+        Documents are identified by their text, from which their chunk id is derived.
+
+        Args:
+            vector_docs (Sequence[Document]): The documents found by the vector retriever, best first.
+            lexical_docs (Sequence[Document]): The documents found by the BM25 index, best first.
+
+        Returns:
+            List[Document]: The `k` best documents of the fused ranking.
+        """
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for ranking, weight in (
+            (vector_docs, 1.0),
+            (lexical_docs, self.lexical_weight),
+        ):
+            for rank, doc in enumerate(ranking, 1):
+                docs.setdefault(doc.page_content, doc)
+                scores[doc.page_content] = scores.get(
+                    doc.page_content, 0.0
+                ) + weight / (self.rrf_k + rank)
+        best = sorted(scores, key=lambda text: -scores[text])[: self.k]
+        return [docs[text] for text in best]
+
+    def _lexical_docs(self, query: str) -> List[Document]:
+        """
+        Searches the BM25 index for the `fetch_k` best chunks matching the filter.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            List[Document]: The chunks found, best first.
+        """
+        return [
+            doc
+            for doc, _ in self.lexical_index.search(
+                query, self.fetch_k, filter=self.filter
+            )
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector_docs = self.vector_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return self.fuse(vector_docs, self._lexical_docs(query))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector_docs = await self.vector_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        # The BM25 index is in memory and scored in a few vectorized passes, so it is not worth a thread.
+        return self.fuse(vector_docs, self._lexical_docs(query))
 
 
 class Retriever:
@@ -10,23 +316,33 @@ class Retriever:
         vectorstore: VectorStore,
         search_type: str = "similarity",
         search_kwargs: Optional[Dict[Any, Any]] = None,
+        lexical_index: Optional[BM25Index] = None,
+        cache: Optional[RetrievalCache] = None,
     ) -> None:
         """
         Initializes a Retriever instance with a vector store and search configurations.
 
         Args:
             vectorstore (VectorStore): The vector store to be used for document retrieval.
-            search_type (str): The type of search to be conducted (e.g., 'similarity', 'mmr').
-            search_kwargs (Optional[Dict[Any, Any]]): Additional keyword arguments to influence the search behavior.
+            search_type (str): The type of search to be conducted (e.g., 'similarity', 'mmr'), or 'hybrid' to fuse a
+                similarity search with a BM25 search of `lexical_index`.
+            search_kwargs (Optional[Dict[Any, Any]]): Additional keyword arguments to influence the search behavior,
+                e.g. `ef_search` for a local vector store with an HNSW index. Hybrid search also accepts `fetch_k`,
+                the number of candidates of each search, and `rrf_k` and `lexical_weight`, see `HybridRetriever`.
+            lexical_index (Optional[BM25Index]): The BM25 index of the chunks, required by hybrid search.
+            cache (Optional[RetrievalCache]): The cache of retrieval results. If None, every query is searched.
 
         Returns:
             None: Returns object of NoneType
         """
-        self.retriever = None
+        self.retriever: Optional[BaseRetriever] = None
         if search_kwargs is None:
-            self.search_kwargs = {"k": 6}
+            search_kwargs = {"k": 6}
+        self.search_kwargs = search_kwargs
         self.search_type = search_type
         self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.cache = cache
 
     def set_retriever(
         self,
@@ -47,16 +363,45 @@ class Retriever:
             self.search_type = search_type
         if search_kwargs is not None:
             self.search_kwargs = search_kwargs
-        self.retriever = self.vectorstore.as_retriever(
-            search_type=self.search_type, search_kwargs=self.search_kwargs
-        )
+        if self.search_type == "hybrid":
+            if self.lexical_index is None:
+                raise ValueError("Hybrid search requires a lexical index")
+            kwargs = dict(self.search_kwargs)
+            hybrid_kwargs = {
+                key: kwargs.pop(key)
+                for key in ("fetch_k", "rrf_k", "lexical_weight")
+                if key in kwargs
+            }
+            k = kwargs.pop("k", 6)
+            fetch_k = hybrid_kwargs.setdefault("fetch_k", max(20, k))
+            retriever: BaseRetriever = HybridRetriever(
+                vector_retriever=self.vectorstore.as_retriever(
+                    search_type="similarity", search_kwargs={**kwargs, "k": fetch_k}
+                ),
+                lexical_index=self.lexical_index,
+                filter=kwargs.get("filter"),
+                k=k,
+                **hybrid_kwargs,
+            )
+        else:
+            retriever = self.vectorstore.as_retriever(
+                search_type=self.search_type, search_kwargs=self.search_kwargs
+            )
+        if self.cache is not None:
+            retriever = CachedRetriever(
+                retriever=retriever,
+                cache=self.cache,
+                search_type=self.search_type,
+                search_kwargs=self.search_kwargs,
+            )
+        self.retriever = retriever
 
-    def get_retriever(self) -> VectorStoreRetriever:
+    def get_retriever(self) -> BaseRetriever:
         """
         Retrieves or initializes the retriever object based on current configuration.
 
         Returns:
-            VectorStoreRetriever: The retriever object ready to be used for document queries.
+            BaseRetriever: The retriever object ready to be used for document queries.
 
         """
         if self.retriever is None:
@@ -75,3 +420,131 @@ class Retriever:
 
         """
         return self.get_retriever().invoke(query)
+
+    async def aretrieve_docs(self, query: str) -> List[Document]:
+        """
+        Asynchronously retrieves documents based on a given query string using the configured retriever.
+
+        Args:
+            query (str): The search query to retrieve relevant documents.
+
+        Returns:
+            List[Document]: A list of Document objects that are relevant to the query.
+
+        """
+        return await self.get_retriever().ainvoke(query)
+
+    def retrieve_docs_batch(
+        self,
+        queries: Sequence[str],
+        k: Optional[Union[int, Sequence[int]]] = None,
+        filters: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+    ) -> List[List[Document]]:
+        """
+        Retrieves the documents of many queries at once. For similarity search, all queries are embedded in one
+        batched call and searched together through the `similarity_search_by_vector_batch` of vector stores that
+        have one, i.e. one matrix product per block of queries for the local store and concurrent searches on pooled
+        connections for Weaviate, or one search by vector per query otherwise. With a retrieval cache, queries are
+        first looked up under the key the cached retriever uses for the same search, and only the misses are embedded
+        and searched, then cached. Other search types run the queries concurrently through the retriever, and its
+        cache.
+
+        Args:
+            queries (Sequence[str]): The search queries.
+            k (Optional[Union[int, Sequence[int]]]): The number of documents of every query, or of each query.
+                Defaults to the `k` of the search settings.
+            filters (Optional[Sequence[Optional[Dict[str, Any]]]]): The metadata filter of each query. Defaults to
+                the `filter` of the search settings.
+
+        Returns:
+            List[List[Document]]: The documents relevant to each query, in query order.
+
+        """
+        if self.search_type != "similarity":
+            if k is not None or filters is not None:
+                raise ValueError(
+                    "Per-query k and filters are only supported by similarity search"
+                )
+            return self.get_retriever().batch(list(queries))
+        search_kwargs = dict(self.search_kwargs)
+        default_k = search_kwargs.pop("k", 4)
+        default_filter = search_kwargs.pop("filter", None)
+        if k is None:
+            k = default_k
+        ks = [k] * len(queries) if isinstance(k, int) else list(k)
+        if filters is None:
+            filters = [default_filter] * len(queries)
+        if len(ks) != len(queries) or len(filters) != len(queries):
+            raise ValueError("k and filters must have one entry per query")
+        results: Dict[int, List[Document]] = {}
+        keys: List[str] = []
+        if self.cache is not None:
+            for i, (query, query_k, query_filter) in enumerate(
+                zip(queries, ks, filters)
+            ):
+                # The settings of the query, as the cached retriever would be configured to search it.
+                query_kwargs = dict(search_kwargs)
+                if "k" in self.search_kwargs or query_k != default_k:
+                    query_kwargs["k"] = query_k
+                if query_filter is not None:
+                    query_kwargs["filter"] = query_filter
+                keys.append(self.cache.key(query, "similarity", query_kwargs))
+                docs = self.cache.get(keys[-1])
+                if docs is not None:
+                    results[i] = docs
+        missing = [i for i in range(len(queries)) if i not in results]
+        if missing:
+            # The generation is read first, so that a result overlapping a change of the index is never served.
+            generation = self.cache.generation() if self.cache is not None else 0
+            for i, docs in zip(
+                missing,
+                self._search_batch(
+                    [queries[i] for i in missing],
+                    [ks[i] for i in missing],
+                    [filters[i] for i in missing],
+                    search_kwargs,
+                ),
+            ):
+                results[i] = docs
+                if self.cache is not None:
+                    self.cache.put(keys[i], docs, generation)
+        return [results[i] for i in range(len(queries))]
+
+    def _search_batch(
+        self,
+        queries: List[str],
+        ks: List[int],
+        filters: List[Optional[Dict[str, Any]]],
+        search_kwargs: Dict[str, Any],
+    ) -> List[List[Document]]:
+        """
+        Embeds queries in one batched call and searches them together, see `retrieve_docs_batch`.
+
+        Args:
+            queries (List[str]): The search queries.
+            ks (List[int]): The number of documents of each query.
+            filters (List[Optional[Dict[str, Any]]]): The metadata filter of each query.
+            search_kwargs (Dict[str, Any]): The other search settings.
+
+        Returns:
+            List[List[Document]]: The documents relevant to each query, in query order.
+        """
+        embeddings = self.vectorstore.embeddings
+        if embeddings is None:
+            raise ValueError(
+                "Batched similarity search requires a vector store with embeddings"
+            )
+        vectors = embed_queries(embeddings, queries)
+        if hasattr(self.vectorstore, "similarity_search_by_vector_batch"):
+            return self.vectorstore.similarity_search_by_vector_batch(
+                vectors, ks, filters, **search_kwargs
+            )
+        return [
+            self.vectorstore.similarity_search_by_vector(
+                vector,
+                k=query_k,
+                **search_kwargs,
+                **({"filter": query_filter} if query_filter else {}),
+            )
+            for vector, query_k, query_filter in zip(vectors, ks, filters)
+        ]
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ann_index import HNSWIndex
+
+
+class TestHNSWIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data = rng.standard_normal((1000, 32)).astype(np.float32)
+        self.data /= np.linalg.norm(self.data, axis=1, keepdims=True)
+        self.queries = rng.standard_normal((50, 32)).astype(np.float32)
+        self.index = HNSWIndex(m=8, ef_construction=64, seed=0)
+
+    def exact(self, query, k):
+        return set(np.argsort(-(self.data @ query))[:k].tolist())
+
+    def recall(self, k, ef_search):
+        hits = 0
+        for query in self.queries:
+            found = self.index.search(self.data, query, k, ef_search=ef_search)
+            hits += len({row for _, row in found} & self.exact(query, k))
+        return hits / (k * len(self.queries))
+
+    def test_recall_grows_with_ef_search(self):
+        self.index.add(self.data, list(range(len(self.data))))
+
+        self.assertEqual(len(self.index), 1000)
+        low, high = self.recall(10, 10), self.recall(10, 200)
+        self.assertGreaterEqual(high, 0.95)
+        self.assertGreaterEqual(high, low)
+
+    def test_incremental_inserts(self):
+        self.index.add(self.data, list(range(500)))
+        self.index.add(self.data, list(range(500, 1000)))
+        query = self.data[750]
+
+        score, row = self.index.search(self.data, query, 1)[0]
+
+        self.assertEqual(row, 750)
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_search_skips_dead_rows(self):
+        self.index.add(self.data, list(range(len(self.data))))
+        alive = np.ones(len(self.data), dtype=bool)
+        alive[7] = False
+
+        found = self.index.search(self.data, self.data[7], 5, alive=alive)
+
+        self.assertNotIn(7, [row for _, row in found])
+        self.assertEqual(len(found), 5)
+
+    def test_search_past_many_dead_rows(self):
+        self.index.add(self.data, list(range(len(self.data))))
+        alive = np.zeros(len(self.data), dtype=bool)
+        alive[::10] = True
+
+        found = self.index.search(self.data, self.queries[0], 10, alive=alive)
+
+        self.assertEqual(len(found), 10)
+        self.assertTrue(all(alive[row] for _, row in found))
+
+    def test_skipped_rows(self):
+        rows = list(range(0, len(self.data), 2))
+        self.index.add(self.data, rows)
+
+        self.assertEqual(self.index.n_nodes, len(rows))
+        found = self.index.search(self.data, self.data[501], 20)
+        self.assertTrue(all(row % 2 == 0 for _, row in found))
+
+    def test_save_and_load(self):
+        self.index.add(self.data, list(range(len(self.data))))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "hnsw.npz")
+            self.index.save(path)
+            loaded = HNSWIndex(m=8)
+            self.assertTrue(loaded.load(path))
+            self.assertFalse(HNSWIndex(m=16).load(path))
+
+        self.assertEqual(loaded.links, self.index.links)
+        self.assertEqual(
+            (loaded.entry_point, loaded.max_level, loaded.n_nodes),
+            (self.index.entry_point, self.index.max_level, self.index.n_nodes),
+        )
+        self.assertEqual(
+            loaded.search(self.data, self.queries[0], 5),
+            self.index.search(self.data, self.queries[0], 5),
+        )
+
+    def test_empty_index(self):
+        self.assertEqual(self.index.search(self.data, self.queries[0], 5), [])
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+
+from langchain_core.documents import Document
+
+from bm25 import BM25Index, tokenize
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.texts = {
+            "a": "The pump fails with error E-1042 when the valve is closed.",
+            "b": "Replace the valve XJ-2000 every year.",
+            "c": "The pump and the valve are cleaned every month.",
+        }
+        self.index.add(
+            list(self.texts),
+            [
+                Document(page_content=text, metadata={"source": chunk_id})
+                for chunk_id, text in self.texts.items()
+            ],
+        )
+
+    def test_tokenize_keeps_compounds(self):
+        self.assertEqual(
+            tokenize("Part XJ-2000, v1.2"),
+            ["part", "xj-2000", "xj", "2000", "v1.2", "v1", "2"],
+        )
+
+    def test_search_ranks_exact_matches(self):
+        results = self.index.search("error e-1042", k=2)
+
+        self.assertEqual(len(results), 1)
+        doc, score = results[0]
+        self.assertEqual(doc.page_content, self.texts["a"])
+        self.assertEqual(doc.metadata, {"source": "a"})
+        self.assertGreater(score, 0)
+        self.assertEqual(
+            [doc.metadata["source"] for doc, _ in self.index.search("xj-2000 valve")][
+                0
+            ],
+            "b",
+        )
+        self.assertEqual(self.index.search("unknown"), [])
+
+    def test_search_filter(self):
+        results = self.index.search("valve", k=3, filter={"source": "b"})
+        self.assertEqual([doc.metadata["source"] for doc, _ in results], ["b"])
+        self.assertEqual(self.index.search("e-1042", filter={"source": "b"}), [])
+
+    def test_add_skips_known_ids(self):
+        self.index.add(["a"], [Document(page_content="other")])
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search("other"), [])
+
+    def test_delete_and_compact(self):
+        self.index.delete(["a"])
+        self.assertNotIn("a", self.index)
+        self.assertEqual(self.index.search("e-1042"), [])
+        self.assertEqual(len(self.index.ids), 3)
+
+        self.index.delete(["b"])
+        # Deleted chunks outnumbered the live one, so the index was rebuilt.
+        self.assertEqual(self.index.ids, ["c"])
+        self.assertEqual(self.index.rows, {"c": 0})
+        self.assertEqual(len(self.index.search("pump valve")), 1)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "bm25")
+            index = BM25Index(path)
+            index.add(
+                list(self.texts),
+                [Document(page_content=text) for text in self.texts.values()],
+            )
+            index.delete(["c"])
+            index.save()
+
+            loaded = BM25Index(path)
+
+            self.assertEqual(loaded.rows, {"a": 0, "b": 1})
+            self.assertNotIn("c", loaded)
+            self.assertEqual(loaded.total_length, index.total_length)
+            self.assertEqual(
+                [(doc.page_content, score) for doc, score in loaded.search("valve")],
+                [(doc.page_content, score) for doc, score in index.search("valve")],
+            )
+            loaded.add(["d"], [Document(page_content="A new valve.")])
+            self.assertEqual(len(loaded.search("valve")), 3)
+
+    def test_deleted_chunks_leave_document_frequency(self):
+        index = BM25Index()
+        index.add(
+            ["a", "b", "c", "d"],
+            [
+                Document(page_content=text)
+                for text in ["valve", "valve", "pump", "pump seal"]
+            ],
+        )
+        index.delete(["a"])
+        fresh = BM25Index()
+        fresh.add(
+            ["b", "c", "d"],
+            [Document(page_content=text) for text in ["valve", "pump", "pump seal"]],
+        )
+
+        self.assertEqual(
+            [score for _, score in index.search("valve")],
+            [score for _, score in fresh.search("valve")],
+        )
+
+    def test_save_replaces_versions_atomically(self):
+        with tempfile.TemporaryDirectory() as path:
+            index = BM25Index(path)
+            index.add(["a"], [Document(page_content="valve")])
+            index.save()
+            index.add(["b"], [Document(page_content="pump")])
+            index.save()
+            mtime = os.path.getmtime(os.path.join(path, "CURRENT"))
+            index.save()
+
+            # Unchanged indexes are not written again, and older versions are removed.
+            self.assertEqual(os.path.getmtime(os.path.join(path, "CURRENT")), mtime)
+            self.assertEqual(sorted(os.listdir(path)), ["CURRENT", "index-2"])
+            # A save interrupted before the switch leaves the previous version in use.
+            os.makedirs(os.path.join(path, "index-3"))
+            with open(os.path.join(path, "index-3", "terms.json"), "w") as f:
+                f.write("[]")
+            loaded = BM25Index(path)
+            self.assertEqual(set(loaded.rows), {"a", "b"})
+            loaded.delete(["a"])
+            loaded.save()
+            self.assertEqual(sorted(os.listdir(path)), ["CURRENT", "index-3"])
+            self.assertEqual(set(BM25Index(path).rows), {"b"})
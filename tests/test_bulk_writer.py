@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import Mock
+
+from langchain_core.documents import Document
+
+from bulk_writer import BulkWriter
+from local_vectorstore import LocalVectorStore
+from tests.test_local_vectorstore import KeywordEmbeddings
+
+
+def make_docs(*texts):
+    return [f"id-{text}" for text in texts], [
+        Document(page_content=text, metadata={"source": text}) for text in texts
+    ]
+
+
+class TestBulkWriter(unittest.TestCase):
+    def setUp(self):
+        self.vectorstore = Mock(name="MockVectorStore")
+        self.vectorstore.embeddings.embed_documents.side_effect = lambda texts: [
+            [1.0] for _ in texts
+        ]
+        self.writer = BulkWriter(self.vectorstore, batch_size=3, max_in_flight=2)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def written_texts(self):
+        return [call.args[1] for call in self.vectorstore.add_vectors.call_args_list]
+
+    def test_batches_span_submits(self):
+        first = self.writer.submit(*make_docs("a", "b"))
+        second = self.writer.submit(*make_docs("c", "d"))
+
+        first.result(timeout=10)
+        self.assertFalse(second.done())
+        self.assertEqual(self.written_texts(), [["a", "b", "c"]])
+        self.assertEqual(self.writer.get_stats()["buffered"], 1)
+
+        self.writer.flush()
+        second.result(timeout=10)
+        self.assertEqual(self.written_texts(), [["a", "b", "c"], ["d"]])
+        add_vectors = self.vectorstore.add_vectors.call_args
+        self.assertEqual(add_vectors.args[0], [[1.0]])
+        self.assertEqual(add_vectors.kwargs["metadatas"], [{"source": "d"}])
+        self.assertEqual(add_vectors.kwargs["ids"], ["id-d"])
+        stats = self.writer.get_stats()
+        self.assertEqual((stats["chunks"], stats["batches"]), (4, 2))
+        self.assertGreater(stats["chunks_per_second"], 0)
+
+    def test_backpressure(self):
+        writer = BulkWriter(self.vectorstore, batch_size=1, max_in_flight=1)
+        started, release = threading.Event(), threading.Event()
+
+        def add_vectors(*args, **kwargs):
+            started.set()
+            release.wait(10)
+
+        self.vectorstore.add_vectors.side_effect = add_vectors
+        writer.submit(*make_docs("a"))
+        started.wait(10)
+        second = threading.Thread(target=writer.submit, args=make_docs("b"))
+        second.start()
+        second.join(0.05)
+
+        # The second batch waits for the first one to complete.
+        self.assertTrue(second.is_alive())
+        self.assertEqual(writer.get_stats()["in_flight"], 1)
+        release.set()
+        second.join(10)
+        writer.close()
+        self.assertEqual(writer.get_stats()["chunks"], 2)
+        self.assertGreater(writer.get_stats()["blocked_seconds"], 0)
+
+    def test_failed_batch(self):
+        self.vectorstore.add_vectors.side_effect = [ConnectionError("down"), None]
+        failed = self.writer.submit(*make_docs("a", "b", "c"))
+        written = self.writer.submit(*make_docs("d"))
+        self.writer.flush()
+
+        with self.assertRaises(ConnectionError):
+            failed.result(timeout=10)
+        self.assertIsNone(written.result(timeout=10))
+        stats = self.writer.get_stats()
+        self.assertEqual((stats["chunks"], stats["failed_batches"]), (1, 1))
+
+    def test_failure_stays_with_its_submission(self):
+        def add_vectors(vectors, texts, **kwargs):
+            if "bad" in texts:
+                raise ValueError("bad chunk")
+
+        self.vectorstore.add_vectors.side_effect = add_vectors
+        written = self.writer.submit(*make_docs("a", "b"))
+        failed = self.writer.submit(*make_docs("bad", "c"))
+
+        self.assertIsNone(written.result(timeout=10))
+        with self.assertRaises(ValueError):
+            failed.result(timeout=10)
+        # The mixed batch is written again one submission at a time.
+        self.assertEqual(self.written_texts(), [["a", "b", "bad"], ["a", "b"], ["bad"]])
+        # The chunk of the failed submission still buffered is dropped.
+        self.assertEqual(self.writer.get_stats()["buffered"], 0)
+        self.writer.flush()
+        self.writer.close()
+        self.assertEqual(len(self.written_texts()), 3)
+        stats = self.writer.get_stats()
+        self.assertEqual((stats["chunks"], stats["failed_batches"]), (2, 2))
+
+    def test_duplicate_chunks_written_once(self):
+        first = self.writer.submit(*make_docs("a"))
+        second = self.writer.submit(*make_docs("a"))
+        self.writer.flush()
+
+        first.result(timeout=10)
+        second.result(timeout=10)
+        self.assertEqual(self.written_texts(), [["a"]])
+
+    def test_store_without_bulk_import(self):
+        vectorstore = Mock(spec=["add_documents"])
+        writer = BulkWriter(vectorstore)
+        ids, docs = make_docs("a", "b")
+        future = writer.submit(ids, docs)
+        writer.close()
+
+        future.result(timeout=10)
+        vectorstore.add_documents.assert_called_once_with(docs, ids=ids)
+
+    def test_asubmit(self):
+        async def write():
+            future = await self.writer.asubmit(*make_docs("a"))
+            await self.writer.aflush()
+            await future
+
+        asyncio.run(write())
+        self.assertEqual(self.written_texts(), [["a"]])
+
+    def test_close(self):
+        future = self.writer.submit(*make_docs("a"))
+        self.writer.close()
+        self.assertTrue(future.done())
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(*make_docs("b"))
+
+    def test_local_vectorstore(self):
+        vectorstore = LocalVectorStore(embedding=KeywordEmbeddings())
+        writer = BulkWriter(vectorstore, batch_size=2)
+        writer.submit(*make_docs("cat cat", "dog", "fish"))
+        writer.close()
+
+        self.assertEqual(len(vectorstore), 3)
+        self.assertEqual(
+            vectorstore.similarity_search("cat", k=1)[0].metadata,
+            {"source": "cat cat"},
+        )
@@ -0,0 +1,222 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from chat_history import (
+    BoundedHistory,
+    HistoryStore,
+    SQLiteHistory,
+    SQLiteHistoryStore,
+    summarize_with,
+)
+
+
+class TestBoundedHistory(unittest.TestCase):
+    def test_message_cap(self):
+        history = BoundedHistory(max_messages=3)
+        for i in range(5):
+            history.add_message(HumanMessage(content=f"message {i}"))
+
+        self.assertEqual(
+            [message.content for message in history.messages],
+            ["message 2", "message 3", "message 4"],
+        )
+        self.assertEqual(history.tokens, [2, 2, 2])
+
+    def test_token_cap_keeps_latest_message(self):
+        history = BoundedHistory(max_tokens=5)
+        history.add_messages(
+            [HumanMessage(content="one two three"), AIMessage(content="four five")]
+        )
+        history.add_message(HumanMessage(content="six seven eight nine ten eleven"))
+
+        self.assertEqual(
+            history.messages, [HumanMessage(content="six seven eight nine ten eleven")]
+        )
+
+    def test_rolling_summary(self):
+        summarizer = Mock(side_effect=lambda messages: f"{len(messages)} messages")
+        history = BoundedHistory(max_messages=4, summarizer=summarizer)
+        history.add_messages([HumanMessage(content="q1"), AIMessage(content="a1")])
+        history.add_messages([HumanMessage(content="q2"), AIMessage(content="a2")])
+        summarizer.assert_not_called()
+
+        history.add_messages([HumanMessage(content="q3"), AIMessage(content="a3")])
+
+        # The turn is summarized once, leaving room for the summary message.
+        summarizer.assert_called_once_with(
+            [
+                HumanMessage(content="q1"),
+                AIMessage(content="a1"),
+                HumanMessage(content="q2"),
+            ]
+        )
+        self.assertEqual(
+            history.messages,
+            [
+                SystemMessage(content="3 messages"),
+                AIMessage(content="a2"),
+                HumanMessage(content="q3"),
+                AIMessage(content="a3"),
+            ],
+        )
+
+        history.add_messages([HumanMessage(content="q4"), AIMessage(content="a4")])
+        self.assertEqual(
+            summarizer.call_args.args[0][:2],
+            [SystemMessage(content="3 messages"), AIMessage(content="a2")],
+        )
+        self.assertEqual(len(history.messages), 4)
+
+    def test_failed_summary_drops_messages(self):
+        history = BoundedHistory(
+            max_messages=2, summarizer=Mock(side_effect=TimeoutError)
+        )
+        history.add_messages(
+            [
+                HumanMessage(content="q1"),
+                AIMessage(content="a1"),
+                HumanMessage(content="q2"),
+            ]
+        )
+        self.assertEqual(history.messages, [HumanMessage(content="q2")])
+
+    def test_clear(self):
+        history = BoundedHistory()
+        history.add_message(HumanMessage(content="hello"))
+        history.clear()
+        self.assertEqual(history.messages, [])
+        self.assertEqual(history.tokens, [])
+
+    def test_summarize_with(self):
+        chat_model = Mock(name="MockChatModel")
+        chat_model.invoke.return_value = AIMessage(content="They said hello.")
+        summarize = summarize_with(chat_model)
+
+        summary = summarize([HumanMessage(content="hello"), AIMessage(content="hi")])
+
+        self.assertEqual(summary, "They said hello.")
+        prompt = chat_model.invoke.call_args.args[0][0].content
+        self.assertIn("human: hello\nai: hi", prompt)
+
+
+class TestHistoryStore(unittest.TestCase):
+    def test_lru_eviction(self):
+        store = HistoryStore(max_sessions=2)
+        for session_id in ["a", "b"]:
+            store[session_id] = store.new_history(session_id)
+        store["a"].add_message(HumanMessage(content="hello"))
+        store["c"] = store.new_history("c")
+
+        self.assertEqual(list(store), ["a", "c"])
+        self.assertNotIn("b", store)
+        self.assertEqual(store.get_stats()["evicted_sessions"], 1)
+
+    @patch("chat_history.time.monotonic")
+    def test_ttl_eviction(self, monotonic_mock):
+        store = HistoryStore(ttl=60)
+        monotonic_mock.return_value = 0.0
+        store["a"] = store.new_history("a")
+        store["b"] = store.new_history("b")
+        monotonic_mock.return_value = 50.0
+        store["b"].add_message(HumanMessage(content="hello"))
+        monotonic_mock.return_value = 100.0
+
+        self.assertNotIn("a", store)
+        self.assertIn("b", store)
+        self.assertEqual(len(store), 1)
+
+    def test_get_stats(self):
+        store = HistoryStore()
+        store["a"] = store.new_history("a")
+        store["a"].add_messages(
+            [HumanMessage(content="héllo"), AIMessage(content="hi")]
+        )
+        store["b"] = store.new_history("b")
+        del store["b"]
+
+        self.assertEqual(
+            store.get_stats(),
+            {
+                "sessions": 1,
+                "messages": 2,
+                "content_bytes": 8,
+                "evicted_sessions": 0,
+            },
+        )
+
+
+class TestSQLiteHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "history.db")
+        self.store = SQLiteHistoryStore(self.path, max_messages=3)
+
+    def tearDown(self):
+        self.store.connection.close()
+        self.tmp_dir.cleanup()
+
+    def test_wal_mode(self):
+        (mode,) = self.store.connection.execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode, "wal")
+
+    def test_loads_last_messages(self):
+        history = self.store.new_history("a")
+        history.add_messages(
+            [HumanMessage(content="q1"), AIMessage(content="a1")]
+            + [HumanMessage(content="q2"), AIMessage(content="a2")]
+        )
+        self.store.new_history("b").add_message(HumanMessage(content="other"))
+
+        self.assertEqual(
+            history.messages,
+            [
+                AIMessage(content="a1"),
+                HumanMessage(content="q2"),
+                AIMessage(content="a2"),
+            ],
+        )
+
+    def test_persists_across_stores(self):
+        self.store.new_history("a").add_message(HumanMessage(content="hello"))
+        # Another worker process opens the same database.
+        other = SQLiteHistoryStore(self.path)
+        try:
+            other.new_history("a").add_message(AIMessage(content="hi"))
+            self.assertEqual(
+                self.store.new_history("a").messages,
+                [HumanMessage(content="hello"), AIMessage(content="hi")],
+            )
+        finally:
+            other.connection.close()
+
+    def test_eviction_keeps_messages(self):
+        store = SQLiteHistoryStore(self.path, max_sessions=1)
+        store["a"] = store.new_history("a")
+        store["a"].add_message(HumanMessage(content="hello"))
+        store["b"] = store.new_history("b")
+
+        self.assertNotIn("a", store)
+        self.assertEqual(
+            store.new_history("a").messages, [HumanMessage(content="hello")]
+        )
+        store.connection.close()
+
+    def test_clear_and_get_stats(self):
+        history = self.store.new_history("a")
+        history.add_messages([HumanMessage(content="q1"), AIMessage(content="a1")])
+        self.store.new_history("b").add_message(HumanMessage(content="q2"))
+        history.clear()
+
+        self.assertEqual(history.messages, [])
+        stats = self.store.get_stats()
+        self.assertEqual(stats["messages"], 1)
+        self.assertGreater(stats["content_bytes"], 0)
+
+    def test_unbounded_load(self):
+        history = SQLiteHistory(self.store.connection, "a", max_messages=None)
+        history.add_messages([HumanMessage(content=f"q{i}") for i in range(5)])
+        self.assertEqual(len(history.messages), 5)
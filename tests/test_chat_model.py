@@ -1,7 +1,10 @@
+import asyncio
 import unittest
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
-from chat_model import ChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_model import PREFIX_BOUNDARY, ChatModel
 
 
 class TestChatModel(unittest.TestCase):
@@ -61,6 +64,80 @@ class TestChatModel(unittest.TestCase):
         )
         self.assertIsNotNone(self.chat_model.chat_model)
 
+    @patch("chat_model.load_model")
+    def test_set_local_model(self, load_model_mock):
+        chat_model = ChatModel(self.model_name, backend="local", num_threads=2)
+        self.assertEqual(chat_model.get_local_model(), load_model_mock.return_value)
+        load_model_mock.assert_called_once_with(
+            self.model_name, quantization="int8", num_threads=2
+        )
+
+    @patch.dict("chat_model.os.environ", {"CHAT_MODEL_QUANTIZATION": "none"})
+    @patch("chat_model.load_model")
+    def test_set_local_model_full_precision(self, load_model_mock):
+        ChatModel(self.model_name, backend="local").set_local_model()
+        load_model_mock.assert_called_once_with(
+            self.model_name, quantization=None, num_threads=None
+        )
+
+    @patch("chat_model.LocalChatModel")
+    @patch("chat_model.PrefixCache")
+    @patch("chat_model.GenerationScheduler")
+    @patch("chat_model.ChatModel.get_tokenizer")
+    @patch("chat_model.ChatModel.get_local_model")
+    def test_set_chat_model_local(
+        self,
+        get_local_model_mock,
+        get_tokenizer_mock,
+        generation_scheduler_mock,
+        prefix_cache_mock,
+        local_chat_model_mock,
+    ):
+        chat_model = ChatModel(
+            self.model_name,
+            backend="local",
+            max_batch_size=4,
+            max_wait=0.05,
+            prefix_cache_mb=64,
+        )
+        chat_model.set_chat_model()
+        prefix_cache_mock.assert_called_once_with(max_bytes=64 * 2**20)
+        generation_scheduler_mock.assert_called_once_with(
+            get_local_model_mock.return_value,
+            get_tokenizer_mock.return_value.eos_token_id,
+            max_batch_size=4,
+            max_wait=0.05,
+            prefix_cache=prefix_cache_mock.return_value,
+        )
+        local_chat_model_mock.assert_called_once_with(
+            model=get_local_model_mock.return_value,
+            tokenizer=get_tokenizer_mock.return_value,
+            prefix_boundary=PREFIX_BOUNDARY,
+            scheduler=generation_scheduler_mock.return_value,
+            max_new_tokens=1000,
+            do_sample=True,
+            temperature=1.0,
+        )
+        self.assertEqual(chat_model.chat_model, local_chat_model_mock.return_value)
+
+    @patch("chat_model.LocalChatModel")
+    @patch("chat_model.GenerationScheduler")
+    @patch("chat_model.ChatModel.get_tokenizer")
+    @patch("chat_model.ChatModel.get_local_model")
+    def test_set_chat_model_local_without_prefix_cache(
+        self,
+        get_local_model_mock,
+        get_tokenizer_mock,
+        generation_scheduler_mock,
+        local_chat_model_mock,
+    ):
+        ChatModel(self.model_name, backend="local", prefix_cache_mb=0).set_chat_model()
+        self.assertIsNone(generation_scheduler_mock.call_args.kwargs["prefix_cache"])
+
+    def test_set_chat_model_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            ChatModel(self.model_name, backend="other").set_chat_model()
+
     @patch("chat_model.ChatModel.set_chat_model")
     def test_get_chat_model(self, set_chat_model_mock):
         # Test get_chat_model without pre-existing chat_model
@@ -69,3 +146,15 @@ class TestChatModel(unittest.TestCase):
 
         set_chat_model_mock.assert_called_once()
         self.assertEqual(result, self.chat_model.chat_model)
+
+    @patch("chat_model.ChatModel.get_chat_model")
+    def test_ainvoke(self, get_chat_model_mock):
+        messages = [HumanMessage(content="Hello")]
+        get_chat_model_mock.return_value.ainvoke = AsyncMock(
+            return_value=AIMessage(content="Hi")
+        )
+
+        response = asyncio.run(self.chat_model.ainvoke(messages))
+
+        get_chat_model_mock.return_value.ainvoke.assert_awaited_once_with(messages)
+        self.assertEqual(response, AIMessage(content="Hi"))
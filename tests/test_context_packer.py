@@ -0,0 +1,96 @@
+import re
+import unittest
+from unittest.mock import Mock
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from context_packer import ContextPacker
+
+
+class WordTokenizer:
+    """Tokenizes texts into words, so that token counts are predictable."""
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.encode = Mock(side_effect=self._encode)
+
+    def _encode(self, text, add_special_tokens=True):
+        words = re.findall(r"\S+|\n", text)
+        return [
+            self.vocabulary.setdefault(word, len(self.vocabulary)) for word in words
+        ]
+
+    def decode(self, tokens):
+        words = {token: word for word, token in self.vocabulary.items()}
+        return " ".join(words[token] for token in tokens)
+
+
+class TestContextPacker(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = WordTokenizer()
+        self.packer = ContextPacker(
+            self.tokenizer, max_tokens=20, history_share=0.5, min_chunk_tokens=2
+        )
+
+    def test_tokenize_is_cached(self):
+        self.packer.tokenize("one two three")
+        self.packer.tokenize("one two three")
+        self.assertEqual(self.tokenizer.encode.call_count, 2)  # "\n\n" and the text
+        self.tokenizer.encode.assert_called_with(
+            "one two three", add_special_tokens=False
+        )
+
+    def test_tokenize_cache_is_bounded(self):
+        self.packer.cache_size = 2
+        for text in ["a", "b", "c"]:
+            self.packer.tokenize(text)
+        self.assertEqual(list(self.packer._tokens), ["b", "c"])
+
+    def test_pack_docs_trims_and_drops(self):
+        docs = [
+            Document(page_content="a b c d"),
+            Document(page_content="e f g h i j"),
+            Document(page_content="k l"),
+        ]
+
+        context, used = self.packer.pack_docs(docs, 9)
+
+        self.assertEqual(context, "a b c d\n\ne f g")
+        self.assertEqual(used, 9)
+        self.assertEqual(self.packer.pack_docs(docs, 100)[1], 16)
+        self.assertEqual(self.packer.pack_docs(docs, 5), ("a b c d", 4))
+
+    def test_pack_docs_by_relevance_score(self):
+        docs = [
+            Document(page_content="low", metadata={"relevance_score": 0.1}),
+            Document(page_content="high", metadata={"relevance_score": 0.9}),
+        ]
+        self.assertEqual(self.packer.pack_docs(docs, 1), ("high", 1))
+
+    def test_pack_history_keeps_recent_messages(self):
+        messages = [
+            HumanMessage(content="old question"),
+            AIMessage(content="old answer"),
+            HumanMessage(content="new question"),
+            AIMessage(content="new answer"),
+        ]
+
+        history, used = self.packer.pack_history(messages, 7)
+
+        self.assertEqual(history, "human: new question\nai: new answer")
+        self.assertEqual(used, 7)
+
+    def test_pack_shares_unused_budget(self):
+        docs = [Document(page_content=" ".join("abcdefghijklmnopqrstuvwxyz"))]
+        messages = [HumanMessage(content="hi"), AIMessage(content="hello")]
+
+        context, history = self.packer.pack("why", docs, messages)
+
+        # 19 tokens are left after the question: the history needs 5 of its 9, the context gets the other 14.
+        self.assertEqual(history, "human: hi\nai: hello")
+        self.assertEqual(context, " ".join("abcdefghijklmn"))
+
+        context, history = self.packer.pack("why", docs, [])
+        self.assertEqual(len(context.split(" ")), 19)
+        self.assertEqual(history, "")
@@ -1,11 +1,23 @@
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, call, patch
 
 import weaviate
+from langchain_core.documents import Document
+from weaviate.classes.query import Filter
+from weaviate.config import AdditionalConfig, Timeout
+from weaviate.exceptions import WeaviateConnectionError
 
-from database_utils import (
-    Database,  # Replace 'your_module' with the actual name of your module
+from database_utils import (  # Replace 'your_module' with the actual name of your module
+    ClientPool,
+    Database,
+    DatabaseSingletonMeta,
+    MMRWeaviateVectorStore,
+    PooledVectorStore,
 )
+from local_vectorstore import LocalVectorStore
 
 
 class TestDatabase(unittest.TestCase):
@@ -21,33 +33,55 @@ class TestDatabase(unittest.TestCase):
         del instance1
         del instance2
 
-    @patch("database_utils.os.getenv")
+    @patch.dict(
+        "database_utils.os.environ",
+        {
+            "WCS_DEMO_URL": "https://cluster",
+            "WCS_DEMO_RO_KEY": "key",
+            "VECTOR_STORE_QUERY_TIMEOUT": "5",
+        },
+    )
     @patch("database_utils.weaviate.connect_to_wcs")
-    def test_database_initialization(self, connect_to_wcs_mock, os_getenv_mock):
-        connect_to_wcs_mock.return_value = Mock(name="WeaviateClient")
-
-        database = Database()
+    def test_connect(self, connect_to_wcs_mock):
+        client = Database.connect()
 
         connect_to_wcs_mock.assert_called_once_with(
-            cluster_url=os_getenv_mock.return_value,
-            auth_credentials=weaviate.auth.AuthApiKey(os_getenv_mock.return_value),
+            cluster_url="https://cluster",
+            auth_credentials=weaviate.auth.AuthApiKey("key"),
+            additional_config=AdditionalConfig(timeout=Timeout(query=5, insert=90)),
         )
-        os_getenv_mock.assert_any_call("WCS_DEMO_URL")
-        os_getenv_mock.assert_any_call("WCS_DEMO_RO_KEY")
-        del database
+        self.assertEqual(client, connect_to_wcs_mock.return_value)
 
-    @patch("database_utils.WeaviateVectorStore")
-    def test_set_db(self, weaviate_vector_store_mock):
-        with patch("database_utils.weaviate.connect_to_wcs") as connect_to_wcs_mock:
-            connect_to_wcs_mock.return_value = Mock(name="WeaviateClient")
-            database = Database()
-            database.set_db()
+    @patch("database_utils.MMRWeaviateVectorStore")
+    @patch("database_utils.Database.connect")
+    def test_set_db(self, connect_mock, weaviate_vector_store_mock):
+        DatabaseSingletonMeta._instances.clear()
+        database = Database(backend="weaviate", pool_size=2)
+        connect_mock.assert_not_called()
+        database.set_db()
 
-            weaviate_vector_store_mock.assert_called_once_with(
-                client=database.client, index_name="MyIndex", text_key="text"
-            )
-            self.assertIsNotNone(database.db)
-            del database
+        self.assertIsInstance(database.db, PooledVectorStore)
+        self.assertIs(database.db.pool, database.pool)
+        self.assertEqual(database.pool.size, 2)
+        database.db.similarity_search("query", k=2)
+        weaviate_vector_store_mock.assert_called_once_with(
+            client=connect_mock.return_value, index_name="MyIndex", text_key="text"
+        )
+        weaviate_vector_store_mock.return_value.similarity_search.assert_called_once_with(
+            "query", k=2
+        )
+        database.close()
+
+    @patch("database_utils.Database.connect")
+    def test_close(self, connect_mock):
+        DatabaseSingletonMeta._instances.clear()
+        with Database(backend="weaviate") as database:
+            pool = database.pool
+        self.assertNotIn(Database, DatabaseSingletonMeta._instances)
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+        self.assertIsNot(Database(backend="weaviate"), database)
+        DatabaseSingletonMeta._instances.clear()
 
     @patch("database_utils.Database.set_db")
     def test_get_db(self, set_db_mock):
@@ -61,3 +95,284 @@ class TestDatabase(unittest.TestCase):
             result, database.db
         )  # `get_db` initializes `db.db` if it's None
         del database
+
+
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        self.clients = []
+
+        def connect():
+            client = Mock(name=f"Client{len(self.clients)}")
+            self.clients.append(client)
+            return client
+
+        self.pool = ClientPool(connect, size=2, timeout=0.05)
+
+    def test_reuse(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            self.assertEqual(self.pool.get_stats()["in_use"], 1)
+        self.assertIs(first, second)
+        stats = self.pool.get_stats()
+        self.assertEqual((stats["created"], stats["in_use"], stats["idle"]), (1, 0, 1))
+
+    def test_size_and_timeout(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.assertIsNot(first, second)
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire()
+        with self.assertRaisesRegex(TimeoutError, "within 0.01 seconds"):
+            self.pool.acquire(timeout=0.01)
+        self.assertEqual(self.pool.get_stats()["timeouts"], 2)
+
+        threading.Timer(0.02, self.pool.release, args=(first,)).start()
+        self.assertIs(self.pool.acquire(timeout=1), first)
+        self.assertGreater(self.pool.get_stats()["max_wait_seconds"], 0.0)
+
+    def test_broken_client_is_replaced(self):
+        function = Mock(side_effect=[WeaviateConnectionError("dropped"), "result"])
+
+        self.assertEqual(self.pool.call(function), "result")
+        self.assertIsNot(function.call_args_list[0].args[0], function.call_args.args[0])
+        self.clients[0].close.assert_called_once()
+        stats = self.pool.get_stats()
+        self.assertEqual((stats["created"], stats["reconnects"]), (2, 1))
+
+    def test_connection_error_after_retries(self):
+        function = Mock(side_effect=WeaviateConnectionError("down"))
+        with self.assertRaises(WeaviateConnectionError):
+            self.pool.call(function, retries=2)
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(self.pool.get_stats()["in_use"], 0)
+
+    def test_other_errors_keep_client(self):
+        with self.assertRaises(ValueError):
+            self.pool.call(Mock(side_effect=ValueError("bad filter")))
+        self.clients[0].close.assert_not_called()
+        self.assertEqual(self.pool.get_stats()["idle"], 1)
+
+    def test_health_check(self):
+        self.pool.check_interval = 0.0
+        with self.pool.connection() as first:
+            first.is_ready.return_value = False
+        with self.pool.connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        first.close.assert_called_once()
+        self.assertEqual(self.pool.get_stats()["reconnects"], 1)
+
+    def test_connect_error_frees_slot(self):
+        pool = ClientPool(Mock(side_effect=WeaviateConnectionError("down")), size=1)
+        with self.assertRaises(WeaviateConnectionError):
+            pool.acquire()
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+
+    def test_close(self):
+        idle = self.pool.acquire()
+        in_use = self.pool.acquire()
+        self.pool.release(idle)
+        with self.pool:
+            pass
+        idle.close.assert_called_once()
+        in_use.close.assert_not_called()
+        self.pool.release(in_use)
+        in_use.close.assert_called_once()
+        with self.assertRaises(RuntimeError):
+            self.pool.acquire()
+
+
+class TestPooledVectorStore(unittest.TestCase):
+    def test_concurrent_calls_use_separate_stores(self):
+        stores = []
+
+        def connect():
+            store = Mock(name="MockWeaviateVectorStore")
+            store.similarity_search.side_effect = lambda query, k: time.sleep(0.02)
+            stores.append(store)
+            return store
+
+        embedding = Mock(name="MockEmbeddings")
+        vectorstore = PooledVectorStore(ClientPool(connect, size=4), embedding)
+        threads = [
+            threading.Thread(target=vectorstore.similarity_search, args=("query",))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(stores), 4)
+        for store in stores:
+            store.similarity_search.assert_called_once_with("query", k=4)
+            self.assertIs(store._embedding, embedding)
+        self.assertIs(vectorstore.embeddings, embedding)
+
+    def test_add_vectors(self):
+        store = Mock(name="MockWeaviateVectorStore")
+        vectorstore = PooledVectorStore(ClientPool(lambda: store))
+
+        vectorstore.add_vectors([[1.0]], ["text"], ids=["id"])
+        store.add_vectors.assert_called_once_with(
+            [[1.0]], ["text"], metadatas=None, ids=["id"]
+        )
+
+    def test_add_texts_retried_with_texts(self):
+        store = Mock(name="MockWeaviateVectorStore")
+        store.add_texts.side_effect = [WeaviateConnectionError("dropped"), ["id"]]
+        vectorstore = PooledVectorStore(ClientPool(lambda: store))
+
+        self.assertEqual(vectorstore.add_texts(iter(["text"]), ids=["id"]), ["id"])
+        self.assertEqual(store.add_texts.call_args.args, (["text"], None))
+
+    def test_relevance_score_fn_does_not_use_pool(self):
+        connect = Mock(name="connect")
+        vectorstore = PooledVectorStore(ClientPool(connect))
+
+        relevance = vectorstore._select_relevance_score_fn()
+        self.assertAlmostEqual(relevance(0.0), 0.5)
+        self.assertGreater(relevance(5.0), relevance(1.0))
+        connect.assert_not_called()
+
+    @patch("database_utils.MMRWeaviateVectorStore")
+    @patch("database_utils.Database.connect")
+    def test_from_texts(self, connect_mock, weaviate_vector_store_mock):
+        embedding = Mock(name="MockEmbeddings")
+        vectorstore = PooledVectorStore.from_texts(
+            ["text"], embedding, [{"page": 1}], pool_size=2, index_name="Docs"
+        )
+
+        self.assertEqual(vectorstore.pool.size, 2)
+        weaviate_vector_store_mock.assert_called_once_with(
+            client=connect_mock.return_value, index_name="Docs", text_key="text"
+        )
+        store = weaviate_vector_store_mock.return_value
+        store.add_texts.assert_called_once_with(["text"], [{"page": 1}])
+        self.assertIs(store._embedding, embedding)
+        vectorstore.pool.close()
+
+    def test_similarity_search_by_vector_batch(self):
+        stores = []
+
+        def connect():
+            store = Mock(name="MockWeaviateVectorStore")
+
+            def similarity_search_by_vector(embedding, k, **kwargs):
+                time.sleep(0.02)
+                return [Document(page_content=str(embedding))] * k
+
+            store.similarity_search_by_vector.side_effect = similarity_search_by_vector
+            stores.append(store)
+            return store
+
+        vectorstore = PooledVectorStore(ClientPool(connect, size=4))
+
+        docs = vectorstore.similarity_search_by_vector_batch(
+            [[1.0], [2.0], [3.0], [4.0]], [1, 2, 1, 1], [{"page": 1}, None, None, None]
+        )
+
+        self.assertEqual([len(query_docs) for query_docs in docs], [1, 2, 1, 1])
+        self.assertEqual(docs[3][0].page_content, "[4.0]")
+        # The searches ran concurrently, on separate connections.
+        self.assertGreater(len(stores), 1)
+        calls = [
+            search
+            for store in stores
+            for search in store.similarity_search_by_vector.call_args_list
+        ]
+        self.assertIn(call([1.0], k=1, filter={"page": 1}), calls)
+        self.assertIn(call([2.0], k=2), calls)
+
+
+class TestMMRWeaviateVectorStore(unittest.TestCase):
+    @patch("database_utils.WeaviateVectorStore._perform_search")
+    def test_filter_is_mapped_to_weaviate_filters(self, perform_search_mock):
+        store = MMRWeaviateVectorStore.__new__(MMRWeaviateVectorStore)
+
+        store._perform_search(
+            None, 2, vector=[1.0], filter={"page": 1, "source": "a.pdf"}
+        )
+
+        perform_search_mock.assert_called_once()
+        self.assertEqual(perform_search_mock.call_args.args, (None, 2))
+        kwargs = perform_search_mock.call_args.kwargs
+        self.assertEqual(kwargs["vector"], [1.0])
+        self.assertNotIn("filter", kwargs)
+        self.assertEqual(
+            kwargs["filters"].filters,
+            [
+                Filter.by_property("page").equal(1),
+                Filter.by_property("source").equal("a.pdf"),
+            ],
+        )
+
+    def test_max_marginal_relevance_search_by_vector(self):
+        store = Mock(name="MockWeaviateVectorStore")
+        store._perform_search.return_value = [
+            Document(page_content=text, metadata={"vector": vector})
+            for text, vector in [
+                ("a", [1.0, 0.05]),
+                ("a'", [1.0, 0.06]),
+                ("b", [0.6, 0.8]),
+            ]
+        ]
+
+        docs = MMRWeaviateVectorStore.max_marginal_relevance_search_by_vector(
+            store, [1.0, 0.0], k=2, fetch_k=3, lambda_mult=0.3
+        )
+
+        store._perform_search.assert_called_once_with(
+            query=None, k=3, include_vector=True, vector=[1.0, 0.0]
+        )
+        self.assertEqual(docs, [Document(page_content="a"), Document(page_content="b")])
+
+    def test_add_vectors(self):
+        store = MagicMock(name="MockWeaviateVectorStore", _text_key="text")
+        batch = store._collection.batch.fixed_size.return_value.__enter__.return_value
+        store._collection.batch.failed_objects = []
+
+        ids = MMRWeaviateVectorStore.add_vectors(
+            store,
+            [[1.0, 0.0], [0.0, 1.0]],
+            ["a", "b"],
+            [{"page": 1}, {}],
+            ["id1", "id2"],
+        )
+
+        self.assertEqual(ids, ["id1", "id2"])
+        store._collection.batch.fixed_size.assert_called_once_with(
+            batch_size=2, concurrent_requests=1
+        )
+        batch.add_object.assert_any_call(
+            properties={"text": "a", "page": 1}, uuid="id1", vector=[1.0, 0.0]
+        )
+        self.assertEqual(batch.add_object.call_count, 2)
+
+    def test_add_vectors_failure(self):
+        store = MagicMock(name="MockWeaviateVectorStore", _text_key="text")
+        store._collection.batch.failed_objects = [Mock(message="invalid vector")]
+        with self.assertRaises(RuntimeError):
+            MMRWeaviateVectorStore.add_vectors(store, [[1.0]], ["a"])
+
+
+class TestLocalDatabase(unittest.TestCase):
+    def setUp(self):
+        DatabaseSingletonMeta._instances.clear()
+
+    def tearDown(self):
+        DatabaseSingletonMeta._instances.clear()
+
+    @patch("database_utils.weaviate.connect_to_wcs")
+    def test_local_backend(self, connect_to_wcs_mock):
+        with tempfile.TemporaryDirectory() as path:
+            with patch.dict(
+                "database_utils.os.environ", {"LOCAL_VECTOR_STORE_DIR": path}
+            ):
+                database = Database(backend="local")
+                db = database.get_db()
+
+            connect_to_wcs_mock.assert_not_called()
+            self.assertIsNone(database.pool)
+            self.assertIsInstance(db, LocalVectorStore)
+            self.assertEqual(db.path, path)
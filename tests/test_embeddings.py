@@ -1,8 +1,26 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, Mock, patch
 
-from embeddings import (
-    Embeddings,  # Import the module containing your class (replace 'your_module')
+import numpy as np
+import requests
+import torch
+
+from embeddings import (  # Import the module containing your class (replace 'your_module')
+    BatchedEmbeddings,
+    CachedEmbeddings,
+    EmbeddingCache,
+    Embeddings,
+    InferenceAPIEmbeddings,
+    LocalEmbeddings,
+    embed_queries,
 )
 
 
@@ -13,11 +31,11 @@ class TestEmbeddings(unittest.TestCase):
         self.embeddings = Embeddings()
 
     @patch("embeddings.os.getenv")
-    @patch("embeddings.HuggingFaceInferenceAPIEmbeddings")
+    @patch("embeddings.InferenceAPIEmbeddings")
     def test_set_embeddings_model(
         self, hugging_face_inference_api_embedding_class_mock, os_getenv_mock
     ):
-        # Mocking the environment variable fetching and the HuggingFaceInferenceAPIEmbeddings constructor
+        # Mocking the environment variable fetching and the InferenceAPIEmbeddings constructor
         os_getenv_mock.return_value = "fake_api_token"
 
         self.assertIsNone(self.embeddings.embeddings)
@@ -36,6 +54,71 @@ class TestEmbeddings(unittest.TestCase):
         # Ensure the embeddings instance is not None after setting it
         self.assertIsNotNone(self.embeddings.embeddings)
 
+    @patch("embeddings.InferenceAPIEmbeddings")
+    def test_set_embeddings_model_with_cache(
+        self, hugging_face_inference_api_embedding_class_mock
+    ):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            embeddings = Embeddings(cache_dir=cache_dir)
+            embeddings.set_embeddings_model()
+
+            self.assertIsInstance(embeddings.embeddings, CachedEmbeddings)
+            self.assertIsInstance(embeddings.embeddings.embeddings, BatchedEmbeddings)
+            self.assertEqual(
+                embeddings.embeddings.embeddings.embeddings,
+                hugging_face_inference_api_embedding_class_mock.return_value,
+            )
+            self.assertEqual(
+                embeddings.embeddings.cache.model_name,
+                "sentence-transformers/all-mpnet-base-v2:api:fp32",
+            )
+
+    @patch("embeddings.LocalEmbeddings")
+    def test_cache_is_keyed_on_backend_and_quantization(
+        self, local_embeddings_class_mock
+    ):
+        local_embeddings_class_mock.return_value.embed_documents.side_effect = (
+            lambda texts: [[1.0] for _ in texts]
+        )
+        with tempfile.TemporaryDirectory() as cache_dir:
+            quantized = Embeddings(cache_dir=cache_dir, backend="local", quantize=True)
+            quantized.set_embeddings_model()
+            quantized.embeddings.embed_documents(["a"])
+            full = Embeddings(cache_dir=cache_dir, backend="local", quantize=False)
+            full.set_embeddings_model()
+
+            self.assertEqual(
+                full.embeddings.cache.model_name.split(":")[1:], ["local", "fp32"]
+            )
+            self.assertEqual(len(quantized.embeddings.cache), 1)
+            self.assertEqual(len(full.embeddings.cache), 0)
+            self.assertEqual(
+                sorted(os.listdir(cache_dir)),
+                [
+                    "sentence-transformers__all-mpnet-base-v2--local--fp32",
+                    "sentence-transformers__all-mpnet-base-v2--local--int8",
+                ],
+            )
+
+    @patch("embeddings.LocalEmbeddings")
+    def test_set_embeddings_model_local(self, local_embeddings_class_mock):
+        embeddings = Embeddings(backend="local", num_threads=2, quantize=True)
+        embeddings.set_embeddings_model()
+
+        local_embeddings_class_mock.assert_called_once_with(
+            model_name="sentence-transformers/all-mpnet-base-v2",
+            batch_size=32,
+            num_threads=2,
+            quantize=True,
+        )
+        self.assertEqual(
+            embeddings.embeddings, local_embeddings_class_mock.return_value
+        )
+
+    def test_set_embeddings_model_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Embeddings(backend="unknown").set_embeddings_model()
+
     @patch("embeddings.Embeddings.set_embeddings_model")
     def test_get_embeddings_model(self, set_embeddings_model_mock):
         self.assertIsNone(self.embeddings.embeddings)
@@ -43,3 +126,300 @@ class TestEmbeddings(unittest.TestCase):
 
         set_embeddings_model_mock.assert_called_once()
         self.assertEqual(result, self.embeddings.embeddings)
+
+
+class TestCachedEmbeddings(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.backend = Mock(name="MockEmbeddingsBackend")
+        self.backend.embed_documents.side_effect = lambda texts: [
+            [float(len(text)), 1.0] for text in texts
+        ]
+        self.backend.embed_query.side_effect = lambda text: [float(len(text)), 2.0]
+        self.cached = CachedEmbeddings(
+            self.backend, model_name="test/model", cache_dir=self.temp_dir.name
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_embed_documents_only_sends_misses(self):
+        first = self.cached.embed_documents(["a", "bb"])
+        second = self.cached.embed_documents(["bb", "ccc", "a"])
+
+        self.assertEqual(first, [[1.0, 1.0], [2.0, 1.0]])
+        self.assertEqual(second, [[2.0, 1.0], [3.0, 1.0], [1.0, 1.0]])
+        self.backend.embed_documents.assert_called_with(["ccc"])
+        self.assertEqual(self.backend.embed_documents.call_count, 2)
+        stats = self.cached.get_stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["cached_vectors"], 3)
+
+    def test_embed_query_is_cached_separately(self):
+        self.cached.embed_documents(["a"])
+        self.assertEqual(self.cached.embed_query("a"), [1.0, 2.0])
+        self.assertEqual(self.cached.embed_query("a"), [1.0, 2.0])
+        self.backend.embed_query.assert_called_once_with("a")
+        self.assertEqual(self.cached.get_stats()["hit_rate"], 1 / 3)
+
+    def test_embed_queries_only_sends_misses(self):
+        self.cached.embed_query("a")
+        self.backend.embed_queries = Mock(
+            side_effect=lambda texts: [[float(len(text)), 3.0] for text in texts]
+        )
+
+        vectors = self.cached.embed_queries(["bb", "a", "bb"])
+
+        self.assertEqual(vectors, [[2.0, 3.0], [1.0, 2.0], [2.0, 3.0]])
+        self.backend.embed_queries.assert_called_once_with(["bb"])
+
+    def test_embed_queries_falls_back_to_embed_query(self):
+        backend = Mock(spec=["embed_documents", "embed_query"])
+        backend.embed_query.side_effect = lambda text: [float(len(text)), 2.0]
+        self.assertEqual(embed_queries(backend, ["a", "bb"]), [[1.0, 2.0], [2.0, 2.0]])
+        backend.embed_documents.assert_not_called()
+
+    def test_aembed_query_is_cached(self):
+        self.backend.aembed_query = AsyncMock(return_value=[1.0, 2.0])
+        self.assertEqual(asyncio.run(self.cached.aembed_query("a")), [1.0, 2.0])
+        self.assertEqual(self.cached.embed_query("a"), [1.0, 2.0])
+        self.backend.aembed_query.assert_awaited_once_with("a")
+        self.backend.embed_query.assert_not_called()
+
+    def test_vectors_persist_on_disk(self):
+        self.cached.embed_documents(["a", "bb"])
+        reloaded = CachedEmbeddings(
+            self.backend, model_name="test/model", cache_dir=self.temp_dir.name
+        )
+        self.assertEqual(
+            reloaded.embed_documents(["bb", "a"]), [[2.0, 1.0], [1.0, 1.0]]
+        )
+        self.assertEqual(self.backend.embed_documents.call_count, 1)
+        self.assertEqual(reloaded.get_stats()["hits"], 2)
+
+    def test_interrupted_write_is_cut_off(self):
+        cache = EmbeddingCache("test/model", cache_dir=self.temp_dir.name)
+        cache.put(["a", "b"], [[1.0, 1.0], [2.0, 2.0]])
+        # A crash left a vector without its key.
+        with open(os.path.join(cache.path, "vectors.f32"), "ab") as f:
+            f.write(np.array([9.0, 9.0], dtype=np.float32).tobytes())
+
+        reloaded = EmbeddingCache("test/model", cache_dir=self.temp_dir.name)
+        reloaded.put(["c"], [[5.0, 5.0]])
+        reloaded = EmbeddingCache("test/model", cache_dir=self.temp_dir.name)
+        self.assertEqual(reloaded.get("c").tolist(), [5.0, 5.0])
+        self.assertEqual(reloaded.get("b").tolist(), [2.0, 2.0])
+        self.assertEqual(len(reloaded), 3)
+
+    def test_first_write_without_metadata_is_dropped(self):
+        cache = EmbeddingCache("test/model", cache_dir=self.temp_dir.name)
+        cache.put(["a"], [[1.0, 1.0]])
+        # A crash left the first vectors without the metadata describing them.
+        os.remove(os.path.join(cache.path, "meta.json"))
+
+        reloaded = EmbeddingCache("test/model", cache_dir=self.temp_dir.name)
+        self.assertEqual(len(reloaded), 0)
+        reloaded.put(["b"], [[2.0, 2.0]])
+        reloaded = EmbeddingCache("test/model", cache_dir=self.temp_dir.name)
+        self.assertIsNone(reloaded.get("a"))
+        self.assertEqual(reloaded.get("b").tolist(), [2.0, 2.0])
+
+    def test_counters_are_thread_safe(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.cached.embed_query, ["a"] * 400))
+        stats = self.cached.get_stats()
+        self.assertEqual(stats["hits"] + stats["misses"], 400)
+        self.assertEqual(stats["misses"], stats["backend_calls"])
+
+    def test_lru_is_bounded(self):
+        cache = EmbeddingCache("test/model", max_items=2)
+        cache.put(["a", "b", "c"], [[1.0], [2.0], [3.0]])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c").tolist(), [3.0])
+        self.assertEqual(len(cache), 2)
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    """Local stand-in for the Hugging Face feature-extraction endpoint with injected latency and failures."""
+
+    def __init__(self, latency=0.05, failures=0, failure_status=503):
+        super().__init__(("127.0.0.1", 0), FakeEmbeddingHandler)
+        self.latency = latency
+        self.failures = failures
+        self.failure_status = failure_status
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        texts = json.loads(self.rfile.read(int(self.headers["Content-Length"])))[
+            "inputs"
+        ]
+        with server.lock:
+            server.requests.append(texts)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = server.failures > 0
+            server.failures -= 1
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+        if fail:
+            body = {"error": "Model is overloaded"}
+        else:
+            body = [[float(len(text)), float(text.count("a"))] for text in texts]
+        payload = json.dumps(body).encode()
+        self.send_response(server.failure_status if fail else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestBatchedEmbeddings(unittest.TestCase):
+
+    def make_embeddings(self, server, **kwargs):
+        backend = InferenceAPIEmbeddings(api_key="fake_api_token", api_url=server.url)
+        return BatchedEmbeddings(backend, backoff=0.01, **kwargs)
+
+    def test_make_batches(self):
+        batched = BatchedEmbeddings(Mock(), max_batch_size=3, max_batch_chars=10)
+        texts = ["aaaa", "bbbb", "c", "d", "e", "ffffffffffff", "g"]
+        self.assertEqual(batched.make_batches(texts), [[0, 1, 2], [3, 4], [5], [6]])
+
+    def test_embed_documents_concurrently_in_order(self):
+        server = FakeEmbeddingServer(latency=0.1)
+        self.addCleanup(server.stop)
+        batched = self.make_embeddings(server, max_batch_size=5, max_concurrency=4)
+        texts = ["a" * (i % 7) + str(i) for i in range(40)]
+
+        start = time.perf_counter()
+        vectors = batched.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(
+            vectors, [[float(len(text)), float(text.count("a"))] for text in texts]
+        )
+        self.assertEqual(len(server.requests), 8)
+        self.assertTrue(all(len(request) <= 5 for request in server.requests))
+        self.assertEqual(server.max_in_flight, 4)
+        # 8 batches of 0.1s with 4 in flight take about 0.2s, against 0.8s sequentially.
+        self.assertLess(elapsed, 0.6)
+
+    def test_failed_batches_are_retried(self):
+        server = FakeEmbeddingServer(latency=0.01, failures=2)
+        self.addCleanup(server.stop)
+        batched = self.make_embeddings(server, max_batch_size=2, max_concurrency=1)
+
+        vectors = batched.embed_documents(["a", "bb", "aaa"])
+
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 0.0], [3.0, 3.0]])
+        self.assertEqual(batched.retries, 2)
+
+    def test_non_transient_errors_are_raised_at_once(self):
+        server = FakeEmbeddingServer(latency=0.01, failures=1, failure_status=401)
+        self.addCleanup(server.stop)
+        batched = self.make_embeddings(server)
+
+        with self.assertRaises(requests.HTTPError):
+            batched.embed_documents(["a", "bb", "aaa"])
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(batched.retries, 0)
+
+        backend = Mock(name="MockEmbeddingsBackend")
+        backend.embed_query.side_effect = ValueError("Input is too long")
+        with self.assertRaises(ValueError):
+            BatchedEmbeddings(backend, backoff=0.0).embed_query("a")
+        backend.embed_query.assert_called_once_with("a")
+
+    def test_failing_batches_are_split(self):
+        backend = Mock(name="MockEmbeddingsBackend")
+
+        async def aembed_documents(texts):
+            if "bad" in texts and len(texts) > 1:
+                raise TimeoutError
+            return [[float(len(text))] for text in texts]
+
+        backend.aembed_documents.side_effect = aembed_documents
+        batched = BatchedEmbeddings(backend, max_retries=1, backoff=0.0)
+
+        vectors = batched.embed_documents(["a", "bad", "ccc"])
+
+        self.assertEqual(vectors, [[1.0], [3.0], [3.0]])
+
+    def test_aembed_query_is_retried(self):
+        backend = Mock(name="MockEmbeddingsBackend")
+        backend.aembed_query = AsyncMock(side_effect=[TimeoutError, [1.0]])
+        batched = BatchedEmbeddings(backend, backoff=0.0)
+
+        self.assertEqual(asyncio.run(batched.aembed_query("a")), [1.0])
+        self.assertEqual(batched.retries, 1)
+
+
+class TestLocalEmbeddings(unittest.TestCase):
+
+    @patch("embeddings.SentenceTransformer")
+    def test_embed_documents(self, sentence_transformer_mock):
+        model = sentence_transformer_mock.return_value
+        model.encode.return_value = np.array([[1.0, 0.0], [0.0, 1.0]])
+        local = LocalEmbeddings(model_name="test/model", batch_size=8)
+
+        vectors = local.embed_documents(["a", "bb"])
+
+        sentence_transformer_mock.assert_called_once_with("test/model", device="cpu")
+        model.encode.assert_called_once_with(
+            ["a", "bb"],
+            batch_size=8,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        self.assertEqual(vectors, [[1.0, 0.0], [0.0, 1.0]])
+        self.assertEqual(local.embed_documents([]), [])
+
+    @patch("embeddings.torch.set_num_threads")
+    @patch("embeddings.SentenceTransformer")
+    def test_embed_query_sets_threads(
+        self, sentence_transformer_mock, set_num_threads_mock
+    ):
+        sentence_transformer_mock.return_value.encode.return_value = np.array(
+            [[0.5, 0.5]]
+        )
+        local = LocalEmbeddings(num_threads=3)
+
+        self.assertEqual(local.embed_query("question"), [0.5, 0.5])
+        set_num_threads_mock.assert_called_once_with(3)
+
+    @patch("embeddings.quantize_dynamic")
+    @patch("embeddings.SentenceTransformer")
+    def test_set_model_quantized(
+        self, sentence_transformer_mock, quantize_dynamic_mock
+    ):
+        local = LocalEmbeddings(quantize=True)
+        local.set_model()
+
+        quantize_dynamic_mock.assert_called_once_with(
+            sentence_transformer_mock.return_value,
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+        )
+        self.assertEqual(local.model, quantize_dynamic_mock.return_value)
@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+import torch
+from langchain_core.messages import HumanMessage
+
+from generation_scheduler import GenerationScheduler, GenerationStream
+from local_llm import LocalChatModel
+from prefix_cache import PrefixCache
+from tests.test_local_llm import (
+    StopForward,
+    make_model,
+    make_tokenizer,
+    recording_model,
+)
+
+
+def reference(model, prompt_ids, max_new_tokens, eos_token_id=1):
+    """Greedy tokens of one prompt generated alone, without padding."""
+    tokenizer = Mock(eos_token_id=eos_token_id)
+    chat_model = LocalChatModel(
+        model=model, tokenizer=tokenizer, max_new_tokens=max_new_tokens, do_sample=False
+    )
+    return list(chat_model.generate_tokens(prompt_ids))
+
+
+class TestGenerationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.model = make_model(64)
+        self.scheduler = GenerationScheduler(
+            self.model, eos_token_id=1, max_batch_size=4, max_wait=0.05
+        )
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def test_batched_generation_matches_single(self):
+        rng = random.Random(0)
+        prompts = [
+            [rng.randrange(2, 64) for _ in range(rng.randrange(2, 12))]
+            for _ in range(10)
+        ]
+        streams = []
+        for i, prompt_ids in enumerate(prompts):
+            streams.append(
+                self.scheduler.submit(prompt_ids, max_new_tokens=5 + i, do_sample=False)
+            )
+            time.sleep(0.002)
+
+        for i, (stream, prompt_ids) in enumerate(zip(streams, prompts)):
+            self.assertEqual(
+                stream.result(timeout=10), reference(self.model, prompt_ids, 5 + i)
+            )
+        stats = self.scheduler.get_stats()
+        # Sequences shared steps, so there were fewer steps than tokens.
+        self.assertLess(stats["steps"], stats["generated_tokens"])
+        self.assertEqual(stats["active"], 0)
+
+    def test_join_running_batch(self):
+        scheduler = GenerationScheduler(
+            self.model, eos_token_id=None, max_batch_size=4, max_wait=0.0
+        )
+        long = scheduler.submit([2, 3, 4], max_new_tokens=40, do_sample=False)
+        tokens = iter(long)
+        next(tokens)
+        short = scheduler.submit([5, 6], max_new_tokens=3, do_sample=False)
+
+        self.assertEqual(len(short.result(timeout=10)), 3)
+        self.assertEqual(len(long.result(timeout=10)), 40)
+        self.assertEqual(
+            long.result(), reference(self.model, [2, 3, 4], 40, eos_token_id=None)
+        )
+        self.assertEqual(
+            short.result(), reference(self.model, [5, 6], 3, eos_token_id=None)
+        )
+        # The short request joined the running batch, so its tokens took no steps of their own.
+        self.assertEqual(scheduler.get_stats()["steps"], 39)
+        scheduler.close()
+
+    def test_prefix_cache(self):
+        prefix_cache = PrefixCache(min_tokens=2)
+        scheduler = GenerationScheduler(
+            self.model,
+            eos_token_id=1,
+            max_batch_size=4,
+            max_wait=0.05,
+            prefix_cache=prefix_cache,
+        )
+        history = list(range(2, 30))
+        prompts = [history + [30], history + [31, 32], history + [33, 34, 35]]
+        streams = [
+            scheduler.submit(prompt_ids, max_new_tokens=6, do_sample=False)
+            for prompt_ids in prompts
+        ]
+
+        for stream, prompt_ids in zip(streams, prompts):
+            self.assertEqual(
+                stream.result(timeout=10), reference(self.model, prompt_ids, 6)
+            )
+        self.assertGreaterEqual(
+            prefix_cache.get_stats()["reused_tokens"], 2 * len(history)
+        )
+        scheduler.close()
+
+    def test_stream(self):
+        stream = self.scheduler.submit([2, 3], max_new_tokens=6, do_sample=False)
+        self.assertEqual(list(stream), stream.result())
+
+    def test_cancel(self):
+        scheduler = GenerationScheduler(self.model, eos_token_id=None, max_wait=0.0)
+        stream = scheduler.submit([2, 3], max_new_tokens=1000, do_sample=False)
+        for i, _ in enumerate(stream):
+            if i == 2:
+                stream.cancel()
+        self.assertLess(len(stream.result()), 1000)
+        scheduler.close()
+
+    def test_cancel_while_queued(self):
+        release = threading.Event()
+
+        def forward(*args, **kwargs):
+            release.wait(10)
+            return self.model(*args, **kwargs)
+
+        scheduler = GenerationScheduler(
+            Mock(side_effect=forward), eos_token_id=None, max_batch_size=1
+        )
+        running = scheduler.submit([2, 3], max_new_tokens=2, do_sample=False)
+        queued = scheduler.submit([4, 5], max_new_tokens=2, do_sample=False)
+        queued.cancel()
+        release.set()
+
+        self.assertEqual(queued.result(timeout=10), [])
+        self.assertEqual(list(queued), [])
+        self.assertEqual(len(running.result(timeout=10)), 2)
+        scheduler.close()
+
+    def test_model_error(self):
+        model = Mock(side_effect=RuntimeError("out of memory"))
+        scheduler = GenerationScheduler(model, eos_token_id=None)
+        stream = scheduler.submit([2, 3])
+        with self.assertRaises(RuntimeError):
+            stream.result(timeout=10)
+        with self.assertRaises(RuntimeError):
+            list(stream)
+        scheduler.close()
+
+    def test_submit_after_close(self):
+        self.scheduler.close()
+        with self.assertRaises(RuntimeError):
+            self.scheduler.submit([2, 3])
+
+    def test_inputs_on_model_device(self):
+        meta = torch.device("meta")
+        model, devices = recording_model(meta)
+        scheduler = GenerationScheduler(model, eos_token_id=None)
+        streams = [
+            GenerationStream([2, 3], 5, do_sample=False, temperature=1.0),
+            GenerationStream([4], 5, do_sample=False, temperature=1.0),
+        ]
+        with self.assertRaises(StopForward):
+            scheduler._prefill(streams)
+        scheduler._active = streams
+        scheduler._mask = torch.ones((2, 2), dtype=torch.long, device=meta)
+        scheduler._next_tokens = torch.zeros(2, dtype=torch.long, device=meta)
+        with self.assertRaises(StopForward):
+            scheduler._step()
+
+        self.assertEqual(len(devices), 2)
+        for inputs in devices:
+            self.assertEqual(
+                set(inputs), {"input_ids", "attention_mask", "position_ids"}
+            )
+            self.assertEqual(set(inputs.values()), {meta})
+
+    def test_pad(self):
+        mask = torch.ones((2, 3), dtype=torch.long)
+        self.assertEqual(
+            GenerationScheduler._pad(mask, 5).tolist(), [[0, 0, 1, 1, 1]] * 2
+        )
+        keys = torch.ones((2, 2, 3, 4))
+        self.assertEqual(GenerationScheduler._pad(keys, 5).shape, (2, 2, 5, 4))
+
+
+class TestLocalChatModelScheduler(unittest.TestCase):
+    def test_stream_through_scheduler(self):
+        tokenizer = make_tokenizer()
+        model = make_model(len(tokenizer))
+        scheduler = GenerationScheduler(model, tokenizer.eos_token_id)
+        chat_model = LocalChatModel(
+            model=model, tokenizer=tokenizer, max_new_tokens=8, do_sample=False
+        )
+        batched = LocalChatModel(
+            model=model,
+            tokenizer=tokenizer,
+            scheduler=scheduler,
+            max_new_tokens=8,
+            do_sample=False,
+        )
+        messages = [HumanMessage(content="hello world")]
+
+        self.assertEqual(
+            batched.invoke(messages).content, chat_model.invoke(messages).content
+        )
+        scheduler.close()
@@ -1,45 +1,420 @@
+import threading
 import unittest
-from unittest.mock import AsyncMock, patch
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, Mock, call, patch
 
-from index import Indexer
+from langchain_core.documents import Document
+
+from bm25 import BM25Index
+from bulk_writer import BulkWriter
+from index import FileProgress, Indexer
+from manifest import IndexManifest
 
 
 class TestIndexer(unittest.TestCase):
     def setUp(self):
-        self.indexer = Indexer()
+        self.indexer = Indexer(manifest=IndexManifest())
 
+    @patch("index.Blob")
     @patch("index.PyPDFLoader")
     @patch("index.RecursiveCharacterTextSplitter")
     def test_load_and_split_data(
-        self, recursive_character_text_splitter_mock, py_pdf_loader_mock
+        self, recursive_character_text_splitter_mock, py_pdf_loader_mock, blob_mock
     ):
         test_file = "test.pdf"
         loader = py_pdf_loader_mock.return_value
-        loader.load_and_split.return_value = ["mocked pages"]
+        loader.parser.lazy_parse.return_value = iter(["mocked page 1", "mocked page 2"])
         text_splitter = recursive_character_text_splitter_mock.return_value
-        text_splitter.split_documents.return_value = ["mocked_splits"]
+        text_splitter.split_documents.side_effect = lambda pages: [f"{pages[0]} split"]
         splits = self.indexer.load_and_split_data(test_file)
 
         py_pdf_loader_mock.assert_called_once_with("test.pdf")
+        blob_mock.from_path.assert_called_once_with(loader.file_path)
+        loader.parser.lazy_parse.assert_called_once_with(
+            blob_mock.from_path.return_value
+        )
         recursive_character_text_splitter_mock.assert_called_once_with(
             chunk_size=1000, chunk_overlap=200
         )
-        text_splitter.split_documents.assert_called_once_with(["mocked pages"])
-        self.assertEqual(splits, ["mocked_splits"])
+        text_splitter.split_documents.assert_any_call(["mocked page 1"])
+        text_splitter.split_documents.assert_any_call(["mocked page 2"])
+        self.assertEqual(splits, ["mocked page 1 split", "mocked page 2 split"])
+
+    @patch("index.Blob")
+    @patch("index.PyPDFLoader")
+    @patch("index.RecursiveCharacterTextSplitter")
+    def test_iter_chunks_is_lazy(
+        self, recursive_character_text_splitter_mock, py_pdf_loader_mock, blob_mock
+    ):
+        pages_read = []
 
-    @patch("index.Indexer.load_and_split_data")
+        def lazy_parse(blob):
+            for page in range(3):
+                pages_read.append(page)
+                yield page
+
+        py_pdf_loader_mock.return_value.parser.lazy_parse.side_effect = lazy_parse
+        recursive_character_text_splitter_mock.return_value.split_documents.side_effect = lambda pages: [
+            pages[0],
+            pages[0],
+        ]
+        chunks = self.indexer.iter_chunks("test.pdf")
+
+        self.assertEqual(next(chunks), 0)
+        self.assertEqual(pages_read, [0])
+
+    @patch("index.IndexManifest.hash_file", return_value="v1")
+    @patch("index.Indexer.iter_chunks")
     @patch("index.Indexer.get_vectorstore")
-    def test_add_doc(self, get_vectorstore_mock, load_and_split_data_mock):
+    def test_add_doc(self, get_vectorstore_mock, iter_chunks_mock, hash_file_mock):
         test_file = "temp_test.pdf"
         test_file_name = "test.pdf"
         vectorstore_mock = get_vectorstore_mock.return_value
-        load_and_split_data_mock.return_value = ["mocked stuff"]
-        vectorstore_mock.aadd_documents = AsyncMock()
+        vectorstore_mock.embeddings.embed_documents.side_effect = lambda texts: [
+            [float(len(text))] for text in texts
+        ]
+
+        iter_chunks_mock.side_effect = lambda file: iter(
+            [Document(page_content=str(chunk)) for chunk in range(5)]
+        )
+        self.indexer.batch_size = 2
+        self.indexer.writer = BulkWriter(vectorstore_mock, batch_size=3)
         self.indexer.add_doc(test_file_name, test_file)
         self.assertIn("test.pdf", self.indexer.files)
-        load_and_split_data_mock.assert_called_once()
-        vectorstore_mock.aadd_documents.assert_called_with(["mocked stuff"])
-        vectorstore_mock.aadd_documents.assert_called_once()
+        hash_file_mock.assert_called_once_with(test_file)
+        iter_chunks_mock.assert_called_once_with(test_file)
+        # The writer imports its own batches of precomputed vectors, the last one being flushed with the file.
+        self.assertEqual(
+            [call.args[1] for call in vectorstore_mock.add_vectors.call_args_list],
+            [["0", "1", "2"], ["3", "4"]],
+        )
+        self.assertEqual(vectorstore_mock.add_vectors.call_args.args[0], [[1.0], [1.0]])
+        self.assertEqual(
+            vectorstore_mock.add_vectors.call_args.kwargs["ids"],
+            [IndexManifest.chunk_id("3"), IndexManifest.chunk_id("4")],
+        )
+        self.assertEqual(self.indexer.writer.get_stats()["chunks"], 5)
+
+        self.indexer.add_doc(test_file_name, test_file)
+        iter_chunks_mock.assert_called_once()
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.iter_chunks")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_doc_reindexes_changed_chunks_only(
+        self, get_vectorstore_mock, iter_chunks_mock, hash_file_mock
+    ):
+        vectorstore_mock = get_vectorstore_mock.return_value
+        vectorstore_mock.adelete = AsyncMock()
+        versions = {"v1": ["intro", "old"], "v2": ["intro", "new", "new"]}
+        iter_chunks_mock.side_effect = lambda file: iter(
+            [Document(page_content=text) for text in versions[file]]
+        )
+        hash_file_mock.side_effect = lambda file: file
+
+        self.indexer.add_doc("test.pdf", "v1")
+        self.indexer.add_doc("test.pdf", "v2")
+
+        self.assertEqual(vectorstore_mock.add_vectors.call_count, 2)
+        added = vectorstore_mock.add_vectors.call_args
+        self.assertEqual(added.args[1], ["new"])
+        self.assertEqual(added.kwargs["ids"], [IndexManifest.chunk_id("new")])
+        vectorstore_mock.adelete.assert_awaited_once_with(
+            [IndexManifest.chunk_id("old")]
+        )
+        self.assertEqual(self.indexer.files, ["test.pdf"])
+        self.assertTrue(self.indexer.is_indexed("test.pdf", "v2"))
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.iter_chunks")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_doc_updates_lexical_index(
+        self, get_vectorstore_mock, iter_chunks_mock, hash_file_mock
+    ):
+        vectorstore_mock = get_vectorstore_mock.return_value
+        vectorstore_mock.adelete = AsyncMock()
+        lexical_index = BM25Index()
+        lexical_index.save = Mock()
+        indexer = Indexer(manifest=IndexManifest(), lexical_index=lexical_index)
+        versions = {"v1": ["intro", "code X100"], "v2": ["intro", "code Y200"]}
+        iter_chunks_mock.side_effect = lambda file: iter(
+            [Document(page_content=text) for text in versions[file]]
+        )
+        hash_file_mock.side_effect = lambda file: file
+
+        indexer.add_doc("test.pdf", "v1")
+        indexer.add_doc("test.pdf", "v2")
+
+        self.assertEqual(len(lexical_index), 2)
+        self.assertEqual(lexical_index.search("x100"), [])
+        self.assertEqual(lexical_index.search("y200")[0][0].page_content, "code Y200")
+        self.assertEqual(lexical_index.save.call_count, 2)
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.iter_chunks")
+    @patch("index.Indexer.get_vectorstore")
+    def test_listeners_run_when_the_store_changes(
+        self, get_vectorstore_mock, iter_chunks_mock, hash_file_mock
+    ):
+        vectorstore_mock = get_vectorstore_mock.return_value
+        listener = Mock()
+        self.indexer.add_listener(listener)
+        iter_chunks_mock.side_effect = lambda file: iter(
+            [Document(page_content="shared")]
+        )
+        hash_file_mock.side_effect = lambda file: file
+
+        self.indexer.add_doc("a.pdf", "a.pdf")
+        self.indexer.add_doc("b.pdf", "b.pdf")
+
+        # The listeners run once the chunk is written and once the file is recorded, the second file only
+        # references a chunk that is already stored.
+        self.assertEqual(listener.call_count, 2)
+        self.assertEqual(self.indexer.generation, 2)
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.iter_chunks")
+    @patch("index.Indexer.get_vectorstore")
+    def test_listeners_run_as_soon_as_chunks_are_deleted(
+        self, get_vectorstore_mock, iter_chunks_mock, hash_file_mock
+    ):
+        vectorstore_mock = get_vectorstore_mock.return_value
+        vectorstore_mock.adelete = AsyncMock()
+        versions = {"v1": ["intro", "old"], "v2": ["intro"]}
+        iter_chunks_mock.side_effect = lambda file: iter(
+            [Document(page_content=text) for text in versions[file]]
+        )
+        hash_file_mock.side_effect = lambda file: file
+        self.indexer.add_doc("test.pdf", "v1")
+        changes = []
+        self.indexer.add_listener(
+            lambda: changes.append(
+                (
+                    vectorstore_mock.adelete.await_count,
+                    self.indexer.is_indexed("test.pdf", "v2"),
+                )
+            )
+        )
+
+        self.indexer.add_doc("test.pdf", "v2")
+
+        # The generation moves before the file is recorded, so the deleted chunk is not served from a cache meanwhile.
+        self.assertEqual(changes, [(1, False), (1, True)])
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.count_pages", return_value=1)
+    @patch("index.Indexer.load_pages")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_docs(
+        self, get_vectorstore_mock, load_pages_mock, count_pages_mock, hash_file_mock
+    ):
+        def count_pages(file):
+            if file == "broken.pdf":
+                raise ValueError("not a PDF")
+            return 1
+
+        count_pages_mock.side_effect = count_pages
+        load_pages_mock.side_effect = lambda file, start, stop: [
+            Document(page_content=f"{file} chunk 1"),
+            Document(page_content=f"{file} chunk 2"),
+            Document(page_content="shared footer"),
+        ]
+        hash_file_mock.side_effect = lambda file: file
+        vectorstore_mock = get_vectorstore_mock.return_value
+        self.indexer.manifest.update("done.pdf", "done.pdf", [])
+        progress = []
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = self.indexer.add_docs(
+                [
+                    ("a.pdf", "a.pdf"),
+                    ("broken.pdf", "broken.pdf"),
+                    ("b.pdf", "b.pdf"),
+                    ("done.pdf", "done.pdf"),
+                ],
+                on_progress=progress.append,
+                executor=executor,
+                max_concurrent_writes=1,
+            )
+
+        self.assertEqual(set(results), {"a.pdf", "b.pdf", "broken.pdf", "done.pdf"})
+        self.assertIsNone(results["a.pdf"])
+        self.assertIsNone(results["done.pdf"])
+        self.assertIsInstance(results["broken.pdf"], ValueError)
+        self.assertCountEqual(self.indexer.files, ["a.pdf", "b.pdf"])
+        self.assertEqual(vectorstore_mock.add_vectors.call_count, 2)
+        added_ids = [
+            chunk_id
+            for call in vectorstore_mock.add_vectors.call_args_list
+            for chunk_id in call.kwargs["ids"]
+        ]
+        # The chunk both files contain is stored once.
+        self.assertEqual(len(added_ids), 5)
+        self.assertEqual(len(set(added_ids)), 5)
+        load_pages_mock.assert_has_calls(
+            [call("a.pdf", 0, 16), call("b.pdf", 0, 16)], any_order=True
+        )
+        self.assertEqual(load_pages_mock.call_count, 2)
+        self.assertNotIn(call("done.pdf"), count_pages_mock.call_args_list)
+        self.assertIn(FileProgress("a.pdf", "parsed", 3), progress)
+        self.assertIn(FileProgress("b.pdf", "indexed", 3), progress)
+        self.assertIn(FileProgress("done.pdf", "unchanged"), progress)
+        self.assertIn(
+            FileProgress("broken.pdf", "failed", error=results["broken.pdf"]),
+            progress,
+        )
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.count_pages", return_value=1)
+    @patch("index.Indexer.load_pages")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_docs_saves_lexical_index_once(
+        self, get_vectorstore_mock, load_pages_mock, count_pages_mock, hash_file_mock
+    ):
+        load_pages_mock.side_effect = lambda file, start, stop: [
+            Document(page_content=file)
+        ]
+        hash_file_mock.side_effect = lambda file: file
+        lexical_index = BM25Index()
+        lexical_index.save = Mock()
+        indexer = Indexer(manifest=IndexManifest(), lexical_index=lexical_index)
+        files = [("a.pdf", "a.pdf"), ("b.pdf", "b.pdf")]
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            indexer.add_docs(files, executor=executor)
+
+            lexical_index.save.assert_called_once_with()
+            self.assertTrue(indexer.is_indexed("a.pdf", "a.pdf"))
+            # The manifest recorded a file whose chunks a crash kept out of the saved lexical index.
+            indexer.lexical_index = BM25Index()
+            self.assertFalse(indexer.is_indexed("a.pdf", "a.pdf"))
+            indexer.add_docs(files[:1], executor=executor)
+
+        self.assertIn(IndexManifest.chunk_id("a.pdf"), indexer.lexical_index)
+        # Its chunk was stored already, so it is not embedded again.
+        written = [
+            chunk_id
+            for call in get_vectorstore_mock.return_value.add_vectors.call_args_list
+            for chunk_id in call.kwargs["ids"]
+        ]
+        self.assertEqual(len(written), 2)
+
+    @patch("index.IndexManifest.hash_file")
+    @patch("index.Indexer.count_pages", return_value=1)
+    @patch("index.Indexer.load_pages")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_docs_write_failure(
+        self, get_vectorstore_mock, load_pages_mock, count_pages_mock, hash_file_mock
+    ):
+        load_pages_mock.side_effect = lambda file, start, stop: [
+            Document(page_content=file)
+        ]
+        hash_file_mock.side_effect = lambda file: file
+        vectorstore_mock = get_vectorstore_mock.return_value
+        vectorstore_mock.add_vectors.side_effect = [ConnectionError("down"), None]
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = self.indexer.add_docs(
+                [("a.pdf", "a.pdf"), ("b.pdf", "b.pdf")],
+                executor=executor,
+                max_concurrent_writes=1,
+            )
+
+        self.assertIsInstance(results["a.pdf"], ConnectionError)
+        self.assertIsNone(results["b.pdf"])
+        self.assertEqual(self.indexer.files, ["b.pdf"])
+        self.assertFalse(self.indexer.is_indexed("a.pdf", "a.pdf"))
+        self.assertFalse(self.indexer._pending_chunks)
+
+    @patch("index.IndexManifest.hash_file", return_value="v1")
+    @patch("index.Indexer.count_pages", return_value=5)
+    @patch("index.Indexer.load_pages")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_docs_streams_page_ranges(
+        self, get_vectorstore_mock, load_pages_mock, count_pages_mock, hash_file_mock
+    ):
+        parsed = []
+
+        def load_pages(file, start, stop):
+            parsed.append((start, stop))
+            return [
+                Document(page_content=f"page {page}") for page in range(start, stop)
+            ]
+
+        load_pages_mock.side_effect = load_pages
+        self.indexer.batch_size = 2
+        progress = []
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = self.indexer.add_docs(
+                [("a.pdf", "a.pdf")],
+                on_progress=progress.append,
+                executor=executor,
+                pages_per_task=2,
+            )
+
+        self.assertIsNone(results["a.pdf"])
+        self.assertEqual(parsed, [(0, 2), (2, 4), (4, 6)])
+        self.assertIn(FileProgress("a.pdf", "indexed", 6), progress)
+        self.assertEqual(len(self.indexer.manifest.files["a.pdf"]["chunks"]), 6)
+
+    @patch("index.pypdf.PdfReader")
+    @patch("index.RecursiveCharacterTextSplitter")
+    def test_load_pages(self, recursive_character_text_splitter_mock, pdf_reader_mock):
+        pdf_reader_mock.return_value.pages = [
+            Mock(**{"extract_text.return_value": f"text {page}"}) for page in range(3)
+        ]
+        text_splitter = recursive_character_text_splitter_mock.return_value
+        text_splitter.split_documents.side_effect = lambda pages: pages
+
+        chunks = self.indexer.load_pages("test.pdf", 1, 16)
+
+        pdf_reader_mock.assert_called_once_with("test.pdf")
+        self.assertEqual(
+            chunks,
+            [
+                Document(
+                    page_content="text 1", metadata={"source": "test.pdf", "page": 1}
+                ),
+                Document(
+                    page_content="text 2", metadata={"source": "test.pdf", "page": 2}
+                ),
+            ],
+        )
+
+    @patch("index.IndexManifest.hash_file", return_value="v1")
+    @patch("index.Indexer.iter_chunks")
+    @patch("index.Indexer.get_vectorstore")
+    def test_add_doc_stops_after_failed_write(
+        self, get_vectorstore_mock, iter_chunks_mock, hash_file_mock
+    ):
+        vectorstore_mock = get_vectorstore_mock.return_value
+        vectorstore_mock.embeddings.embed_documents.side_effect = lambda texts: [
+            [1.0] for _ in texts
+        ]
+        vectorstore_mock.add_vectors.side_effect = ConnectionError("down")
+        writer = BulkWriter(vectorstore_mock, batch_size=1)
+        write_failed = threading.Event()
+        write = writer._write
+        writer._write = lambda batch: (write(batch), write_failed.set())
+
+        def chunks(file):
+            yield Document(page_content="0")
+            write_failed.wait(10)
+            yield from [Document(page_content="1"), Document(page_content="2")]
+
+        iter_chunks_mock.side_effect = chunks
+        self.indexer.batch_size = 1
+        self.indexer.writer = writer
+
+        with self.assertRaises(ConnectionError):
+            self.indexer.add_doc("test.pdf", "temp_test.pdf")
+        # The chunks read once the failure is known are not sent.
+        self.assertEqual(
+            [call.args[1] for call in vectorstore_mock.add_vectors.call_args_list],
+            [["0"], ["1"]],
+        )
+        self.assertNotIn("test.pdf", self.indexer.files)
 
     @patch("index.Database")
     @patch("index.Embeddings")
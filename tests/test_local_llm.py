@@ -0,0 +1,223 @@
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+import torch
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from local_llm import Int4Linear, LocalChatModel, held_back, load_model
+from prefix_cache import PrefixCache
+
+WORDS = ["user", "assistant", "system", "hello", "world", "stop", "here", "again"]
+
+
+def make_tokenizer():
+    vocab = {"[UNK]": 0, "</s>": 1, **{word: i + 2 for i, word in enumerate(WORDS)}}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="[UNK]", eos_token="</s>"
+    )
+
+
+class StopForward(Exception):
+    pass
+
+
+def recording_model(device):
+    """A model on the given device, recording the devices of its tensor inputs and stopping at the first call."""
+    devices = []
+
+    def forward(**kwargs):
+        devices.append(
+            {
+                name: value.device
+                for name, value in kwargs.items()
+                if isinstance(value, torch.Tensor)
+            }
+        )
+        raise StopForward
+
+    return Mock(side_effect=forward, device=device), devices
+
+
+def make_model(vocab_size, hidden_size=16):
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=2 * hidden_size,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        num_key_value_heads=2,
+        max_position_embeddings=64,
+        eos_token_id=1,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+class TestLocalChatModel(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = make_tokenizer()
+        self.model = make_model(len(self.tokenizer))
+        self.chat_model = LocalChatModel(
+            model=self.model,
+            tokenizer=self.tokenizer,
+            max_new_tokens=8,
+            do_sample=False,
+        )
+
+    def test_encode_without_chat_template(self):
+        prompt_ids = self.chat_model.encode(
+            [SystemMessage(content="hello"), HumanMessage(content="world")]
+        )
+        self.assertEqual(
+            self.tokenizer.decode(prompt_ids),
+            "system [UNK] hello user [UNK] world assistant [UNK]",
+        )
+
+    def test_encode_with_chat_template(self):
+        self.tokenizer.chat_template = (
+            "{% for message in messages %}{{ message['role'] }} {{ message['content'] }} {% endfor %}"
+            "{% if add_generation_prompt %}assistant{% endif %}"
+        )
+        prompt_ids = self.chat_model.encode([HumanMessage(content="hello")])
+        self.assertEqual(self.tokenizer.decode(prompt_ids), "user hello assistant")
+
+    def test_generate_tokens_matches_generate(self):
+        prompt_ids = self.chat_model.encode([HumanMessage(content="hello world")])
+        expected = self.model.generate(
+            torch.tensor([prompt_ids]),
+            max_new_tokens=8,
+            do_sample=False,
+            eos_token_id=self.tokenizer.eos_token_id,
+            pad_token_id=self.tokenizer.eos_token_id,
+        )[0, len(prompt_ids) :].tolist()
+        expected = [token for token in expected if token != self.tokenizer.eos_token_id]
+
+        self.assertEqual(list(self.chat_model.generate_tokens(prompt_ids)), expected)
+
+    def test_stream_matches_invoke(self):
+        messages = [HumanMessage(content="hello")]
+        chunks = [chunk.content for chunk in self.chat_model.stream(messages)]
+        response = self.chat_model.invoke(messages)
+
+        self.assertIsInstance(response, AIMessage)
+        self.assertEqual("".join(chunks), response.content)
+        self.assertGreater(len(chunks), 1)
+
+    def test_stop_sequences(self):
+        tokens = self.tokenizer.convert_tokens_to_ids(
+            ["hello", "world", "stop", "here", "again"]
+        )
+        with patch.object(LocalChatModel, "generate_tokens", return_value=iter(tokens)):
+            chunks = [
+                chunk.content
+                for chunk in self.chat_model.stream(
+                    [HumanMessage(content="hello")], stop=[" stop here"]
+                )
+            ]
+        self.assertEqual(chunks, ["hello", " world"])
+
+    def test_stream_decodes_incrementally(self):
+        tokens = self.tokenizer.convert_tokens_to_ids(WORDS * 4)
+        with patch.object(
+            LocalChatModel, "generate_tokens", return_value=iter(tokens)
+        ), patch.object(
+            self.tokenizer, "decode", wraps=self.tokenizer.decode
+        ) as decode_mock:
+            chunks = [
+                chunk.content
+                for chunk in self.chat_model.stream([HumanMessage(content="hello")])
+            ]
+        self.assertEqual(
+            "".join(chunks), self.tokenizer.decode(tokens, skip_special_tokens=True)
+        )
+        # Each step decodes at most two tokens.
+        self.assertTrue(all(len(call.args[0]) <= 2 for call in decode_mock.mock_calls))
+
+    def test_inputs_on_model_device(self):
+        meta = torch.device("meta")
+        model, devices = recording_model(meta)
+        for prefix_cache in (None, PrefixCache(min_tokens=2)):
+            chat_model = LocalChatModel(
+                model=model, tokenizer=Mock(eos_token_id=1), prefix_cache=prefix_cache
+            )
+            with self.assertRaises(StopForward):
+                next(chat_model.generate_tokens([2, 3, 4]))
+
+        self.assertEqual(devices, [{"input_ids": meta}] * 2)
+
+    def test_held_back(self):
+        self.assertEqual(held_back("hello wor", ["world"]), 3)
+        self.assertEqual(held_back("hello", ["world"]), 0)
+        self.assertEqual(held_back("hello", []), 0)
+
+
+class TestLoadModel(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        make_model(16).save_pretrained(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_int8(self):
+        model = load_model(self.tmp_dir.name, quantization="int8")
+        layer = model.model.layers[0].self_attn.q_proj
+        self.assertIsInstance(layer, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertFalse(model.training)
+        self.assertEqual(model(torch.tensor([[1, 2, 3]])).logits.shape, (1, 3, 16))
+
+    def test_full_precision(self):
+        model = load_model(self.tmp_dir.name, quantization=None)
+        self.assertIsInstance(model.model.layers[0].self_attn.q_proj, torch.nn.Linear)
+
+    @patch("local_llm.torch.cuda.is_available", return_value=True)
+    @patch("local_llm.get_quantization_config")
+    @patch("local_llm.AutoModelForCausalLM")
+    def test_int4(self, auto_model_mock, get_quantization_config_mock, _):
+        model = load_model("test/model", quantization="int4")
+        auto_model_mock.from_pretrained.assert_called_once_with(
+            "test/model",
+            quantization_config=get_quantization_config_mock.return_value,
+            device_map="auto",
+        )
+        self.assertEqual(model, auto_model_mock.from_pretrained.return_value)
+
+    @patch("local_llm.torch.cuda.is_available", return_value=False)
+    def test_int4_on_cpu(self, _):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            make_model(16, hidden_size=64).save_pretrained(tmp_dir)
+            reference = load_model(tmp_dir, quantization=None)
+            model = load_model(tmp_dir, quantization="int4")
+        self.assertIsInstance(model.model.layers[0].self_attn.q_proj, Int4Linear)
+        self.assertIsInstance(model.lm_head, Int4Linear)
+        self.assertFalse(model.training)
+        inputs = torch.tensor([[1, 2, 3]])
+        with torch.inference_mode():
+            logits, expected = model(inputs).logits, reference(inputs).logits
+        self.assertEqual(logits.shape, (1, 3, 16))
+        self.assertLess(float((logits - expected).abs().max()), 0.1)
+
+    def test_int4_linear(self):
+        torch.manual_seed(0)
+        linear = torch.nn.Linear(64, 16)
+        inputs = torch.randn(2, 3, 64)
+        self.assertTrue(Int4Linear.supports(linear))
+        self.assertFalse(Int4Linear.supports(torch.nn.Linear(16, 16)))
+        outputs = Int4Linear(linear)(inputs)
+        # The weights rounded to 16 levels between the minimum and maximum of each group of 32 inputs.
+        groups = linear.weight.detach().reshape(16, 2, 32)
+        low = groups.amin(dim=-1, keepdim=True)
+        scales = (groups.amax(dim=-1, keepdim=True) - low) / 15
+        weight = (((groups - low) / scales).round() * scales + low).reshape(16, 64)
+        expected = inputs @ weight.T + linear.bias.detach()
+        self.assertEqual(outputs.shape, (2, 3, 16))
+        self.assertLess(float((outputs - expected).abs().max()), 0.05)
+
+    def test_unknown_quantization(self):
+        with self.assertRaises(ValueError):
+            load_model(self.tmp_dir.name, quantization="fp8")
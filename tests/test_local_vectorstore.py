@@ -0,0 +1,271 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ann_index import HNSWIndex
+from local_vectorstore import LocalVectorStore
+
+
+class KeywordEmbeddings(Embeddings):
+    """Embeds texts by counting a few keywords, so that similarities are predictable."""
+
+    keywords = ["cat", "dog", "fish", "bird"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(text.count(keyword)) + 0.01 for keyword in self.keywords]
+
+
+class TestLocalVectorStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.embedding = KeywordEmbeddings()
+        self.store = LocalVectorStore(embedding=self.embedding, path=self.temp_dir.name)
+        self.ids = self.store.add_texts(
+            ["cat cat", "dog", "fish fish", "cat dog"],
+            metadatas=[{"page": 1}, {"page": 2}, {"page": 1}, {"page": 2}],
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_similarity_search(self):
+        docs = self.store.similarity_search("cat", k=2)
+        self.assertEqual([doc.page_content for doc in docs], ["cat cat", "cat dog"])
+        self.assertEqual(docs[0].metadata, {"page": 1})
+
+    def test_similarity_search_with_score_and_filter(self):
+        results = self.store.similarity_search_with_score(
+            "dog", k=4, filter={"page": 2}
+        )
+        self.assertEqual([doc.page_content for doc, _ in results], ["dog", "cat dog"])
+        self.assertAlmostEqual(results[0][1], 1.0, places=3)
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_similarity_search_by_vector_batch(self):
+        queries = ["cat", "dog", "fish", "bird cat"]
+        vectors = [self.embedding.embed_query(query) for query in queries]
+        ks = [2, 1, 3, 2]
+
+        results = self.store.similarity_search_by_vector_batch(
+            vectors, ks, block_size=3
+        )
+
+        self.assertEqual(
+            results,
+            [self.store.similarity_search(query, k=k) for query, k in zip(queries, ks)],
+        )
+        filtered = self.store.similarity_search_by_vector_batch(
+            vectors[:2], [4, 4], filters=[{"page": 2}, None]
+        )
+        self.assertEqual([doc.page_content for doc in filtered[0]], ["cat dog", "dog"])
+        self.assertEqual(len(filtered[1]), 4)
+
+    def test_similarity_search_by_vector_batch_hnsw(self):
+        store = LocalVectorStore(embedding=self.embedding, index="hnsw")
+        store.add_texts(["cat cat", "dog", "fish fish"])
+        vectors = [self.embedding.embed_query(query) for query in ["dog", "fish"]]
+
+        results = store.similarity_search_by_vector_batch(vectors, [1, 1])
+
+        self.assertEqual(
+            [[doc.page_content for doc in docs] for docs in results],
+            [["dog"], ["fish fish"]],
+        )
+        self.assertEqual(
+            LocalVectorStore(
+                embedding=self.embedding
+            ).similarity_search_by_vector_batch(vectors, [1, 1]),
+            [[], []],
+        )
+
+    def test_dot_metric(self):
+        store = LocalVectorStore(embedding=self.embedding, metric="dot")
+        store.add_texts(["cat", "cat cat cat", "dog"])
+        self.assertEqual(
+            store.similarity_search("cat", k=1)[0].page_content, "cat cat cat"
+        )
+
+    def test_dot_metric_relevance_scores(self):
+        store = LocalVectorStore(embedding=self.embedding, metric="dot")
+        store.add_texts(["cat cat cat", "dog"])
+        scores = [
+            score
+            for _, score in store.similarity_search_with_relevance_scores("cat", k=2)
+        ]
+        self.assertTrue(all(0.0 <= score <= 1.0 for score in scores))
+        self.assertGreater(scores[0], scores[1])
+
+    def test_duplicate_ids_in_one_call(self):
+        self.store.add_texts(["bird", "fish"], ids=["x", "x"])
+
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.ids.count("x"), 1)
+        self.assertEqual(
+            self.store.similarity_search("fish", k=1)[0].page_content, "fish"
+        )
+        reloaded = LocalVectorStore(embedding=self.embedding, path=self.temp_dir.name)
+        self.assertEqual(len(reloaded), 5)
+
+    def test_delete_and_upsert(self):
+        self.assertTrue(self.store.delete([self.ids[0]]))
+        self.assertFalse(self.store.delete(["missing"]))
+        self.store.add_texts(["bird"], ids=[self.ids[1]])
+
+        self.assertEqual(len(self.store), 3)
+        contents = [
+            doc.page_content for doc in self.store.similarity_search("cat dog", k=4)
+        ]
+        self.assertNotIn("cat cat", contents)
+        self.assertNotIn("dog", contents)
+        self.assertIn("bird", contents)
+
+    def test_persistence(self):
+        self.store.delete([self.ids[2]])
+        reloaded = LocalVectorStore(embedding=self.embedding, path=self.temp_dir.name)
+
+        self.assertEqual(len(reloaded), 3)
+        np.testing.assert_array_equal(
+            reloaded.vectors[: reloaded.size], self.store.vectors[: self.store.size]
+        )
+        docs = reloaded.similarity_search("fish", k=1)
+        self.assertNotEqual(docs[0].page_content, "fish fish")
+        reloaded.add_texts(["fish"])
+        self.assertEqual(
+            reloaded.similarity_search("fish", k=1)[0].page_content, "fish"
+        )
+
+    def test_persistence_after_interrupted_write(self):
+        # A crash left the vector of a row without its document, and half of another document.
+        with open(self.store._file("vectors.f32"), "ab") as f:
+            f.write(np.ones(4, dtype=np.float32).tobytes())
+        with open(self.store._file("docs.jsonl"), "a") as f:
+            f.write('{"id": "orphan", "te')
+        reloaded = LocalVectorStore(embedding=self.embedding, path=self.temp_dir.name)
+        self.assertEqual(len(reloaded), 4)
+        reloaded.add_texts(["bird"])
+
+        reloaded = LocalVectorStore(embedding=self.embedding, path=self.temp_dir.name)
+        docs_and_scores = reloaded.similarity_search_with_score("bird", k=1)
+        self.assertEqual(docs_and_scores[0][0].page_content, "bird")
+        self.assertAlmostEqual(docs_and_scores[0][1], 1.0, places=5)
+
+    def test_max_marginal_relevance_search(self):
+        self.store.add_texts(["cat cat cat"])
+        docs = self.store.max_marginal_relevance_search("cat", k=2, fetch_k=4)
+        contents = [doc.page_content for doc in docs]
+        self.assertIn(contents[0], ["cat cat", "cat cat cat"])
+        # The second copy of the same direction is redundant and must not be picked.
+        self.assertEqual(len({"cat cat", "cat cat cat"} & set(contents)), 1)
+
+    def test_as_retriever(self):
+        retriever = self.store.as_retriever(search_kwargs={"k": 1})
+        self.assertEqual(retriever.invoke("fish")[0].page_content, "fish fish")
+
+    def test_async_search(self):
+        embed_query = self.embedding.embed_query
+        self.embedding.aembed_query = AsyncMock(side_effect=embed_query)
+        self.embedding.embed_query = Mock(side_effect=AssertionError)
+
+        docs = asyncio.run(
+            self.store.as_retriever(search_kwargs={"k": 2}).ainvoke("cat")
+        )
+        mmr_docs = asyncio.run(
+            self.store.amax_marginal_relevance_search("cat", k=2, fetch_k=4)
+        )
+
+        self.assertEqual([doc.page_content for doc in docs], ["cat cat", "cat dog"])
+        self.assertEqual(mmr_docs[0].page_content, "cat cat")
+        self.assertEqual(self.embedding.aembed_query.await_count, 2)
+
+    def test_hnsw_index(self):
+        store = LocalVectorStore(
+            embedding=self.embedding, path=self.temp_dir.name, index="hnsw"
+        )
+        self.assertEqual(len(store.hnsw), 4)
+        ids = store.add_texts(["bird", "bird cat"])
+        self.assertEqual(len(store.hnsw), 6)
+
+        docs = store.similarity_search("bird", k=2, ef_search=8)
+        self.assertEqual([doc.page_content for doc in docs], ["bird", "bird cat"])
+        store.delete([ids[0]])
+        self.assertEqual(
+            store.similarity_search("bird", k=1)[0].page_content, "bird cat"
+        )
+        retriever = store.as_retriever(search_kwargs={"k": 1, "ef_search": 4})
+        self.assertEqual(retriever.invoke("fish")[0].page_content, "fish fish")
+
+    def test_hnsw_graph_persisted(self):
+        store = LocalVectorStore(
+            embedding=self.embedding, path=self.temp_dir.name, index="hnsw"
+        )
+        with patch.object(HNSWIndex, "add", autospec=True) as add_mock:
+            reloaded = LocalVectorStore(
+                embedding=self.embedding, path=self.temp_dir.name, index="hnsw"
+            )
+        # The graph is read back, only the rows added since it was saved are inserted.
+        add_mock.assert_called_once_with(reloaded.hnsw, reloaded.vectors, [])
+        self.assertEqual(reloaded.hnsw.links, store.hnsw.links)
+        self.assertEqual(reloaded.hnsw.entry_point, store.hnsw.entry_point)
+
+        self.store.add_texts(["bird"])
+        reloaded = LocalVectorStore(
+            embedding=self.embedding, path=self.temp_dir.name, index="hnsw"
+        )
+        self.assertEqual(len(reloaded.hnsw), 5)
+        self.assertEqual(
+            reloaded.similarity_search("bird", k=1)[0].page_content, "bird"
+        )
+
+    def test_hnsw_rebuilt_after_deletes(self):
+        store = LocalVectorStore(
+            embedding=self.embedding, path=self.temp_dir.name, index="hnsw"
+        )
+        store.delete([self.ids[0]])
+        self.assertEqual(store.hnsw.n_nodes, 4)
+        with store._rebuild_lock:
+            store.delete([self.ids[2]])
+            # The current graph keeps serving, skipping the deleted rows, until the rebuild is done.
+            self.assertEqual(store.hnsw.n_nodes, 4)
+            self.assertEqual(
+                [doc.page_content for doc in store.similarity_search("cat", k=4)],
+                ["cat dog", "dog"],
+            )
+        store.wait_for_graph_rebuild()
+
+        self.assertEqual(store.hnsw.n_nodes, 2)
+        self.assertEqual(
+            [doc.page_content for doc in store.similarity_search("cat", k=4)],
+            ["cat dog", "dog"],
+        )
+        reloaded = LocalVectorStore(
+            embedding=self.embedding, path=self.temp_dir.name, index="hnsw"
+        )
+        self.assertEqual(reloaded.hnsw.n_nodes, 2)
+
+    def test_rebuild_graph_keeps_rows_added_meanwhile(self):
+        store = LocalVectorStore(embedding=self.embedding, index="hnsw")
+        store.add_texts(["cat", "dog", "bird"], ids=["a", "b", "c"])
+        store.delete(["a", "b"])
+        store.add_texts(["fish"], ids=["d"])
+        store.wait_for_graph_rebuild()
+        store.rebuild_graph()
+
+        self.assertEqual(store.hnsw.n_nodes, 2)
+        self.assertEqual(store.similarity_search("fish", k=1)[0].page_content, "fish")
+
+    def test_unknown_index(self):
+        with self.assertRaises(ValueError):
+            LocalVectorStore(index="ivf")
+
+    def test_from_texts(self):
+        store = LocalVectorStore.from_texts(
+            ["cat", "dog"], self.embedding, ids=["a", "b"]
+        )
+        self.assertEqual(store.rows, {"a": 0, "b": 1})
@@ -1,7 +1,13 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import ANY, Mock, patch
 
+from langchain_core.messages import HumanMessage
+
+from index import FileProgress
 from main import RAGApp  # Assuming your script is named rag_app.py
+from resources import ResourceRegistry
 
 
 class StSessionStateMock(Mock, dict):
@@ -12,6 +18,34 @@ class StSessionStateMock(Mock, dict):
         self[attr] = value
 
 
+class StSessionStateProxyMock:
+    """A single object for every session, like `st.session_state`, reading and writing the state of the current one."""
+
+    def __init__(self):
+        self.__dict__["session"] = {}
+
+    def switch_session(self):
+        self.__dict__["session"] = {}
+
+    def __contains__(self, key):
+        return key in self.session
+
+    def __getitem__(self, key):
+        return self.session[key]
+
+    def __setitem__(self, key, value):
+        self.session[key] = value
+
+    def __getattr__(self, attr):
+        return self.session[attr]
+
+    def __setattr__(self, attr, value):
+        self.session[attr] = value
+
+    def keys(self):
+        return self.session.keys()
+
+
 class TestRAGApp(unittest.TestCase):
 
     @patch("main.st")
@@ -33,7 +67,6 @@ class TestRAGApp(unittest.TestCase):
     ):
         """Setup test environment before each test."""
         self.mock_state = StSessionStateMock(name="MockStSessionState")
-        self.mock_session_id = str(id(self.mock_state))
         self.rag_chain = Mock(name="MockRagChain")
         self.retriever = Mock(name="MockVectorStoreRetriever")
         self.vectorstore = Mock(name="MockVectorStore")
@@ -45,7 +78,8 @@ class TestRAGApp(unittest.TestCase):
         get_vectorstore_mock.return_value = self.vectorstore
         get_indexer_mock.return_value = self.indexer
         get_model_mock.return_value = self.model
-        self.app = RAGApp()
+        self.app = RAGApp(resources=ResourceRegistry())
+        self.mock_session_id = self.mock_state["session_id"]
 
     def test_init_sets_up_correct_attributes(self):
         """Test RAGApp initializes correctly with expected attributes."""
@@ -60,6 +94,7 @@ class TestRAGApp(unittest.TestCase):
         self.assertEqual(self.app.retriever, self.retriever)
         self.assertEqual(self.app.rag_chain, self.rag_chain)
         self.assertIsNone(self.mock_state["user_message"])
+        self.assertEqual(self.app.session_id, self.mock_state["session_id"])
 
     @patch("main.ChatModel")
     def test_get_model(self, chat_model_mock):
@@ -68,17 +103,45 @@ class TestRAGApp(unittest.TestCase):
         self.assertIsInstance(
             model, Mock
         )  # Assuming type checking for specific classes
-        self.assertTrue(self.mock_state["model"])
-        self.assertEqual(model, self.mock_state["model"])
+        self.assertEqual(model, self.app.resources.resources["model"])
         self.assertEqual(model, self.model)
 
+    @patch("main.RagChain")
+    @patch("main.Retriever")
+    @patch("main.Indexer")
+    @patch("main.ChatModel")
+    @patch("main.st")
+    def test_sessions_share_components(
+        self, st_mock, chat_model_mock, indexer_mock, retriever_mock, rag_chain_mock
+    ):
+        rag_chain_mock.side_effect = lambda **kwargs: Mock(name="MockRagChain")
+        indexer_mock.return_value.lexical_index = None
+        resources = ResourceRegistry()
+        st_mock.session_state = StSessionStateProxyMock()
+        apps = []
+        for _ in range(2):
+            st_mock.session_state.switch_session()
+            apps.append(RAGApp(resources=resources))
+
+        chat_model_mock.assert_called_once()
+        indexer_mock.assert_called_once()
+        retriever_mock.assert_called_once()
+        self.assertIs(apps[0].model, apps[1].model)
+        self.assertIs(apps[0].retriever, apps[1].retriever)
+        self.assertIs(apps[0].get_history_store(), apps[1].get_history_store())
+        # The RAG chain is bound to the chat history of its session.
+        self.assertNotEqual(apps[0].session_id, apps[1].session_id)
+        # A rerun of the script in the same session keeps its id.
+        self.assertEqual(RAGApp(resources=resources).session_id, apps[1].session_id)
+        self.assertIsNot(apps[0].rag_chain, apps[1].rag_chain)
+        self.assertEqual(rag_chain_mock.call_count, 2)
+
     @patch("main.Indexer")
     def test_get_indexer(self, indexer_mock):
         indexer_mock.return_value = self.indexer
         indexer = self.app.get_indexer()
         self.assertIsInstance(indexer, Mock)
-        self.assertTrue(self.mock_state["indexer"])
-        self.assertEqual(indexer, self.app.indexer)
+        self.assertEqual(indexer, self.app.resources.resources["indexer"])
         self.assertEqual(indexer, self.indexer)
 
     @patch("main.Indexer")
@@ -87,8 +150,7 @@ class TestRAGApp(unittest.TestCase):
         self.indexer.get_vectorstore.return_value = self.vectorstore
         vectorstore = self.app.get_vectorstore()
         self.assertIsInstance(vectorstore, Mock)
-        self.assertTrue(self.mock_state["vectorstore"])
-        self.assertEqual(vectorstore, self.app.vectorstore)
+        self.assertEqual(vectorstore, self.app.resources.resources["vectorstore"])
         self.assertEqual(vectorstore, self.vectorstore)
 
     @patch("main.Retriever")
@@ -100,14 +162,96 @@ class TestRAGApp(unittest.TestCase):
         retriever = self.app.get_retriever()
         self.assertIsInstance(retriever, Mock)
         retriever_mock.assert_called_once_with(self.vectorstore)
-        self.assertTrue(self.mock_state["retriever"])
-        self.assertEqual(retriever, self.app.retriever)
+        self.assertEqual(retriever, self.app.resources.resources["retriever"])
         self.assertEqual(retriever, self.retriever)
 
+    @patch.dict(
+        "main.os.environ", {"HYBRID_SEARCH": "true", "LEXICAL_INDEX_PATH": "bm25"}
+    )
+    @patch("main.Retriever")
+    @patch("main.BM25Index")
+    @patch("main.Indexer")
+    @patch("main.RAGApp.get_vectorstore")
+    def test_get_retriever_hybrid(
+        self, get_vectorstore_mock, indexer_mock, bm25_index_mock, retriever_mock
+    ):
+        get_vectorstore_mock.return_value = self.vectorstore
+        indexer_mock.return_value = self.indexer
+        self.indexer.lexical_index = bm25_index_mock.return_value
+
+        self.app.get_retriever()
+
+        bm25_index_mock.assert_called_once_with("bm25")
+        indexer_mock.assert_called_once_with(lexical_index=bm25_index_mock.return_value)
+        retriever_mock.assert_called_once_with(
+            self.vectorstore,
+            search_type="hybrid",
+            lexical_index=bm25_index_mock.return_value,
+        )
+
+    @patch.dict(
+        "main.os.environ",
+        {"RETRIEVAL_CACHE_MAX_ITEMS": "50", "RETRIEVAL_CACHE_TTL": "10"},
+    )
+    @patch("main.Retriever")
+    @patch("main.RAGApp.get_indexer")
+    @patch("main.RAGApp.get_vectorstore")
+    def test_get_retriever_with_cache(
+        self, get_vectorstore_mock, get_indexer_mock, retriever_mock
+    ):
+        get_vectorstore_mock.return_value = self.vectorstore
+        get_indexer_mock.return_value = self.indexer
+        self.indexer.lexical_index = None
+        self.indexer.generation = 3
+
+        self.app.get_retriever()
+
+        cache = retriever_mock.call_args.kwargs["cache"]
+        self.assertEqual((cache.max_items, cache.ttl), (50, 10.0))
+        self.assertEqual(cache.generation(), 3)
+        self.indexer.generation = 4
+        self.assertEqual(cache.generation(), 4)
+
+    @patch.dict(
+        "main.os.environ",
+        {"RERANKER_MODEL": "cross-encoder", "RERANK_CANDIDATES": "30"},
+    )
+    @patch("main.Retriever")
+    @patch("main.Reranker")
+    @patch("main.RAGApp.get_vectorstore")
+    def test_get_retriever_with_reranker(
+        self, get_vectorstore_mock, reranker_mock, retriever_mock
+    ):
+        get_vectorstore_mock.return_value = self.vectorstore
+        self.app.indexer.lexical_index = None
+
+        self.app.get_retriever()
+
+        reranker_mock.assert_called_once_with("cross-encoder", top_k=6, time_budget=0.3)
+        self.assertEqual(
+            self.app.resources.resources["reranker"], reranker_mock.return_value
+        )
+        retriever_mock.assert_called_once_with(
+            self.vectorstore, search_kwargs={"k": 30}
+        )
+
     @patch("main.RagChain")
+    @patch("main.RAGApp.get_reranker")
+    @patch("main.RAGApp.get_history_store")
+    @patch("main.RAGApp.get_context_packer")
+    @patch("main.RAGApp.get_semantic_cache")
     @patch("main.RAGApp.get_model")
     @patch("main.RAGApp.get_retriever")
-    def test_get_rag_chain(self, get_retriever_mock, get_model_mock, rag_chain_mock):
+    def test_get_rag_chain(
+        self,
+        get_retriever_mock,
+        get_model_mock,
+        get_semantic_cache_mock,
+        get_context_packer_mock,
+        get_history_store_mock,
+        get_reranker_mock,
+        rag_chain_mock,
+    ):
         get_retriever_mock.return_value = self.retriever
         get_model_mock.return_value = self.model
         rag_chain_mock.return_value = self.rag_chain
@@ -116,12 +260,150 @@ class TestRAGApp(unittest.TestCase):
         self.assertTrue(self.mock_state["rag_chain"])
         self.assertEqual(rag_chain, self.app.rag_chain)
         self.assertEqual(rag_chain, self.rag_chain)
+        self.rag_chain.set_rag_chain.assert_called_once_with()
         rag_chain_mock.assert_called_once_with(
             chat_model=self.model,
             retriever=self.retriever,
             session_id=self.mock_session_id,
+            semantic_cache=get_semantic_cache_mock.return_value,
+            context_packer=get_context_packer_mock.return_value,
+            history_store=get_history_store_mock.return_value,
+            reranker=get_reranker_mock.return_value,
         )
 
+    @patch.dict(
+        "main.os.environ",
+        {
+            "HISTORY_MAX_MESSAGES": "10",
+            "HISTORY_MAX_TOKENS": "500",
+            "HISTORY_SUMMARIZE": "true",
+        },
+    )
+    @patch("main.summarize_with")
+    @patch("main.RAGApp.get_context_packer")
+    @patch("main.RAGApp.get_model")
+    def test_get_history_store(
+        self, get_model_mock, get_context_packer_mock, summarize_with_mock
+    ):
+        get_model_mock.return_value = self.model
+        get_context_packer_mock.return_value.tokenize.return_value = [1, 2, 3]
+        history_store = self.app.get_history_store()
+        history = history_store.new_history("session")
+
+        self.assertEqual(self.app.resources.resources["history_store"], history_store)
+        self.assertEqual(history_store.max_sessions, 1000)
+        self.assertEqual(history.max_messages, 10)
+        self.assertEqual(history.max_tokens, 500)
+        self.assertEqual(history.count_tokens("a b"), 3)
+        summarize_with_mock.assert_called_once_with(
+            self.model.get_chat_model.return_value
+        )
+        self.assertEqual(history.summarizer, summarize_with_mock.return_value)
+
+    @patch.dict(
+        "main.os.environ",
+        {"HISTORY_DB_PATH": "history.db", "HISTORY_MAX_MESSAGES": "10"},
+    )
+    @patch("main.SQLiteHistoryStore")
+    def test_get_history_store_sqlite(self, sqlite_history_store_mock):
+        history_store = self.app.get_history_store()
+
+        self.assertEqual(history_store, sqlite_history_store_mock.return_value)
+        self.assertEqual(self.app.resources.resources["history_store"], history_store)
+        sqlite_history_store_mock.assert_called_once_with(
+            "history.db", max_messages=10, max_sessions=1000, ttl=86400.0
+        )
+
+    @patch("main.RAGApp.get_rag_chain")
+    @patch("main.RAGApp.get_retriever")
+    @patch("main.RAGApp.get_vectorstore")
+    @patch("main.RAGApp.get_indexer")
+    @patch("main.RAGApp.get_model")
+    @patch("main.st")
+    def test_history_survives_restart(self, st_mock, *component_mocks):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.dict(
+            "main.os.environ",
+            {
+                "HISTORY_DB_PATH": os.path.join(tmp_dir, "history.db"),
+                "HISTORY_USER_SECRET": "secret",
+            },
+        ):
+            st_mock.session_state = StSessionStateProxyMock()
+            st_mock.experimental_user = {"email": "alice@example.com"}
+            app = RAGApp(resources=ResourceRegistry())
+            history_store = app.get_history_store()
+            history_store.new_history(app.session_id).add_message(
+                HumanMessage(content="hello")
+            )
+            history_store.connection.close()
+
+            # After a restart, the user signs in again in a new session of a new process.
+            st_mock.session_state.switch_session()
+            restarted = RAGApp(resources=ResourceRegistry())
+            history_store = restarted.get_history_store()
+            try:
+                self.assertEqual(restarted.session_id, app.session_id)
+                self.assertEqual(
+                    history_store.new_history(restarted.session_id).messages,
+                    [HumanMessage(content="hello")],
+                )
+                # The history of another user is keyed apart.
+                st_mock.session_state.switch_session()
+                st_mock.experimental_user = {"email": "bob@example.com"}
+                other = RAGApp(resources=ResourceRegistry())
+                self.assertNotEqual(other.session_id, app.session_id)
+                self.assertNotIn("alice", app.session_id)
+            finally:
+                history_store.connection.close()
+
+    @patch("main.st")
+    def test_new_session_id(self, st_mock):
+        st_mock.experimental_user = {"email": "alice@example.com"}
+        # Without a secret, the session ids are random, even for a signed-in user.
+        self.assertNotEqual(RAGApp.new_session_id(), RAGApp.new_session_id())
+        with patch.dict("main.os.environ", {"HISTORY_USER_SECRET": "secret"}):
+            self.assertEqual(RAGApp.new_session_id(), RAGApp.new_session_id())
+            st_mock.experimental_user = {}
+            self.assertNotEqual(RAGApp.new_session_id(), RAGApp.new_session_id())
+
+    @patch.dict("main.os.environ", {"PROMPT_TOKEN_BUDGET": "2000"})
+    @patch("main.ContextPacker")
+    @patch("main.RAGApp.get_model")
+    def test_get_context_packer(self, get_model_mock, context_packer_mock):
+        get_model_mock.return_value = self.model
+        context_packer = self.app.get_context_packer()
+        context_packer_mock.assert_called_once_with(
+            self.model.get_tokenizer.return_value, max_tokens=2000, history_share=0.3
+        )
+        self.assertEqual(context_packer, context_packer_mock.return_value)
+        self.assertEqual(self.app.resources.resources["context_packer"], context_packer)
+
+    @patch.dict("main.os.environ", {"PROMPT_TOKEN_BUDGET": "0"})
+    def test_get_context_packer_disabled(self):
+        self.assertIsNone(self.app.get_context_packer())
+
+    @patch.dict("main.os.environ", {"SEMANTIC_CACHE_THRESHOLD": "0.9"})
+    @patch("main.SemanticCache")
+    @patch("main.RAGApp.get_indexer")
+    @patch("main.RAGApp.get_vectorstore")
+    def test_get_semantic_cache(
+        self, get_vectorstore_mock, get_indexer_mock, semantic_cache_mock
+    ):
+        get_vectorstore_mock.return_value = self.vectorstore
+        get_indexer_mock.return_value = self.indexer
+        semantic_cache = self.app.get_semantic_cache()
+        semantic_cache_mock.assert_called_once_with(
+            self.vectorstore.embeddings, threshold=0.9, ttl=3600.0, max_items=1000
+        )
+        self.assertEqual(semantic_cache, semantic_cache_mock.return_value)
+        self.indexer.add_listener.assert_called_once_with(semantic_cache.invalidate)
+        self.assertEqual(self.app.get_semantic_cache(), semantic_cache)
+
+    @patch.dict("main.os.environ", {}, clear=True)
+    def test_get_semantic_cache_disabled(self):
+        self.assertIsNone(self.app.get_semantic_cache())
+        self.assertIn("semantic_cache", self.app.resources)
+
     @patch("main.RagChain")
     def test_generate_response(self, rag_chain_mock):
         """Test the response generation based on an input string."""
@@ -133,6 +415,16 @@ class TestRAGApp(unittest.TestCase):
         self.rag_chain.query.assert_called_once_with(mock_input_text)
         self.assertEqual(response, "Hello, reply!")
 
+    @patch("main.RagChain")
+    def test_stream_response(self, rag_chain_mock):
+        mock_input_text = "Hello, test!"
+        self.rag_chain.stream.return_value = iter(["Hello, ", "reply!"])
+        response = self.app.stream_response(mock_input_text)
+        self.rag_chain.stream.assert_called_once_with(mock_input_text)
+        self.assertEqual(list(response), ["Hello, ", "reply!"])
+
+    @patch("main.st.error")
+    @patch("main.st.progress")
     @patch("main.st.file_uploader")
     @patch("main.NamedTemporaryFile")
     @patch("main.os.remove")
@@ -141,6 +433,8 @@ class TestRAGApp(unittest.TestCase):
         os_remove_mock,
         named_temporary_file_mock,
         st_file_uploader_mock,
+        st_progress_mock,
+        st_error_mock,
     ):
         """
         Test the upload_and_index_files method to see if it correctly handles file uploads and document indexing.
@@ -157,7 +451,8 @@ class TestRAGApp(unittest.TestCase):
 
         # Mock st.file_uploader to return our mock uploaded files
         st_file_uploader_mock.return_value = [mock_uploaded_file]
-        self.indexer.files = []
+        self.indexer.is_indexed.return_value = False
+        self.indexer.add_docs.return_value = {"test_document.txt": None}
         self.app.indexer = self.indexer
         # Run the method under test
         self.app.upload_and_index_files()
@@ -166,26 +461,65 @@ class TestRAGApp(unittest.TestCase):
         st_file_uploader_mock.assert_called_with(
             "Choose a file", accept_multiple_files=True
         )
+        self.indexer.is_indexed.assert_called_once_with(
+            "test_document.txt",
+            "315f5bdb76d078c43b8ac0064e4a0164612b1fce77c869345bfc94c75894edd3",
+        )
         mock_temporary_file.write.assert_called_once_with(b"Hello, world!")
         # Verify that the document was added to the indexer
         os_remove_mock.assert_called_once_with("temp_test_document.txt")
-        self.indexer.add_doc.assert_called_once()
-        self.indexer.add_doc.assert_called_once_with(
-            "test_document.txt", "temp_test_document.txt"
+        self.indexer.add_docs.assert_called_once()
+        self.indexer.add_docs.assert_called_once_with(
+            [("test_document.txt", "temp_test_document.txt")], on_progress=ANY
         )  # Extract positional arguments
+        st_progress_mock.assert_called_once()
+        st_error_mock.assert_not_called()
+
+    @patch("main.st.error")
+    @patch("main.st.progress")
+    @patch("main.st.file_uploader")
+    @patch("main.NamedTemporaryFile")
+    @patch("main.os.remove")
+    def test_upload_and_index_files_reports_failures(
+        self,
+        os_remove_mock,
+        named_temporary_file_mock,
+        st_file_uploader_mock,
+        st_progress_mock,
+        st_error_mock,
+    ):
+        mock_uploaded_file = Mock(name="MockFile")
+        mock_uploaded_file.name = "broken.pdf"
+        mock_uploaded_file.getbuffer.return_value = b"%PDF"
+        named_temporary_file_mock.return_value.__enter__.return_value.name = "tmp.pdf"
+        st_file_uploader_mock.return_value = [mock_uploaded_file]
+        self.indexer.is_indexed.return_value = False
+
+        def add_docs(files, on_progress):
+            on_progress(FileProgress("broken.pdf", "failed", error=ValueError("bad")))
+            return {"broken.pdf": ValueError("bad")}
+
+        self.indexer.add_docs.side_effect = add_docs
+        self.app.upload_and_index_files()
+
+        st_progress_mock.return_value.progress.assert_called_once_with(
+            1.0, text="broken.pdf: failed"
+        )
+        st_error_mock.assert_called_once_with("Could not index broken.pdf: bad")
+        os_remove_mock.assert_called_once_with("tmp.pdf")
 
     @patch("main.st.chat_input")
     @patch("main.st.chat_message")
-    @patch("main.st.spinner")
-    @patch("main.RAGApp.generate_response")
+    @patch("main.st.write_stream")
+    @patch("main.RAGApp.stream_response")
     @patch("main.st.write")
     @patch("main.RAGApp.get_rag_chain")
     def test_chat_interface(
         self,
         get_rag_chain_mock,
         write_mock,
-        generate_response_mock,
-        spinner_mock,
+        stream_response_mock,
+        write_stream_mock,
         chat_message_mock,
         chat_input_mock,
     ):
@@ -201,7 +535,7 @@ class TestRAGApp(unittest.TestCase):
         get_rag_chain_mock.return_value = self.rag_chain
         self.rag_chain.get_session_history.return_value = mock_history
         chat_input_mock.return_value = mock_prompt
-        generate_response_mock.return_value = "Hello, reply!"
+        stream_response_mock.return_value = iter(["Hello, ", "reply!"])
         self.app.chat_interface()
         self.rag_chain.get_session_history.assert_called_once_with(self.mock_session_id)
         chat_message_mock.assert_any_call("human")
@@ -209,8 +543,9 @@ class TestRAGApp(unittest.TestCase):
         write_mock.assert_any_call("Hello")
         write_mock.assert_any_call("Hi")
         write_mock.assert_any_call("Hello, test!")
-        write_mock.assert_any_call("Hello, reply!")
-        spinner_mock.assert_called_once_with("Thinking...")
+        stream_response_mock.assert_called_once_with("Hello, test!")
+        write_stream_mock.assert_called_once_with(stream_response_mock.return_value)
+        self.assertIsNone(self.app.state.user_message)
 
     @patch("main.st.title")
     @patch("main.st.sidebar")
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+import uuid
+
+from manifest import IndexManifest
+
+
+class TestIndexManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "manifest.json")
+        self.manifest = IndexManifest(self.path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_hash_file(self):
+        file = os.path.join(self.temp_dir.name, "test.pdf")
+        with open(file, "wb") as f:
+            f.write(b"Hello, world!")
+        self.assertEqual(
+            IndexManifest.hash_file(file),
+            "315f5bdb76d078c43b8ac0064e4a0164612b1fce77c869345bfc94c75894edd3",
+        )
+
+    def test_chunk_id(self):
+        chunk_id = IndexManifest.chunk_id("some text")
+        self.assertEqual(str(uuid.UUID(chunk_id)), chunk_id)
+        self.assertEqual(chunk_id, IndexManifest.chunk_id("some text"))
+        self.assertNotEqual(chunk_id, IndexManifest.chunk_id("other text"))
+
+    def test_is_current(self):
+        self.assertFalse(self.manifest.is_current("a.pdf", "v1"))
+        self.manifest.update("a.pdf", "v1", ["x"])
+        self.assertTrue(self.manifest.is_current("a.pdf", "v1"))
+        self.assertFalse(self.manifest.is_current("a.pdf", "v2"))
+
+    def test_stale_chunks(self):
+        self.manifest.update("a.pdf", "v1", ["x", "y", "shared"])
+        self.manifest.update("b.pdf", "v1", ["shared"])
+
+        self.assertEqual(self.manifest.stale_chunks("a.pdf", ["x", "z"]), ["y"])
+        self.assertEqual(self.manifest.stale_chunks("c.pdf", ["x"]), [])
+
+        self.manifest.update("a.pdf", "v2", ["x", "z"])
+        self.assertTrue(self.manifest.is_stored("shared"))
+        self.assertTrue(self.manifest.is_stored("z"))
+        self.assertFalse(self.manifest.is_stored("y"))
+
+    def test_persistence(self):
+        self.manifest.update("a.pdf", "v1", ["x", "x", "y"])
+
+        manifest = IndexManifest(self.path)
+
+        self.assertEqual(
+            manifest.files, {"a.pdf": {"hash": "v1", "chunks": ["x", "y"]}}
+        )
+        self.assertTrue(manifest.is_stored("y"))
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+from langchain_community.vectorstores.utils import (
+    maximal_marginal_relevance as langchain_mmr,
+)
+
+from mmr import maximal_marginal_relevance
+
+
+class TestMaximalMarginalRelevance(unittest.TestCase):
+    def test_matches_langchain(self):
+        rng = np.random.default_rng(0)
+        for lambda_mult in [0.0, 0.3, 0.5, 1.0]:
+            query = rng.standard_normal(16)
+            candidates = rng.standard_normal((50, 16))
+
+            self.assertEqual(
+                maximal_marginal_relevance(query, candidates, lambda_mult, k=8),
+                langchain_mmr(query, list(candidates), lambda_mult, k=8),
+            )
+
+    def test_prefers_diverse_candidates(self):
+        query = np.array([1.0, 0.0])
+        candidates = np.array([[1.0, 0.05], [1.0, 0.06], [0.6, 0.8]])
+
+        self.assertEqual(maximal_marginal_relevance(query, candidates, 0.3, 2), [0, 2])
+        self.assertEqual(maximal_marginal_relevance(query, candidates, 1.0, 2), [0, 1])
+
+    def test_edge_cases(self):
+        query = np.array([1.0, 0.0])
+        self.assertEqual(maximal_marginal_relevance(query, np.zeros((0, 2)), k=3), [])
+        self.assertEqual(
+            maximal_marginal_relevance(query, np.array([[0.0, 0.0], [1.0, 0.0]]), k=5),
+            [1, 0],
+        )
@@ -0,0 +1,171 @@
+import unittest
+from unittest.mock import Mock
+
+import torch
+from langchain_core.messages import HumanMessage
+
+from local_llm import LocalChatModel
+from prefix_cache import PrefixCache
+from tests.test_local_llm import make_model, make_tokenizer
+
+
+def make_cache(length, heads=2, head_size=4, layers=2):
+    """Key/value states of a prompt of the given length, whose values are the positions."""
+    positions = torch.arange(length, dtype=torch.float32)[None, None, :, None]
+    states = positions.expand(1, heads, length, head_size).contiguous()
+    return tuple((states, states.clone()) for _ in range(layers))
+
+
+def meta_model(layers, heads, head_size):
+    """A model returning float32 key/value states of the given size on the meta device, which allocates nothing."""
+
+    def forward(input_ids, past_key_values=None, use_cache=True):
+        past = 0 if past_key_values is None else past_key_values[0][0].shape[2]
+        shape = (1, heads, past + input_ids.shape[1], head_size)
+        return Mock(
+            logits=torch.zeros((1, input_ids.shape[1], 4)),
+            past_key_values=tuple(
+                (torch.empty(shape, device="meta"), torch.empty(shape, device="meta"))
+                for _ in range(layers)
+            ),
+        )
+
+    return Mock(side_effect=forward)
+
+
+class TestPrefixCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = PrefixCache(max_bytes=2**20, min_tokens=2)
+
+    def test_lookup_longest_prefix(self):
+        self.cache.put([1, 2, 3, 4], make_cache(4))
+        self.cache.put([1, 2, 5, 6, 7, 8], make_cache(6))
+
+        length, states = self.cache.lookup([1, 2, 5, 6, 9])
+        self.assertEqual(length, 4)
+        self.assertEqual(states[0][0].shape, (1, 2, 4, 4))
+        self.assertEqual(states[0][0][0, 0, :, 0].tolist(), [0, 1, 2, 3])
+        self.assertEqual(self.cache.get_stats()["reused_tokens"], 4)
+
+    def test_lookup_leaves_last_token(self):
+        self.cache.put([1, 2, 3], make_cache(3))
+        length, _ = self.cache.lookup([1, 2, 3])
+        self.assertEqual(length, 2)
+
+    def test_lookup_miss(self):
+        self.cache.put([1, 2, 3], make_cache(3))
+        self.assertEqual(self.cache.lookup([1, 4, 5]), (0, None))
+        self.assertEqual(self.cache.lookup([4, 5, 6]), (0, None))
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (0, 2))
+
+    def test_put_replaces_extended_prompt(self):
+        self.cache.put([1, 2, 3], make_cache(3))
+        self.cache.put([1, 2, 3, 4, 5], make_cache(5))
+        self.assertEqual(self.cache.get_stats()["cached_prompts"], 1)
+        self.assertEqual(self.cache.bytes, PrefixCache._size(make_cache(5)))
+
+    def test_put_evicts_least_recently_used(self):
+        size = PrefixCache._size(make_cache(4))
+        cache = PrefixCache(max_bytes=2 * size, min_tokens=2)
+        cache.put([1, 2, 3, 4], make_cache(4))
+        cache.put([5, 6, 7, 8], make_cache(4))
+        cache.lookup([1, 2, 3, 9])
+        cache.put([9, 10, 11, 12], make_cache(4))
+
+        self.assertEqual(cache.lookup([5, 6, 7, 9]), (0, None))
+        self.assertEqual(cache.lookup([1, 2, 3, 9])[0], 3)
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+    def test_put_skips_short_or_large_prompts(self):
+        self.cache.put([1], make_cache(1))
+        PrefixCache(max_bytes=1).put([1, 2, 3], make_cache(3))
+        self.assertEqual(self.cache.get_stats()["cached_prompts"], 0)
+
+    def test_invalidate(self):
+        self.cache.put([1, 2, 3], make_cache(3))
+        self.cache.invalidate()
+        self.assertEqual(self.cache.lookup([1, 2, 3, 4]), (0, None))
+        self.assertEqual(self.cache.bytes, 0)
+
+    def test_prefill_matches_full_forward(self):
+        model = make_model(64)
+        cache = PrefixCache(min_tokens=2)
+        shared = list(range(2, 40))
+        with torch.inference_mode():
+            cache.prefill(model, shared + [40, 41])
+            logits, states = cache.prefill(model, shared + [50, 51, 52])
+            expected = model(input_ids=torch.tensor([shared + [50, 51, 52]]))
+
+        self.assertTrue(torch.allclose(logits, expected.logits[0, -1], atol=1e-5))
+        self.assertEqual(states[0][0].shape[2], len(shared) + 3)
+        stats = cache.get_stats()
+        self.assertEqual(stats["reused_tokens"], len(shared))
+        self.assertEqual(stats["prefill_tokens"], len(shared) + 2 + 3)
+
+    def test_prefill_caches_shared_prefix_of_7b_model(self):
+        # 32 layers of 8 key/value heads of 128 float32 values, as Mistral-7B: 256 KiB per token.
+        model = meta_model(layers=32, heads=8, head_size=128)
+        cache = PrefixCache()
+        history = list(range(2, 1502))
+        prompt_ids = history + list(range(5000, 6500))
+
+        # The states of the whole 3000 tokens prompt exceed the 512 MiB budget.
+        cache.prefill(model, prompt_ids)
+        self.assertEqual(cache.get_stats()["cached_prompts"], 0)
+        cache.prefill(model, prompt_ids, cache_length=len(history))
+        self.assertEqual(cache.get_stats()["cached_bytes"], len(history) * 2**18)
+
+        next_prompt_ids = history + list(range(7000, 8500))
+        length, states = cache.lookup(next_prompt_ids)
+        self.assertEqual(length, len(history))
+        self.assertEqual(states[0][0].shape, (1, 8, len(history), 128))
+
+
+class TestLocalChatModelPrefixCache(unittest.TestCase):
+    def test_generation_matches_without_cache(self):
+        model = make_model(64)
+        tokenizer = Mock(eos_token_id=1)
+        cache = PrefixCache(min_tokens=2)
+        chat_model = LocalChatModel(
+            model=model, tokenizer=tokenizer, max_new_tokens=8, do_sample=False
+        )
+        cached = LocalChatModel(
+            model=model,
+            tokenizer=tokenizer,
+            prefix_cache=cache,
+            max_new_tokens=8,
+            do_sample=False,
+        )
+        history = list(range(2, 30))
+
+        for prompt_ids in (history + [30, 31], history + [30, 32, 33]):
+            self.assertEqual(
+                list(cached.generate_tokens(prompt_ids)),
+                list(chat_model.generate_tokens(prompt_ids)),
+            )
+        self.assertEqual(cache.get_stats()["reused_tokens"], len(history) + 1)
+
+    def test_caches_prompt_before_boundary(self):
+        tokenizer = make_tokenizer()
+        cache = PrefixCache(min_tokens=2)
+        chat_model = LocalChatModel(
+            model=make_model(len(tokenizer)),
+            tokenizer=tokenizer,
+            prefix_cache=cache,
+            prefix_boundary=" stop",
+            max_new_tokens=2,
+            do_sample=False,
+        )
+        messages = [HumanMessage(content="hello world hello stop here again")]
+        prompt_ids = chat_model.encode(messages)
+
+        self.assertEqual(
+            tokenizer.decode(
+                prompt_ids[: chat_model.shared_length(messages, prompt_ids)]
+            ),
+            "user [UNK] hello world hello",
+        )
+        chat_model.invoke(messages)
+        ((cached, _, _),) = cache.entries.values()
+        self.assertEqual(tokenizer.decode(cached), "user [UNK] hello world hello")
@@ -0,0 +1,29 @@
+import unittest
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from prompts import DEFAULT_PROMPT, prefix_boundary
+
+
+class TestPrefixBoundary(unittest.TestCase):
+    def test_default_prompt(self):
+        boundary = prefix_boundary(DEFAULT_PROMPT)
+        prompt = DEFAULT_PROMPT.format(history="[]", context="docs", question="why?")
+
+        self.assertEqual(boundary, " \n Context: ")
+        self.assertLess(prompt.index("[]"), prompt.index(boundary))
+        self.assertEqual(prompt.index(boundary) + len(boundary), prompt.index("docs"))
+
+    def test_follows_the_template(self):
+        prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", "Be concise."),
+                ("human", "{history}\nDocuments:\n{context}\n{question}"),
+            ]
+        )
+        self.assertEqual(prefix_boundary(prompt), "\nDocuments:\n")
+
+    def test_missing_variable(self):
+        prompt = ChatPromptTemplate.from_messages([("human", "{question}")])
+        with self.assertRaises(ValueError):
+            prefix_boundary(prompt)
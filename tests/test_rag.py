@@ -1,9 +1,19 @@
+import asyncio
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
-from langchain_core.runnables import ConfigurableFieldSpec
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import ConfigurableFieldSpec, RunnableLambda
 
-from rag import InMemoryHistory, RagChain  # Update import with your module
+from chat_history import BoundedHistory, SQLiteHistoryStore
+from rag import (  # Update import with your module
+    DEFAULT_PROMPT,
+    RagChain,
+    SemanticCache,
+)
 
 
 class TestRagChain(unittest.TestCase):
@@ -20,39 +30,42 @@ class TestRagChain(unittest.TestCase):
 
     def test_get_session_history_new_session(self):
         history = self.rag_chain.get_session_history(self.session_id)
-        self.assertIsInstance(history, InMemoryHistory)
+        self.assertIsInstance(history, BoundedHistory)
         self.assertEqual(history.messages, [])
         self.assertIn(self.session_id, self.rag_chain.store)
 
     def test_get_session_history_existing_session(self):
-        expected_history = InMemoryHistory()
-        expected_history.add_message(Mock())
-        self.rag_chain.store[self.session_id] = expected_history
+        self.rag_chain.store = SQLiteHistoryStore(":memory:")
+        self.addCleanup(self.rag_chain.store.connection.close)
+        self.rag_chain.store.new_history(self.session_id).add_message(
+            HumanMessage(content="hello")
+        )
 
         history = self.rag_chain.get_session_history(self.session_id)
-        self.assertEqual(history, expected_history)
+        self.assertEqual(history.messages, [HumanMessage(content="hello")])
+        self.assertIs(self.rag_chain.get_session_history(self.session_id), history)
 
     @patch("rag.RunnableWithMessageHistory")
     @patch("rag.RunnablePassthrough.assign")
     @patch("rag.StrOutputParser")
-    @patch("rag.itemgetter")
+    @patch("rag.RunnableLambda")
     @patch("rag.RagChain.format_docs")
     @patch("rag.RagChain.get_session_history")
     def test_set_rag_chain(
         self,
         get_session_history_mock,
         format_docs_mock,
-        itemgetter_mock,
+        runnable_lambda_mock,
         str_output_parser_mock,
         runnable_passthrough_assign_mock,
         runnable_with_message_history_mock,
     ):
         self.rag_chain.set_rag_chain()
 
-        itemgetter_mock.assert_called_once_with("question")
-        context_mock = (
-            itemgetter_mock.return_value | self.rag_chain.retriever | format_docs_mock
+        runnable_lambda_mock.assert_called_once_with(
+            self.rag_chain.retrieve, afunc=self.rag_chain.aretrieve
         )
+        context_mock = runnable_lambda_mock.return_value | format_docs_mock
         first_step_mock = runnable_passthrough_assign_mock.return_value
         rag_chain_mock = (
             first_step_mock
@@ -102,3 +115,300 @@ class TestRagChain(unittest.TestCase):
             config={"configurable": {"session_id": self.session_id}},
         )
         self.assertEqual(response, expected_response)
+
+    @patch("rag.RagChain.get_rag_chain")
+    def test_stream(self, get_rag_chain_mock):
+        question = "What is unit testing?"
+        get_rag_chain_mock.return_value.stream.return_value = iter(
+            ["It is ", "a test."]
+        )
+        response = self.rag_chain.stream(question)
+
+        get_rag_chain_mock.return_value.stream.assert_called_once_with(
+            {"question": question},
+            config={"configurable": {"session_id": self.session_id}},
+        )
+        self.assertEqual(list(response), ["It is ", "a test."])
+
+    def test_stream_records_history(self):
+        self.rag_chain.retriever = RunnableLambda(
+            lambda question: [Document(page_content="Unit tests test units.")]
+        )
+        self.rag_chain.prompt = DEFAULT_PROMPT
+        self.chat_model.get_chat_model.return_value = GenericFakeChatModel(
+            messages=iter([AIMessage(content="It tests units.")])
+        )
+
+        chunks = list(self.rag_chain.stream("What is unit testing?"))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), "It tests units.")
+        self.assertEqual(
+            self.rag_chain.get_session_history(self.session_id).messages,
+            [
+                HumanMessage(content="What is unit testing?"),
+                AIMessage(content="It tests units."),
+            ],
+        )
+
+    @patch("rag.RagChain.get_rag_chain")
+    def test_aquery(self, get_rag_chain_mock):
+        question = "What is unit testing?"
+        get_rag_chain_mock.return_value.ainvoke = AsyncMock(
+            return_value="It is a testing method."
+        )
+        response = asyncio.run(self.rag_chain.aquery(question))
+
+        get_rag_chain_mock.return_value.ainvoke.assert_awaited_once_with(
+            {"question": question},
+            config={"configurable": {"session_id": self.session_id}},
+        )
+        self.assertEqual(response, "It is a testing method.")
+
+    def test_aquery_sessions_run_concurrently(self):
+        in_flight = []
+        max_in_flight = []
+
+        async def aretrieve(question):
+            in_flight.append(question)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.2)
+            in_flight.remove(question)
+            return [Document(page_content="Unit tests test units.")]
+
+        chains = []
+        for i in range(10):
+            chat_model = Mock(name="MockChatModel")
+            chat_model.get_chat_model.return_value = GenericFakeChatModel(
+                messages=iter([AIMessage(content=f"Answer {i}")])
+            )
+            chains.append(
+                RagChain(RunnableLambda(aretrieve), chat_model, f"session {i}")
+            )
+
+        async def run_sessions():
+            return await asyncio.gather(
+                *(chain.aquery(f"Question {i}") for i, chain in enumerate(chains))
+            )
+
+        answers = asyncio.run(run_sessions())
+
+        self.assertEqual(answers, [f"Answer {i}" for i in range(10)])
+        # Sessions wait on retrieval at the same time instead of one after the other.
+        self.assertGreater(max(max_in_flight), 1)
+        self.assertEqual(
+            chains[3].get_session_history("session 3").messages[-1],
+            AIMessage(content="Answer 3"),
+        )
+
+    @patch("rag.RagChain.get_rag_chain")
+    def test_astream(self, get_rag_chain_mock):
+        async def astream(*args, **kwargs):
+            for chunk in ["It is ", "a test."]:
+                yield chunk
+
+        get_rag_chain_mock.return_value.astream.side_effect = astream
+
+        async def collect():
+            return [chunk async for chunk in self.rag_chain.astream("What?")]
+
+        self.assertEqual(asyncio.run(collect()), ["It is ", "a test."])
+        get_rag_chain_mock.return_value.astream.assert_called_once_with(
+            {"question": "What?"},
+            config={"configurable": {"session_id": self.session_id}},
+        )
+
+    def make_cached_chain(self, answers):
+        embeddings = Mock(name="MockEmbeddings")
+        vectors = {
+            "What is unit testing?": [1.0, 0.0],
+            "what is unit testing": [0.99, 0.1],
+            "What is a fixture?": [0.0, 1.0],
+        }
+        embeddings.embed_query.side_effect = vectors.get
+        embeddings.aembed_query = AsyncMock(side_effect=vectors.get)
+        self.rag_chain.semantic_cache = SemanticCache(embeddings, threshold=0.9)
+        self.rag_chain.retriever = Mock(
+            wraps=RunnableLambda(
+                lambda question: [Document(page_content="Unit tests test units.")]
+            )
+        )
+        self.rag_chain.prompt = DEFAULT_PROMPT
+        self.chat_model.get_chat_model.return_value = GenericFakeChatModel(
+            messages=iter([AIMessage(content=answer) for answer in answers])
+        )
+        return self.rag_chain.semantic_cache
+
+    def test_query_semantic_cache(self):
+        cache = self.make_cached_chain(
+            ["It tests units.", "It sets up tests.", "It still tests units."]
+        )
+
+        self.assertEqual(
+            self.rag_chain.query("What is unit testing?"), "It tests units."
+        )
+        # Another session asks a similar question with the same, empty, history.
+        self.rag_chain.session_id = "other_session_id"
+        self.assertEqual(
+            self.rag_chain.query("what is unit testing"), "It tests units."
+        )
+        self.assertEqual(
+            self.rag_chain.query("What is a fixture?"), "It sets up tests."
+        )
+        # The first session asks again after its own history, which the cached answer was not conditioned on.
+        self.rag_chain.session_id = self.session_id
+        self.assertEqual(
+            self.rag_chain.query("what is unit testing"), "It still tests units."
+        )
+
+        self.assertEqual(self.rag_chain.retriever.invoke.call_count, 4)
+        self.assertEqual(
+            cache.get_stats(),
+            {"hits": 1, "misses": 3, "hit_rate": 1 / 4, "cached_answers": 3},
+        )
+        messages = self.rag_chain.get_session_history("other_session_id").messages
+        self.assertEqual(
+            messages[:2],
+            [
+                HumanMessage(content="what is unit testing"),
+                AIMessage(content="It tests units."),
+            ],
+        )
+        self.assertEqual(len(messages), 4)
+
+    def test_stream_semantic_cache(self):
+        cache = self.make_cached_chain(["It tests units."])
+
+        first = list(self.rag_chain.stream("What is unit testing?"))
+        self.rag_chain.session_id = "other_session_id"
+        second = list(self.rag_chain.stream("what is unit testing"))
+
+        self.assertGreater(len(first), 1)
+        self.assertEqual(second, ["It tests units."])
+        self.assertEqual(cache.hits, 1)
+        for session_id in (self.session_id, "other_session_id"):
+            self.assertEqual(
+                len(self.rag_chain.get_session_history(session_id).messages), 2
+            )
+
+    def test_aquery_semantic_cache(self):
+        cache = self.make_cached_chain(["It tests units."])
+
+        async def ask():
+            first = await self.rag_chain.aquery("What is unit testing?")
+            self.rag_chain.session_id = "other_session_id"
+            return [first, await self.rag_chain.aquery("what is unit testing")]
+
+        self.assertEqual(asyncio.run(ask()), ["It tests units.", "It tests units."])
+        self.assertEqual(cache.hits, 1)
+        cache.embeddings.embed_query.assert_not_called()
+
+    def test_retrieve_reranks(self):
+        docs = [Document(page_content="a"), Document(page_content="b")]
+        reranked = [Document(page_content="b")]
+        reranker = Mock(name="MockReranker")
+        reranker.rerank.return_value = reranked
+        reranker.arerank = AsyncMock(return_value=reranked)
+        self.rag_chain.reranker = reranker
+        self.rag_chain.retriever = RunnableLambda(lambda question: docs)
+
+        self.assertEqual(self.rag_chain.retrieve({"question": "q"}), reranked)
+        reranker.rerank.assert_called_once_with("q", docs)
+        self.assertEqual(
+            asyncio.run(self.rag_chain.aretrieve({"question": "q"})), reranked
+        )
+        reranker.arerank.assert_awaited_once_with("q", docs)
+        # Documents passed in were already reranked.
+        self.assertEqual(self.rag_chain.retrieve({"question": "q", "docs": docs}), docs)
+
+    def test_query_packs_context_and_history(self):
+        prompts = []
+        context_packer = Mock(name="MockContextPacker")
+        context_packer.pack.return_value = ("packed context", "packed history")
+        docs = [Document(page_content="Unit tests test units.")]
+        self.rag_chain.context_packer = context_packer
+        self.rag_chain.retriever = RunnableLambda(lambda question: docs)
+        self.rag_chain.prompt = DEFAULT_PROMPT
+        self.chat_model.get_chat_model.return_value = RunnableLambda(
+            lambda prompt: prompts.append(prompt.to_string()) or AIMessage("Answer")
+        )
+        self.rag_chain.get_session_history(self.session_id).add_message(
+            HumanMessage(content="Hello")
+        )
+
+        self.assertEqual(self.rag_chain.query("What is unit testing?"), "Answer")
+
+        context_packer.pack.assert_called_once_with(
+            "What is unit testing?", docs, [HumanMessage(content="Hello")]
+        )
+        self.assertIn(
+            "Chat History: packed history \n Context: packed context \n", prompts[0]
+        )
+
+
+class TestSemanticCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticCache(Mock(name="MockEmbeddings"), threshold=0.9)
+        self.docs = [Document(page_content="a"), Document(page_content="b")]
+        self.fingerprint = SemanticCache.fingerprint(self.docs)
+        self.vector = np.array([1.0, 0.0], dtype=np.float32)
+
+    def test_lookup(self):
+        self.cache.put(self.vector, self.fingerprint, "answer")
+
+        similar = SemanticCache._normalize([0.95, 0.2])
+        self.assertEqual(self.cache.lookup(similar, self.fingerprint), "answer")
+        self.assertIsNone(self.cache.lookup(np.array([0.0, 1.0]), self.fingerprint))
+        other_context = SemanticCache.fingerprint(self.docs[::-1])
+        self.assertIsNone(self.cache.lookup(self.vector, other_context))
+        other_history = SemanticCache.fingerprint(
+            self.docs, [HumanMessage(content="Which one?")]
+        )
+        self.assertIsNone(self.cache.lookup(self.vector, other_history))
+        self.assertEqual(self.cache.get_stats()["hit_rate"], 1 / 4)
+
+    def test_embed_query(self):
+        self.cache.embeddings.embed_query.return_value = [3.0, 4.0]
+        np.testing.assert_allclose(self.cache.embed_query("question"), [0.6, 0.8])
+
+    @patch("rag.time.monotonic")
+    def test_ttl(self, monotonic_mock):
+        self.cache.ttl = 10
+        monotonic_mock.return_value = 100.0
+        self.cache.put(self.vector, self.fingerprint, "answer")
+        monotonic_mock.return_value = 111.0
+
+        self.assertIsNone(self.cache.lookup(self.vector, self.fingerprint))
+        self.assertEqual(len(self.cache.entries), 0)
+
+    def test_lru_eviction(self):
+        self.cache.max_items = 2
+        vectors = np.eye(3, dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            self.cache.put(vector, self.fingerprint, f"answer {i}")
+            if i == 1:
+                self.assertEqual(
+                    self.cache.lookup(vectors[0], self.fingerprint), "answer 0"
+                )
+
+        self.assertEqual(self.cache.lookup(vectors[0], self.fingerprint), "answer 0")
+        self.assertIsNone(self.cache.lookup(vectors[1], self.fingerprint))
+        self.assertEqual(self.cache.lookup(vectors[2], self.fingerprint), "answer 2")
+
+    def test_rows_are_reused(self):
+        self.cache.max_items = 2
+        vectors = np.eye(3, dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            self.cache.put(vector, SemanticCache.fingerprint([]), f"answer {i}")
+
+        self.assertEqual(self.cache.vectors.shape, (2, 3))
+        self.assertEqual(self.cache.get_stats()["cached_answers"], 2)
+        self.assertEqual(
+            self.cache.lookup(vectors[2], SemanticCache.fingerprint([])), "answer 2"
+        )
+        self.assertIsNone(self.cache.lookup(vectors[0], SemanticCache.fingerprint([])))
+
+    def test_invalidate(self):
+        self.cache.put(self.vector, self.fingerprint, "answer")
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.lookup(self.vector, self.fingerprint))
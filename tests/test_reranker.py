@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+from unittest.mock import Mock, patch
+
+from langchain_core.documents import Document
+
+from reranker import Reranker
+
+
+class TestReranker(unittest.TestCase):
+    def setUp(self):
+        self.reranker = Reranker(top_k=3, batch_size=2, time_budget=None)
+        self.reranker.model = Mock(name="MockCrossEncoder")
+        # Longer chunks score higher.
+        self.reranker.model.predict.side_effect = lambda pairs, **kwargs: [
+            float(len(text)) for _, text in pairs
+        ]
+        self.docs = [
+            Document(page_content="a", metadata={"source": "1"}),
+            Document(page_content="bbb"),
+            Document(page_content="cc"),
+            Document(page_content="dddd"),
+        ]
+
+    @patch("reranker.CrossEncoder")
+    def test_get_model(self, cross_encoder_mock):
+        reranker = Reranker("cross-encoder")
+        self.assertEqual(reranker.get_model(), cross_encoder_mock.return_value)
+        cross_encoder_mock.assert_called_once_with("cross-encoder", device="cpu")
+
+    def test_rerank(self):
+        docs = self.reranker.rerank("query", self.docs)
+
+        self.assertEqual([doc.page_content for doc in docs], ["dddd", "bbb", "cc"])
+        self.assertEqual(docs[0].metadata, {"relevance_score": 4.0})
+        self.assertEqual(self.reranker.model.predict.call_count, 2)
+        self.assertEqual(
+            self.reranker.model.predict.call_args.args[0],
+            [("query", "cc"), ("query", "dddd")],
+        )
+        self.assertEqual(self.docs[0].metadata, {"source": "1"})
+
+    def test_scores_are_cached(self):
+        self.reranker.rerank("query", self.docs[:2])
+        self.reranker.model.predict.reset_mock()
+
+        self.reranker.rerank("query", self.docs)
+
+        self.reranker.model.predict.assert_called_once_with(
+            [("query", "cc"), ("query", "dddd")], batch_size=2, show_progress_bar=False
+        )
+        self.reranker.rerank("other query", self.docs[:1])
+        self.assertEqual(self.reranker.model.predict.call_count, 2)
+
+    def test_cache_is_bounded(self):
+        self.reranker.cache_size = 2
+        self.reranker.score("query", self.docs)
+        self.assertEqual(len(self.reranker._scores), 2)
+
+    @patch("reranker.time.perf_counter")
+    def test_time_budget(self, perf_counter_mock):
+        self.reranker.time_budget = 1.0
+        # Start at 0, the first batch runs from 0 to 0.8, and a second one would end after the budget.
+        perf_counter_mock.side_effect = [0.0, 0.0, 0.8, 0.8]
+
+        docs = self.reranker.rerank("query", self.docs)
+
+        self.reranker.model.predict.assert_called_once()
+        # The unscored candidates follow the scored ones in retrieval order.
+        self.assertEqual([doc.page_content for doc in docs], ["bbb", "a", "cc"])
+        self.assertNotIn("relevance_score", docs[2].metadata)
+
+    def test_arerank(self):
+        docs = asyncio.run(self.reranker.arerank("query", self.docs))
+        self.assertEqual(docs[0].page_content, "dddd")
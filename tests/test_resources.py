@@ -0,0 +1,64 @@
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+from resources import ResourceRegistry
+
+
+class TestResourceRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ResourceRegistry()
+
+    def test_get_builds_once(self):
+        factory = Mock(return_value="model")
+
+        self.assertEqual(self.registry.get("model", factory), "model")
+        self.assertEqual(self.registry.get("model", factory), "model")
+
+        factory.assert_called_once_with()
+        self.assertIn("model", self.registry)
+        stats = self.registry.get_stats()
+        self.assertEqual((stats["resources"], stats["reused"]), (1, 1))
+
+    def test_concurrent_sessions_wait_for_the_first_build(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.05)
+            return object()
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(self.registry.get("model", factory))
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_nested_factories(self):
+        vectorstore = self.registry.get(
+            "vectorstore",
+            lambda: ("vectorstore", self.registry.get("indexer", lambda: "indexer")),
+        )
+        self.assertEqual(vectorstore, ("vectorstore", "indexer"))
+        self.assertEqual(self.registry.get_stats()["resources"], 2)
+
+    def test_none_is_cached(self):
+        factory = Mock(return_value=None)
+        self.assertIsNone(self.registry.get("reranker", factory))
+        self.assertIsNone(self.registry.get("reranker", factory))
+        factory.assert_called_once_with()
+
+    def test_clear(self):
+        self.registry.get("model", lambda: "old")
+        self.registry.clear()
+        self.assertEqual(self.registry.get("model", lambda: "new"), "new")
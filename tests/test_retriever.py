@@ -1,7 +1,24 @@
+import asyncio
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
-from retriever import Retriever
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25 import BM25Index
+from retriever import CachedRetriever, HybridRetriever, RetrievalCache, Retriever
+
+
+class FixedRetriever(BaseRetriever):
+    """Returns the same documents for every query."""
+
+    docs: list
+
+    queries: list = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.queries.append(query)
+        return self.docs
 
 
 class TestRetriever(unittest.TestCase):
@@ -30,6 +47,16 @@ class TestRetriever(unittest.TestCase):
         )
         self.assertIsNotNone(self.retriever.retriever)
 
+    def test_init_search_kwargs(self):
+        self.assertEqual(self.retriever.search_kwargs, {"k": 6})
+        retriever = Retriever(
+            vectorstore=self.vector_store_mock, search_kwargs={"k": 4, "ef_search": 64}
+        )
+        retriever.set_retriever()
+        self.vector_store_mock.as_retriever.assert_called_once_with(
+            search_type="similarity", search_kwargs={"k": 4, "ef_search": 64}
+        )
+
     @patch("retriever.Retriever.set_retriever")
     def test_get_retriever(self, set_retriever_mock):
         # Ensuring that retriever is set up lazily
@@ -49,3 +76,286 @@ class TestRetriever(unittest.TestCase):
 
         get_retriever_mock.return_value.invoke.assert_called_once_with(dummy_query)
         self.assertEqual(result, dummy_response)
+
+    @patch("retriever.Retriever.get_retriever")
+    def test_aretrieve_docs(self, get_retriever_mock):
+        dummy_query = "what is unit testing?"
+        dummy_response = ["Document 1", "Document 2"]
+        get_retriever_mock.return_value.ainvoke = AsyncMock(return_value=dummy_response)
+
+        result = asyncio.run(self.retriever.aretrieve_docs(dummy_query))
+
+        get_retriever_mock.return_value.ainvoke.assert_awaited_once_with(dummy_query)
+        self.assertEqual(result, dummy_response)
+
+
+class TestHybridRetriever(unittest.TestCase):
+    def setUp(self):
+        self.lexical_index = BM25Index()
+        self.lexical_index.add(
+            ["1", "2"],
+            [
+                Document(page_content="error E-1042 in the pump"),
+                Document(page_content="the pump is cleaned"),
+            ],
+        )
+        self.vector_docs = [
+            Document(page_content="how to clean a pump"),
+            Document(page_content="the pump is cleaned"),
+        ]
+        self.retriever = HybridRetriever(
+            vector_retriever=FixedRetriever(docs=self.vector_docs),
+            lexical_index=self.lexical_index,
+            k=2,
+        )
+
+    def test_fuse(self):
+        docs = self.retriever.invoke("pump E-1042")
+
+        # Found by both searches first, then the two top-ranked matches tie and the vector match comes first.
+        self.assertEqual(
+            [doc.page_content for doc in docs],
+            ["the pump is cleaned", "how to clean a pump"],
+        )
+
+    def test_lexical_weight(self):
+        self.retriever.lexical_weight = 2.0
+        docs = asyncio.run(self.retriever.ainvoke("E-1042"))
+        self.assertEqual(
+            [doc.page_content for doc in docs],
+            ["error E-1042 in the pump", "how to clean a pump"],
+        )
+
+    def test_filter_applies_to_lexical_hits(self):
+        self.lexical_index.add(
+            ["3"],
+            [Document(page_content="error E-1042 again", metadata={"page": 2})],
+        )
+        self.retriever.vector_retriever = FixedRetriever(docs=[])
+        self.retriever.filter = {"page": 2}
+
+        docs = self.retriever.invoke("E-1042")
+        self.assertEqual([doc.page_content for doc in docs], ["error E-1042 again"])
+
+    def test_set_retriever(self):
+        vector_store_mock = Mock(name="MockVectorStore")
+        vector_store_mock.as_retriever.return_value = FixedRetriever(docs=[])
+        retriever = Retriever(
+            vector_store_mock,
+            search_type="hybrid",
+            search_kwargs={"k": 4, "rrf_k": 10, "ef_search": 64, "filter": {"page": 1}},
+            lexical_index=self.lexical_index,
+        )
+
+        hybrid = retriever.get_retriever()
+
+        self.assertIsInstance(hybrid, HybridRetriever)
+        self.assertEqual((hybrid.k, hybrid.fetch_k, hybrid.rrf_k), (4, 20, 10))
+        self.assertEqual(hybrid.filter, {"page": 1})
+        vector_store_mock.as_retriever.assert_called_once_with(
+            search_type="similarity",
+            search_kwargs={"ef_search": 64, "filter": {"page": 1}, "k": 20},
+        )
+        with self.assertRaises(ValueError):
+            Retriever(vector_store_mock, search_type="hybrid").set_retriever()
+
+
+class TestRetrieveDocsBatch(unittest.TestCase):
+    def setUp(self):
+        self.vector_store_mock = Mock(name="MockVectorStore")
+        self.vector_store_mock.embeddings.embed_queries.return_value = [[1.0], [2.0]]
+        self.retriever = Retriever(
+            self.vector_store_mock, search_kwargs={"k": 3, "ef_search": 64}
+        )
+
+    def test_batched_search(self):
+        self.vector_store_mock.similarity_search_by_vector_batch.return_value = [
+            [Document(page_content="a")],
+            [Document(page_content="b")],
+        ]
+        docs = self.retriever.retrieve_docs_batch(
+            ["q1", "q2"], k=[1, 2], filters=[None, {"page": 1}]
+        )
+
+        self.vector_store_mock.embeddings.embed_queries.assert_called_once_with(
+            ["q1", "q2"]
+        )
+        self.vector_store_mock.similarity_search_by_vector_batch.assert_called_once_with(
+            [[1.0], [2.0]], [1, 2], [None, {"page": 1}], ef_search=64
+        )
+        self.assertEqual(
+            docs, self.vector_store_mock.similarity_search_by_vector_batch.return_value
+        )
+
+    def test_batched_search_uses_cache(self):
+        generation = [0]
+        cache = RetrievalCache(generation=lambda: generation[0])
+        self.retriever.cache = cache
+        cache.put(
+            cache.key("Q1", "similarity", {"k": 3, "ef_search": 64}),
+            [Document(page_content="cached")],
+            0,
+        )
+        self.vector_store_mock.embeddings.embed_queries.return_value = [[2.0]]
+        self.vector_store_mock.similarity_search_by_vector_batch.return_value = [
+            [Document(page_content="b")]
+        ]
+
+        docs = self.retriever.retrieve_docs_batch(["q1", "q2"])
+
+        self.assertEqual(
+            docs, [[Document(page_content="cached")], [Document(page_content="b")]]
+        )
+        # Only the miss is embedded and searched, and it is cached for the next batch or single retrieval.
+        self.vector_store_mock.embeddings.embed_queries.assert_called_once_with(["q2"])
+        self.vector_store_mock.similarity_search_by_vector_batch.assert_called_once_with(
+            [[2.0]], [3], [None], ef_search=64
+        )
+        self.assertEqual(
+            cache.get(cache.key("q2", "similarity", {"k": 3, "ef_search": 64})),
+            [Document(page_content="b")],
+        )
+        self.assertEqual(
+            self.retriever.retrieve_docs_batch(["q2"], k=1, filters=[{"page": 1}]),
+            [[Document(page_content="b")]],
+        )
+        self.assertEqual(
+            self.vector_store_mock.similarity_search_by_vector_batch.call_count, 2
+        )
+
+    def test_search_by_vector_fallback(self):
+        vector_store_mock = Mock(
+            spec=["embeddings", "similarity_search_by_vector", "as_retriever"]
+        )
+        vector_store_mock.embeddings.embed_queries.return_value = [[1.0], [2.0]]
+        vector_store_mock.similarity_search_by_vector.side_effect = (
+            lambda vector, k, **kwargs: [Document(page_content=str(vector))] * k
+        )
+        retriever = Retriever(vector_store_mock, search_kwargs={"k": 2})
+
+        docs = retriever.retrieve_docs_batch(["q1", "q2"], filters=[{"page": 1}, None])
+
+        self.assertEqual([len(query_docs) for query_docs in docs], [2, 2])
+        self.assertEqual(docs[1][0].page_content, "[2.0]")
+        vector_store_mock.similarity_search_by_vector.assert_any_call(
+            [1.0], k=2, filter={"page": 1}
+        )
+        vector_store_mock.similarity_search_by_vector.assert_called_with([2.0], k=2)
+
+    def test_other_search_types(self):
+        self.retriever.set_retriever(search_type="mmr")
+        self.retriever.retriever.batch.return_value = [["doc"], ["doc"]]
+
+        self.assertEqual(
+            self.retriever.retrieve_docs_batch(["q1", "q2"]), [["doc"], ["doc"]]
+        )
+        with self.assertRaises(ValueError):
+            self.retriever.retrieve_docs_batch(["q1"], k=2)
+
+
+class TestRetrievalCache(unittest.TestCase):
+    def setUp(self):
+        self.generation = 0
+        self.cache = RetrievalCache(max_items=2, generation=lambda: self.generation)
+        self.docs = [
+            Document(
+                page_content="alpha", metadata={"page": 1, "relevance_score": 0.9}
+            ),
+            Document(page_content="beta", metadata={"page": 2}),
+        ]
+
+    def test_key_normalizes_query(self):
+        self.assertEqual(
+            RetrievalCache.key("  What is  RAG? ", "similarity", {"k": 6, "a": 1}),
+            RetrievalCache.key("what is rag?", "similarity", {"a": 1, "k": 6}),
+        )
+        self.assertNotEqual(
+            RetrievalCache.key("what is rag?", "similarity", {"k": 6}),
+            RetrievalCache.key("what is rag?", "mmr", {"k": 6}),
+        )
+
+    def test_put_and_get(self):
+        self.cache.put("q", self.docs, 0)
+        self.assertEqual(self.cache.get("q"), self.docs)
+        self.assertIsNone(self.cache.get("other"))
+        self.assertEqual(
+            self.cache.get_stats(),
+            {
+                "hits": 1,
+                "misses": 1,
+                "hit_rate": 0.5,
+                "cached_results": 1,
+                "cached_docs": 2,
+            },
+        )
+
+    def test_shares_documents(self):
+        self.cache.put("q1", self.docs, 0)
+        self.cache.put("q2", [Document(page_content="alpha", metadata={"page": 1})], 0)
+        self.assertEqual(self.cache.get_stats()["cached_docs"], 2)
+        self.assertEqual(
+            self.cache.get("q2"), [Document(page_content="alpha", metadata={"page": 1})]
+        )
+        self.cache.put("q3", [], 0)
+
+        # q1 is evicted, and only the chunk q2 still refers to is kept.
+        self.assertIsNone(self.cache.get("q1"))
+        self.assertEqual(list(self.cache.docs.values())[0][0].page_content, "alpha")
+        self.assertEqual(self.cache.get_stats()["cached_docs"], 1)
+
+    def test_generation_invalidation(self):
+        self.cache.put("q", self.docs, 0)
+        self.generation = 1
+        self.assertIsNone(self.cache.get("q"))
+        # A result retrieved while the index was changing is never served.
+        self.cache.put("q", self.docs, 0)
+        self.assertIsNone(self.cache.get("q"))
+        self.assertEqual(self.cache.get_stats()["cached_docs"], 0)
+
+    @patch("retriever.time.monotonic")
+    def test_ttl(self, monotonic_mock):
+        monotonic_mock.return_value = 0.0
+        self.cache.ttl = 60
+        self.cache.put("q", self.docs, 0)
+        monotonic_mock.return_value = 50.0
+        self.assertIsNotNone(self.cache.get("q"))
+        monotonic_mock.return_value = 100.0
+        self.assertIsNone(self.cache.get("q"))
+
+    def test_invalidate(self):
+        self.cache.put("q", self.docs, 0)
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get("q"))
+        self.assertEqual(self.cache.get_stats()["cached_docs"], 0)
+
+
+class TestCachedRetriever(unittest.TestCase):
+    def setUp(self):
+        self.inner = FixedRetriever(docs=[Document(page_content="alpha")], queries=[])
+        self.cache = RetrievalCache()
+        self.retriever = CachedRetriever(
+            retriever=self.inner,
+            cache=self.cache,
+            search_type="similarity",
+            search_kwargs={"k": 6},
+        )
+
+    def test_invoke(self):
+        self.assertEqual(self.retriever.invoke("What is RAG?"), self.inner.docs)
+        self.assertEqual(self.retriever.invoke("what is  rag?"), self.inner.docs)
+        self.assertEqual(self.inner.queries, ["What is RAG?"])
+
+    def test_ainvoke(self):
+        asyncio.run(self.retriever.ainvoke("q"))
+        docs = asyncio.run(self.retriever.ainvoke("q"))
+        self.assertEqual(docs, self.inner.docs)
+        self.assertEqual(self.inner.queries, ["q"])
+
+    def test_set_retriever_wraps(self):
+        vector_store_mock = Mock(name="MockVectorStore")
+        vector_store_mock.as_retriever.return_value = self.inner
+        retriever = Retriever(vector_store_mock, cache=self.cache)
+        retriever.set_retriever()
+        self.assertIsInstance(retriever.retriever, CachedRetriever)
+        self.assertEqual(retriever.retriever.search_kwargs, {"k": 6})
+        self.assertEqual(retriever.retriever.retriever, self.inner)